@@ -7,27 +7,25 @@ from qgis._core import QgsProcessingFeedback
 from enmapbox.apps.SpecDeepMap.core_deep_learning_trainer import MyModel
 from enmapbox.apps.SpecDeepMap.core_tester import load_model_and_tile_size
 import os
+import queue
+import threading
 import numpy as np
 import torch
 import csv
 from osgeo import gdal, ogr, osr
 
-def compute_iou_per_class(pred, gt, cls_values):
-    """Compute IoU for each class given a list of class values."""
-    ious = []  # Use a list to store IoU values
+def compute_intersection_union_per_class(pred, gt, cls_values):
+    """Count intersection and union pixels for each class given a list of class values."""
+    intersections = np.zeros(len(cls_values), dtype=np.int64)
+    unions = np.zeros(len(cls_values), dtype=np.int64)
 
-    for cls in cls_values:
+    for c, cls in enumerate(cls_values):
         pred_cls = (pred == cls)
         gt_cls = (gt == cls)
-        intersection = np.logical_and(pred_cls, gt_cls).sum()
-        union = np.logical_or(pred_cls, gt_cls).sum()
+        intersections[c] = np.logical_and(pred_cls, gt_cls).sum()
+        unions[c] = np.logical_or(pred_cls, gt_cls).sum()
 
-        if union == 0:
-            ious.append(np.nan)  # Avoid dividing by zero
-        else:
-            ious.append(intersection / union)
-
-    return ious
+    return intersections, unions
 
 
 
@@ -112,10 +110,57 @@ def calculate_stride_and_overlap(tile_size_x, tile_size_y, overlap_percentage):
     return stride_x, stride_y, overlap_x, overlap_y
 
 
+def crop_windows(positions, image_dim, overlap):
+    """
+    Return (start, end, output_start) per tile position along one axis.
+
+    Predicted tiles are cropped by the overlap towards neighbouring tiles. Each crop ends where the crop of the next
+    tile starts, so the cropped tiles cover the image exactly once and every pixel is written only once.
+    """
+    output_starts = [0 if i == 0 else pos + overlap for i, pos in enumerate(positions)]
+    output_ends = output_starts[1:] + [image_dim]
+    return [(output_start - pos, output_end - pos, output_start)
+            for pos, output_start, output_end in zip(positions, output_starts, output_ends)]
+
+
+def read_tile_batches(input_raster, windows, tile_size_x, tile_size_y, batch_size, no_data_value, tile_queue,
+                      stop_event):
+    """
+    Read batches of tiles in row-major order and put them into the tile_queue (runs in a background thread).
+
+    A batch is a tuple of (windows, tiles [batch, bands, y, x] as float32, no-data masks of the first band or None).
+    The thread opens its own dataset, as GDAL datasets must not be shared between threads.
+    Errors are passed through the queue, the end is marked by None.
+    """
+    try:
+        dataset = gdal.Open(input_raster)
+        for start in range(0, len(windows), batch_size):
+            if stop_event.is_set():
+                break
+            batch_windows = windows[start:start + batch_size]
+            tiles = np.empty((len(batch_windows), dataset.RasterCount, tile_size_y, tile_size_x), dtype=np.float32)
+            masks = None
+            if no_data_value is not None:
+                masks = np.empty((len(batch_windows), tile_size_y, tile_size_x), dtype=bool)
+            for i, window in enumerate(batch_windows):
+                tile = dataset.ReadAsArray(window[0], window[1], tile_size_x, tile_size_y)
+                tiles[i] = tile
+                if masks is not None:
+                    masks[i] = (tile if tile.ndim == 2 else tile[0]) == no_data_value
+            tile_queue.put((batch_windows, tiles, masks))
+        dataset = None
+    except Exception as error:
+        tile_queue.put(error)
+    tile_queue.put(None)
+
+
 def pred_mapper(input_raster=None, model_checkpoint=None, overlap=10, gt_path=None, ignore_index=0
                 , acc=None, raster_output=None, vector_output=None, csv_output=None,
-                feedback: QgsProcessingFeedback = None):  # , #vector=True
+                feedback: QgsProcessingFeedback = None, batch_size=8, num_threads=0, prefetch=2):  # , #vector=True
     # get names
+    # Tiles are read in row-major order by a background thread (prefetching up to `prefetch` batches), predicted in
+    # batches of `batch_size` tiles and the cropped predictions are written directly into the output GeoTIFF.
+    # num_threads sets the number of CPU threads used by torch (0: torch default)
 
     print('vector_output', vector_output)
 
@@ -138,11 +183,17 @@ def pred_mapper(input_raster=None, model_checkpoint=None, overlap=10, gt_path=No
     band = dataset.GetRasterBand(1)
     no_data_value = band.GetNoDataValue()
 
-    # Create an in-memory raster
-    driver = gdal.GetDriverByName('MEM')
-    mem_ds = driver.Create('', image_x, image_y, 1, gdal.GDT_Byte)
-    mem_ds.SetGeoTransform(dataset.GetGeoTransform())
-    mem_ds.SetProjection(dataset.GetProjection())
+    # Create the output raster, cropped predictions are streamed into it
+    directory = os.path.dirname(raster_output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    gtiff_driver = gdal.GetDriverByName('GTiff')
+    out_ds = gtiff_driver.Create(raster_output, image_x, image_y, 1, gdal.GDT_Byte, options=['TILED=YES'])
+    out_ds.SetGeoTransform(dataset.GetGeoTransform())
+    out_ds.SetProjection(dataset.GetProjection())
+    out_band = out_ds.GetRasterBand(1)
+    if no_data_value != None:
+        out_band.SetNoDataValue(no_data_value)
 
     # added read image x and y from checkpoint
 
@@ -152,6 +203,8 @@ def pred_mapper(input_raster=None, model_checkpoint=None, overlap=10, gt_path=No
         acc_d = 'cuda'
     else:
         acc_d = 'cpu'
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
 
     model.to(acc_d)
 
@@ -168,62 +221,66 @@ def pred_mapper(input_raster=None, model_checkpoint=None, overlap=10, gt_path=No
     print('Y_positions', y_positions)
     total_tiles = len(x_positions) * len(y_positions)
 
+    # Tiles in row-major order (matching GDAL's block layout), each with its crop window along x and y
+    x_crops = crop_windows(x_positions, image_x, overlap_x)
+    y_crops = crop_windows(y_positions, image_y, overlap_y)
+    windows = [(x, y, x_crop, y_crop) for y, y_crop in zip(y_positions, y_crops)
+               for x, x_crop in zip(x_positions, x_crops)]
+
+    gt_dataset = gdal.Open(gt_path) if gt_path else None
+    if gt_dataset is not None and (gt_dataset.RasterXSize != image_x or gt_dataset.RasterYSize != image_y):
+        raise ValueError(f"Shape mismatch: ground truth {(gt_dataset.RasterYSize, gt_dataset.RasterXSize)} and "
+                         f"prediction {(image_y, image_x)}")
+
+    # Intersection and union per class, accumulated while writing (cropped tiles do not overlap)
+    intersections = np.zeros(len(cls_values), dtype=np.int64)
+    unions = np.zeros(len(cls_values), dtype=np.int64)
+
+    # Start the reader thread
+    tile_queue = queue.Queue(maxsize=max(1, prefetch))
+    stop_event = threading.Event()
+    reader = threading.Thread(target=read_tile_batches, daemon=True,
+                              args=(input_raster, windows, tile_size_x, tile_size_y, max(1, batch_size),
+                                    no_data_value, tile_queue, stop_event))
+    reader.start()
+
     # Initialize the counter
     counter = 0
 
-    for x in x_positions:
-        for y in y_positions:
-            tile = dataset.ReadAsArray(x, y, tile_size_x, tile_size_y)
+    try:
+        while True:
+            batch = tile_queue.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            batch_windows, tiles, masks = batch
+
+            # Make prediction using the model for the whole batch
+            image = torch.as_tensor(tiles, dtype=torch.float32)
+            if acc == 'gpu':
+                image = image.to('cuda')
+            preds = model.predict(image)
+            preds = np.reshape(preds, (len(batch_windows), tile_size_y, tile_size_x))  # predict squeezes batch of 1
 
+            for i, (x, y, (x_start, x_end, output_x), (y_start, y_end, output_y)) in enumerate(batch_windows):
+                # Crop the tile
+                cropped = preds[i, y_start:y_end, x_start:x_end].astype(np.uint8)
 
-            image = np.expand_dims(tile, axis=0)
+                # mask no-data pixels of the input and pixels without ground truth
+                if masks is not None:
+                    cropped[masks[i, y_start:y_end, x_start:x_end]] = 0
+                if gt_dataset is not None:
+                    gt = gt_dataset.ReadAsArray(output_x, output_y, x_end - x_start, y_end - y_start)
+                    cropped[gt == 0] = 0
+                    tile_intersections, tile_unions = compute_intersection_union_per_class(cropped, gt, cls_values)
+                    intersections += tile_intersections
+                    unions += tile_unions
 
-            # Make prediction using the model 3
-            image = image.astype(np.float32)
-            image = torch.as_tensor(image, dtype=torch.float32)
-            if acc=='gpu':
-                image = image.to('cuda')
-            preds = model.predict(image)
+                # Write the cropped tile, adjusting for overlap in the output coordinates
+                out_band.WriteArray(cropped, xoff=output_x, yoff=output_y)
 
-            pred_flat = preds # .astype("uint8")
-            #if acc=='gpu':
-             #   preds =preds.cpu()
-            #pred_classes = preds.squeeze(0)  # Shape becomes [H, W]
-
-            # Convert to numpy for further use outside PyTorch
-            #pred_flat = pred_classes.detach().numpy().astype("uint8")
-
-            # Determine crop coordinates within the tile
-            if x == 0:
-                x_start = 0
-                x_end = tile_size_x - overlap_x
-            elif x == x_positions[-1]:
-                x_start = overlap_x
-                x_end = tile_size_x
-            else:
-                x_start = overlap_x
-                x_end = tile_size_x - overlap_x
-
-            if y == 0:
-                y_start = 0
-                y_end = tile_size_y - overlap_y
-            elif y == y_positions[-1]:
-                y_start = overlap_y
-                y_end = tile_size_y
-            else:
-                y_start = overlap_y
-                y_end = tile_size_y - overlap_y
-
-            # Crop the tile
-            cropped = pred_flat[y_start:y_end,
-                      x_start:x_end]
-
-            # Write the cropped tile back, adjusting for overlap in the output coordinates
-            output_x = x if x == 0 else x + overlap_x
-            output_y = y if y == 0 else y + overlap_y
-            mem_ds.GetRasterBand(1).WriteArray(cropped, xoff=output_x, yoff=output_y)
-
-            counter += 1
+            counter += len(batch_windows)
 
             progress = (counter / total_tiles) * 100
             if isinstance(feedback, QgsProcessingFeedback):
@@ -232,47 +289,17 @@ def pred_mapper(input_raster=None, model_checkpoint=None, overlap=10, gt_path=No
                 # Allow user to cancel the process
                 if feedback.isCanceled():
                     break
-
-    if no_data_value != None:
-        # dataset = gdal.Open(input_raster)
-        modified_band = dataset.GetRasterBand(1)
-
-        # Read data from modified raster
-        data_arr = modified_band.ReadAsArray()
-        # data_arr = dataset.ReadAsArray(0)
-
-        # create mask for no-data values
-        mask = (data_arr == no_data_value)
-
-        mem_arr = mem_ds.ReadAsArray()  # assuming a single band raster
-
-        # mask image
-        mem_arr[mask] = 0
-
-        # write masked image to ratser file
-        mem_ds.WriteArray(mem_arr)
-
-        ## new
-        band = mem_ds.GetRasterBand(1)
-        band.SetNoDataValue(no_data_value)
-
-    if gt_path:
-        gt_dataset = gdal.Open(gt_path)
-        gt_data_arr = gt_dataset.ReadAsArray()
-
-        gt_mask = (gt_data_arr == 0)
-
-        mem_arr = mem_ds.ReadAsArray()  # assuming a single band raster
-
-        # mask image
-        mem_arr[gt_mask] = 0
-
-        # write masked image to ratser file
-        mem_ds.WriteArray(mem_arr)
-
-
-    gtiff_driver = gdal.GetDriverByName('GTiff')
-    out_ds = gtiff_driver.CreateCopy(raster_output, mem_ds, 0)
+    finally:
+        # stop the reader thread and unblock it, if it waits for a free place in the queue
+        stop_event.set()
+        while reader.is_alive():
+            try:
+                tile_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        reader.join()
+
+    out_ds.FlushCache()
 
     # vectorize raster  (drop no data polygon, (outside bounds))
     if vector_output:
@@ -281,35 +308,10 @@ def pred_mapper(input_raster=None, model_checkpoint=None, overlap=10, gt_path=No
     # calc. mean and per class IoU ignore index (no-data label))
 
     if gt_path:
-        # Open the ground truth raster
-        gt_dataset = gdal.Open(gt_path)
-        gt = gt_dataset.ReadAsArray()
-        print('Ground truth raster shape:', gt.shape)
-
-        # Open the prediction raster
-        pred_dataset = mem_ds
-        prediction = pred_dataset.ReadAsArray()
-
-        # Ensure shapes match
-        if gt.shape != prediction.shape:
-            raise ValueError(f"Shape mismatch: ground truth {gt.shape} and prediction {prediction.shape}")
-
-        #print('num_classes', num_classes)
-
-        # new calc iou, look at this logic again ! IMPORTANT !
-        #if np.any(gt==0) and remove_c == 'No':
-         #   num_classes = num_classes+1
-        #if np.any(gt == 0) and remove_c == 'Yes':
-         #   num_classes = num_classes
-       # else:
-        #    num_classes = num_classes
-        mean_iou_per_class= compute_iou_per_class(prediction, gt, cls_values)
-        #mean_iou_per_class = compute_iou_per_class(prediction, gt, num_classes)
-
-        # Calculate IoU per class
-        #ious = compute_iou_per_class(prediction, gt, cls_values)
+        # IoU per class from the intersections and unions accumulated during prediction
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_iou_per_class = list(np.where(unions == 0, np.nan, intersections / unions))
         print(cls_values)
-        #print(ious)
 
         mean_iou = np.nanmean(mean_iou_per_class)
         # different approach here compared to mapper. if remove = yes meaning automatical 0 in data as otherwise  remove_c no: meaning no class extension needed
@@ -341,8 +343,7 @@ def pred_mapper(input_raster=None, model_checkpoint=None, overlap=10, gt_path=No
 
             print(f"IoU per class and mean IoU written to {csv_output}")
 
-    mem_ds = None
+    out_band = None
     out_ds = None
+    gt_dataset = None
     dataset = None
-    modified_band = None
-    modified_dataset = None
@@ -1,13 +1,67 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from osgeo import gdal
 from qgis._core import QgsProcessingFeedback
 
 
+def write_tile(path, array, geo_transform, projection, data_type, metadata=None, band_properties=None):
+    """
+    Write a tile array [bands, y, x] as GeoTIFF (runs in a worker thread, each thread creates its own dataset).
+
+    band_properties is a list of dicts per band (see read_band_properties), as copied by gdal.Translate;
+    the no data value is set per band.
+    """
+    driver = gdal.GetDriverByName('GTiff')
+    out_ds = driver.Create(path, array.shape[2], array.shape[1], array.shape[0], data_type)
+    out_ds.SetGeoTransform(geo_transform)
+    out_ds.SetProjection(projection)
+    if metadata:
+        out_ds.SetMetadata(metadata)
+    for i in range(array.shape[0]):
+        out_band = out_ds.GetRasterBand(i + 1)
+        if band_properties:
+            properties = band_properties[i]
+            if properties['nodata'] is not None:
+                out_band.SetNoDataValue(properties['nodata'])
+            out_band.SetMetadata(properties['metadata'])
+            if properties['description']:
+                out_band.SetDescription(properties['description'])
+            if properties['scale'] is not None:
+                out_band.SetScale(properties['scale'])
+            if properties['offset'] is not None:
+                out_band.SetOffset(properties['offset'])
+            out_band.SetColorInterpretation(properties['color_interpretation'])
+        out_band.WriteArray(array[i])
+    out_band = None
+    out_ds = None
+
+
+def read_band_properties(ds):
+    # band no data value, metadata, description, scale/offset and colour interpretation of all bands of a dataset
+    properties = list()
+    for i in range(ds.RasterCount):
+        band = ds.GetRasterBand(i + 1)
+        properties.append({'nodata': band.GetNoDataValue(), 'metadata': band.GetMetadata(), 'description': band.GetDescription(),
+                           'scale': band.GetScale(), 'offset': band.GetOffset(),
+                           'color_interpretation': band.GetColorInterpretation()})
+    return properties
+
+
+def tile_geo_transform(geo_transform, x, y):
+    # geotransform of a tile with upper left pixel (x, y)
+    return (geo_transform[0] + x * geo_transform[1] + y * geo_transform[2], geo_transform[1], geo_transform[2],
+            geo_transform[3] + x * geo_transform[4] + y * geo_transform[5], geo_transform[4], geo_transform[5])
+
+
 def split_raster(raster, ds_mask, output_path, tile_size_x, tile_size_y, step_x, step_y,
-                 remove_null_int=10, feedback: QgsProcessingFeedback = None):  # no_data_value= 0 removed and fixed to 0
+                 remove_null_int=10, feedback: QgsProcessingFeedback = None, n_workers=0,
+                 strip_memory=2 ** 28):  # no_data_value= 0 removed and fixed to 0
     # add assert raster size ds and mask same, and crs, and pixel size,
+    # Source data is read once per row of tiles, in strips of several tiles (at most strip_memory bytes of image
+    # data); tiles are sliced from the strips in memory, empty tiles are filtered with vectorized label counts and
+    # the image and label tiles are written by n_workers threads (0: all CPUs)
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
@@ -26,109 +80,107 @@ def split_raster(raster, ds_mask, output_path, tile_size_x, tile_size_y, step_x,
     ds = gdal.Open(raster)
     ds_mask = gdal.Open(ds_mask)
 
-    #  get Mask meta data
-    data_type = ds_mask.GetRasterBand(1).DataType
-    projection = ds_mask.GetProjection()
-
     spec_band = ds.GetRasterBand(1)
     nodata_spec = spec_band.GetNoDataValue()
 
-        # Read data from modified raster
-    if nodata_spec is not None:
-
-        data_arr = spec_band.ReadAsArray()
-            # data_arr = dataset.ReadAsArray(0)
-
-        mask = (data_arr == nodata_spec)
-
-            # mask label raster with no data mask
-        band = ds_mask.ReadAsArray()
-
-            # reserved no data label class 0
-        band[mask] = 0  # or use no_data_value from interface to over-burn  ' changed. fixed to 0 for no data label
-    else:
-        band = ds_mask.ReadAsArray()
+    # image tiles keep data type, metadata and band properties of the image; label tiles are written with the
+    # data type of the image, as before
+    data_type = spec_band.DataType
+    geo_transform = ds.GetGeoTransform()
+    projection = ds.GetProjection()
+    metadata = ds.GetMetadata()
+    band_properties = read_band_properties(ds)
+    label_properties = read_band_properties(ds_mask)[:1]
+    dtype = spec_band.ReadAsArray(0, 0, 1, 1).dtype
 
-    extended_array = np.pad(band, ((0, tile_size_y), (0, tile_size_x)), mode='constant', constant_values=0)
     original_width = ds.RasterXSize
     original_height = ds.RasterYSize
-    original_band = ds.GetRasterBand(1)  # Assuming single-band raster
+    band_count = ds.RasterCount
 
-    # Calculate the dimensions of the new raster
-    new_width = original_width + tile_size_x
-    new_height = original_height + tile_size_y
+    # tile positions, tiles reaching over the raster border are padded (image with no data, labels with 0)
+    x_positions = list(range(0, original_width, step_x))
+    y_positions = list(range(0, original_height, step_y))
+    total_tiles = len(x_positions) * len(y_positions)
 
-    # Create an in-memory raster with the new dimensions
-    driver = gdal.GetDriverByName('MEM')
-    new_dataset = driver.Create('', new_width, new_height, 1, original_band.DataType)
+    # number of tiles per strip, limited by strip_memory
+    tile_bytes = band_count * tile_size_y * max(step_x, 1) * dtype.itemsize
+    tiles_per_strip = int(max(1, min(len(x_positions), strip_memory // max(tile_bytes, 1))))
 
-    # Set the geotransform and projection from the original raster
-    new_dataset.SetGeoTransform(ds.GetGeoTransform())
-    new_dataset.SetProjection(ds.GetProjection())
+    # padding with the no data value of each band
+    fill_values = np.array([0 if properties['nodata'] is None else properties['nodata']
+                            for properties in band_properties], dtype=dtype).reshape((band_count, 1, 1))
+    remove_null_percent = remove_null_int / 100
 
-    # Read the data from the original raster and write it to the new raster
-    # data = original_band.ReadAsArray(0, 0, original_width, original_height)
-    new_dataset.GetRasterBand(1).WriteArray(extended_array, 0, 0)
-    ds_mask = new_dataset
-
-    total_tiles = ((ds.RasterXSize // step_x) + 1) * ((ds.RasterYSize // step_y) + 1)
     counter = 0
     tile_counter = 0
+    canceled = False
+
+    if n_workers <= 0:
+        n_workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = list()
+        for y in y_positions:  # row-major order, matching the block layout of the source rasters
+            for first in range(0, len(x_positions), tiles_per_strip):
+                strip_x = x_positions[first:first + tiles_per_strip]
+
+                # read the strip once from image and labels; the source window is clipped at the raster border
+                x0 = strip_x[0]
+                x1 = strip_x[-1] + tile_size_x
+                read_x = min(x1, original_width) - x0
+                read_y = min(y + tile_size_y, original_height) - y
+                image_strip = np.empty((band_count, tile_size_y, x1 - x0), dtype=dtype)
+                image_strip[:] = fill_values
+                image_strip[:, :read_y, :read_x] = ds.ReadAsArray(x0, y, read_x, read_y).reshape(
+                    (band_count, read_y, read_x))
+                label_strip = np.zeros((tile_size_y, x1 - x0), dtype=dtype)
+                label_strip[:read_y, :read_x] = ds_mask.GetRasterBand(1).ReadAsArray(x0, y, read_x, read_y)
+
+                # reserved no data label class 0, where the first image band is no data
+                if nodata_spec is not None:
+                    label_strip[:read_y, :read_x][image_strip[0, :read_y, :read_x] == nodata_spec] = 0
 
-    for x in range(0, ds.RasterXSize, step_x):  # inklusiv +1
-        for y in range(0, ds.RasterYSize,
-                       step_y):
-
-            if remove_null_int > 0:
-                mask_array = ds_mask.ReadAsArray(x, y, tile_size_x, tile_size_y)
-
-                # changed fixed to 0 as no_data_label
-                non_zero_percentage = np.sum(mask_array != 0) / mask_array.size
-                # Check if more than 50% of the values are not zero
+                # share of labelled pixels for all tiles of the strip at once (window sums of column counts)
+                offsets = np.array(strip_x) - x0
+                column_counts = np.concatenate([[0], np.cumsum(np.count_nonzero(label_strip, axis=0))])
+                non_zero_percentage = (column_counts[offsets + tile_size_x] - column_counts[offsets]) / \
+                                      (tile_size_x * tile_size_y)
 
-                remove_null_percent = remove_null_int / 100
-                if non_zero_percentage >= remove_null_percent:
+                for x, offset, percentage in zip(strip_x, offsets, non_zero_percentage):
                     output = f'{r_name}_tile_{x}_{y}.tif'
-                    path_i_out = os.path.join(image_dir, output)
-                    path_l_out = os.path.join(label_dir, output)
-                    if nodata_spec is not None:
-
-                        gdal.Translate(path_i_out, ds, srcWin=[x, y, tile_size_x, tile_size_y], noData=nodata_spec)
-                        gdal.Translate(path_l_out, ds_mask, srcWin=[x, y, tile_size_x, tile_size_y])
-                    else:
-                        gdal.Translate(path_i_out, ds, srcWin=[x, y, tile_size_x, tile_size_y])
-                        gdal.Translate(path_l_out, ds_mask, srcWin=[x, y, tile_size_x, tile_size_y])
+                    if remove_null_int > 0 and percentage < remove_null_percent:
+                        print(f"Not created {output}")
+                        continue
+                    tile_transform = tile_geo_transform(geo_transform, x, y)
+                    pending.append(executor.submit(
+                        write_tile, os.path.join(image_dir, output), image_strip[:, :, offset:offset + tile_size_x],
+                        tile_transform, projection, data_type, metadata, band_properties))
+                    pending.append(executor.submit(
+                        write_tile, os.path.join(label_dir, output),
+                        label_strip[np.newaxis, :, offset:offset + tile_size_x], tile_transform, projection,
+                        data_type, band_properties=label_properties))
                     print(f"Created {output}")
                     tile_counter += 1
-                else:
-                    output = f'{r_name}_tile_{x}_{y}.tif'
-                    print(f"Not created {output}")
 
-            else:
-                output = f'{r_name}_tile_{x}_{y}.tif'
-                path_i_out = os.path.join(image_dir, output)
-                path_l_out = os.path.join(label_dir, output)
-                if nodata_spec is not None:
+                # wait for the tiles of earlier strips, so that only a few strips are kept in memory
+                while len(pending) > 4 * n_workers + 2 * tiles_per_strip:
+                    pending.pop(0).result()
 
-                    gdal.Translate(path_i_out, ds, srcWin=[x, y, tile_size_x, tile_size_y], noData=nodata_spec)
-                    gdal.Translate(path_l_out, ds_mask, srcWin=[x, y, tile_size_x, tile_size_y])
-                else:
-                    gdal.Translate(path_i_out, ds, srcWin=[x, y, tile_size_x, tile_size_y])
-                    gdal.Translate(path_l_out, ds_mask, srcWin=[x, y, tile_size_x, tile_size_y])
-                print(f"Created {output}")
-                tile_counter += 1
+                counter += len(strip_x)
 
-            counter += 1
+                progress = (counter / total_tiles) * 100
+                if isinstance(feedback, QgsProcessingFeedback):
+                    feedback.setProgress(progress)
 
-            progress = (counter / total_tiles) * 100
-            if isinstance(feedback, QgsProcessingFeedback):
-                feedback.setProgress(progress)
+                    # Allow user to cancel the process
+                    if feedback.isCanceled():
+                        canceled = True
+                        break
+            if canceled:
+                break
 
-                # Allow user to cancel the process
-                if feedback.isCanceled():
-                    break
+        for future in pending:
+            future.result()  # raise errors of the worker threads
 
-    new_dataset = None
     ds = None
     ds_mask = None
 
@@ -39,6 +39,8 @@ class DL_Mapper(QgsProcessingAlgorithm):
     P_vector = 'vector'
     # P_no_data_value = 'no_data_value'
     P_acc = 'acc'
+    P_batch_size = 'batch_size'
+    P_num_threads = 'num_threads'
     P_raster_output = 'raster_output'
     P_vector_output = 'vector_output'
     P_csv_output = 'csv_output'
@@ -107,6 +109,10 @@ class DL_Mapper(QgsProcessingAlgorithm):
                '<p>As this algorithm loads the input raster in small tiles, an can be defined with this parameter. This overlap is cropped from each predicted tile in directions to other tiles, so that there is no actual overlap in the prediction, but boundary effect are minimized. A good suggestion is 5-10% of image size. If the overlap doesnt lead to full coverage, the overlap is adjusted to next possible solution, to give full coverage of prediction </p>' \
                '<h3>Device</h3>' \
                '<p>CPU or GPU can be used, for GPU use Cuda needs to be installed correctly for given python environment</p>' \
+               '<h3>Batch Size</h3>' \
+               '<p>Number of tiles predicted at once. Tiles are read ahead in a background thread while the model predicts. Larger batches reduce the per tile overhead, but need more memory.</p>' \
+               '<h3>CPU Threads</h3>' \
+               '<p>Number of threads used by torch for prediction on the CPU. If 0, the torch default is used.</p>' \
                '<h3>Prediction as Raster </h3>' \
                '<p> Prediction can be saved as TIFF file with this parameter</p>' \
                '<h3>Prediction as Vector Output</h3>' \
@@ -137,6 +143,14 @@ class DL_Mapper(QgsProcessingAlgorithm):
             defaultValue=10))
         self.addParameter(QgsProcessingParameterEnum(
             name=self.P_acc, description='Device', options=['cpu', 'gpu'], defaultValue=0))
+        self.addParameter(QgsProcessingParameterNumber(
+            name=self.P_batch_size, description='Batch Size',
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=8, minValue=1))
+        self.addParameter(QgsProcessingParameterNumber(
+            name=self.P_num_threads, description='CPU Threads',
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=0, minValue=0))
 
         self.addParameter(
             QgsProcessingParameterRasterDestination(
@@ -178,6 +192,8 @@ class DL_Mapper(QgsProcessingAlgorithm):
                     overlap=self.parameterAsInt(parameters, self.P_overlap, context),
                     gt_path=self.parameterAsRasterLayer(parameters, self.P_gt_path, context).source(),
                     acc=self.parameterAsEnum(parameters, self.P_acc, context),
+                    batch_size=self.parameterAsInt(parameters, self.P_batch_size, context),
+                    num_threads=self.parameterAsInt(parameters, self.P_num_threads, context),
                     feedback=feedback,
                     raster_output=self.parameterAsOutputLayer(parameters, self.P_raster_output, context),
                     vector_output=self.parameterAsOutputLayer(parameters, self.P_vector_output, context),
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+***************************************************************************
+    CreateLUT_algorithm.py - LMU Agri Apps - headless creation of PROSAIL/PROINFORM look-up-tables
+    -----------------------------------------------------------------------
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 3 of the License, or
+    (at your option) any later version.
+                                                                                                                                                 *
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this software. If not, see <https://www.gnu.org/licenses/>.
+***************************************************************************
+"""
+
+# CreateLUT_algorithm.py exposes the LUT creation of the "Create Look-up-table" app as a processing algorithm,
+# so that LUTs can be built without the GUI, e.g. from the QGIS Python console or in batch mode.
+# The parameter ranges are taken from a _00paras.txt file, as written by the GUI for each LUT.
+
+import os
+
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum, QgsProcessingParameterString, QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFolderDestination, QgsProcessingOutputFile)
+
+from lmuvegetationapps import APP_DIR
+import lmuvegetationapps.Resources.PROSAIL.call_model as mod
+
+
+def read_paras_file(filename):
+    # read the model setup and the parameter ranges from a _00paras.txt file; each parameter is given as a list of
+    # length 1 (fixed), 2 (uniform), 3 (logical) or 4 (gauss)
+    with open(filename, 'r') as para_meta:
+        metacontent = [line.rstrip('\n') for line in para_meta.readlines()]
+    lop = metacontent[1].split("=")[1]
+    canopy_arch = metacontent[2].split("=")[1]
+    depends = int(metacontent[3].split("#")[0].split("=")[1])
+    paras = dict()
+    for line in metacontent[4:]:
+        if line.strip() == "":
+            continue
+        para_name, para_range = line.split("#")[0].split("=")
+        paras[para_name] = [float(i) for i in para_range.replace("[", "").replace("]", "").split(", ")]
+    if canopy_arch == "None":
+        canopy_arch = None
+    return lop, canopy_arch, depends, paras
+
+
+class CreateLUTAlgorithm(QgsProcessingAlgorithm):
+    P_PARAS = 'parameterFile'
+    P_NS = 'ns'
+    P_SENSOR = 'sensor'
+    P_INT_BOOST = 'intBoost'
+    P_CP_CBC = 'cpCbcDependency'
+    P_SPLIT_SIZE = 'splitSize'
+    P_WORKER_COUNT = 'workerCount'
+    P_NAME = 'name'
+    P_OUTPUT_FOLDER = 'outputFolder'
+    P_OUTPUT_META = 'outputMeta'
+
+    @staticmethod
+    def sensors():
+        # 'default' returns PROSAIL spectra (400-2500 nm @ 1nm), all other sensors are read from the .srf files
+        srf_dir = os.path.join(APP_DIR, 'Resources', 'Spec2Sensor', 'srf')
+        return ['default'] + sorted(os.path.splitext(item)[0] for item in os.listdir(srf_dir)
+                                    if item.endswith('.srf'))
+
+    def group(self):
+        return 'Vegetation'
+
+    def groupId(self):
+        return 'vegetation'
+
+    def displayName(self):
+        return 'Create PROSAIL look-up-table'
+
+    def name(self):
+        return 'CreatePROSAILLookUpTable'
+
+    def initAlgorithm(self, configuration=None):
+        self.addParameter(QgsProcessingParameterFile(
+            self.P_PARAS, 'LUT parameter file', extension='txt'))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.P_NS, 'Number of statistical draws (ns)', QgsProcessingParameterNumber.Integer, 1000, False, 1))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.P_SENSOR, 'Sensor', self.sensors(), False, 0))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.P_INT_BOOST, 'Reflectance scale factor', QgsProcessingParameterNumber.Integer, 10000, False, 1))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.P_CP_CBC, 'Cp/CBC dependency', False))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.P_SPLIT_SIZE, 'Model runs per split', QgsProcessingParameterNumber.Integer, 5000, False, 1))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.P_WORKER_COUNT, 'Number of worker processes', QgsProcessingParameterNumber.Integer, 1, False, 0))
+        self.addParameter(QgsProcessingParameterString(self.P_NAME, 'LUT name', 'LUT'))
+        self.addParameter(QgsProcessingParameterFolderDestination(self.P_OUTPUT_FOLDER, 'Output folder'))
+        self.addOutput(QgsProcessingOutputFile(self.P_OUTPUT_META, 'LUT meta file'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        lop, canopy_arch, depends, paras = read_paras_file(self.parameterAsFile(parameters, self.P_PARAS, context))
+        sensor = self.sensors()[self.parameterAsEnum(parameters, self.P_SENSOR, context)]
+        name = self.parameterAsString(parameters, self.P_NAME, context)
+        folder = self.parameterAsString(parameters, self.P_OUTPUT_FOLDER, context)
+        os.makedirs(folder, exist_ok=True)
+
+        model_I = mod.InitModel(lop=lop, canopy_arch=canopy_arch, int_boost=self.parameterAsInt(
+            parameters, self.P_INT_BOOST, context), s2s=sensor)
+        model_I.initialize_vectorized(LUT_dir=folder + '/', LUT_name=name,
+                                      ns=self.parameterAsInt(parameters, self.P_NS, context),
+                                      max_per_file=self.parameterAsInt(parameters, self.P_SPLIT_SIZE, context),
+                                      depends=depends,
+                                      depends_cp_cbc=self.parameterAsBoolean(parameters, self.P_CP_CBC, context),
+                                      n_workers=self.parameterAsInt(parameters, self.P_WORKER_COUNT, context),
+                                      feedback=feedback, **paras)
+
+        meta_file = os.path.join(folder, name + '_00meta.lut')
+        feedback.pushInfo('LUT written to {}'.format(meta_file))
+        return {self.P_OUTPUT_FOLDER: folder, self.P_OUTPUT_META: meta_file}
+
+    def shortHelpString(self):
+        html = '' \
+               '<p>Creates a PROSAIL/PROINFORM look-up-table (LUT) without the GUI. The LUT is written as one ' \
+               'memory-mapped LUT container (<i>name</i>.lutc) together with the meta files used by the inversion ' \
+               'and the Processor apps. Model runs are computed split by split, optionally on a pool of worker ' \
+               'processes.</p>' \
+               '<h3>LUT parameter file</h3>' \
+               '<p>A <i>_00paras.txt</i> file, as written by the "Create Look-up-table" app, defining the leaf and ' \
+               'canopy models and the parameter ranges.</p>' \
+               '<h3>Number of statistical draws (ns)</h3>' \
+               '<p>Number of draws from the statistical distributions of the parameters.</p>' \
+               '<h3>Sensor</h3>' \
+               '<p>Sensor to resample the PROSAIL spectra to; "default" keeps 400-2500 nm @ 1nm.</p>' \
+               '<h3>Reflectance scale factor</h3>' \
+               '<p>Factor applied to the model reflectances, e.g. 10000 for EnMAP.</p>' \
+               '<h3>Cp/CBC dependency</h3>' \
+               '<p>Whether to drop LUT members with a protein content (cp) larger than the carbon based ' \
+               'constituents (cbc), as the "Cp/CBC check" of the "Create Look-up-table" app does. The ' \
+               'setting is not stored in the LUT parameter file.</p>' \
+               '<h3>Model runs per split</h3>' \
+               '<p>Number of model runs computed in one block of work.</p>' \
+               '<h3>Number of worker processes</h3>' \
+               '<p>Number of worker processes running the model in parallel; 0 uses all CPUs. Splits are run ' \
+               'in separate processes, not threads: each worker starts a new Python interpreter, which on ' \
+               'Windows and macOS means relaunching the QGIS executable. Use 1 to run everything in the ' \
+               'QGIS process.</p>' \
+               '<h3>LUT name</h3>' \
+               '<p>Base name of the LUT files.</p>' \
+               '<h3>Output folder</h3>' \
+               '<p>Folder to write the LUT files into.</p>'
+        return html
+
+    def helpUrl(self, *args, **kwargs):
+        return ''
+
+    def createInstance(self):
+        return type(self)()
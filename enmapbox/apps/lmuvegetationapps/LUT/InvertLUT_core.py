@@ -28,10 +28,15 @@
 # The idea is to browse through all spectra of the LUT, treating it as a library, and detect the spectra with closest
 # relation to the measured reflectances; The median of the n-best fits is considered the valid result
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from enmapbox.coreapps._classic.hubflow.core import *
 from matplotlib import pyplot as plt
 import numpy as np
 
+from lmuvegetationapps.LUT.LUT_container import LUTContainer
+
 
 # class RTMInversion is the core class of the inversion
 class RTMInversion:
@@ -63,9 +68,25 @@ class RTMInversion:
 
         # LUT:
         self.ntotal = None  # how many entries in total
+        self.storage = None  # "splits": <name>_<geo>_<split>.npy files, "container": <name>.lutc (LUTContainer)
+        self.container = None
         self.ns = None  # how many different parameter variations from the statistical distribution of the LUT
         self.tts_LUT, self.tto_LUT, self.psi_LUT, self.nangles_LUT = (None, None, None, None)
 
+        # Inversion engine: pixels are inverted in chunks by a pool of worker threads, so that the cost matrices
+        # (pixels x LUT-members) of all concurrently processed chunks do not exceed chunk_memory bytes in total.
+        # The cost matrix is computed with the (multithreaded) BLAS, which already uses all cores; a second worker
+        # only overlaps the ranking of one chunk with the matrix product of the next, more would oversubscribe
+        self.chunk_memory = 2 ** 27
+        self.workers = min(2, os.cpu_count() or 1)
+        # Optional nearest neighbour index over the LUT spectra (only for RMSE and MAE): None, 'kd_tree' or 'ball_tree'
+        # With index_components, the index is built on the first principal components of the LUT spectra (RMSE only);
+        # the index then returns nbfits * index_oversampling candidates, which are re-ranked with the exact RMSE
+        self.index_type = None
+        self.index_components = None
+        self.index_oversampling = 4
+        self.ntotal_lut = None  # number of members in the LUT of the current geo_ensemble
+
     def inversion_setup(self, image, image_out, LUT_path, ctype, nbfits, nbfits_type, noisetype, noiselevel,
                         wl_image, exclude_bands, out_mode, geo_image=None, geo_fixed=None, spatial_geo=False,
                         nodat=None, mask_image=None):
@@ -230,6 +251,50 @@ class RTMInversion:
 
         return delta
 
+    @staticmethod
+    def _costfun_batch(image_ref, model_ref, ctype, model_sqnorm=None):
+        # Batched version of _costfun: image_ref holds one spectrum per column (n_wl, n_pixels), model_ref the LUT
+        # spectra (n_wl, n_members); returns the distances of all pixels to all LUT-members (n_pixels, n_members)
+        # model_ref may also be a list of band blocks (e.g. views into a LUT container), which stacked in order
+        # match the bands of image_ref
+        model_blocks = model_ref if isinstance(model_ref, list) else [model_ref]
+        image_blocks = list()
+        offset = 0
+        for model_block in model_blocks:
+            image_blocks.append(image_ref[offset:offset + model_block.shape[0]])
+            offset += model_block.shape[0]
+
+        n_wl = image_ref.shape[0]
+        if ctype == 1:  # RMSE, squared distances from the identity |a - b|² = |a|² - 2ab + |b|²
+            if model_sqnorm is None:
+                model_sqnorm = sum(np.einsum('ij,ij->j', block, block) for block in model_blocks)
+            image_sqnorm = np.einsum('ij,ij->j', image_ref, image_ref)
+            delta = image_blocks[0].T @ model_blocks[0]
+            for image_block, model_block in zip(image_blocks[1:], model_blocks[1:]):
+                delta += image_block.T @ model_block
+            delta *= -2
+            delta += image_sqnorm[:, np.newaxis]
+            delta += model_sqnorm[np.newaxis, :]
+            np.maximum(delta, 0, out=delta)  # rounding errors may produce tiny negative values
+            delta /= n_wl
+            np.sqrt(delta, out=delta)
+        elif ctype == 2 or ctype == 3:  # MAE / mNSE, accumulate absolute differences band by band
+            delta = np.zeros(shape=(image_ref.shape[1], model_blocks[0].shape[1]))
+            buffer = np.empty_like(delta)
+            for image_block, model_block in zip(image_blocks, model_blocks):
+                for image_band, model_band in zip(image_block, model_block):
+                    np.subtract(image_band[:, np.newaxis], model_band[np.newaxis, :], out=buffer)
+                    np.abs(buffer, out=buffer)
+                    delta += buffer
+            if ctype == 3:
+                denominator = np.sum(np.abs(image_ref - np.mean(image_ref, axis=0)), axis=0)
+                delta = 1.0 - delta / denominator[:, np.newaxis]
+        else:
+            delta = None
+            exit("wrong cost function type. Expected 1, 2 or 3; got %i instead" % ctype)
+
+        return delta
+
     def get_lutmeta(self, file):
         with open(file, 'r') as metafile:
             metacontent = metafile.readlines()
@@ -272,6 +337,15 @@ class RTMInversion:
         self.whichpara = metacontent[13].split("=")[1].split(";")
         self.npara = len(self.whichpara)
 
+        # LUTs stored in one LUT container are marked by "storage=container", older LUTs consist of splits
+        self.storage = "splits"
+        for line in metacontent[14:]:
+            if line.startswith("storage="):
+                self.storage = line.split("=")[1]
+        self.container = None
+        if self.storage == "container":  # memory-mapped, only the geo_ensembles in use are read from disk
+            self.container = LUTContainer(self.LUT_base + ".lutc")
+
         self.nangles_LUT = [len(self.tts_LUT), len(self.tto_LUT), len(self.psi_LUT)]
         if self.nbfits_type == "rel":
             self.nbfits = int(self.ns * (self.nbfits / 100.0))  # convert from % to relative units
@@ -288,6 +362,78 @@ class RTMInversion:
         plt.plot(model_ref, color='r')
         plt.show()
 
+    def load_lut(self, ilut):
+        # load all splits of a geo_ensemble, separate parameters and spectra, and prepare the inversion engine
+        if self.storage == "container":
+            lut_params = self.container.parameters(ilut)
+            bands = [band for band in range(self.container.nbands) if band not in self.exclude_bands_image]
+            lut = self.container.spectra_runs(ilut, bands)  # views of contiguous bands, nothing is copied
+            if self.noisetype > 0 or self.index_type is not None:
+                lut = np.vstack(lut)  # noise and the index need the spectra in memory
+        else:
+            load_objects = [np.load(self.LUT_base + "_" + str(ilut) + "_" + str(split) + ".npy")
+                            for split in range(self.splits)]
+            lut = np.hstack(load_objects)  # load all splits of the current geo_ensembles into "lut"
+            lut_params = lut[:self.npara, :]  # extract parameters - they are at the beginning rows of lut
+            lut = np.delete(lut, self.exclude_bands_model, axis=0)  # delete exclude_bands_model - members
+
+        if not isinstance(lut, list):
+            lut = self.add_noise(ref_array=lut, noise_type=self.noisetype, sigma=self.noiselevel)  # add noise
+            lut = [np.ascontiguousarray(lut, dtype=np.float64)]
+
+        # squared norms of the LUT spectra, reused for all chunks
+        lut_sqnorm = sum(np.einsum('ij,ij->j', block, block) for block in lut)
+        index, projection = self.build_index(lut[0]) if len(lut) == 1 else (None, None)
+
+        return lut_params, lut, lut_sqnorm, index, projection
+
+    def build_index(self, lut):
+        # build the optional nearest neighbour index over the LUT spectra (one LUT-member per row)
+        if self.index_type is None or self.ctype not in (1, 2):
+            return None, None
+        from sklearn.neighbors import BallTree, KDTree
+        tree = KDTree if self.index_type == 'kd_tree' else BallTree
+        metric = 'euclidean' if self.ctype == 1 else 'manhattan'  # RMSE / MAE are monotonic in these distances
+
+        if self.ctype != 1 or self.index_components is None or self.index_components >= lut.shape[0]:
+            return tree(lut.T, metric=metric), None
+
+        # PCA: project the centered spectra onto the eigenvectors of the largest eigenvalues of the covariance
+        mean = np.mean(lut, axis=1)
+        centered = lut - mean[:, np.newaxis]
+        eigenvalues, eigenvectors = np.linalg.eigh(centered @ centered.T)
+        components = eigenvectors[:, ::-1][:, :self.index_components].T
+        return tree((components @ centered).T, metric=metric), (mean, components)
+
+    def chunk_size(self):
+        # number of pixels per chunk, such that the distances of the chunks of all workers fit into chunk_memory
+        if self.index_type is not None and self.ctype in (1, 2):
+            n_members = self.nbfits * self.index_oversampling * self.n_wl
+        else:
+            n_members = self.ntotal_lut
+        return max(1, self.chunk_memory // (8 * max(1, n_members) * max(1, self.workers)))
+
+    def invert_chunk(self, lut_params, lut, lut_sqnorm, index, projection, spectra):
+        # find the nbfits best fitting LUT-members for a chunk of spectra (n_wl, n_pixels) and return the median of
+        # their parameters (npara, n_pixels); lut is a list of band blocks (a single block if an index is used)
+        spectra = spectra.astype(np.float64)
+        if index is None:
+            estimates = self._costfun_batch(image_ref=spectra, model_ref=lut, ctype=self.ctype,
+                                            model_sqnorm=lut_sqnorm)
+            nbest_subset = np.argpartition(estimates, self.nbfits, axis=1)[:, 0:self.nbfits]
+        elif projection is None:  # exact nearest neighbours in the full spectral space
+            nbest_subset = index.query(spectra.T, k=self.nbfits, return_distance=False)
+        else:  # candidates from the PCA-reduced space, re-ranked with the exact RMSE
+            mean, components = projection
+            k = min(self.nbfits * self.index_oversampling, lut[0].shape[1])
+            candidates = index.query((components @ (spectra - mean[:, np.newaxis])).T, k=k, return_distance=False)
+            distances = np.sum((lut[0].T[candidates] - spectra.T[:, np.newaxis, :]) ** 2, axis=2)
+            best = np.argpartition(distances, self.nbfits - 1, axis=1)[:, 0:self.nbfits]
+            nbest_subset = np.take_along_axis(candidates, best, axis=1)
+
+        # Obtain the final result for each pixel: The median of the subset (the order of the n best fits is irrelevant)
+        return np.median(lut_params[:, nbest_subset], axis=2)
+
     def run_inversion(self, prg_widget=None, qgis_app=None):
         # find out, which "whichLUT" are actually found in the geo_image
         self.whichLUT_unique = np.unique(self.whichLUT)
@@ -308,56 +454,45 @@ class RTMInversion:
 
         self.out_matrix = np.empty(shape=(self.npara, self.nrows, self.ncols))  # create empty array for outputs
 
-        # Iterate over all LUT ensembles (the coordinates are known from loop above)
-        for i_ilut, ilut in enumerate(self.whichLUT_unique):
-            if whichLUT_coords[i_ilut][0].size == 0:
-                continue  # after masking, not all 'iluts' are present in the image_copy
-            # make a list of all files that make up one LUT from splits
-            load_objects = [np.load(self.LUT_base + "_" + str(ilut) + "_" + str(split) + ".npy")
-                            for split in range(self.splits)]
-            lut = np.hstack(load_objects)  # load all splits of the current geo_ensembles into "lut"
-
-            lut_params = lut[:self.npara, :]  # extract parameters - they are at the beginning rows of lut
-            lut = np.delete(lut, self.exclude_bands_model, axis=0)  # delete exclude_bands_model - members
-            lut = self.add_noise(ref_array=lut, noise_type=self.noisetype, sigma=self.noiselevel)  # add noise
-
-            samples_size = len(whichLUT_coords[i_ilut][0])  # how many pixels in the current iLUT (whichLUT member)
-            result = np.zeros(shape=(self.npara, samples_size))
-
-            # Iterate over each pixel sample (whichLUT)
-            for isample in range(samples_size):
-                # Get reflectance data of the current sample (all pixels at once)
-                mydata = self.image[:, whichLUT_coords[i_ilut][0][isample], whichLUT_coords[i_ilut][1][isample]]
-
-                # calculate distances between sample and all LUT-members of iLUT
-                estimates = self._costfun(image_ref=mydata[:, np.newaxis], model_ref=lut, ctype=self.ctype)
-                pix_current += 1
-                if isample % 1000 == 0:  # update the progress bar every 1000 pixels
-                    if prg_widget:
-                        pix_limit = pix_current + 999
-                        if pix_limit > npixel_valid:
-                            pix_limit = npixel_valid
-                        prg_widget.gui.lblCaption_r.setText('Inverting pixels {:d}-{:d} of {:d}'
-                                                            .format(pix_current, pix_limit, npixel_valid))
-                        prg_widget.gui.prgBar.setValue(pix_current * 100 // npixel_valid)
-                        qgis_app.processEvents()
-                    else:
-                        print("LUT_unique #{:d} of {:d}: Checking sample {:d} of {:d}"
-                              .format(i_ilut, len(self.whichLUT_unique), isample, samples_size))
-
-                # nbest_subset is a subset of LUT for the n best performing entries
-                nbest_subset = np.argpartition(estimates, self.nbfits)[0:self.nbfits]
-                # sort in order of distance: closest match is nbest_subset[0]
-                nbest_subset = nbest_subset[np.argsort(estimates[nbest_subset])]
-
-                # Obtain the final result for this sample: The median of the subset
-                result[:, isample] = np.median(lut_params[:, nbest_subset], axis=1)
-
-                # Visualize: turn this on and specify WHEN to visualize if necessary
-                # self._visualize(image_ref == mydata, model_ref=nbest_subset[0])
-
-            # Place all results for this whichLUT run in the out_matrix
-            self.out_matrix[:, whichLUT_coords[i_ilut][0], whichLUT_coords[i_ilut][1]] = result
+        # Iterate over all LUT ensembles (the coordinates are known from loop above); the pixels of an ensemble are
+        # inverted in chunks by the worker threads, while the next ensemble is already loaded
+        pending = list()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for i_ilut, ilut in enumerate(self.whichLUT_unique):
+                rows, cols = whichLUT_coords[i_ilut]
+                if rows.size == 0:
+                    continue  # after masking, not all 'iluts' are present in the image_copy
+                lut_params, lut, lut_sqnorm, index, projection = self.load_lut(ilut)
+                self.ntotal_lut = lut_params.shape[1]
+
+                chunk = self.chunk_size()
+                for start in range(0, rows.size, chunk):
+                    chunk_rows, chunk_cols = rows[start:start + chunk], cols[start:start + chunk]
+                    future = executor.submit(self.invert_chunk, lut_params, lut, lut_sqnorm, index, projection,
+                                             self.image[:, chunk_rows, chunk_cols])
+                    pending.append((future, chunk_rows, chunk_cols, i_ilut))
+
+                # collect the results of all previous ensembles, only the current LUT is kept in memory
+                while len(pending) > 0 and pending[0][3] != i_ilut:
+                    pix_current = self._collect(pending.pop(0), pix_current, npixel_valid, prg_widget, qgis_app)
+
+            while len(pending) > 0:
+                pix_current = self._collect(pending.pop(0), pix_current, npixel_valid, prg_widget, qgis_app)
+
+    def _collect(self, pending, pix_current, npixel_valid, prg_widget, qgis_app):
+        # Place the results of a chunk in the out_matrix and update the progress
+        future, chunk_rows, chunk_cols, i_ilut = pending
+        self.out_matrix[:, chunk_rows, chunk_cols] = future.result()
+        pix_current += chunk_rows.size
+        if prg_widget:
+            prg_widget.gui.lblCaption_r.setText('Inverting pixels {:d}-{:d} of {:d}'
+                                                .format(pix_current - chunk_rows.size + 1, pix_current, npixel_valid))
+            prg_widget.gui.prgBar.setValue(pix_current * 100 // npixel_valid)
+            qgis_app.processEvents()
+        elif pix_current // 1000 != (pix_current - chunk_rows.size) // 1000 or pix_current == npixel_valid:
+            print("LUT_unique #{:d} of {:d}: Inverted {:d} of {:d} pixels"
+                  .format(i_ilut, len(self.whichLUT_unique), pix_current, npixel_valid))
+        return pix_current
 
     def write_image(self):
         # write output to file(s), use the same grid as the input image
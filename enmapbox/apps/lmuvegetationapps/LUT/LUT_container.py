@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+***************************************************************************
+    LUT_container.py - LMU Agri Apps - memory-mapped storage of look-up-tables
+    -----------------------------------------------------------------------
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 3 of the License, or
+    (at your option) any later version.
+                                                                                                                                                 *
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this software. If not, see <https://www.gnu.org/licenses/>.
+***************************************************************************
+"""
+
+# LUT_container.py stores a complete LUT (all geo-ensembles) in ONE self-describing file (.lutc), which is opened
+# via memory-mapping. Only the parts of the LUT that are actually accessed are read from disk, so inversion and
+# training can work on LUTs larger than RAM.
+#
+# File layout:
+#   magic (8 bytes) | header length (8 bytes, little endian) | JSON header | padding
+#   data block:     (n_geo, npara + nbands, n_members) - for each geo-ensemble the parameters block (npara rows),
+#                   followed by the spectra block (nbands rows), like in the former <name>_<geo>_<split>.npy files
+#   geometry block: (n_geo, 3) - tts, tto, psi of each geo-ensemble (geometry index)
+# The JSON header holds the meta information (as in the _00meta.lut file), the parameter names, the wavelengths
+# and the offsets and shapes of both blocks.
+
+import json
+
+import numpy as np
+
+
+class LUTContainer:
+    MAGIC = b'LMULUTC1'
+    ALIGNMENT = 64  # blocks start at multiples of 64 bytes
+
+    def __init__(self, filename, mode='r'):
+        # open an existing container; mode 'r' (read-only) or 'r+' (read and write)
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError("{} is not a LUT container".format(filename))
+            header_length = int.from_bytes(file.read(8), 'little')
+            self.header = json.loads(file.read(header_length).decode('utf-8'))
+
+        self.meta = self.header['meta']
+        self.parameter_names = self.header['parameters']
+        self.wavelengths = self.header['wavelengths']
+        self.npara = len(self.parameter_names)
+        self.nbands = len(self.wavelengths)
+        self.n_geo, _, self.n_members = self.header['data']['shape']
+
+        self.data = np.memmap(filename, dtype=np.dtype(self.header['data']['dtype']), mode=mode,
+                              offset=self.header['data']['offset'], shape=tuple(self.header['data']['shape']))
+        self.geometry = np.memmap(filename, dtype=np.float64, mode=mode, offset=self.header['geometry']['offset'],
+                                  shape=tuple(self.header['geometry']['shape']))
+
+    @classmethod
+    def create(cls, filename, parameter_names, wavelengths, geometry, n_members, meta=None, dtype=np.float64):
+        # create a new container with uninitialized data, fill it via parameters(geo) and spectra(geo) afterwards
+        geometry = np.asarray(geometry, dtype=np.float64).reshape((-1, 3))
+        n_geo = geometry.shape[0]
+        data_shape = [n_geo, len(parameter_names) + len(wavelengths), int(n_members)]
+        dtype = np.dtype(dtype)
+
+        # the header size depends on the offsets, so offsets are reserved with a fixed width first
+        header = {'meta': meta if meta is not None else dict(),
+                  'parameters': list(parameter_names),
+                  'wavelengths': [float(wl) for wl in wavelengths],
+                  'data': {'offset': 10 ** 15, 'shape': data_shape, 'dtype': dtype.str},
+                  'geometry': {'offset': 10 ** 15, 'shape': [n_geo, 3], 'dtype': np.dtype(np.float64).str}}
+        header_length = len(json.dumps(header).encode('utf-8'))
+        data_offset = cls._align(len(cls.MAGIC) + 8 + header_length)
+        geometry_offset = cls._align(data_offset + int(np.prod(data_shape)) * dtype.itemsize)
+        header['data']['offset'] = data_offset
+        header['geometry']['offset'] = geometry_offset
+        header_bytes = json.dumps(header).encode('utf-8').ljust(header_length)
+
+        with open(filename, 'wb') as file:
+            file.write(cls.MAGIC)
+            file.write(header_length.to_bytes(8, 'little'))
+            file.write(header_bytes)
+            file.truncate(geometry_offset + geometry.nbytes)  # allocate the file without writing the data block
+
+        container = cls(filename, mode='r+')
+        container.geometry[:] = geometry
+        return container
+
+    @classmethod
+    def _align(cls, offset):
+        return (offset + cls.ALIGNMENT - 1) // cls.ALIGNMENT * cls.ALIGNMENT
+
+    def flush(self):
+        self.data.flush()
+        self.geometry.flush()
+
+    def close(self):
+        # write pending changes and release the memory maps; views taken before remain valid
+        if self.data is not None:
+            self.flush()
+        self.data, self.geometry = None, None
+
+    def record(self, geo):
+        # parameters and spectra of one geo-ensemble (npara + nbands, n_members); zero-copy view
+        return self.data[geo]
+
+    def parameters(self, geo):
+        # parameters of one geo-ensemble (npara, n_members); zero-copy view
+        return self.data[geo, :self.npara]
+
+    def spectra(self, geo, bands=None):
+        # spectra of one geo-ensemble (nbands, n_members); bands may be a slice or a list of band indices
+        # Zero-copy view, if the bands are equally spaced (e.g. a contiguous range), otherwise a copy
+        spectra = self.data[geo, self.npara:]
+        if bands is None:
+            return spectra
+        if isinstance(bands, slice):
+            return spectra[bands]
+        band_slice = self.band_slice(bands)
+        if band_slice is not None:
+            return spectra[band_slice]
+        return spectra[list(bands)]
+
+    def spectra_runs(self, geo, bands=None):
+        # spectra of one geo-ensemble as list of zero-copy views, one for each run of contiguous bands
+        # Stacking the views in order (np.vstack) equals spectra(geo, bands)
+        spectra = self.data[geo, self.npara:]
+        if bands is None:
+            return [spectra]
+        return [spectra[run] for run in self.band_runs(bands)]
+
+    @staticmethod
+    def band_slice(bands):
+        # return the slice, which selects the band indices, or None if they are not equally spaced
+        bands = np.asarray(bands, dtype=np.int64)
+        if bands.size == 0:
+            return slice(0, 0)
+        if bands.size == 1:
+            return slice(int(bands[0]), int(bands[0]) + 1)
+        steps = np.diff(bands)
+        if steps[0] <= 0 or np.any(steps != steps[0]):
+            return None
+        return slice(int(bands[0]), int(bands[-1]) + 1, int(steps[0]))
+
+    @staticmethod
+    def band_runs(bands):
+        # split a sorted list of band indices into slices of contiguous bands
+        bands = np.asarray(bands, dtype=np.int64)
+        if bands.size == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(bands) != 1) + 1
+        starts = np.concatenate([[0], breaks])
+        stops = np.concatenate([breaks, [bands.size]])
+        return [slice(int(bands[start]), int(bands[stop - 1]) + 1) for start, stop in zip(starts, stops)]
+
+    def geo_index(self, tts, tto, psi):
+        # number of the geo-ensemble with the closest geometry (as in RTMInversion.get_geometry)
+        tts_LUT, tto_LUT, psi_LUT = (np.unique(self.geometry[:, i]) for i in range(3))
+        angles = [np.argmin(np.abs(tts - tts_LUT)), np.argmin(np.abs(tto - tto_LUT)), np.argmin(np.abs(psi - psi_LUT))]
+        return int(angles[2] * len(tto_LUT) * len(tts_LUT) + angles[1] * len(tts_LUT) + angles[0])
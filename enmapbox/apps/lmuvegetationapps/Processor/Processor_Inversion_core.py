@@ -44,6 +44,7 @@ from _classic.hubflow.core import *
 import numpy as np
 
 from lmuvegetationapps.Processor.Processor_Training_MLRA_defaults import MLRA_defaults
+from lmuvegetationapps.LUT.LUT_container import LUTContainer
 
 from sklearn.neural_network import MLPRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
@@ -987,8 +988,12 @@ class ProcessorTraining:
 
     def read_lut(self, geo):
         # open a lut-file and reads the content; loads all splits of one geo-ensemble which is passed into the method
-        lut = np.hstack([np.load(self.lut_base + '_{:d}_{:d}'.format(geo, split) + ".npy")
-                         for split in range(self.splits)])  # load all splits of the current geo_ensembles
+        if self.meta_dict.get('storage', 'splits') == 'container':  # all geo_ensembles in one LUT container
+            # memory-mapped view of the geo-ensemble, only the rows selected below are read from disk
+            lut = LUTContainer(self.lut_base + '.lutc').record(geo)
+        else:
+            lut = np.hstack([np.load(self.lut_base + '_{:d}_{:d}'.format(geo, split) + ".npy")
+                             for split in range(self.splits)])  # load all splits of the current geo_ensembles
         # only select the rows with correct band information, then transpose into columns
         X = np.asarray(lut[self.subset_bands_lut, :]).T
 
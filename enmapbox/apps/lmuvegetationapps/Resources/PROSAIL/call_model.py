@@ -28,8 +28,12 @@
 """
 
 import os
+from functools import partial
+
 import numpy as np
 from scipy.stats import truncnorm
+from enmapboxprocessing.blockexecutor import BlockExecutor
+from lmuvegetationapps.LUT.LUT_container import LUTContainer
 import lmuvegetationapps.Resources.PROSAIL.SAIL as SAIL_v
 import lmuvegetationapps.Resources.PROSAIL.INFORM as INFORM_v
 import lmuvegetationapps.Resources.PROSAIL.prospect as prospect_v
@@ -148,6 +152,12 @@ class CallModel:
         return inform
 
 
+def run_lut_split(model, split, paras_block):
+    # Execute PROSAIL for one split of the para_grid (nruns, npara) and return the spectra (nbands, nruns);
+    # module-level function, so that it can be sent to worker processes
+    return model.run_model(paras=dict(zip(model.para_names, paras_block.T))).T
+
+
 # The "SetupMultiple" class handles management of LUT creations; it distributes input parameter ranges into actual
 # Arrays that are later fed into PROSAIL in blocks (vectorized)
 class SetupMultiple:
@@ -347,9 +357,13 @@ class InitModel:
 
     def initialize_vectorized(self, LUT_dir, LUT_name, ns, max_per_file=5000, soil=None,
                               prgbar_widget=None, qgis_app=None, depends=False, depends_cp_cbc=False,
-                              testmode=False, **paras):
+                              testmode=False, n_workers=1, feedback=None, **paras):
         # This is the most important function for initializing PROSAIL
         # It calls instances of PROSAIL and provides blocks of the para_grid
+        # The LUT is written into ONE memory-mapped LUT container <LUT_name>.lutc with a block of shape
+        # (geo_ensembles, npara + nbands, members per geo_ensemble); the splits of max_per_file runs are only
+        # blocks of work, which are distributed over n_workers processes (0: all CPUs)
+        # feedback (e.g. a QgsProcessingFeedback) replaces the progress bar widget when running headless
         self.soil = soil
         if len(paras["tts"]) > 1 or len(paras["tto"]) > 1 or len(paras["psi"]) > 1:
             self.geo_mode = "sort"  # LUT-Files are (firstly) sorted by geometry
@@ -386,10 +400,8 @@ class InitModel:
             sensor_init_success = self.s2s_I.init_sensor()
             if not sensor_init_success:
                 exit("Could not convert spectra to sensor resolution!")
-            nbands = self.s2s_I.n_wl_sensor
             wl_sensor = self.s2s_I.wl_sensor
         else:
-            nbands = len(lambd)
             wl_sensor = lambd
 
         # for debugging or time estimation
@@ -402,6 +414,16 @@ class InitModel:
         struct_ensemble = 0
         n_struct_ensembles = 1
 
+        # With the cp-cbc dependency, members with cp > cbc are deleted; the members of each geo_ensemble are
+        # compacted, so that all geo_ensembles need to keep the same number of members
+        if mask is not None:
+            members_per_geo = mask.reshape((n_ensembles_geo, crun_pergeo)).sum(axis=1)
+            if np.any(members_per_geo != members_per_geo[0]):
+                raise ValueError("cp-cbc dependency removes different numbers of LUT members per geometry")
+            n_members = int(members_per_geo[0])
+        else:
+            n_members = crun_pergeo
+
         ##  Prepare content for .lut-metafile:
         # Geometries are either logical (len == 3) or fixed (len == 1) or not supplied
         if len(paras["tts"]) == 3:
@@ -440,14 +462,15 @@ class InitModel:
             meta.write("\ncanopy_architecture_model=%s" % self.canopy_arch)
             meta.write("\ngeo_mode=%s" % self.geo_mode)
             meta.write("\ngeo_ensembles=%i" % n_ensembles_geo)
-            meta.write("\nsplits=%i" % n_ensembles_split)
-            meta.write("\nmax_file_length=%i" % self.max_filelength)
+            meta.write("\nsplits=%i" % 1)  # all splits are stored in the same file
+            meta.write("\nmax_file_length=%i" % n_members)
             meta.write("\ntts={}".format(";".join(i for i in tts_str)))
             meta.write("\ntto={}".format(";".join(i for i in tto_str)))
             meta.write("\npsi={}".format(";".join(i for i in psi_str)))
             meta.write("\nmultiplication_factor=%i" % self.int_boost)
             meta.write("\nparameters={}".format(";".join(i for i in self.para_names)))
             meta.write("\nwavelengths={}".format(";".join(str(i) for i in wl_sensor)))
+            meta.write("\nstorage=container")  # one LUT container instead of <name>_<geo>_<split>.npy files
 
         # Write another metafile which contains the ranges of all parameters (for information and restoring in the GUI)
         with open("%s_00paras.txt" % (LUT_dir + LUT_name), "w") as paras_meta:
@@ -477,62 +500,83 @@ class InitModel:
             prgbar_widget.gui.lblCaption_l.setText("Creating LUT")
             qgis_app.processEvents()
 
-        for geo_ensemble in range(n_ensembles_geo):  # iterate through all ensembles of geometries
-            rest = crun_pergeo
-            for split in range(n_ensembles_split):  # iterate through all "splits" (max_per_file)
-
-                if rest >= max_per_file:  # if there are more runs left than max_per_file allows...
-                    save_array = np.empty((nbands + npara, max_per_file))  # build an empty array
-                    nruns = max_per_file  # runs is max
-                else:
-                    nruns = rest  # otherwise, nruns is what's left
-                    save_array = np.empty((nbands + npara, rest))
-
-                run = geo_ensemble * crun_pergeo + split * max_per_file  # current run (first of the current split)
-
-                if prgbar_widget:
-                    if prgbar_widget.gui.lblCancel.text() == "-1":
-                        prgbar_widget.gui.lblCancel.setText("")
-                        prgbar_widget.gui.cmdCancel.setDisabled(False)
-                        raise ValueError("LUT creation cancelled!")
-
-                    prgbar_widget.gui.lblCaption_r.setText('Ensemble Geo {:d} of {:d} | Split {:d} of {:d}'.
-                                                           format(geo_ensemble + 1, n_ensembles_geo, split + 1,
-                                                                  n_ensembles_split))
-                    qgis_app.processEvents()
-
-                else:
-                    print(
-                        "LUT ensemble struct #{:d} of {:d}; ensemble geo #{:d} of {:d}; split #{:d} of {:d}; "
-                        "total #{:d} of {:d}"
-                        .format(struct_ensemble, n_struct_ensembles - 1, geo_ensemble,
-                                n_ensembles_geo - 1, split, n_ensembles_split - 1, run, crun_max))
-
-                if prgbar_widget:
-                    prgbar_widget.gui.prgBar.setValue(int(run * 100 / crun_max))  # set value of the progress bar
-                    qgis_app.processEvents()
-
-                # Execute the model and fill the results into the prepared array
-                # The double transpose of the matrix (.T) fits the paras in the necessary shape run_model expects
-                # The first "npara" rows are reserved for the parameter-values
-                # The rest is reserved for the spectral results of PROSAIL
-                save_array[npara:, :] = self.run_model(paras=
-                                                       dict(zip(self.para_names, para_grid[run:run + nruns, :].T))).T
-                save_array[:npara, :] = para_grid[run:run + nruns, :].T
-                if mask is not None:
-                    save_array = save_array[:, mask]
-                    # TODO: adapt "n_total"/"ns" to number of final samples in the LUT is mask was applied
-
-                rest -= max_per_file  # calculate what's left for next iteration
-
-                # Save each split to a new file (.npy)
-                np.save("{}_{:d}_{:d}".format(LUT_dir + LUT_name, geo_ensemble, split), save_array)
+        # Preallocate the LUT container on disk; parameters are stored in the first npara rows, followed by the
+        # spectra; the geometry index holds tts, tto and psi of each geo_ensemble
+        lut_file = "%s.lutc" % (LUT_dir + LUT_name)
+        geo_columns = [self.para_names.index(angle) for angle in ["tts", "tto", "psi"]]
+        geometry = para_grid[::crun_pergeo, :][:n_ensembles_geo, geo_columns]
+        container_meta = {"name": LUT_name, "n_total": int(setup.nruns_total), "ns": int(setup.ns),
+                          "lop_model": self.lop, "canopy_architecture_model": self.canopy_arch,
+                          "geo_mode": self.geo_mode, "multiplication_factor": int(self.int_boost)}
+        container = LUTContainer.create(lut_file, parameter_names=self.para_names, wavelengths=wl_sensor,
+                                        geometry=geometry, n_members=n_members, meta=container_meta)
+        lut = container.data
+
+        # A split is identified by (geo_ensemble, split); runs are in the order of the para_grid
+        splits = [(geo_ensemble, split) for geo_ensemble in range(n_ensembles_geo)
+                  for split in range(n_ensembles_split)]
+
+        def split_runs(geo_ensemble, split):
+            run = geo_ensemble * crun_pergeo + split * max_per_file  # current run (first of the current split)
+            nruns = min(max_per_file, crun_pergeo - split * max_per_file)
+            return run, nruns
+
+        def read(block):
+            geo_ensemble, split = block
+            run, nruns = split_runs(geo_ensemble, split)
+
+            if prgbar_widget:
+                if prgbar_widget.gui.lblCancel.text() == "-1":
+                    prgbar_widget.gui.lblCancel.setText("")
+                    prgbar_widget.gui.cmdCancel.setDisabled(False)
+                    raise ValueError("LUT creation cancelled!")
+            if feedback is not None and feedback.isCanceled():
+                raise ValueError("LUT creation cancelled!")
+
+            return para_grid[run:run + nruns, :]
+
+        def write(block, spectra):
+            geo_ensemble, split = block
+            run, nruns = split_runs(geo_ensemble, split)
+
+            # place parameters and spectra of the split at the position of its (remaining) members
+            members = slice(None)
+            first = split * max_per_file
+            if mask is not None:
+                members = mask[run:run + nruns]
+                first = int(np.sum(mask[geo_ensemble * crun_pergeo:run]))
+            count = nruns if mask is None else int(np.sum(members))
+            lut[geo_ensemble, :npara, first:first + count] = para_grid[run:run + nruns, :].T[:, members]
+            lut[geo_ensemble, npara:, first:first + count] = spectra[:, members]
+
+            done = run + nruns
+            if prgbar_widget:
+                prgbar_widget.gui.lblCaption_r.setText('Ensemble Geo {:d} of {:d} | Split {:d} of {:d}'.
+                                                       format(geo_ensemble + 1, n_ensembles_geo, split + 1,
+                                                              n_ensembles_split))
+                prgbar_widget.gui.prgBar.setValue(int(done * 100 / crun_max))  # set value of the progress bar
+                qgis_app.processEvents()
+            elif feedback is not None:
+                feedback.setProgress(done * 100 / crun_max)
+            else:
+                print("LUT ensemble struct #{:d} of {:d}; ensemble geo #{:d} of {:d}; split #{:d} of {:d}; "
+                      "total #{:d} of {:d}"
+                      .format(struct_ensemble, n_struct_ensembles - 1, geo_ensemble,
+                              n_ensembles_geo - 1, split, n_ensembles_split - 1, done, crun_max))
+
+        # Execute the model split by split; PROSPECT and SAIL are pure NumPy, so the splits are fanned out
+        # to a pool of worker processes, while the results are written by this process in the original order
+        executor = BlockExecutor(workerCount=n_workers, useProcesses=True)
+        executor.run(splits, read, partial(run_lut_split, self), write)
+        container.close()
 
         if prgbar_widget:
             prgbar_widget.gui.lblCaption_r.setText('File {:d} of {:d}'.format(crun_max, crun_max))
             prgbar_widget.gui.prgBar.setValue(100)
             prgbar_widget.gui.close()
 
+        return lut_file
+
     def initialize_single(self, **paras):
         # Initialize a single run of PROSAIL (simplification for building of para_grid)
         self.soil = paras["soil"]
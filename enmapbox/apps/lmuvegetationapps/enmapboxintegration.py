@@ -148,6 +148,10 @@ class LMU_EnMAPBoxApp(EnMAPBoxApplication):
         m = MainUiFunc()
         m.show()
 
+    def processingAlgorithms(self):
+        from lmuvegetationapps.LUT.CreateLUT_algorithm import CreateLUTAlgorithm
+        return [CreateLUTAlgorithm()]
+
 
 ### Interfaces to use algorithms in algorithms.py within
 ### QGIS Processing Framework
@@ -117,7 +117,7 @@ class MaskRasterDataProvider(QgsRasterDataProvider):
 
         array = self.reader.arrayFromBoundingBoxAndSize(boundingBox, width, height, bandList=[self.bandNo])[0]
         maskArray = self.reader.maskArray(
-            [array], [bandNo], self.maskNonFiniteValues, None, self.maskNoDataValues
+            [array], [self.bandNo], self.maskNonFiniteValues, None, self.maskNoDataValues
         )[0]
 
         if self.maskValues is not None:
@@ -10,6 +10,7 @@ from enmapbox.typeguard import typechecked
 from enmapboxprocessing.algorithm.aggregaterasterbandsalgorithm import AggregateRasterBandsAlgorithm
 from enmapboxprocessing.algorithm.aggregaterastersalgorithm import AggregateRastersAlgorithm
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.onlineaggregator import OnlineAggregator
 from enmapboxprocessing.rasterreader import RasterReader
 
 
@@ -25,10 +26,14 @@ class AggregateArdRastersAlgorithm(EnMAPProcessingAlgorithm):
     P_END_DATE, _END_DATE = 'endDate', 'End date'
     P_START_DAY, _START_DAY = 'startDay', 'Start day'
     P_END_DAY, _END_DAY = 'endDay', 'End day'
+    P_QUANTILE_METHOD, _QUANTILE_METHOD = 'quantileMethod', 'Quantile method'
+    P_SKETCH_SIZE, _SKETCH_SIZE = 'sketchSize', 'Sketch size'
 
     P_OUTPUT_BASENAME, _OUTPUT_BASENAME = 'outputBasename', 'Output basename'
     P_OUTPUT_DATA_CUBE, _OUTPUT_DATA_CUBE = 'outputDataCube', 'Output data cube'
     O_FUNCTION = AggregateRasterBandsAlgorithm.O_FUNCTION
+    O_QUANTILE_METHOD = AggregateRastersAlgorithm.O_QUANTILE_METHOD
+    ExactQuantileMethod, ApproximateQuantileMethod = range(len(O_QUANTILE_METHOD))
 
     def displayName(self) -> str:
         return 'Aggregate ARD raster layers'
@@ -54,6 +59,16 @@ class AggregateArdRastersAlgorithm(EnMAPProcessingAlgorithm):
             (self._END_DATE, 'Filter rasters by end date.'),
             (self._START_DAY, 'Filter rasters by start day.'),
             (self._END_DAY, 'Filter rasters by end day.'),
+            (self._QUANTILE_METHOD, 'Method used for median, interquartile range and percentiles. '
+                                    'Exact quantiles require all rasters of a tile block in memory at once. '
+                                    'Approximate quantiles are derived from a sketch, which allows to stream the '
+                                    'rasters one at a time, so that memory usage is independent of the length of '
+                                    'the time series. All other functions are always streamed. '
+                                    'Short series, for which the exact stack needs less memory than the sketch, '
+                                    'are aggregated exactly.'),
+            (self._SKETCH_SIZE, 'Number of centroids used by the approximate quantile sketch. '
+                                'Quantiles are exact for up to twice as many observations, '
+                                'rank errors are approximately 1% with the default size.'),
 
             (self._OUTPUT_BASENAME, 'The output basename used to write into the output data cube. '
                                     'When using a standard name like "myRaster.tif", all outputs are written into a '
@@ -75,6 +90,11 @@ class AggregateArdRastersAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterDate(self.P_END_DATE, self._END_DATE, None, True, advanced=True)
         self.addParameterInt(self.P_START_DAY, self._START_DAY, None, True, 1, 366, True)
         self.addParameterInt(self.P_END_DAY, self._END_DAY, None, True, 1, 366, True)
+        self.addParameterEnum(
+            self.P_QUANTILE_METHOD, self._QUANTILE_METHOD, self.O_QUANTILE_METHOD, False, self.ExactQuantileMethod,
+            True, True
+        )
+        self.addParameterInt(self.P_SKETCH_SIZE, self._SKETCH_SIZE, OnlineAggregator.SketchSize, True, 1, None, True)
         self.addParameterString(self.P_OUTPUT_BASENAME, self._OUTPUT_BASENAME)
         self.addParameterFolderDestination(self.P_OUTPUT_DATA_CUBE, self._OUTPUT_DATA_CUBE)
 
@@ -90,6 +110,8 @@ class AggregateArdRastersAlgorithm(EnMAPProcessingAlgorithm):
         endDate = self.parameterAsDateTime(parameters, self.P_END_DATE, context).date()
         startDay = self.parameterAsInt(parameters, self.P_START_DAY, context)
         endDay = self.parameterAsInt(parameters, self.P_END_DAY, context)
+        quantileMethod = self.parameterAsEnum(parameters, self.P_QUANTILE_METHOD, context)
+        sketchSize = self.parameterAsInt(parameters, self.P_SKETCH_SIZE, context)
         outputBasename = self.parameterAsString(parameters, self.P_OUTPUT_BASENAME, context)
         outputDataCube = self.parameterAsFileOutput(parameters, self.P_OUTPUT_DATA_CUBE, context)
 
@@ -138,6 +160,8 @@ class AggregateArdRastersAlgorithm(EnMAPProcessingAlgorithm):
             parameters = {
                 alg.P_RASTERS: filenames,
                 alg.P_FUNCTION: functionIndices,
+                alg.P_QUANTILE_METHOD: quantileMethod,
+                alg.P_SKETCH_SIZE: sketchSize,
                 alg.P_OUTPUT_BASENAME: outputBasename,
                 alg.P_OUTPUT_FOLDER: join(outputDataCube, tilename)
             }
@@ -1,12 +1,13 @@
-from math import ceil, nan, inf
+from math import nan
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
-from osgeo import gdal
 
+from enmapboxprocessing.algorithm.aggregaterastersalgorithm import AggregateRastersAlgorithm
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
-from enmapboxprocessing.numpyutils import NumpyUtils
+from enmapboxprocessing.memoryplanner import MemoryPlanner
+from enmapboxprocessing.onlineaggregator import OnlineAggregator
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.utils import Utils
 from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, Qgis)
@@ -17,6 +18,8 @@ from enmapbox.typeguard import typechecked
 class AggregateRasterBandsAlgorithm(EnMAPProcessingAlgorithm):
     P_RASTER, _RASTER = 'raster', 'Raster layer'
     P_FUNCTION, _FUNCTION = 'function', 'Aggregation functions'
+    P_QUANTILE_METHOD, _QUANTILE_METHOD = 'quantileMethod', 'Quantile method'
+    P_SKETCH_SIZE, _SKETCH_SIZE = 'sketchSize', 'Sketch size'
     P_OUTPUT_RASTER, _OUTPUT_RASTER = 'outputRaster', 'Output raster layer'
 
     O_FUNCTION = [
@@ -30,6 +33,8 @@ class AggregateRasterBandsAlgorithm(EnMAPProcessingAlgorithm):
     ) = range(len(O_FUNCTION))
     P0 = len(O_FUNCTION)
     O_FUNCTION.extend([f'{i}-th percentile' for i in range(101)])
+    O_QUANTILE_METHOD = AggregateRastersAlgorithm.O_QUANTILE_METHOD
+    ExactQuantileMethod, ApproximateQuantileMethod = range(len(O_QUANTILE_METHOD))
 
     def displayName(self) -> str:
         return 'Aggregate raster layer bands'
@@ -42,6 +47,16 @@ class AggregateRasterBandsAlgorithm(EnMAPProcessingAlgorithm):
             (self._RASTER, 'A raster layer with bands to be aggregated.'),
             (self._FUNCTION, 'Aggregation functions to be used. '
                              'Number and order of selected functions equals number and order of output bands.'),
+            (self._QUANTILE_METHOD, 'Method used for median, interquartile range and percentiles. '
+                                    'Exact quantiles require all bands of a block in memory at once. '
+                                    'Approximate quantiles are derived from a sketch, which allows to stream the '
+                                    'bands one at a time, so that memory usage is independent of the number of '
+                                    'bands. All other functions are always streamed. '
+                                    'Short series, for which the exact stack needs less memory than the sketch, '
+                                    'are aggregated exactly.'),
+            (self._SKETCH_SIZE, 'Number of centroids used by the approximate quantile sketch. '
+                                'Quantiles are exact for up to twice as many observations, '
+                                'rank errors are approximately 1% with the default size.'),
             (self._OUTPUT_RASTER, self.RasterFileDestination)
         ]
 
@@ -51,6 +66,11 @@ class AggregateRasterBandsAlgorithm(EnMAPProcessingAlgorithm):
     def initAlgorithm(self, configuration: Dict[str, Any] = None):
         self.addParameterRasterLayer(self.P_RASTER, self._RASTER)
         self.addParameterEnum(self.P_FUNCTION, self._FUNCTION, self.O_FUNCTION, True, None)
+        self.addParameterEnum(
+            self.P_QUANTILE_METHOD, self._QUANTILE_METHOD, self.O_QUANTILE_METHOD, False, self.ExactQuantileMethod,
+            True, True
+        )
+        self.addParameterInt(self.P_SKETCH_SIZE, self._SKETCH_SIZE, OnlineAggregator.SketchSize, True, 1, None, True)
         self.addParameterRasterDestination(self.P_OUTPUT_RASTER, self._OUTPUT_RASTER)
 
     def processAlgorithm(
@@ -59,6 +79,8 @@ class AggregateRasterBandsAlgorithm(EnMAPProcessingAlgorithm):
         raster = self.parameterAsRasterLayer(parameters, self.P_RASTER, context)
         functionIndices = self.parameterAsEnums(parameters, self.P_FUNCTION, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_RASTER, context)
+        quantileMethod = self.parameterAsEnum(parameters, self.P_QUANTILE_METHOD, context)
+        sketchSize = self.parameterAsInt(parameters, self.P_SKETCH_SIZE, context)
 
         with open(filename + '.log', 'w') as logfile:
             feedback, feedback2 = self.createLoggingFeedback(feedback, logfile)
@@ -68,75 +90,60 @@ class AggregateRasterBandsAlgorithm(EnMAPProcessingAlgorithm):
             bandCount = len(functionIndices)
             writer = Driver(filename, feedback=feedback).createLike(reader, Qgis.DataType.Float32, bandCount)
             noDataValue = Utils.defaultNoDataValue(np.float32)
-            lineMemoryUsage = reader.lineMemoryUsage(reader.bandCount() + bandCount, 4)
-            blockSizeY = min(raster.height(), ceil(gdal.GetCacheMax() / lineMemoryUsage))
-            blockSizeX = raster.width()
+            flags = AggregateRastersAlgorithm.onlineAggregatorFlags(functionIndices)
+            seriesLength = reader.bandCount()
+
+            # bands are streamed one at a time into the aggregation state
+            streamingPlanner = MemoryPlanner(feedback=feedback)
+            streamingPlanner.add('input', 1, np.float32)
+            streamingPlanner.addMask()
+            streamingPlanner.add('aggregation state', OnlineAggregator.stateBandCount(**flags), np.float64)
+            streamingPlanner.add(
+                'quantile sketch', OnlineAggregator.sketchBandCount(flags['quantiles'], sketchSize, seriesLength),
+                np.float32
+            )
+            streamingPlanner.add(
+                'sketch temporaries',
+                OnlineAggregator.temporaryBandCount(flags['quantiles'], sketchSize, seriesLength), np.float64
+            )
+
+            stackPlanner = MemoryPlanner(feedback=feedback)
+            stackPlanner.add('input', reader.bandCount(), np.float32)
+            stackPlanner.addMask(reader.bandCount())
+            stackPlanner.add('sorted input', reader.bandCount(), np.float32)
+            stackPlanner.add('moments', 3, np.float64)
+
+            isStreaming = AggregateRastersAlgorithm.isStreaming(
+                flags, quantileMethod, streamingPlanner, stackPlanner, feedback
+            )
+            if isStreaming:
+                feedback.pushInfo('Stream bands into online aggregation')
+                planner = streamingPlanner
+            else:
+                planner = stackPlanner
+            planner.addWriter(writer)
+            blockSizeX, blockSizeY = planner.blockSize(reader, [writer])
             for block in reader.walkGrid(blockSizeX, blockSizeY, feedback):
-                array = np.array(reader.arrayFromBlock(block), dtype=np.float32)
-                mask = reader.maskArray(array)
-                invalid = np.logical_not(np.any(mask, axis=0))  # whole pixel is no data (see  #1424)
-                array[np.logical_not(mask)] = nan
-
-                if (self.AnyTrueFunction in functionIndices) or self.AllTrueFunction in functionIndices:
-                    arrayAsBool = np.logical_and(np.isfinite(array), array)  # take care of NaN and Inf values
-
-                # Calculate all percentiles at once.
-                q = [i - self.P0 for i in functionIndices if i >= self.P0]
-                for i, outarray in enumerate(NumpyUtils.nanpercentile(array, q)):
-                    bandNo = functionIndices.index(q[i] + self.P0) + 1
-                    outarray[np.isnan(outarray)] = noDataValue
-                    writer.writeArray2d(outarray, bandNo, xOffset=block.xOffset, yOffset=block.yOffset)
-
-                # Calculate all other indices individually.
-                for bandNo, functionIndex in enumerate(functionIndices, 1):
-                    if functionIndex >= self.P0:  # skip percentiles
-                        continue
-                    elif functionIndex == self.ArithmeticMeanFunction:
-                        outarray = np.nanmean(array, axis=0)
-                    elif functionIndex == self.StandardDeviationFunction:
-                        outarray = np.nanstd(array, axis=0)
-                    elif functionIndex == self.VarianceFunction:
-                        outarray = np.nanvar(array, axis=0)
-                    elif functionIndex == self.MinimumFunction:
-                        outarray = np.nanmin(array, axis=0)
-                    elif functionIndex == self.MedianFunction:
-                        outarray = np.nanmedian(array, axis=0)
-                    elif functionIndex == self.MaximumFunction:
-                        outarray = np.nanmax(array, axis=0)
-                    elif functionIndex == self.SumFunction:
-                        outarray = np.nansum(array, axis=0)
-                    elif functionIndex == self.ProductFunction:
-                        outarray = np.nanprod(array, axis=0)
-                    elif functionIndex == self.RangeFunction:
-                        outarray = np.nanmax(array, axis=0) - np.nanmin(array, axis=0)
-                    elif functionIndex == self.InterquartileRangeFunction:
-                        p25, p75 = NumpyUtils.nanpercentile(array, [25, 75])
-                        outarray = p75 - p25
-                    elif functionIndex == self.AnyTrueFunction:
-                        outarray = np.any(arrayAsBool, axis=0).astype(np.float32)
-                    elif functionIndex == self.AllTrueFunction:
-                        outarray = np.all(arrayAsBool, axis=0).astype(np.float32)
-                    elif functionIndex == self.ArgMinimumFunction:
-                        # Numpy nanargmin will throw an All-NaN slice encountered ValueError, instead of just a warning.
-                        # Append a inf band to prevent this.
-                        array2 = list(array)
-                        array2.append(np.full_like(array[0], inf))
-                        outarray = np.nanargmin(array2, axis=0).astype(np.float32)
-                        # Now, set All-NaN slice pixel to nan.
-                        outarray[outarray == len(array)] = nan
-                    elif functionIndex == self.ArgMaximumFunction:
-                        # Numpy nanargmax will throw an All-NaN slice encountered ValueError, instead of just a warning.
-                        # Append a -inf band to prevent this.
-                        array2 = list(array)
-                        array2.append(np.full_like(array[0], -inf))
-                        outarray = np.nanargmax(array2, axis=0).astype(np.float32)
-                        # Now, set All-NaN slice pixel to nan.
-                        outarray[outarray == len(array)] = nan
-                    else:
-                        raise ValueError()
-
+                if isStreaming:
+                    aggregator = OnlineAggregator(
+                        (block.height, block.width), sketchSize=sketchSize, seriesLength=seriesLength, **flags
+                    )
+                    for bandNo in reader.bandNumbers():
+                        array = np.array(reader.arrayFromBlock(block, [bandNo]), dtype=np.float32)
+                        mask = reader.maskArray(array, [bandNo])
+                        array[np.logical_not(mask)] = nan
+                        aggregator.update(array[0])
+                    outarrays = AggregateRastersAlgorithm.aggregateOnline(aggregator, functionIndices)
+                    invalid = aggregator.count == 0  # whole pixel is no data (see  #1424)
+                else:
+                    array = np.array(reader.arrayFromBlock(block), dtype=np.float32)
+                    mask = reader.maskArray(array)
+                    invalid = np.logical_not(np.any(mask, axis=0))  # whole pixel is no data (see  #1424)
+                    array[np.logical_not(mask)] = nan
+                    outarrays = AggregateRastersAlgorithm.aggregateArray(array, functionIndices)
+
+                for bandNo, outarray in enumerate(outarrays, 1):
                     # replace nan values by no data values
-                    assert outarray.dtype == np.float32, self.O_FUNCTION[functionIndex]
                     outarray[np.isnan(outarray)] = noDataValue
 
                     # explicitely mask pixel with all-no-data (see #1424)
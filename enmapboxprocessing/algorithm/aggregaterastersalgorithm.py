@@ -1,19 +1,22 @@
-from math import ceil, nan, inf
+from math import nan, inf
 from os import makedirs
 from os.path import join, exists, splitext
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Tuple, Optional
 
 import numpy as np
-from osgeo import gdal
 from qgis.core import QgsProcessingContext, QgsProcessingFeedback, QgsProcessingException, QgsProcessing, \
     QgsRasterLayer, Qgis
 
 from enmapbox.typeguard import typechecked
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
 from enmapboxprocessing.numpyutils import NumpyUtils
+from enmapboxprocessing.onlineaggregator import OnlineAggregator
+from enmapboxprocessing.rasterblockinfo import RasterBlockInfo
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.rasterwriter import RasterWriter
+from enmapboxprocessing.typing import Array2d, Array3d
 from enmapboxprocessing.utils import Utils
 
 
@@ -23,6 +26,8 @@ class AggregateRastersAlgorithm(EnMAPProcessingAlgorithm):
     P_MASKS, _MASKS = 'masks', 'Mask layers'
     P_FUNCTION, _FUNCTION = 'function', 'Aggregation functions'
     P_GRID, _GRID = 'grid', 'Grid'
+    P_QUANTILE_METHOD, _QUANTILE_METHOD = 'quantileMethod', 'Quantile method'
+    P_SKETCH_SIZE, _SKETCH_SIZE = 'sketchSize', 'Sketch size'
     P_OUTPUT_BASENAME, _OUTPUT_BASENAME = 'outputBasename', 'Output basename'
     P_OUTPUT_FOLDER, _OUTPUT_FOLDER = 'outputFolder', 'Output folder'
 
@@ -37,6 +42,180 @@ class AggregateRastersAlgorithm(EnMAPProcessingAlgorithm):
     ) = range(len(O_FUNCTION))
     P0 = len(O_FUNCTION)
     O_FUNCTION.extend([f'{i}-th percentile' for i in range(101)])
+    O_QUANTILE_METHOD = ['Exact', 'Approximate']
+    ExactQuantileMethod, ApproximateQuantileMethod = range(len(O_QUANTILE_METHOD))
+
+    SortedFunctions = [MinimumFunction, MedianFunction, MaximumFunction, RangeFunction, InterquartileRangeFunction]
+    MomentFunctions = [ArithmeticMeanFunction, StandardDeviationFunction, VarianceFunction]
+
+    @staticmethod
+    def readRasterBlock(reader: RasterReader, mreader: Optional[RasterReader], block: RasterBlockInfo) -> np.ndarray:
+        """Return all bands of a raster block as float32 array, with masked values set to NaN."""
+        array = np.array(reader.arrayFromBlock(block), np.float32)
+        mask = reader.maskArray(array)
+        if mreader is not None:
+            marray = mreader.arrayFromBlock(block)
+            mask = np.logical_and(mask, mreader.maskArray(marray, defaultNoDataValue=0))
+        array[np.logical_not(mask)] = nan
+        return array
+
+    @classmethod
+    def onlineAggregatorFlags(cls, functionIndices: List[int]) -> Dict[str, bool]:
+        """Return the OnlineAggregator statistics required by the given functions."""
+        return dict(
+            moments=any(i in cls.MomentFunctions for i in functionIndices),
+            extremes=any(i in [cls.MinimumFunction, cls.MaximumFunction, cls.RangeFunction] for i in functionIndices),
+            sums=cls.SumFunction in functionIndices,
+            products=cls.ProductFunction in functionIndices,
+            truths=cls.AnyTrueFunction in functionIndices or cls.AllTrueFunction in functionIndices,
+            args=cls.ArgMinimumFunction in functionIndices or cls.ArgMaximumFunction in functionIndices,
+            quantiles=any(i in [cls.MedianFunction, cls.InterquartileRangeFunction] or i >= cls.P0
+                          for i in functionIndices)
+        )
+
+    @classmethod
+    def isStreaming(
+            cls, flags: Dict[str, bool], quantileMethod: int, streamingPlanner: MemoryPlanner,
+            stackPlanner: MemoryPlanner, feedback: QgsProcessingFeedback
+    ) -> bool:
+        """
+        Return whether to stream the series into the online aggregation instead of aggregating the stack.
+
+        Approximate quantiles are only streamed, if the sketch needs less memory than the stack,
+        i.e. for series that are longer than the sketch.
+        """
+        if not flags['quantiles']:
+            return True
+        if quantileMethod != cls.ApproximateQuantileMethod:
+            return False
+        if streamingPlanner.pixelMemoryUsage() < stackPlanner.pixelMemoryUsage():
+            return True
+        feedback.pushInfo('Series is short, exact quantiles need less memory than the quantile sketch')
+        return False
+
+    @classmethod
+    def aggregateOnline(cls, aggregator: OnlineAggregator, functionIndices: List[int]) -> List[np.ndarray]:
+        """Return the results of an online aggregation as float32 arrays. Results are NaN for pixel without observations."""
+        q = sorted({i - cls.P0 for i in functionIndices if i >= cls.P0})
+        if cls.MedianFunction in functionIndices:
+            q.append(50)
+        if cls.InterquartileRangeFunction in functionIndices:
+            q.extend([25, 75])
+        percentiles = dict(zip(q, aggregator.resultQuantiles(q))) if len(q) > 0 else dict()
+
+        outarrays = list()
+        for functionIndex in functionIndices:
+            if functionIndex >= cls.P0:
+                outarray = percentiles[functionIndex - cls.P0]
+            elif functionIndex == cls.ArithmeticMeanFunction:
+                outarray = aggregator.resultMean()
+            elif functionIndex == cls.StandardDeviationFunction:
+                outarray = aggregator.resultStandardDeviation()
+            elif functionIndex == cls.VarianceFunction:
+                outarray = aggregator.resultVariance()
+            elif functionIndex == cls.MinimumFunction:
+                outarray = aggregator.resultMinimum()
+            elif functionIndex == cls.MedianFunction:
+                outarray = percentiles[50]
+            elif functionIndex == cls.MaximumFunction:
+                outarray = aggregator.resultMaximum()
+            elif functionIndex == cls.SumFunction:
+                outarray = aggregator.resultSum()
+            elif functionIndex == cls.ProductFunction:
+                outarray = aggregator.resultProduct()
+            elif functionIndex == cls.RangeFunction:
+                outarray = aggregator.resultMaximum() - aggregator.resultMinimum()
+            elif functionIndex == cls.InterquartileRangeFunction:
+                outarray = percentiles[75] - percentiles[25]
+            elif functionIndex == cls.AnyTrueFunction:
+                outarray = aggregator.resultAnyTrue()
+            elif functionIndex == cls.AllTrueFunction:
+                outarray = aggregator.resultAllTrue()
+            elif functionIndex == cls.ArgMinimumFunction:
+                outarray = aggregator.resultArgMinimum()
+            elif functionIndex == cls.ArgMaximumFunction:
+                outarray = aggregator.resultArgMaximum()
+            else:
+                raise ValueError()
+            outarrays.append(outarray.astype(np.float32))
+        return outarrays
+
+    @classmethod
+    def aggregateArray(cls, array: Array3d, functionIndices: List[int]) -> List[Array2d]:
+        """
+        Aggregate a stack of bands along the first axis, while ignoring NaN values.
+
+        The stack is sorted only once, and minimum, median, maximum, range, interquartile range and all
+        percentiles are derived from the sorted stack.
+        Mean, variance and standard deviation are accumulated in a single Welford pass over the stack.
+        Results are NaN for pixel without observations.
+        """
+        valid = np.logical_not(np.isnan(array))
+        count = np.sum(valid, axis=0)
+        outarrays = dict()
+
+        if any(i in cls.SortedFunctions or i >= cls.P0 for i in functionIndices):
+            sortedArray = np.sort(array, axis=0)  # NaN values are sorted to the end
+            q = sorted({i - cls.P0 for i in functionIndices if i >= cls.P0})
+            if cls.MedianFunction in functionIndices:
+                q.append(50)
+            if cls.InterquartileRangeFunction in functionIndices:
+                q.extend([25, 75])
+            percentiles = dict(zip(q, NumpyUtils.percentilesFromSorted(sortedArray, count, q)))
+            minimum = sortedArray[0]
+            maximum = np.take_along_axis(sortedArray, np.clip(count - 1, 0, None)[None], axis=0)[0]
+            for functionIndex in functionIndices:
+                if functionIndex >= cls.P0:
+                    outarrays[functionIndex] = percentiles[functionIndex - cls.P0]
+            outarrays[cls.MinimumFunction] = minimum
+            outarrays[cls.MaximumFunction] = maximum
+            outarrays[cls.RangeFunction] = maximum - minimum
+            if cls.MedianFunction in functionIndices:
+                outarrays[cls.MedianFunction] = percentiles[50]
+            if cls.InterquartileRangeFunction in functionIndices:
+                outarrays[cls.InterquartileRangeFunction] = percentiles[75] - percentiles[25]
+
+        if any(i in cls.MomentFunctions for i in functionIndices):
+            n = np.zeros(array.shape[1:], np.float64)
+            mean = np.zeros(array.shape[1:], np.float64)
+            m2 = np.zeros(array.shape[1:], np.float64)
+            for values, ivalid in zip(array, valid):
+                values = np.where(ivalid, values, 0.)
+                n += ivalid
+                delta = values - mean
+                mean += np.divide(delta, n, out=np.zeros_like(delta), where=ivalid)
+                m2 += np.where(ivalid, delta * (values - mean), 0.)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                variance = m2 / n
+            mean[n == 0] = nan
+            outarrays[cls.ArithmeticMeanFunction] = mean.astype(np.float32)
+            outarrays[cls.VarianceFunction] = variance.astype(np.float32)
+            outarrays[cls.StandardDeviationFunction] = np.sqrt(variance).astype(np.float32)
+
+        for functionIndex in functionIndices:
+            if functionIndex in outarrays:
+                continue
+            elif functionIndex == cls.SumFunction:
+                outarray = np.nansum(array, axis=0)
+            elif functionIndex == cls.ProductFunction:
+                outarray = np.nanprod(array, axis=0)
+            elif functionIndex in [cls.AnyTrueFunction, cls.AllTrueFunction]:
+                arrayAsBool = np.logical_and(valid, array)  # take care of NaN values
+                if functionIndex == cls.AnyTrueFunction:
+                    outarray = np.any(arrayAsBool, axis=0).astype(np.float32)
+                else:
+                    outarray = np.all(arrayAsBool, axis=0).astype(np.float32)
+            elif functionIndex == cls.ArgMinimumFunction:
+                outarray = np.argmin(np.where(valid, array, inf), axis=0).astype(np.float32)
+                outarray[count == 0] = nan
+            elif functionIndex == cls.ArgMaximumFunction:
+                outarray = np.argmax(np.where(valid, array, -inf), axis=0).astype(np.float32)
+                outarray[count == 0] = nan
+            else:
+                raise ValueError()
+            outarrays[functionIndex] = outarray
+
+        return [outarrays[functionIndex].copy() for functionIndex in functionIndices]
 
     def displayName(self) -> str:
         return 'Aggregate raster layers'
@@ -54,6 +233,16 @@ class AggregateRastersAlgorithm(EnMAPProcessingAlgorithm):
             (self._GRID, 'Reference grid specifying the destination extent, pixel size and projection. '
                          'If not defined, first raster is used as grid.'),
             (self._MASKS, 'A list of external raster mask layers.'),
+            (self._QUANTILE_METHOD, 'Method used for median, interquartile range and percentiles. '
+                                    'Exact quantiles require all rasters of a block in memory at once. '
+                                    'Approximate quantiles are derived from a sketch, which allows to stream the '
+                                    'rasters one at a time, so that memory usage is independent of the number of '
+                                    'rasters. All other functions are always streamed. '
+                                    'Short series, for which the exact stack needs less memory than the sketch, '
+                                    'are aggregated exactly.'),
+            (self._SKETCH_SIZE, 'Number of centroids used by the approximate quantile sketch. '
+                                'Quantiles are exact for up to twice as many observations, '
+                                'rank errors are approximately 1% with the default size.'),
             (self._OUTPUT_FOLDER, self.FolderDestination)
         ]
 
@@ -68,6 +257,11 @@ class AggregateRastersAlgorithm(EnMAPProcessingAlgorithm):
             self.P_MASKS, self._MASKS, QgsProcessing.SourceType.TypeRaster, None, True, True
         )
         self.addParameterRasterLayer(self.P_GRID, self._GRID, None, True, True)
+        self.addParameterEnum(
+            self.P_QUANTILE_METHOD, self._QUANTILE_METHOD, self.O_QUANTILE_METHOD, False, self.ExactQuantileMethod,
+            True, True
+        )
+        self.addParameterInt(self.P_SKETCH_SIZE, self._SKETCH_SIZE, OnlineAggregator.SketchSize, True, 1, None, True)
         self.addParameterFolderDestination(self.P_OUTPUT_FOLDER, self._OUTPUT_FOLDER)
 
     def processAlgorithm(
@@ -79,6 +273,8 @@ class AggregateRastersAlgorithm(EnMAPProcessingAlgorithm):
         functionIndices = self.parameterAsEnums(parameters, self.P_FUNCTION, context)
         basename = self.parameterAsString(parameters, self.P_OUTPUT_BASENAME, context)
         foldername = self.parameterAsFileOutput(parameters, self.P_OUTPUT_FOLDER, context)
+        quantileMethod = self.parameterAsEnum(parameters, self.P_QUANTILE_METHOD, context)
+        sketchSize = self.parameterAsInt(parameters, self.P_SKETCH_SIZE, context)
 
         if masks is not None and len(masks) != len(rasters):
             raise QgsProcessingFeedback('Number of masks does not match number of rasters.')
@@ -122,96 +318,68 @@ class AggregateRastersAlgorithm(EnMAPProcessingAlgorithm):
                     writer.setWavelength(readers[0].wavelength(bandNo), bandNo)
                 writers.append(writer)
 
-            lineMemoryUsage = gridReader.lineMemoryUsage(len(writers) + len(readers), 4)
-            blockSizeY = min(raster.height(), ceil(gdal.GetCacheMax() / lineMemoryUsage))
-            blockSizeX = raster.width()
-            for block in gridReader.walkGrid(blockSizeX, blockSizeY, feedback):
+            flags = self.onlineAggregatorFlags(functionIndices)
+            seriesLength = len(readers)
 
-                if masks is not None:
-                    externalMasks = list()
-                    for mreader in mreaders:
-                        a = mreader.arrayFromBlock(block)
-                        m = mreader.maskArray(a, defaultNoDataValue=0)
-                        externalMasks.append(m)
+            # rasters are streamed one at a time into the aggregation state
+            streamingPlanner = MemoryPlanner(feedback=feedback)
+            streamingPlanner.add('input', bandCount, np.float32)
+            streamingPlanner.addMask(bandCount)
+            streamingPlanner.add('aggregation state', bandCount * OnlineAggregator.stateBandCount(**flags), np.float64)
+            streamingPlanner.add(
+                'quantile sketch',
+                bandCount * OnlineAggregator.sketchBandCount(flags['quantiles'], sketchSize, seriesLength), np.float32
+            )
+            streamingPlanner.add(
+                'sketch temporaries',
+                bandCount * OnlineAggregator.temporaryBandCount(flags['quantiles'], sketchSize, seriesLength),
+                np.float64
+            )
 
-                for bandNo in readers[0].bandNumbers():
-                    array = list()
-                    mask = list()
-                    for i, reader in enumerate(readers):
-                        iarray = reader.arrayFromBlock(block, [bandNo])
-                        imask = reader.maskArray(iarray, [bandNo])
-                        if masks is not None:
-                            imask = np.logical_and(imask, externalMasks[i])
-                        array.append(iarray[0])
-                        mask.append(imask[0])
-                    array = np.array(array, np.float32)
-                    invalid = np.logical_not(np.any(mask, axis=0))  # whole pixel is no data
-                    array[np.logical_not(mask)] = nan
-
-                    if self.AnyTrueFunction in functionIndices or self.AllTrueFunction in functionIndices:
-                        arrayAsBool = np.logical_and(np.isfinite(array), array)  # take care of NaN and Inf values
-
-                    # Calculate all percentiles at once.
-                    q = [i - self.P0 for i in functionIndices if i >= self.P0]
-                    for i, outarray in enumerate(NumpyUtils.nanpercentile(array, q)):
-                        writer = writers[functionIndices.index(q[i] + self.P0)]
-                        outarray[np.isnan(outarray)] = noDataValue
-                        outarray[invalid] = noDataValue
-                        writer.writeArray2d(outarray, bandNo, xOffset=block.xOffset, yOffset=block.yOffset)
+            # the stack of all bands of all rasters is read once per block
+            stackPlanner = MemoryPlanner(feedback=feedback)
+            stackPlanner.add('stack', len(readers) * bandCount, np.float32)
+            stackPlanner.addMask(len(readers), 'stack mask')
+            stackPlanner.add('sorted stack', len(readers), np.float32)
+            stackPlanner.add('moments', 3, np.float64)
+
+            isStreaming = self.isStreaming(flags, quantileMethod, streamingPlanner, stackPlanner, feedback)
+            if isStreaming:
+                feedback.pushInfo('Stream rasters into online aggregation')
+                planner = streamingPlanner
+            else:
+                planner = stackPlanner
+            for functionIndex, writer in zip(functionIndices, writers):
+                planner.addWriter(writer, self.O_FUNCTION[functionIndex])
+            blockSizeX, blockSizeY = planner.blockSize(gridReader, writers)
+            for block in gridReader.walkGrid(blockSizeX, blockSizeY, feedback):
 
-                    # Calculate all other indices individually.
-                    for functionIndex, writer in zip(functionIndices, writers):
-                        if functionIndex >= self.P0:  # skip percentiles
-                            continue
-                        elif functionIndex == self.ArithmeticMeanFunction:
-                            outarray = np.nanmean(array, axis=0)
-                        elif functionIndex == self.StandardDeviationFunction:
-                            outarray = np.nanstd(array, axis=0)
-                        elif functionIndex == self.VarianceFunction:
-                            outarray = np.nanvar(array, axis=0)
-                        elif functionIndex == self.MinimumFunction:
-                            outarray = np.nanmin(array, axis=0)
-                        elif functionIndex == self.MedianFunction:
-                            outarray = np.nanmedian(array, axis=0)
-                        elif functionIndex == self.MaximumFunction:
-                            outarray = np.nanmax(array, axis=0)
-                        elif functionIndex == self.SumFunction:
-                            outarray = np.nansum(array, axis=0)
-                        elif functionIndex == self.ProductFunction:
-                            outarray = np.nanprod(array, axis=0)
-                        elif functionIndex == self.RangeFunction:
-                            outarray = np.nanmax(array, axis=0) - np.nanmin(array, axis=0)
-                        elif functionIndex == self.InterquartileRangeFunction:
-                            p25, p75 = NumpyUtils.nanpercentile(array, [25, 75])
-                            outarray = p75 - p25
-                        elif functionIndex == self.AnyTrueFunction:
-                            outarray = np.any(arrayAsBool, axis=0).astype(np.float32)
-                        elif functionIndex == self.AllTrueFunction:
-                            outarray = np.all(arrayAsBool, axis=0).astype(np.float32)
-                        elif functionIndex == self.ArgMinimumFunction:
-                            # Numpy nanargmin will throw an All-NaN slice encountered ValueError, instead of just a warning.
-                            # Append a inf band to prevent this.
-                            array2 = list(array)
-                            array2.append(np.full_like(array[0], inf))
-                            outarray = np.nanargmin(array2, axis=0).astype(np.float32)
-                            # Now, set All-NaN slice pixel to nan.
-                            outarray[outarray == len(array)] = nan
-                        elif functionIndex == self.ArgMaximumFunction:
-                            # Numpy nanargmax will throw an All-NaN slice encountered ValueError, instead of just a warning.
-                            # Append a -inf band to prevent this.
-                            array2 = list(array)
-                            array2.append(np.full_like(array[0], -inf))
-                            outarray = np.nanargmax(array2, axis=0).astype(np.float32)
-                            # Now, set All-NaN slice pixel to nan.
-                            outarray[outarray == len(array)] = nan
-                        else:
-                            raise ValueError()
+                if isStreaming:
+                    aggregator = OnlineAggregator(
+                        (bandCount, block.height, block.width), sketchSize=sketchSize, seriesLength=seriesLength,
+                        **flags
+                    )
+                    for i, reader in enumerate(readers):
+                        aggregator.update(self.readRasterBlock(reader, mreaders[i] if len(mreaders) > 0 else None, block))
+                    outarrays = self.aggregateOnline(aggregator, functionIndices)
+                    invalid = aggregator.count == 0  # whole pixel is no data
+                    outarraysByBand = [[outarray[bandIndex] for outarray in outarrays]
+                                       for bandIndex in range(bandCount)]
+                else:
+                    stack = np.empty((len(readers), bandCount, block.height, block.width), np.float32)
+                    for i, reader in enumerate(readers):
+                        stack[i] = self.readRasterBlock(reader, mreaders[i] if len(mreaders) > 0 else None, block)
+                    invalid = np.all(np.isnan(stack), axis=0)  # whole pixel is no data
+                    outarraysByBand = [self.aggregateArray(stack[:, bandIndex], functionIndices)
+                                       for bandIndex in range(bandCount)]
 
+                for bandIndex, bandNo in enumerate(readers[0].bandNumbers()):
+                    for outarray, writer in zip(outarraysByBand[bandIndex], writers):
                         # replace nan values by no data values
                         outarray[np.isnan(outarray)] = noDataValue
 
                         # explicitely mask pixel with all-no-data (see #1424)
-                        outarray[invalid] = noDataValue
+                        outarray[invalid[bandIndex]] = noDataValue
 
                         # write result
                         writer.writeArray2d(outarray, bandNo, xOffset=block.xOffset, yOffset=block.yOffset)
@@ -1,10 +1,16 @@
 import inspect
+from functools import lru_cache, partial
 from inspect import signature
-from typing import Dict, Any, List, Tuple, Optional
+from typing import Dict, Any, List, Tuple, Optional, Callable
 
+import numpy as np
+
+from enmapboxprocessing.blockexecutor import BlockExecutor
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm
+from enmapboxprocessing.memoryplanner import MemoryPlanner
 from enmapboxprocessing.rasterreader import RasterReader
+from enmapboxprocessing.utils import Utils
 from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, Qgis)
 from enmapbox.typeguard import typechecked
 
@@ -13,12 +19,18 @@ from enmapbox.typeguard import typechecked
 class ApplyBandFunctionAlgorithmBase(EnMAPProcessingAlgorithm):
     P_RASTER, _RASTER = 'raster', 'Raster layer'
     P_FUNCTION, _FUNCTION = 'function', 'Function'
+    P_WORKER_COUNT, _WORKER_COUNT = 'workerCount', 'Number of workers'
+    P_USE_PROCESSES, _USE_PROCESSES = 'useProcesses', 'Use processes instead of threads'
     P_OUTPUT_RASTER, _OUTPUT_RASTER = 'outputRaster', 'Output raster layer'
 
     def helpParameters(self) -> List[Tuple[str, str]]:
         return [
             (self._RASTER, 'Raster layer to be processed band-wise.'),
             (self._FUNCTION, self.helpParameterCode()),
+            (self._WORKER_COUNT, 'Number of workers used for processing bands and tiles in parallel. '
+                                 'Use 1 for sequential processing and 0 for using all CPU cores.'),
+            (self._USE_PROCESSES, 'Whether to run the workers in separate processes instead of threads. '
+                                  'Processes are only recommended for functions that do not release the GIL.'),
             (self._OUTPUT_RASTER, self.RasterFileDestination)
         ]
 
@@ -40,6 +52,8 @@ class ApplyBandFunctionAlgorithmBase(EnMAPProcessingAlgorithm):
     def initAlgorithm(self, configuration: Dict[str, Any] = None):
         self.addParameterRasterLayer(self.P_RASTER, self._RASTER)
         self.addParameterCode(self.P_FUNCTION, self._FUNCTION, self.defaultCodeAsString())
+        self.addParameterInt(self.P_WORKER_COUNT, self._WORKER_COUNT, 1, True, 0, None, True)
+        self.addParameterBoolean(self.P_USE_PROCESSES, self._USE_PROCESSES, False, True, True)
         self.addParameterRasterDestination(self.P_OUTPUT_RASTER, self._OUTPUT_RASTER)
 
     def defaultCodeAsString(self):
@@ -51,18 +65,19 @@ class ApplyBandFunctionAlgorithmBase(EnMAPProcessingAlgorithm):
         return lines
 
     def parameterAsFunction(self, parameters: Dict[str, Any], name, context: QgsProcessingContext):
-        namespace = dict()
         code = self.parameterAsString(parameters, name, context)
-        exec(code, namespace)
-        function = namespace['function']
-        return function
+        return compileBandFunction(code)
 
     def processAlgorithm(
             self, parameters: Dict[str, Any], context: QgsProcessingContext, feedback: QgsProcessingFeedback
     ) -> Dict[str, Any]:
         raster = self.parameterAsRasterLayer(parameters, self.P_RASTER, context)
+        code = self.parameterAsString(parameters, self.P_FUNCTION, context)
         function = self.parameterAsFunction(parameters, self.P_FUNCTION, context)
+        workerCount = self.parameterAsInt(parameters, self.P_WORKER_COUNT, context)
+        useProcesses = self.parameterAsBoolean(parameters, self.P_USE_PROCESSES, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_RASTER, context)
+        maximumMemoryUsage = Utils.maximumMemoryUsage()
 
         with open(filename + '.log', 'w') as logfile:
             feedback, feedback2 = self.createLoggingFeedback(feedback, logfile)
@@ -71,18 +86,66 @@ class ApplyBandFunctionAlgorithmBase(EnMAPProcessingAlgorithm):
             feedback.pushInfo('Apply function')
             self.reader = RasterReader(raster)
             self.writer = Driver(filename, feedback=feedback).createLike(self.reader, self.outputDataType())
-            for i in range(self.reader.bandCount()):
-                feedback.setProgress(i / self.reader.bandCount() * 100)
-                bandList = [i + 1]
-                self.array = self.reader.array(bandList=bandList)[0]
+            executor = BlockExecutor(workerCount, useProcesses)
+            planner = MemoryPlanner(executor.maximumBlockMemoryUsage(maximumMemoryUsage), feedback)
+            planner.addReader(self.reader, [1])
+            planner.add('function', 3, np.float64)  # prepared input, output and temporaries
+            planner.addMask()
+            planner.add('output', 1, self.outputDataType())
+            if self.isDefaultCode(code):
+                overlap = self.overlap()
+            else:
+                feedback.pushInfo('Function code was edited, footprint is unknown')
+                overlap = None
+            if overlap is None:
+                feedback.pushInfo('Function is not known to be local, process whole bands')
+                blockSizeX, blockSizeY = self.reader.width(), self.reader.height()
+                # only keep as many whole bands in flight, as fit into the memory budget
+                bandMemoryUsage = planner.pixelMemoryUsage() * blockSizeX * blockSizeY
+                queueSize = min(executor.queueSize, max(1, maximumMemoryUsage // max(1, bandMemoryUsage)))
+                executor = BlockExecutor(executor.workerCount, useProcesses, queueSize)
+                feedback.pushInfo(f'Memory plan: {bandMemoryUsage / 2 ** 20:.1f} MB per band, {queueSize} band(s) in '
+                                  f'flight ({maximumMemoryUsage / 2 ** 20:.1f} MB)')
+            else:
+                feedback.pushInfo(f'Function footprint requires tiles to overlap by {overlap} pixel')
+                blockSizeX, blockSizeY = planner.blockSize(self.reader, [self.writer], overlap)
+
+            # tiles are (band number, x offset, y offset, width, height), tiles of all bands are processed together
+            bandCount = self.reader.bandCount()
+            tiles = [(bandNo, block.xOffset, block.yOffset, block.width, block.height)
+                     for block in self.reader.walkGrid(blockSizeX, blockSizeY)
+                     for bandNo in range(1, bandCount + 1)]
+            if overlap is None:
+                overlap = 0
+
+            def read(tile):
+                bandNo, xOffset, yOffset, width, height = tile
+                # the halo is clipped at the raster border, so that the function handles the border itself
+                x0 = max(0, xOffset - overlap)
+                y0 = max(0, yOffset - overlap)
+                x1 = min(self.reader.width(), xOffset + width + overlap)
+                y1 = min(self.reader.height(), yOffset + height + overlap)
+                bandList = [bandNo]
+                self.array = self.reader.arrayFromPixelOffsetAndSize(x0, y0, x1 - x0, y1 - y0, bandList)[0]
                 self.prepareInput()
-                self.marray = self.reader.maskArray(self.array[None], bandList=bandList)[0]
-                if len(signature(function).parameters) == 1:
-                    self.outarray = function(self.array)
-                else:
-                    self.outarray = function(self.array, self.reader.noDataValue(i + 1))
+                marray = self.reader.maskArray(self.array[None], bandList=bandList)[0]
+                window = (slice(yOffset - y0, yOffset - y0 + height), slice(xOffset - x0, xOffset - x0 + width))
+                return self.array, marray[window], window, self.reader.noDataValue(bandNo)
+
+            def write(tile, data):
+                bandNo, xOffset, yOffset, width, height = tile
+                self.outarray, self.marray = data
                 self.prepareOutput()
-                self.writer.writeArray(self.outarray[None], bandList=bandList)
+                self.writer.writeArray2d(self.outarray, bandNo, xOffset, yOffset)
+                write.count += 1
+                feedback.setProgress(write.count / len(tiles) * 100)
+
+            write.count = 0
+            if executor.useProcesses and executor.isParallel():
+                process = partial(applyBandFunctionInWorker, code)
+            else:
+                process = partial(applyBandFunction, function)
+            executor.run(tiles, read, process, write)
 
             self.writer.setMetadata(self.reader.metadata())
             self.writer.setNoDataValue(self.outputNoDataValue())
@@ -95,6 +158,24 @@ class ApplyBandFunctionAlgorithmBase(EnMAPProcessingAlgorithm):
 
         return result
 
+    def overlap(self) -> Optional[int]:
+        """
+        Return the number of pixels, tiles need to overlap, so that the tile-wise result matches the band-wise result.
+
+        The overlap is the footprint radius of the default function code and is only used, if the code is not edited.
+        Return None, if the function is not local, in which case whole bands are processed.
+        Overwrite this method, if the footprint of the function is known.
+        """
+        return None
+
+    def isDefaultCode(self, code: str) -> bool:
+        """Return whether the code equals the default code, ignoring blank lines and trailing whitespace."""
+
+        def normalize(text: str) -> List[str]:
+            return [line.rstrip() for line in text.replace(r'\n', '\n').splitlines() if line.strip() != '']
+
+        return normalize(code) == normalize(self.defaultCodeAsString())
+
     def outputDataType(self) -> Qgis.DataType:
         return Qgis.Float32
 
@@ -106,3 +187,25 @@ class ApplyBandFunctionAlgorithmBase(EnMAPProcessingAlgorithm):
 
     def prepareOutput(self):
         pass
+
+
+@lru_cache()
+def compileBandFunction(code: str) -> Callable:
+    namespace = dict()
+    exec(code, namespace)
+    return namespace['function']
+
+
+def applyBandFunction(function: Callable, tile, data) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    array, marray, window, noDataValue = data
+    if len(signature(function).parameters) == 1:
+        outarray = function(array)
+    else:
+        outarray = function(array, noDataValue)
+    if window is not None:
+        outarray = outarray[window]
+    return outarray, marray
+
+
+def applyBandFunctionInWorker(code: str, tile, data) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    return applyBandFunction(compileBandFunction(code), tile, data)
@@ -1,4 +1,3 @@
-from math import ceil
 from random import randint
 from typing import Dict, Any, List, Tuple
 
@@ -6,6 +5,7 @@ import numpy as np
 
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import Category
 from enmapboxprocessing.utils import Utils
@@ -61,12 +61,13 @@ class ClassificationFromClassProbabilityAlgorithm(EnMAPProcessingAlgorithm):
 
             reader = RasterReader(probability)
             writer = Driver(filename, feedback=feedback).createLike(reader, Qgis.DataType.Byte, 1)
-            lineMemoryUsage = reader.lineMemoryUsage()
-            blockSizeY = min(probability.height(), ceil(Utils.maximumMemoryUsage() / lineMemoryUsage))
-            blockSizeX = probability.width()
+            planner = MemoryPlanner(feedback=feedback)
+            planner.addReader(reader, name='probability')
+            planner.addWriter(writer, 'classification')
+            blockSizeX, blockSizeY = planner.blockSize(reader, [writer])
             for block in reader.walkGrid(blockSizeX, blockSizeY, feedback):
                 array = reader.arrayFromBlock(block)
-                invalid = ~np.all(reader.maskArray(array), 0)
+                invalid = ~reader.maskArrayAllBands(array)
                 array.insert(0, 1. - np.sum(array, 0))  # unclassified fraction
                 outarray = np.argmax(array, 0)
                 outarray[invalid] = 0
@@ -1,15 +1,15 @@
 import inspect
 import traceback
-from math import ceil
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 
 import numpy as np
 
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.utils import Utils
-from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, Qgis)
+from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, Qgis, QgsProcessingException)
 from enmapbox.typeguard import typechecked
 
 
@@ -19,6 +19,11 @@ class ConvolutionFilterAlgorithmBase(EnMAPProcessingAlgorithm):
     P_KERNEL, _KERNEL = 'kernel', 'Kernel'
     P_NORMALIZE, _NORMALIZE = 'normalize', 'Normalize kernel'
     P_INTERPOLATE, _INTERPOLATE = 'interpolate', 'Interpolate no data pixel'
+    P_BACKEND, _BACKEND = 'backend', 'Convolution backend'
+    O_BACKEND = ['Automatic', 'Direct', 'Separable', 'FFT']
+    AutomaticBackend, DirectBackend, SeparableBackend, FftBackend = range(len(O_BACKEND))
+    SmallKernelSizeLimit = 9  # smaller kernels are always convolved directly
+    DirectKernelSizeLimit = 49  # larger kernels are convolved via FFT, if not separable
     P_OUTPUT_RASTER, _OUTPUT_RASTER = 'outputRaster', 'Output raster layer'
 
     def helpParameters(self) -> List[Tuple[str, str]]:
@@ -29,6 +34,11 @@ class ConvolutionFilterAlgorithmBase(EnMAPProcessingAlgorithm):
             (self._INTERPOLATE, 'Whether to interpolate no data pixel. '
                                 'Will result in renormalization of the kernel at each position ignoring '
                                 'pixels with no data values.'),
+            (self._BACKEND, 'How to calculate the convolution. '
+                            'Direct convolution is used for small kernels, '
+                            'separable kernels (e.g. box and Gaussian) are applied as a sequence of 1D convolutions '
+                            'and large kernels are convolved via FFT. '
+                            'All backends give the same result, up to floating point precision.'),
             (self._OUTPUT_RASTER, self.RasterFileDestination)
         ]
 
@@ -58,6 +68,7 @@ class ConvolutionFilterAlgorithmBase(EnMAPProcessingAlgorithm):
         self.addParameterCode(self.P_KERNEL, self._KERNEL, self.defaultCodeAsString())
         self.addParameterBoolean(self.P_NORMALIZE, self._NORMALIZE, self.normalizeByDefault(), False, True)
         self.addParameterBoolean(self.P_INTERPOLATE, self._INTERPOLATE, self.interpolateByDefault(), False, True)
+        self.addParameterEnum(self.P_BACKEND, self._BACKEND, self.O_BACKEND, False, self.AutomaticBackend, True, True)
         self.addParameterRasterDestination(self.P_OUTPUT_RASTER, self._OUTPUT_RASTER)
 
     def defaultCodeAsString(self):
@@ -99,11 +110,12 @@ class ConvolutionFilterAlgorithmBase(EnMAPProcessingAlgorithm):
             nan_treatment = 'interpolate'
         else:
             nan_treatment = 'fill'
+        backend = self.parameterAsEnum(parameters, self.P_BACKEND, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_RASTER, context)
         maximumMemoryUsage = Utils.maximumMemoryUsage()
 
         with open(filename + '.log', 'w') as logfile:
-            from astropy.convolution import convolve, CustomKernel
+            from astropy.convolution import CustomKernel
             feedback, feedback2 = self.createLoggingFeedback(feedback, logfile)
             self.tic(feedback, parameters, context)
 
@@ -118,20 +130,31 @@ class ConvolutionFilterAlgorithmBase(EnMAPProcessingAlgorithm):
             zsize, ysize, xsize = kernel.shape
             overlap = int((max(ysize, xsize) + 1) / 2.)
 
+            if backend == self.AutomaticBackend:
+                backend = self.selectBackend(kernel.array, nan_treatment, normalize_kernel)
+            if backend == self.SeparableBackend and self.separableFactors(kernel.array) is None:
+                message = 'kernel is not separable'
+                feedback.reportError(message, True)
+                raise QgsProcessingException(message)
+            feedback.pushInfo(f'Convolution backend: {self.O_BACKEND[backend]}')
+
             feedback.pushInfo('Convolve raster')
             rasterReader = RasterReader(raster)
             writer = Driver(filename, feedback=feedback).createLike(rasterReader, Qgis.Float32)
-            lineMemoryUsage = rasterReader.lineMemoryUsage(dataTypeSize=Qgis.Float32)
-            lineMemoryUsage *= 2  # output has same size
-            blockSizeY = min(raster.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-            blockSizeX = raster.width()
+            planner = MemoryPlanner(maximumMemoryUsage, feedback)
+            planner.addReader(rasterReader)
+            planner.addMask(rasterReader.bandCount())
+            if backend == self.DirectBackend:
+                planner.add('convolution', 3 * rasterReader.bandCount(), np.float64)  # astropy works on float64 copies
+            else:
+                planner.add('convolution', 4 * rasterReader.bandCount(), np.float64)  # values, weights and results
+            planner.addWriter(writer)
+            blockSizeX, blockSizeY = planner.blockSize(rasterReader, [writer])
             for block in rasterReader.walkGrid(blockSizeX, blockSizeY, feedback):
-                feedback.setProgress(block.yOffset / rasterReader.height() * 100)
                 array = rasterReader.arrayFromBlock(block, overlap=overlap)
                 mask = rasterReader.maskArray(array)
-                outarray = convolve(
-                    array, kernel, fill_value=np.nan, nan_treatment=nan_treatment,
-                    normalize_kernel=normalize_kernel, mask=np.logical_not(mask)
+                outarray = self.convolve(
+                    array, np.logical_not(mask), kernel.array, nan_treatment, normalize_kernel, backend
                 )
                 noDataValue = float(np.finfo(np.float32).min)
                 outarray[np.isnan(outarray)] = noDataValue
@@ -147,3 +170,132 @@ class ConvolutionFilterAlgorithmBase(EnMAPProcessingAlgorithm):
             self.toc(feedback, result)
 
         return result
+
+    @classmethod
+    def selectBackend(cls, kernel: np.ndarray, nan_treatment: str, normalize_kernel: bool) -> int:
+        """Return the fastest backend for the given kernel."""
+        if (nan_treatment == 'interpolate' or normalize_kernel) and not cls.isNormalizableKernel(kernel):
+            return cls.DirectBackend  # astropy reports the ill-posed normalization
+        if kernel.size <= cls.SmallKernelSizeLimit:
+            return cls.DirectBackend
+        if cls.separableFactors(kernel) is not None:
+            return cls.SeparableBackend
+        if kernel.size > cls.DirectKernelSizeLimit:
+            return cls.FftBackend
+        return cls.DirectBackend
+
+    @staticmethod
+    def isNormalizableKernel(kernel: np.ndarray) -> bool:
+        """Return whether the kernel sum is not close to zero (same criterion as astropy)."""
+        kernelSum = np.sum(kernel)
+        return bool(kernelSum >= 0.01 and not np.isclose(kernelSum, 0, atol=1e-8))
+
+    @staticmethod
+    def separableFactors(kernel: np.ndarray) -> Optional[List[np.ndarray]]:
+        """Return 1D factors along each axis, if the kernel is the outer product of 1D kernels."""
+        axes = [axis for axis, size in enumerate(kernel.shape) if size > 1]
+        factors = [np.ones(1) for size in kernel.shape]
+        if len(axes) == 0:
+            factors[0] = kernel.reshape(1)
+            return factors
+        if len(axes) == 1:
+            factors[axes[0]] = kernel.reshape(-1)
+            return factors
+        if len(axes) > 2:
+            return None
+        kernel2d = kernel.reshape([kernel.shape[axis] for axis in axes])
+        u, s, vT = np.linalg.svd(kernel2d)
+        factor1 = u[:, 0] * np.sqrt(s[0])
+        factor2 = vT[0] * np.sqrt(s[0])
+        if not np.allclose(np.outer(factor1, factor2), kernel2d, rtol=1e-10, atol=1e-12 * np.max(np.abs(kernel2d))):
+            return None
+        factors[axes[0]] = factor1
+        factors[axes[1]] = factor2
+        return factors
+
+    @classmethod
+    def convolve(
+            cls, array: np.ndarray, invalid: np.ndarray, kernel: np.ndarray, nan_treatment: str, normalize_kernel: bool,
+            backend: int = None
+    ) -> np.ndarray:
+        """
+        Convolve a 3d array with a 3d kernel, like astropy.convolution.convolve with fill_value=np.nan.
+
+        Pixel outside the array and invalid pixel are treated as no data.
+        Result pixel without any valid data are set to NaN.
+        """
+        if backend is None or backend == cls.AutomaticBackend:
+            backend = cls.selectBackend(kernel, nan_treatment, normalize_kernel)
+
+        if backend == cls.DirectBackend:
+            from astropy.convolution import convolve
+            return convolve(
+                array, kernel, fill_value=np.nan, nan_treatment=nan_treatment, normalize_kernel=normalize_kernel,
+                mask=invalid
+            )
+
+        array = np.asarray(array)
+        invalid = np.logical_or(invalid, np.logical_not(np.isfinite(array)))
+        valid = np.logical_not(invalid).astype(np.float64)
+        values = np.where(invalid, 0., array)
+        kernelSum = np.sum(kernel)
+        if backend == cls.SeparableBackend:
+            factors = cls.separableFactors(kernel)
+            if factors is None:
+                raise ValueError('kernel is not separable')
+            tolerance = 0.  # zero weights are exact
+
+            def convolveKernel(a):
+                return cls.convolveSeparable(a, factors)
+        elif backend == cls.FftBackend:
+            tolerance = 1e-10 * np.sum(np.abs(kernel))  # zero weights are subject to FFT round-off errors
+
+            def convolveKernel(a):
+                return cls.convolveFft(a, kernel)
+        else:
+            raise ValueError(f'invalid backend: {backend}')
+
+        outarray = convolveKernel(values)
+        if nan_treatment == 'interpolate':
+            weights = convolveKernel(valid)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                outarray /= weights
+            outarray[np.abs(weights) <= tolerance] = np.nan
+            if not normalize_kernel:
+                outarray *= kernelSum
+        else:
+            # a single no data pixel inside the kernel footprint (including pixel outside the array) results in no data
+            footprint = [np.ones(size) for size in kernel.shape]
+            invalidCount = cls.convolveSeparable(1. - valid, footprint, 1.)
+            outarray[invalidCount > 0.5] = np.nan
+            if normalize_kernel:
+                outarray /= kernelSum
+        return outarray
+
+    @staticmethod
+    def convolveSeparable(array: np.ndarray, factors: List[np.ndarray], fillValue=0.) -> np.ndarray:
+        """Convolve with the outer product of the 1D factors, padded with the fill value."""
+        from scipy.ndimage import convolve1d
+        outarray = np.asarray(array, np.float64)
+        for axis, factor in enumerate(factors):
+            if len(factor) == 1:
+                if factor[0] != 1:
+                    outarray = outarray * factor[0]
+                continue
+            outarray = convolve1d(outarray, factor, axis, mode='constant', cval=fillValue)
+        return outarray
+
+    @staticmethod
+    def convolveFft(array: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+        """Convolve via FFT, with zero padding."""
+        from scipy.signal import fftconvolve
+        axes = [axis for axis, size in enumerate(kernel.shape) if size > 1]
+        array = np.asarray(array, np.float64)
+        if len(axes) == 0:
+            return array * kernel.reshape(-1)[0]
+        if axes == [1, 2]:  # convolve band-wise to keep the FFT buffers small
+            outarray = np.empty_like(array)
+            for i in range(len(array)):
+                outarray[i] = fftconvolve(array[i], kernel[0], mode='same')
+            return outarray
+        return fftconvolve(array, kernel, mode='same', axes=axes)
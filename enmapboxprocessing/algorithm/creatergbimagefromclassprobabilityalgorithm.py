@@ -1,11 +1,10 @@
-from math import ceil
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
-from osgeo import gdal
 
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import Category
 from enmapboxprocessing.utils import Utils
@@ -63,7 +62,7 @@ class CreateRgbImageFromClassProbabilityAlgorithm(EnMAPProcessingAlgorithm):
         styledLayer = self.parameterAsLayer(parameters, self.P_COLORS_LAYER, context)
         colors = self.parameterAsValues(parameters, self.P_COLORS, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_RGB, context)
-        maximumMemoryUsage = gdal.GetCacheMax()
+        maximumMemoryUsage = Utils.maximumMemoryUsage()
 
         categories = None
         if colors is not None:
@@ -83,10 +82,11 @@ class CreateRgbImageFromClassProbabilityAlgorithm(EnMAPProcessingAlgorithm):
         reader = RasterReader(probability)
         driver = Driver(filename, feedback=feedback)
         writer = driver.createLike(reader, Qgis.Byte, 3)
-        lineMemoryUsage = reader.lineMemoryUsage()
-        lineMemoryUsage += reader.lineMemoryUsage(3, Qgis.Float32)
-        blockSizeY = min(reader.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-        blockSizeX = reader.width()
+        planner = MemoryPlanner(maximumMemoryUsage, feedback)
+        planner.addReader(reader, name='probability')
+        planner.add('rgb', 3, np.float32)
+        planner.addWriter(writer, 'rgb image')
+        blockSizeX, blockSizeY = planner.blockSize(reader, [writer])
         for block in reader.walkGrid(blockSizeX, blockSizeY, feedback):
             arrayRgb = np.zeros((3, block.height, block.width), np.float32)
             for bandNo, category in enumerate(categories, 1):
@@ -256,7 +256,8 @@ class CreateSpectralIndicesAlgorithm(EnMAPProcessingAlgorithm):
 
         # add imports
         code = 'import numpy as np\n' \
-               'from math import nan\n\n'
+               'from math import nan\n' + \
+               VrtBandMathAlgorithm.NumexprImportCode + '\n'
 
         # add constants
         extraNewLine = False
@@ -278,7 +279,7 @@ class CreateSpectralIndicesAlgorithm(EnMAPProcessingAlgorithm):
                 code += f'    {name} = np.float32(in_ar[{i}]) / {scale}\n'
 
         # add formula
-        code += f'    {short_name} = {formula}\n'
+        code += VrtBandMathAlgorithm.assignExpressionCode(short_name, formula)
 
         # mask noDataRegion
         for i, noDataValue in enumerate(noDataValues):
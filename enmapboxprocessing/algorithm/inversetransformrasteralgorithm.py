@@ -1,11 +1,10 @@
-from math import ceil
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
-from osgeo import gdal
 
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import TransformerDump
 from enmapboxprocessing.utils import Utils
@@ -53,7 +52,7 @@ class InverseTransformRasterAlgorithm(EnMAPProcessingAlgorithm):
         raster = self.parameterAsRasterLayer(parameters, self.P_RASTER, context)
         dump = self.parameterAsTransformerDump(parameters, self.P_TRANSFORMER, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_RASTER, context)
-        maximumMemoryUsage = gdal.GetCacheMax()
+        maximumMemoryUsage = Utils.maximumMemoryUsage()
 
         with open(filename + '.log', 'w') as logfile:
             feedback, feedback2 = self.createLoggingFeedback(feedback, logfile)
@@ -69,12 +68,16 @@ class InverseTransformRasterAlgorithm(EnMAPProcessingAlgorithm):
             # init result raster
             noDataValue = Utils.defaultNoDataValue(np.float32)
             writer = Driver(filename, feedback=feedback).createLike(reader, Qgis.Float32, bandCount)
-            lineMemoryUsage = reader.lineMemoryUsage() + reader.lineMemoryUsage(bandCount, 4)
-            blockSizeY = min(raster.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-            blockSizeX = raster.width()
+            planner = MemoryPlanner(maximumMemoryUsage, feedback)
+            planner.addReader(reader, name='features')
+            planner.addMask()
+            planner.add('feature matrix', reader.bandCount(), np.float64)  # estimators usually work on float64
+            planner.add('transformation', bandCount, np.float64)
+            planner.addWriter(writer, 'transformed features')
+            blockSizeX, blockSizeY = planner.blockSize(reader, [writer])
             for block in reader.walkGrid(blockSizeX, blockSizeY, feedback):
                 arrayX = reader.arrayFromBlock(block)
-                valid = np.all(reader.maskArray(arrayX), axis=0)
+                valid = reader.maskArrayAllBands(arrayX)
                 X = list()
                 for a in arrayX:
                     X.append(a[valid])
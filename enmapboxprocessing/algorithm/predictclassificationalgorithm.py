@@ -1,10 +1,13 @@
-from math import ceil
+from functools import partial
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
 
+from enmapboxprocessing.blockexecutor import BlockExecutor
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
+from enmapboxprocessing.predictionengine import PredictionEngine
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import ClassifierDump
 from enmapboxprocessing.utils import Utils
@@ -18,6 +21,9 @@ class PredictClassificationAlgorithm(EnMAPProcessingAlgorithm):
     P_RASTER, _RASTER = 'raster', 'Raster layer with features'
     P_CLASSIFIER, _CLASSIFIER = 'classifier', 'Classifier'
     P_MATCH_BY_NAME, _MATCH_BY_NAME = 'matchByName', 'Match features and bands by name'
+    P_WORKER_COUNT, _WORKER_COUNT = 'workerCount', 'Number of workers'
+    P_USE_PROCESSES, _USE_PROCESSES = 'useProcesses', 'Use processes instead of threads'
+    P_BATCH_SIZE, _BATCH_SIZE = 'batchSize', 'Batch size'
     P_OUTPUT_CLASSIFICATION, _OUTPUT_CLASSIFICATION = 'outputClassification', 'Output classification layer'
 
     def displayName(self) -> str:
@@ -39,6 +45,14 @@ class PredictClassificationAlgorithm(EnMAPProcessingAlgorithm):
                            'but overall number of bands and features do match, raster bands are used in original order.'),
             (self._CLASSIFIER, 'A fitted classifier.'),
             (self._MATCH_BY_NAME, 'Whether to match raster bands and classifier features by name.'),
+            (self._WORKER_COUNT, 'Number of workers used for predicting blocks in parallel. '
+                                 'Use 1 for sequential processing and 0 for using all CPU cores.'),
+            (self._USE_PROCESSES, 'Whether to run the workers in separate processes instead of threads. '
+                                  'Processes are only recommended for classifiers that do not release the GIL, '
+                                  'because the classifier is copied into each worker process.'),
+            (self._BATCH_SIZE, 'Maximum number of pixels passed to the classifier at once. '
+                               'Smaller batches reduce the memory used by the classifier, '
+                               'larger batches reduce the overhead per call.'),
             (self._OUTPUT_CLASSIFICATION, self.RasterFileDestination)
         ]
 
@@ -49,6 +63,9 @@ class PredictClassificationAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterRasterLayer(self.P_RASTER, self._RASTER)
         self.addParameterPickleFile(self.P_CLASSIFIER, self._CLASSIFIER)
         self.addParameterBoolean(self.P_MATCH_BY_NAME, self._MATCH_BY_NAME, False, True)
+        self.addParameterInt(self.P_WORKER_COUNT, self._WORKER_COUNT, 1, True, 0, None, True)
+        self.addParameterBoolean(self.P_USE_PROCESSES, self._USE_PROCESSES, False, True, True)
+        self.addParameterInt(self.P_BATCH_SIZE, self._BATCH_SIZE, PredictionEngine.BatchSize, True, 1, None, True)
         self.addParameterRasterDestination(self.P_OUTPUT_CLASSIFICATION, self._OUTPUT_CLASSIFICATION)
 
     def checkParameterValues(self, parameters: Dict[str, Any], context: QgsProcessingContext) -> Tuple[bool, str]:
@@ -64,6 +81,9 @@ class PredictClassificationAlgorithm(EnMAPProcessingAlgorithm):
         raster = self.parameterAsRasterLayer(parameters, self.P_RASTER, context)
         dump = self.parameterAsClassifierDump(parameters, self.P_CLASSIFIER, context)
         matchByName = self.parameterAsBoolean(parameters, self.P_MATCH_BY_NAME, context)
+        workerCount = self.parameterAsInt(parameters, self.P_WORKER_COUNT, context)
+        useProcesses = self.parameterAsBoolean(parameters, self.P_USE_PROCESSES, context)
+        batchSize = self.parameterAsInt(parameters, self.P_BATCH_SIZE, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_CLASSIFICATION, context)
         maximumMemoryUsage = Utils.maximumMemoryUsage()
 
@@ -72,7 +92,7 @@ class PredictClassificationAlgorithm(EnMAPProcessingAlgorithm):
             self.tic(feedback, parameters, context)
 
             rasterReader = RasterReader(raster)
-            bandNames = [rasterReader.bandName(i + 1) for i in range(rasterReader.bandCount())]
+            bandNames = rasterReader.bandNames()
 
             # match classifier features with raster band names
             bandList = None
@@ -84,8 +104,7 @@ class PredictClassificationAlgorithm(EnMAPProcessingAlgorithm):
 
             # ... if not possible, try to remove bad bands
             if bandList is None and len(bandNames) != len(dump.features):
-                goodBandList = [bandNo for bandNo in rasterReader.bandNumbers()
-                                if rasterReader.badBandMultiplier(bandNo) == 1]
+                goodBandList = [int(bandNo) for bandNo in np.flatnonzero(rasterReader.badBandMultipliers() == 1) + 1]
                 if len(goodBandList) == len(dump.features):
                     bandList = goodBandList
 
@@ -103,25 +122,25 @@ class PredictClassificationAlgorithm(EnMAPProcessingAlgorithm):
 
             dataType = Utils.smallesUIntDataType(max([c.value for c in dump.categories]))
             writer = Driver(filename, feedback=feedback).createLike(rasterReader, dataType, 1)
-            lineMemoryUsage = rasterReader.lineMemoryUsage()
-            blockSizeY = min(raster.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-            blockSizeX = raster.width()
-            for block in rasterReader.walkGrid(blockSizeX, blockSizeY, feedback):
+            executor = BlockExecutor(workerCount, useProcesses)
+            planner = MemoryPlanner(executor.maximumBlockMemoryUsage(maximumMemoryUsage), feedback)
+            planner.addReader(rasterReader, bandList, 'features')
+            planner.addMask()
+            planner.addWriter(writer, 'classification')
+            blockSizeX, blockSizeY = planner.blockSize(rasterReader, [writer])
+
+            def read(block):
                 arrayX = rasterReader.arrayFromBlock(block, bandList)
-                valid = np.all(rasterReader.maskArray(arrayX, bandList), axis=0)
-                X = list()
-                for a in arrayX:
-                    X.append(a[valid])
-                y = dump.classifier.predict(np.transpose(X))
-
-                # classifier may return 2d array (e.g. CatBoostClassifier) -> need to flatten data
-                if y.ndim == 2 and y.shape[1] == 1:
-                    y = y.flatten()
-
-                arrayY = np.zeros_like(valid, Utils.qgisDataTypeToNumpyDataType(dataType))
-                arrayY[valid] = y
+                valid = rasterReader.maskArrayAllBands(arrayX, bandList)
+                return arrayX, valid
+
+            def write(block, arrayY):
                 writer.writeArray2d(arrayY, 1, xOffset=block.xOffset, yOffset=block.yOffset)
 
+            engine = PredictionEngine(dump.classifier.predict, batchSize)
+            process = partial(predictClassificationBlock, engine, Utils.qgisDataTypeToNumpyDataType(dataType))
+            executor.run(rasterReader.walkGrid(blockSizeX, blockSizeY, feedback), read, process, write)
+
             writer.close()
             outraster = QgsRasterLayer(filename)
             renderer = Utils.palettedRasterRendererFromCategories(outraster.dataProvider(), 1, dump.categories)
@@ -132,3 +151,10 @@ class PredictClassificationAlgorithm(EnMAPProcessingAlgorithm):
             self.toc(feedback, result)
 
         return result
+
+
+def predictClassificationBlock(engine: PredictionEngine, numpyDataType, block, data) -> np.ndarray:
+    arrayX, valid = data
+    arrayY = np.zeros_like(valid, numpyDataType)
+    engine.predict(arrayX, valid, [arrayY])  # 2d predictions (e.g. CatBoostClassifier) are handled by the engine
+    return arrayY
@@ -1,11 +1,13 @@
-from math import ceil
+from functools import partial
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
-from osgeo import gdal
 
+from enmapboxprocessing.blockexecutor import BlockExecutor
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
+from enmapboxprocessing.predictionengine import PredictionEngine
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import ClassifierDump
 from enmapboxprocessing.utils import Utils
@@ -18,6 +20,9 @@ class PredictClassPropabilityAlgorithm(EnMAPProcessingAlgorithm):
     P_RASTER, _RASTER = 'raster', 'Raster layer with features'
     P_CLASSIFIER, _CLASSIFIER = 'classifier', 'Classifier'
     P_MATCH_BY_NAME, _MATCH_BY_NAME = 'matchByName', 'Match features and bands by name'
+    P_WORKER_COUNT, _WORKER_COUNT = 'workerCount', 'Number of workers'
+    P_USE_PROCESSES, _USE_PROCESSES = 'useProcesses', 'Use processes instead of threads'
+    P_BATCH_SIZE, _BATCH_SIZE = 'batchSize', 'Batch size'
     P_OUTPUT_PROBABILITY, _OUTPUT_PROBABILITY = 'outputProbability', 'Output class probability layer'
 
     def displayName(self) -> str:
@@ -32,6 +37,14 @@ class PredictClassPropabilityAlgorithm(EnMAPProcessingAlgorithm):
                            'Classifier features and raster bands are matched by name.'),
             (self._CLASSIFIER, 'A fitted classifier.'),
             (self._MATCH_BY_NAME, 'Whether to match raster bands and classifier features by name.'),
+            (self._WORKER_COUNT, 'Number of workers used for predicting blocks in parallel. '
+                                 'Use 1 for sequential processing and 0 for using all CPU cores.'),
+            (self._USE_PROCESSES, 'Whether to run the workers in separate processes instead of threads. '
+                                  'Processes are only recommended for classifiers that do not release the GIL, '
+                                  'because the classifier is copied into each worker process.'),
+            (self._BATCH_SIZE, 'Maximum number of pixels passed to the classifier at once. '
+                               'Smaller batches reduce the memory used by the classifier, '
+                               'larger batches reduce the overhead per call.'),
             (self._OUTPUT_PROBABILITY, self.RasterFileDestination)
         ]
 
@@ -42,6 +55,9 @@ class PredictClassPropabilityAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterRasterLayer(self.P_RASTER, self._RASTER)
         self.addParameterPickleFile(self.P_CLASSIFIER, self._CLASSIFIER)
         self.addParameterBoolean(self.P_MATCH_BY_NAME, self._MATCH_BY_NAME, False, True)
+        self.addParameterInt(self.P_WORKER_COUNT, self._WORKER_COUNT, 1, True, 0, None, True)
+        self.addParameterBoolean(self.P_USE_PROCESSES, self._USE_PROCESSES, False, True, True)
+        self.addParameterInt(self.P_BATCH_SIZE, self._BATCH_SIZE, PredictionEngine.BatchSize, True, 1, None, True)
         self.addParameterRasterDestination(self.P_OUTPUT_PROBABILITY, self._OUTPUT_PROBABILITY)
 
     def checkParameterValues(self, parameters: Dict[str, Any], context: QgsProcessingContext) -> Tuple[bool, str]:
@@ -59,15 +75,18 @@ class PredictClassPropabilityAlgorithm(EnMAPProcessingAlgorithm):
         raster = self.parameterAsRasterLayer(parameters, self.P_RASTER, context)
         dump = self.parameterAsClassifierDump(parameters, self.P_CLASSIFIER, context)
         matchByName = self.parameterAsBoolean(parameters, self.P_MATCH_BY_NAME, context)
+        workerCount = self.parameterAsInt(parameters, self.P_WORKER_COUNT, context)
+        useProcesses = self.parameterAsBoolean(parameters, self.P_USE_PROCESSES, context)
+        batchSize = self.parameterAsInt(parameters, self.P_BATCH_SIZE, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_PROBABILITY, context)
-        maximumMemoryUsage = gdal.GetCacheMax()
+        maximumMemoryUsage = Utils.maximumMemoryUsage()
 
         with open(filename + '.log', 'w') as logfile:
             feedback, feedback2 = self.createLoggingFeedback(feedback, logfile)
             self.tic(feedback, parameters, context)
 
             rasterReader = RasterReader(raster)
-            bandNames = [rasterReader.bandName(i + 1) for i in range(rasterReader.bandCount())]
+            bandNames = rasterReader.bandNames()
 
             # match classifier features with raster band names
             bandList = None
@@ -79,8 +98,7 @@ class PredictClassPropabilityAlgorithm(EnMAPProcessingAlgorithm):
 
             # ... if not possible, try to remove bad bands
             if bandList is None and len(bandNames) != len(dump.features):
-                goodBandList = [bandNo for bandNo in rasterReader.bandNumbers()
-                                if rasterReader.badBandMultiplier(bandNo) == 1]
+                goodBandList = [int(bandNo) for bandNo in np.flatnonzero(rasterReader.badBandMultipliers() == 1) + 1]
                 if len(goodBandList) == len(dump.features):
                     bandList = goodBandList
 
@@ -100,21 +118,26 @@ class PredictClassPropabilityAlgorithm(EnMAPProcessingAlgorithm):
             dataType = Qgis.DataType.Float32
             gdalDataType = Utils.qgisDataTypeToNumpyDataType(dataType)
             writer = Driver(filename, feedback=feedback).createLike(rasterReader, dataType, nBands)
-            lineMemoryUsage = rasterReader.lineMemoryUsage() + rasterReader.lineMemoryUsage(nBands, 32 // 4)
-            blockSizeY = min(raster.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-            blockSizeX = raster.width()
-            for block in rasterReader.walkGrid(blockSizeX, blockSizeY, feedback):
+            executor = BlockExecutor(workerCount, useProcesses)
+            planner = MemoryPlanner(executor.maximumBlockMemoryUsage(maximumMemoryUsage), feedback)
+            planner.addReader(rasterReader, bandList, 'features')
+            planner.addMask()
+            planner.addWriter(writer, 'probability')
+            blockSizeX, blockSizeY = planner.blockSize(rasterReader, [writer])
+
+            def read(block):
                 arrayX = rasterReader.arrayFromBlock(block, bandList)
-                valid = np.all(rasterReader.maskArray(arrayX, bandList), axis=0)
-                X = list()
-                for a in arrayX:
-                    X.append(a[valid])
-                y = dump.classifier.predict_proba(np.transpose(X))
-                arrayY = np.full((nBands, *valid.shape), -1, gdalDataType)
+                valid = rasterReader.maskArrayAllBands(arrayX, bandList)
+                return arrayX, valid
+
+            def write(block, arrayY):
                 for i, aY in enumerate(arrayY):
-                    aY[valid] = y[:, i]
                     writer.writeArray2d(aY, i + 1, xOffset=block.xOffset, yOffset=block.yOffset)
 
+            engine = PredictionEngine(dump.classifier.predict_proba, batchSize)
+            process = partial(predictClassProbabilityBlock, engine, nBands, gdalDataType)
+            executor.run(rasterReader.walkGrid(blockSizeX, blockSizeY, feedback), read, process, write)
+
             for bandNo, c in enumerate(dump.categories, 1):
                 writer.setBandName(c.name, bandNo)
             writer.setNoDataValue(-1)
@@ -124,3 +147,10 @@ class PredictClassPropabilityAlgorithm(EnMAPProcessingAlgorithm):
             self.toc(feedback, result)
 
         return result
+
+
+def predictClassProbabilityBlock(engine: PredictionEngine, nBands: int, numpyDataType, block, data) -> np.ndarray:
+    arrayX, valid = data
+    arrayY = np.full((nBands, *valid.shape), -1, numpyDataType)
+    engine.predict(arrayX, valid, arrayY)
+    return arrayY
@@ -1,11 +1,14 @@
-from math import ceil
+from functools import partial
 from random import randint
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
 
+from enmapboxprocessing.blockexecutor import BlockExecutor
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
+from enmapboxprocessing.predictionengine import PredictionEngine
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import ClustererDump, Category
 from enmapboxprocessing.utils import Utils
@@ -20,6 +23,9 @@ class PredictClusteringAlgorithm(EnMAPProcessingAlgorithm):
     P_RASTER, _RASTER = 'raster', 'Raster layer with features'
     P_CLUSTERER, _CLUSTERER = 'clusterer', 'Clusterer'
     P_MATCH_BY_NAME, _MATCH_BY_NAME = 'matchByName', 'Match features and bands by name'
+    P_WORKER_COUNT, _WORKER_COUNT = 'workerCount', 'Number of workers'
+    P_USE_PROCESSES, _USE_PROCESSES = 'useProcesses', 'Use processes instead of threads'
+    P_BATCH_SIZE, _BATCH_SIZE = 'batchSize', 'Batch size'
     P_OUTPUT_CLASSIFICATION, _OUTPUT_CLASSIFICATION = 'outputClassification', 'Output classification layer'
 
     def displayName(self) -> str:
@@ -38,6 +44,14 @@ class PredictClusteringAlgorithm(EnMAPProcessingAlgorithm):
                            'raster bands are used in original order.'),
             (self._CLUSTERER, 'A fitted clusterer.'),
             (self._MATCH_BY_NAME, 'Whether to match raster bands and classifier features by name.'),
+            (self._WORKER_COUNT, 'Number of workers used for predicting blocks in parallel. '
+                                 'Use 1 for sequential processing and 0 for using all CPU cores.'),
+            (self._USE_PROCESSES, 'Whether to run the workers in separate processes instead of threads. '
+                                  'Processes are only recommended for clusterers that do not release the GIL, '
+                                  'because the clusterer is copied into each worker process.'),
+            (self._BATCH_SIZE, 'Maximum number of pixels passed to the clusterer at once. '
+                               'Smaller batches reduce the memory used by the clusterer, '
+                               'larger batches reduce the overhead per call.'),
             (self._OUTPUT_CLASSIFICATION, self.RasterFileDestination)
         ]
 
@@ -48,6 +62,9 @@ class PredictClusteringAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterRasterLayer(self.P_RASTER, self._RASTER)
         self.addParameterPickleFile(self.P_CLUSTERER, self._CLUSTERER)
         self.addParameterBoolean(self.P_MATCH_BY_NAME, self._MATCH_BY_NAME, False, True)
+        self.addParameterInt(self.P_WORKER_COUNT, self._WORKER_COUNT, 1, True, 0, None, True)
+        self.addParameterBoolean(self.P_USE_PROCESSES, self._USE_PROCESSES, False, True, True)
+        self.addParameterInt(self.P_BATCH_SIZE, self._BATCH_SIZE, PredictionEngine.BatchSize, True, 1, None, True)
         self.addParameterRasterDestination(self.P_OUTPUT_CLASSIFICATION, self._OUTPUT_CLASSIFICATION)
 
     def checkParameterValues(self, parameters: Dict[str, Any], context: QgsProcessingContext) -> Tuple[bool, str]:
@@ -63,6 +80,9 @@ class PredictClusteringAlgorithm(EnMAPProcessingAlgorithm):
         raster = self.parameterAsRasterLayer(parameters, self.P_RASTER, context)
         dump = self.parameterAsClustererDump(parameters, self.P_CLUSTERER, context)
         matchByName = self.parameterAsBoolean(parameters, self.P_MATCH_BY_NAME, context)
+        workerCount = self.parameterAsInt(parameters, self.P_WORKER_COUNT, context)
+        useProcesses = self.parameterAsBoolean(parameters, self.P_USE_PROCESSES, context)
+        batchSize = self.parameterAsInt(parameters, self.P_BATCH_SIZE, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_CLASSIFICATION, context)
         maximumMemoryUsage = Utils.maximumMemoryUsage()
 
@@ -71,7 +91,7 @@ class PredictClusteringAlgorithm(EnMAPProcessingAlgorithm):
             self.tic(feedback, parameters, context)
 
             rasterReader = RasterReader(raster)
-            bandNames = [rasterReader.bandName(i + 1) for i in range(rasterReader.bandCount())]
+            bandNames = rasterReader.bandNames()
 
             # match clusterer features with raster band names
             bandList = None
@@ -83,8 +103,7 @@ class PredictClusteringAlgorithm(EnMAPProcessingAlgorithm):
 
             # ... if not possible, try to remove bad bands
             if bandList is None and len(bandNames) != len(dump.features):
-                goodBandList = [bandNo for bandNo in rasterReader.bandNumbers()
-                                if rasterReader.badBandMultiplier(bandNo) == 1]
+                goodBandList = [int(bandNo) for bandNo in np.flatnonzero(rasterReader.badBandMultipliers() == 1) + 1]
                 if len(goodBandList) == len(dump.features):
                     bandList = goodBandList
 
@@ -105,22 +124,26 @@ class PredictClusteringAlgorithm(EnMAPProcessingAlgorithm):
             numpyDataType = Utils.qgisDataTypeToNumpyDataType(qgisDataType)
             writer = Driver(filename, feedback=feedback).createLike(rasterReader, qgisDataType, 1)
             noDataValue = 0
-            lineMemoryUsage = rasterReader.lineMemoryUsage()
-            blockSizeY = min(raster.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-            blockSizeX = raster.width()
-            for block in rasterReader.walkGrid(blockSizeX, blockSizeY, feedback):
+            executor = BlockExecutor(workerCount, useProcesses)
+            planner = MemoryPlanner(executor.maximumBlockMemoryUsage(maximumMemoryUsage), feedback)
+            planner.addReader(rasterReader, bandList, 'features')
+            planner.addMask()
+            planner.addWriter(writer, 'classification')
+            blockSizeX, blockSizeY = planner.blockSize(rasterReader, [writer])
+
+            def read(block):
                 arrayX = rasterReader.arrayFromBlock(block, bandList)
-                valid = np.all(rasterReader.maskArray(arrayX, bandList), axis=0)
-                X = list()
-                for a in arrayX:
-                    X.append(a[valid])
-                y = dump.clusterer.predict(np.transpose(X))
-                arrayY = np.zeros_like(valid, numpyDataType)
-                arrayY[valid] = y + 1  # cluster numbers start with 1!
+                valid = rasterReader.maskArrayAllBands(arrayX, bandList)
+                return arrayX, valid
+
+            def write(block, arrayY):
                 writer.writeArray2d(arrayY, 1, xOffset=block.xOffset, yOffset=block.yOffset)
+
+            engine = PredictionEngine(dump.clusterer.predict, batchSize)
+            process = partial(predictClusteringBlock, engine, numpyDataType)
+            executor.run(rasterReader.walkGrid(blockSizeX, blockSizeY, feedback), read, process, write)
             writer.setNoDataValue(noDataValue)
-            writer.close()
-            del writer
+            writer.close()  # releases the dataset, the classification layer is opened from the filename
 
             # create default style
             classification = QgsRasterLayer(filename)
@@ -134,3 +157,11 @@ class PredictClusteringAlgorithm(EnMAPProcessingAlgorithm):
             self.toc(feedback, result)
 
         return result
+
+
+def predictClusteringBlock(engine: PredictionEngine, numpyDataType, block, data) -> np.ndarray:
+    arrayX, valid = data
+    arrayY = np.zeros_like(valid, numpyDataType)
+    engine.predict(arrayX, valid, [arrayY])
+    arrayY[valid] += 1  # cluster numbers start with 1!
+    return arrayY
@@ -1,11 +1,14 @@
-from math import ceil
+from functools import partial
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
 
 from enmapbox.typeguard import typechecked
+from enmapboxprocessing.blockexecutor import BlockExecutor
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
+from enmapboxprocessing.predictionengine import PredictionEngine
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import RegressorDump
 from enmapboxprocessing.utils import Utils
@@ -18,6 +21,9 @@ class PredictRegressionAlgorithm(EnMAPProcessingAlgorithm):
     P_RASTER, _RASTER = 'raster', 'Raster layer with features'
     P_REGRESSOR, _REGRESSOR = 'regressor', 'Regressor'
     P_MATCH_BY_NAME, _MATCH_BY_NAME = 'matchByName', 'Match features and bands by name'
+    P_WORKER_COUNT, _WORKER_COUNT = 'workerCount', 'Number of workers'
+    P_USE_PROCESSES, _USE_PROCESSES = 'useProcesses', 'Use processes instead of threads'
+    P_BATCH_SIZE, _BATCH_SIZE = 'batchSize', 'Batch size'
     P_OUTPUT_REGRESSION, _OUTPUT_REGRESSION = 'outputRegression', 'Output regression layer'
 
     def displayName(self) -> str:
@@ -32,6 +38,14 @@ class PredictRegressionAlgorithm(EnMAPProcessingAlgorithm):
                            'Regressor features and raster bands are matched by name.'),
             (self._REGRESSOR, 'A fitted regressor.'),
             (self._MATCH_BY_NAME, 'Whether to match raster bands and regressor features by name.'),
+            (self._WORKER_COUNT, 'Number of workers used for predicting blocks in parallel. '
+                                 'Use 1 for sequential processing and 0 for using all CPU cores.'),
+            (self._USE_PROCESSES, 'Whether to run the workers in separate processes instead of threads. '
+                                  'Processes are only recommended for regressors that do not release the GIL, '
+                                  'because the regressor is copied into each worker process.'),
+            (self._BATCH_SIZE, 'Maximum number of pixels passed to the regressor at once. '
+                               'Smaller batches reduce the memory used by the regressor, '
+                               'larger batches reduce the overhead per call.'),
             (self._OUTPUT_REGRESSION, self.RasterFileDestination)
         ]
 
@@ -42,6 +56,9 @@ class PredictRegressionAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterRasterLayer(self.P_RASTER, self._RASTER)
         self.addParameterPickleFile(self.P_REGRESSOR, self._REGRESSOR)
         self.addParameterBoolean(self.P_MATCH_BY_NAME, self._MATCH_BY_NAME, False, True)
+        self.addParameterInt(self.P_WORKER_COUNT, self._WORKER_COUNT, 1, True, 0, None, True)
+        self.addParameterBoolean(self.P_USE_PROCESSES, self._USE_PROCESSES, False, True, True)
+        self.addParameterInt(self.P_BATCH_SIZE, self._BATCH_SIZE, PredictionEngine.BatchSize, True, 1, None, True)
         self.addParameterRasterDestination(self.P_OUTPUT_REGRESSION, self._OUTPUT_REGRESSION)
 
     def checkParameterValues(self, parameters: Dict[str, Any], context: QgsProcessingContext) -> Tuple[bool, str]:
@@ -59,6 +76,9 @@ class PredictRegressionAlgorithm(EnMAPProcessingAlgorithm):
         raster = self.parameterAsRasterLayer(parameters, self.P_RASTER, context)
         dump = self.parameterAsRegressorDump(parameters, self.P_REGRESSOR, context)
         matchByName = self.parameterAsBoolean(parameters, self.P_MATCH_BY_NAME, context)
+        workerCount = self.parameterAsInt(parameters, self.P_WORKER_COUNT, context)
+        useProcesses = self.parameterAsBoolean(parameters, self.P_USE_PROCESSES, context)
+        batchSize = self.parameterAsInt(parameters, self.P_BATCH_SIZE, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_REGRESSION, context)
         maximumMemoryUsage = Utils.maximumMemoryUsage()
 
@@ -67,7 +87,7 @@ class PredictRegressionAlgorithm(EnMAPProcessingAlgorithm):
             self.tic(feedback, parameters, context)
 
             rasterReader = RasterReader(raster)
-            bandNames = [rasterReader.bandName(i + 1) for i in range(rasterReader.bandCount())]
+            bandNames = rasterReader.bandNames()
 
             # match regressor features with raster band names
             bandList = None
@@ -79,8 +99,7 @@ class PredictRegressionAlgorithm(EnMAPProcessingAlgorithm):
 
             # ... if not possible, try to remove bad bands
             if bandList is None and len(bandNames) != len(dump.features):
-                goodBandList = [bandNo for bandNo in rasterReader.bandNumbers()
-                                if rasterReader.badBandMultiplier(bandNo) == 1]
+                goodBandList = [int(bandNo) for bandNo in np.flatnonzero(rasterReader.badBandMultipliers() == 1) + 1]
                 if len(goodBandList) == len(dump.features):
                     bandList = goodBandList
 
@@ -99,23 +118,26 @@ class PredictRegressionAlgorithm(EnMAPProcessingAlgorithm):
             nBands = len(dump.targets)
             writer = Driver(filename, feedback=feedback).createLike(rasterReader, Qgis.DataType.Float32, nBands)
             noDataValue = Utils.defaultNoDataValue(np.float32)
-            lineMemoryUsage = rasterReader.lineMemoryUsage() + rasterReader.lineMemoryUsage(nBands, 4)
-            blockSizeY = min(raster.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-            blockSizeX = raster.width()
-            for block in rasterReader.walkGrid(blockSizeX, blockSizeY, feedback):
+            executor = BlockExecutor(workerCount, useProcesses)
+            planner = MemoryPlanner(executor.maximumBlockMemoryUsage(maximumMemoryUsage), feedback)
+            planner.addReader(rasterReader, bandList, 'features')
+            planner.addMask()
+            planner.addWriter(writer, 'regression')
+            blockSizeX, blockSizeY = planner.blockSize(rasterReader, [writer])
+
+            def read(block):
                 arrayX = rasterReader.arrayFromBlock(block, bandList)
-                valid = np.all(rasterReader.maskArray(arrayX, bandList), axis=0)
-                X = list()
-                for a in arrayX:
-                    X.append(a[valid])
-                y = dump.regressor.predict(np.transpose(X))
-                if y.ndim == 1:
-                    y = y.reshape((-1, 1))
-                arrayY = np.full((nBands, *valid.shape), noDataValue, np.float32)
+                valid = rasterReader.maskArrayAllBands(arrayX, bandList)
+                return arrayX, valid
+
+            def write(block, arrayY):
                 for i, aY in enumerate(arrayY):
-                    aY[valid] = y[:, i]
                     writer.writeArray2d(aY, i + 1, xOffset=block.xOffset, yOffset=block.yOffset)
 
+            engine = PredictionEngine(dump.regressor.predict, batchSize)
+            process = partial(predictRegressionBlock, engine, nBands, noDataValue)
+            executor.run(rasterReader.walkGrid(blockSizeX, blockSizeY, feedback), read, process, write)
+
             for bandNo, t in enumerate(dump.targets, 1):
                 writer.setBandName(t.name, bandNo)
                 if t.color is not None:
@@ -127,3 +149,10 @@ class PredictRegressionAlgorithm(EnMAPProcessingAlgorithm):
             self.toc(feedback, result)
 
         return result
+
+
+def predictRegressionBlock(engine: PredictionEngine, nBands: int, noDataValue: float, block, data) -> np.ndarray:
+    arrayX, valid = data
+    arrayY = np.full((nBands, *valid.shape), noDataValue, np.float32)
+    engine.predict(arrayX, valid, arrayY)
+    return arrayY
@@ -123,7 +123,7 @@ class PrepareRegressionDatasetFromContinuousRasterAlgorithm(EnMAPProcessingAlgor
         XMask = list()
         for block in reader.walkGrid(blockSizeX, blockSizeY, feedback):
             arrayRegression = regressionReader.arrayFromBlock(block)
-            labeled = np.all(regressionReader.maskArray(arrayRegression), axis=0)
+            labeled = regressionReader.maskArrayAllBands(arrayRegression)
             blockY = list()
             for a in arrayRegression:
                 blockY.append(a[labeled])
@@ -1,6 +1,4 @@
-import math
 from os.path import join
-from random import randint
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
@@ -21,6 +19,7 @@ class PrepareRegressionDatasetFromSynthMixAlgorithm(EnMAPProcessingAlgorithm):
     P_MIXING_PROBABILITIES, _MIXING_PROBABILITIES = 'mixingProbabilities', 'Mixing complexity probabilities'
     P_ALLOW_WITHINCLASS_MIXTURES, _ALLOW_WITHINCLASS_MIXTURES = 'allowWithinClassMixtures', 'Allow within-class mixtures'
     P_CLASS_PROBABILITIES, _CLASS_PROBABILITIES = 'classProbabilities', 'Class probabilities'
+    P_SEED, _SEED = 'seed', 'Random seed'
     P_OUTPUT_FOLDER, _OUTPUT_FOLDER = 'outputFolder', 'Output folder'
 
     @classmethod
@@ -43,6 +42,7 @@ class PrepareRegressionDatasetFromSynthMixAlgorithm(EnMAPProcessingAlgorithm):
             (self._ALLOW_WITHINCLASS_MIXTURES, 'Whether to allow mixtures with profiles belonging to the same class.'),
             (self._CLASS_PROBABILITIES, 'A list of probabilities for drawing profiles from each class. '
                                         'If not specified, class probabilities are proportional to the class size.'),
+            (self._SEED, 'The seed for the random generator can be provided.'),
             (self._OUTPUT_FOLDER, self.FolderDestination)
         ]
 
@@ -57,6 +57,7 @@ class PrepareRegressionDatasetFromSynthMixAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterString(self.P_MIXING_PROBABILITIES, self._MIXING_PROBABILITIES, '0.5, 0.5', False, True)
         self.addParameterBoolean(self.P_ALLOW_WITHINCLASS_MIXTURES, self._ALLOW_WITHINCLASS_MIXTURES, True)
         self.addParameterString(self.P_CLASS_PROBABILITIES, self._CLASS_PROBABILITIES, None, False, True)
+        self.addParameterInt(self.P_SEED, self._SEED, None, True, 1, None, True)
         self.addParameterFolderDestination(self.P_OUTPUT_FOLDER, self._OUTPUT_FOLDER)
 
     def processAlgorithm(
@@ -69,6 +70,7 @@ class PrepareRegressionDatasetFromSynthMixAlgorithm(EnMAPProcessingAlgorithm):
         self.mixingProbabilities = self.parameterAsValues(parameters, self.P_MIXING_PROBABILITIES, context)
         self.allowWithinClassMixtures = self.parameterAsBoolean(parameters, self.P_ALLOW_WITHINCLASS_MIXTURES, context)
         self.classProbabilities = self.parameterAsValues(parameters, self.P_CLASS_PROBABILITIES, context)
+        seed = self.parameterAsInt(parameters, self.P_SEED, context)
         foldername = self.parameterAsFileOutput(parameters, self.P_OUTPUT_FOLDER, context)
 
         with open(join(foldername, 'processing.log'), 'w') as logfile:
@@ -82,14 +84,10 @@ class PrepareRegressionDatasetFromSynthMixAlgorithm(EnMAPProcessingAlgorithm):
             feedback.pushInfo(
                 f'Load classification dataset: X=array{list(self.X.shape)} y=array{list(self.y.shape)} categories={[c.name for c in self.categories]}')
 
-            if self.classProbabilities is None:
-                self.classProbabilities = list()
-                for category in self.categories:
-                    self.classProbabilities.append(np.average(self.y == category.value))
-
+            rng = np.random.default_rng(seed)
             for category in self.categories:
                 filename = join(foldername, category.name + '.pkl')
-                X, y = self.mixCategory(category)
+                X, y = self.mixCategory(category, rng)
 
                 checkSampleShape(X, y, raise_=True)
 
@@ -102,71 +100,87 @@ class PrepareRegressionDatasetFromSynthMixAlgorithm(EnMAPProcessingAlgorithm):
 
         return result
 
-    def mixCategory(self, targetCategory: Category):
-
-        targetIndex = self.categories.index(targetCategory)
-        features, labels = self.X.T, self.y.flatten()
-        classes = len(self.categories)
-        classProbabilities = {category.value: v for category, v in zip(self.categories, self.classProbabilities)}
-        mixingComplexities = {i: v for i, v in enumerate(self.mixingProbabilities, 2)}
+    def mixCategory(self, targetCategory: Category, rng: np.random.Generator = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Create all mixtures for the target category at once.
+
+        Mixing complexities, class labels, endmember indices and mixing weights are drawn for all mixtures in
+        batches, and all mixtures are derived by a single weight matrix product.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        features, labels = self.X, self.y.flatten()
+        classValues = np.array([category.value for category in self.categories])
+        if self.classProbabilities is None:  # proportional to the class size
+            classProbabilities = np.array([np.average(labels == value) for value in classValues])
+        else:
+            classProbabilities = np.array(self.classProbabilities, dtype=np.float64)
+        complexities = np.arange(2, len(self.mixingProbabilities) + 2)
+        maxComplexity = complexities[-1]
         targetRange = [0, 1]
 
-        # cache label indices and setup 0%/100% fractions from class labels
-        indices = dict()
-        zeroOneFractions = np.zeros((classes, features.shape[1]), dtype=np.float32)
-        for i, category in enumerate(self.categories):
-            indices[category.value] = np.where(labels == category.value)[0]
-            zeroOneFractions[i, indices[category.value]] = 1.
-
-        # create mixtures
-        mixtures = list()
-        fractions = list()
-
-        classProbabilities2 = {k: v / (1 - classProbabilities[targetCategory.value])
-                               for k, v in classProbabilities.items()
-                               if k != targetCategory.value}
-        for i in range(self.n):
-            complexity = np.random.choice(list(mixingComplexities.keys()), p=list(mixingComplexities.values()))
-
-            isBackground = self.background >= randint(1, 100)
-
-            if isBackground:
-                drawnLabels = list(
-                    np.random.choice(
-                        list(classProbabilities2.keys()), size=1, replace=False, p=list(classProbabilities2.values())
-                    )
-                )
-            else:
-                drawnLabels = [targetCategory.value]
+        # cache label indices, so that endmembers can be drawn for all classes at once
+        memberIndices = [np.where(labels == value)[0] for value in classValues]
+        memberOffsets = np.cumsum([0] + [len(indices) for indices in memberIndices])[:-1]
+        memberCounts = np.array([len(indices) for indices in memberIndices])
+        memberIndices = np.concatenate(memberIndices)
 
-            if self.allowWithinClassMixtures:
-                drawnLabels.extend(np.random.choice(list(classProbabilities.keys()), size=complexity - 1, replace=True,
-                                                    p=list(classProbabilities.values())))
+        # class probabilities without the target class
+        targetIndex = self.categories.index(targetCategory)
+        otherClasses = np.array([i for i in range(len(classValues)) if i != targetIndex])
+        otherProbabilities = classProbabilities[otherClasses] / (1 - classProbabilities[targetIndex])
+
+        # draw mixing complexities and class labels (as class indices; -1 for unused endmembers)
+        complexity = rng.choice(complexities, self.n, p=self.mixingProbabilities)
+        used = np.arange(maxComplexity)[None] < complexity[:, None]
+        drawnClasses = np.full((self.n, maxComplexity), -1)
+        isBackground = self.background >= rng.integers(1, 101, self.n)
+        drawnClasses[:, 0] = targetIndex
+        drawnClasses[isBackground, 0] = rng.choice(otherClasses, np.sum(isBackground), p=otherProbabilities)
+        if self.allowWithinClassMixtures:
+            drawnClasses[:, 1:] = rng.choice(len(classValues), (self.n, maxComplexity - 1), p=classProbabilities)
+        else:
+            if maxComplexity - 1 > np.sum(otherProbabilities > 0):
+                raise ValueError('Cannot take a larger sample than population when within-class mixtures are not allowed')
+            # weighted sampling without replacement via exponential sort keys (Efraimidis-Spirakis)
+            with np.errstate(divide='ignore'):
+                keys = np.log(rng.random((self.n, len(otherClasses)))) / otherProbabilities
+            drawnClasses[:, 1:] = otherClasses[np.argsort(-keys, axis=1)[:, :maxComplexity - 1]]
+        drawnClasses[~used] = -1
+
+        # draw endmembers uniformly within each class
+        drawnIndices = np.zeros_like(drawnClasses)
+        drawnOffsets = (rng.random(np.sum(used)) * memberCounts[drawnClasses[used]]).astype(int)
+        drawnIndices[used] = memberIndices[memberOffsets[drawnClasses[used]] + drawnOffsets]
+
+        # draw random weights: first weight inside the target range, following weights from the remaining share,
+        # last weight takes the rest
+        weights = np.zeros((self.n, maxComplexity))
+        remaining = np.ones(self.n)
+        randoms = rng.random((self.n, maxComplexity))
+        for i in range(maxComplexity):
+            isLast = complexity - 1 == i
+            if i == 0:
+                weight = randoms[:, i] * (targetRange[1] - targetRange[0]) + targetRange[0]
             else:
-                drawnLabels.extend(
-                    np.random.choice(list(classProbabilities2.keys()), size=complexity - 1, replace=False,
-                                     p=list(classProbabilities2.values())))
-
-            drawnIndices = [np.random.choice(indices[label]) for label in drawnLabels]
-            drawnFeatures = features[:, drawnIndices]
-            drawnFractions = zeroOneFractions[:, drawnIndices]
-
-            randomWeights = list()
-            for i in range(complexity - 1):
-                if i == 0:
-                    weight = np.random.random() * (targetRange[1] - targetRange[0]) + targetRange[0]
-                else:
-                    weight = np.random.random() * (1. - sum(randomWeights))
-                randomWeights.append(weight)
-            randomWeights.append(1. - sum(randomWeights))
-
-            assert math.isclose(sum(randomWeights), 1.0)
-            mixtures.append(np.sum(drawnFeatures * randomWeights, axis=1))
-            fractions.append(np.sum(drawnFractions * randomWeights, axis=1)[targetIndex])
+                weight = randoms[:, i] * remaining
+            weight[isLast] = remaining[isLast]
+            weight[~used[:, i]] = 0.
+            weights[:, i] = weight
+            remaining -= weight
+        assert np.allclose(weights.sum(axis=1), 1.0)
+
+        # mix all endmembers with a single sparse (mixtures x endmembers) weight matrix product
+        from scipy.sparse import csr_matrix
+        indptr = np.arange(0, self.n * maxComplexity + 1, maxComplexity)
+        weightMatrix = csr_matrix((weights.ravel(), drawnIndices.ravel(), indptr), shape=(self.n, len(features)))
+        mixtures = weightMatrix @ features
+        fractions = np.sum(weights * (drawnClasses == targetIndex), axis=1)
 
         if self.includeEndmember:
-            mixtures.extend(features.T)
-            fractions.extend(np.float32(labels == targetCategory.value))  # 1. for target class, 0. for the rest
+            mixtures = np.concatenate([mixtures, features])
+            fractions = np.concatenate([fractions, labels == targetCategory.value])  # 1 for target class, 0 else
 
         X = np.array(mixtures, dtype=np.float32)
         y = np.array(fractions, dtype=np.float32)[None].T
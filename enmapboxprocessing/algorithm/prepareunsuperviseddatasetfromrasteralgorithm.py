@@ -134,7 +134,7 @@ class PrepareUnsupervisedDatasetFromRasterAlgorithm(EnMAPProcessingAlgorithm):
                 maskArray = np.all(np.asarray(maskArray)[goodBands], axis=0)
                 if mask is not None:
                     array2 = readerMask.arrayFromBlock(block)
-                    maskArray2 = np.all(readerMask.maskArray(array2, defaultNoDataValue=0), axis=0)
+                    maskArray2 = readerMask.maskArrayAllBands(array2, defaultNoDataValue=0)
                     maskArray = np.logical_and(maskArray, maskArray2)
 
                 blockX = list()
@@ -1,9 +1,12 @@
 import traceback
 import warnings
 from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from functools import lru_cache, partial
 from math import ceil
 from os.path import basename, splitext, join, dirname
-from re import finditer, Match
+from re import finditer, Match, search
+from types import CodeType
 from typing import Dict, Any, List, Tuple, Union, Optional
 from unittest.mock import Mock
 
@@ -14,8 +17,10 @@ from osgeo import gdal
 from enmapbox.typeguard import typechecked
 from enmapboxprocessing.algorithm.rasterizevectoralgorithm import RasterizeVectorAlgorithm
 from enmapboxprocessing.algorithm.translaterasteralgorithm import TranslateRasterAlgorithm
+from enmapboxprocessing.blockexecutor import BlockExecutor
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.fusedexpression import FusedExpression
 from enmapboxprocessing.parameter.processingparameterrastermathcodeeditwidget import \
     ProcessingParameterRasterMathCodeEditWidgetWrapper
 from enmapboxprocessing.processingfeedback import ProcessingFeedback
@@ -24,7 +29,23 @@ from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.rasterwriter import RasterWriter
 from enmapboxprocessing.utils import Utils
 from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, QgsProcessingException, QgsProcessing,
-                       QgsProcessingParameterString, QgsProject, QgsRasterLayer, Qgis, QgsVectorLayer, QgsFields)
+                       QgsProcessingParameterString, QgsProject, QgsRasterLayer, Qgis, QgsVectorLayer, QgsFields,
+                       QgsRectangle)
+
+
+@typechecked
+@dataclass
+class RasterMathPlan(object):
+    """Result of analysing the raster math code once, reused for the dry-run and all blocks."""
+    needAllData: Dict[str, bool]  # whether the full array of a raster is used
+    isRasterizedVector: Dict[str, bool]  # whether a raster is a rasterized vector
+    atBands: Dict[str, Dict[Tuple[int, ...], List[str]]]  # band numbers and @identifiers used for each raster
+    writerNames: List[str]  # identifiers used with RasterWriter set-methods
+    source: str  # rewritten code
+    isSingleLineCode: bool
+    usesObjects: bool  # whether reader or writer objects are used, e.g. R1_
+    codeObject: CodeType
+    expression: Optional[FusedExpression] = None  # single line code that is pure element-wise arithmetic
 
 
 @typechecked
@@ -35,6 +56,8 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
     P_NO_DATA_VALUE, _NO_DATA_VALUE = 'noDataValue', 'No data value'
     P_OVERLAP, _OVERLAP = 'overlap', 'Block overlap'
     P_MONOLITHIC, _MONOLITHIC = 'monolithic', 'Monolithic processing'
+    P_WORKER_COUNT, _WORKER_COUNT = 'workerCount', 'Number of workers'
+    P_USE_PROCESSES, _USE_PROCESSES = 'useProcesses', 'Use processes instead of threads'
     P_R1 = 'R1'
     P_R2 = 'R2'
     P_R3 = 'R3'
@@ -91,6 +114,15 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
              'This may be useful for some spatially unbound operations, '
              'like segmentation or region growing, when calculating global statistics, '
              'or if RAM is not an issue at all.'),
+            (self._WORKER_COUNT, 'Number of workers used for evaluating blocks in parallel. '
+                                 'Use 1 for sequential processing and 0 for using all CPU cores. '
+                                 'Parallel processing requires code that only uses the data arrays, '
+                                 'i.e. no reader or writer objects like R1_; otherwise blocks are processed '
+                                 'sequentially.'),
+            (self._USE_PROCESSES, 'Whether to run the workers in separate processes instead of threads. '
+                                  'Threads are sufficient for vectorized NumPy code, which releases the GIL. '
+                                  'Use processes for code that spends a lot of time in pure Python. '
+                                  'Feedback from worker processes is not reported.'),
             ('Raster layer mapped to R1, ..., R10', 'Additional raster layers mapped to Ri.'),
             ('Vector layer mapped to V1, ..., V10', 'Additional vector layers mapped to Vi.'),
             (self._RS, 'Additional list of raster layers mapped to a list variable RS.'),
@@ -137,6 +169,8 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterFloat(self.P_NO_DATA_VALUE, self._NO_DATA_VALUE, None, True, None, None, True)
         self.addParameterInt(self.P_OVERLAP, self._OVERLAP, None, True, 0)
         self.addParameterBoolean(self.P_MONOLITHIC, self._MONOLITHIC, False, True)
+        self.addParameterInt(self.P_WORKER_COUNT, self._WORKER_COUNT, 1, True, 0, None, True)
+        self.addParameterBoolean(self.P_USE_PROCESSES, self._USE_PROCESSES, False, True, True)
         for name, description in self.inputRasterNames():
             self.addParameterRasterLayer(name, description, None, True, True)
         for name, description in self.inputVectorNames():
@@ -159,6 +193,8 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
         floatInput = self.parameterAsBoolean(parameters, self.P_FLOAT_INPUT, context)
         overlap = self.parameterAsInt(parameters, self.P_OVERLAP, context)
         monolithic = self.parameterAsBoolean(parameters, self.P_MONOLITHIC, context)
+        workerCount = self.parameterAsInt(parameters, self.P_WORKER_COUNT, context)
+        useProcesses = self.parameterAsBoolean(parameters, self.P_USE_PROCESSES, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_RASTER, context)
 
         with open(filename + '.log', 'w') as logfile:
@@ -272,9 +308,20 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
             readers = {rasterName: RasterReader(raster) for rasterName, raster in rasters.items()}
             readers2 = {rasterName: RasterReader(raster) for rasterName, raster in rasters2.items()}
 
+            # analyse the code once
+            plan = self.makePlan(code, readers, feedback)
+
             # init output raster layer
             writers = self.makeWriter(
-                code, filename, grid, readers, readers2, floatInput, noDataValue, feedback)
+                plan, filename, grid, readers, readers2, floatInput, noDataValue, feedback)
+
+            executor = BlockExecutor(workerCount, useProcesses)
+            if executor.isParallel() and plan.usesObjects:
+                feedback.pushWarning(
+                    'Code uses reader or writer objects, which can not be shared with parallel workers. '
+                    'Blocks are processed sequentially.'
+                )
+                executor = BlockExecutor()
 
             # get block size
             lineMemoryUsage = 0
@@ -282,7 +329,8 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
                 lineMemoryUsage += grid.lineMemoryUsage(reader.bandCount(), reader.dataTypeSize())
             for writer in writers.values():
                 lineMemoryUsage += grid.lineMemoryUsage(writer.bandCount(), writer.dataTypeSize())
-            blockSizeY = min(grid.height(), ceil(Utils.maximumMemoryUsage() / lineMemoryUsage))
+            maximumMemoryUsage = executor.maximumBlockMemoryUsage(Utils.maximumMemoryUsage())
+            blockSizeY = min(grid.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
             blockSizeX = grid.width()
             if monolithic:
                 blockSizeY = grid.height()
@@ -291,11 +339,8 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
             # process
             if overlap is None:
                 overlap = 0
-            for block in grid.walkGrid(blockSizeX, blockSizeY, feedback):
 
-                results = self.processBlock(
-                    code, block, readers, readers2, writers, floatInput, noDataValue, overlap, feedback
-                )
+            def write(block: RasterBlockInfo, results: Dict[str, np.ndarray]):
                 for key in results:
                     if self.isTemporaryVariable(key):
                         continue
@@ -304,6 +349,35 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
                     result = results[key]
                     writer.writeArray(result, block.xOffset, block.yOffset, overlap=overlap)
 
+            blocks = grid.walkGrid(blockSizeX, blockSizeY, feedback)
+            if not executor.isParallel():
+                for block in blocks:
+                    results = self.processBlock(
+                        plan, block, readers, readers2, writers, floatInput, noDataValue, overlap, feedback
+                    )
+                    write(block, results)
+            else:
+                def read(block: RasterBlockInfo) -> Dict[str, Any]:
+                    return self.readBlock(plan, block, readers, readers2, floatInput, noDataValue, overlap)
+
+                rasterNames = list(readers)
+                if useProcesses:  # code objects, blocks and feedback can't be pickled
+                    expressionCode = None if plan.expression is None else plan.expression.expression
+                    process = partial(
+                        executeRasterMathBlockInWorker, plan.source, plan.isSingleLineCode, rasterNames, overlap,
+                        expressionCode
+                    )
+                    executor.run(
+                        map(blockToTuple, blocks), lambda block: read(blockFromTuple(block)), process,
+                        lambda block, results: write(blockFromTuple(block), results)
+                    )
+                else:
+                    process = partial(
+                        executeRasterMathBlock, plan.codeObject, plan.isSingleLineCode, rasterNames, overlap,
+                        feedback=feedback, expression=plan.expression
+                    )
+                    executor.run(blocks, read, process, write)
+
             # prepare results
             result = {self.P_OUTPUT_RASTER: None}
             for key, writer in writers.items():
@@ -341,28 +415,20 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
         return result
 
     def makeWriter(
-            self, code: str, filename: str, grid: RasterReader, readers: Dict[str, RasterReader],
+            self, plan: RasterMathPlan, filename: str, grid: RasterReader, readers: Dict[str, RasterReader],
             readers2: Dict[str, RasterReader], floatInput: bool, noDataValue: Optional[float],
             feedback: ProcessingFeedback
     ) -> Dict[str, Union[RasterWriter, Mock]]:
         # We derive output data types and band counts by executing the code on a minimal extent (i.e. one pixel).
         # We call this a dry-run.
 
-        # Find writer objects by parsing for set-methods.
-        writers = dict()  # we have no writers
-        for method in RasterWriter.__dict__:
-            if method.startswith('set'):
-                match_: Match
-                pattern = r'\w*.' + method
-                for match_ in finditer(pattern, code):
-                    substring = code[match_.start(): match_.end()]
-                    identifier = substring.split('.')[0]
-                    writers[identifier] = Mock()  # silently ignore all writer interaction
+        # Writer objects are not available yet.
+        writers = {identifier: Mock() for identifier in plan.writerNames}  # silently ignore all writer interaction
 
         results = {}
         for block in grid.walkGrid(1, 1, None):
             results = self.processBlock(
-                code, block, readers, readers2, writers, floatInput, noDataValue, 0, feedback, True
+                plan, block, readers, readers2, writers, floatInput, noDataValue, 0, feedback, True
             )
             break  # stop after processing the first pixel
 
@@ -394,83 +460,70 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
 
         return writers
 
-    def processBlock(
-            self, code: str, block: RasterBlockInfo, readers: Dict[str, RasterReader],
-            readers2: Dict[str, RasterReader], writers: Dict[str, Union[RasterWriter, Mock]],
-            floatInput: bool, noDataValue: Optional[float], overlap: int, feedback: ProcessingFeedback, dryRun=False
-    ) -> Dict[str, np.ndarray]:
+    def makePlan(self, code: str, readers: Dict[str, RasterReader], feedback: ProcessingFeedback) -> RasterMathPlan:
+        """Analyse the code once: find used bands, rewrite identifiers and compile the code."""
 
-        # add modules
-        namespace = dict()
-        namespace['np'] = np
-        namespace['numpy'] = numpy
+        # Find writer objects by parsing for set-methods.
+        writerNames = list()
+        for method in RasterWriter.__dict__:
+            if method.startswith('set'):
+                match_: Match
+                pattern = r'\w*.' + method
+                for match_ in finditer(pattern, code):
+                    substring = code[match_.start(): match_.end()]
+                    identifier = substring.split('.')[0]
+                    if identifier not in writerNames:
+                        writerNames.append(identifier)
 
-        # add special variables
-        if dryRun:
-            namespace['feedback'] = Mock()  # silently ignore all feedback
-        else:
-            namespace['feedback'] = feedback
-        namespace['block'] = block
-        namespace['dryRun'] = dryRun
+        # inject reader objects (before the analysis, so that the reader methods do not count as array usage)
+        for rasterName in readers:
+            for method in RasterReader.__dict__:
+                code = code.replace(rasterName + '.' + method, rasterName + '_.' + method)
+
+        # skip comments and add some space for avoiding index errors when checking
+        lines = [line + '    ' for line in code.splitlines() if not line.startswith('#')]
 
-        # add data arrays and readers
+        needAllData = dict()
+        isRasterizedVector = dict()
+        atBandsByRaster = dict()
         atIdentifiers = list()  # collect all @identifiers that need to be substitution with valid identifier
         for rasterName in readers:
             reader = readers[rasterName]  # used for querying metadata etc.
-            reader2 = readers2[rasterName]  # used for reading the resampled data
 
             # only read all the data if really required, maybe we just need single bands indicated by the usage of'@'
-            needAllData = False
+            needAllData[rasterName] = False
 
             # - check if we use the actual array
             match_: Match
-            for line in code.splitlines():
-                if line.startswith('#'):
-                    continue
-                line += '    '  # add some space for avoiding index errors when checking
-                for match_ in finditer(rasterName, line):
-                    if line[match_.end()] in '@.':
-                        continue  # not using the actual array, but only a single band or the reader
-                needAllData = True
+            for line in lines:
+                for match_ in finditer(rf'\b{rasterName}\b', line):  # the reader object R1_ is not matched
+                    if line[match_.end()] in '@':
+                        continue  # not using the actual array, but only a single band
+                    needAllData[rasterName] = True
 
             # - check if we use the actual mask array
             match_: Match
-            for line in code.splitlines():
-                if line.startswith('#'):
-                    continue
-                line += '    '  # add some space for avoiding index errors when checking
-                for match_ in finditer(rasterName + 'Mask', line):
+            for line in lines:
+                for match_ in finditer(rf'\b{rasterName}Mask\b', line):
                     if line[match_.end()] in '@':
                         continue  # not using the actual mask array, but only a single band
-                needAllData = True
+                    needAllData[rasterName] = True
 
-            if needAllData:
-                # check if the raster is a rasterized vector ...
-                isRasterizedVector = reader.bandName(reader.bandCount()) == 'None'
-                if isRasterizedVector:  # ... if so, we just assign the 0/1 mask, instead of all burned fields
-                    array = np.array(reader2.arrayFromBlock(block, [reader.bandCount()], overlap))
-                    namespace[rasterName] = array
-                    namespace[rasterName + 'Mask'] = array == 1
-                else:
-                    array = np.array(reader2.arrayFromBlock(block, None, overlap))
+            # - the RS and RSMask lists hold the actual arrays of all list rasters R11, R12, ...
+            isListRaster = rasterName[:1] == 'R' and rasterName[1:].isdigit() and int(rasterName[1:]) > 10
+            if isListRaster and any(search(r'\bRS(Mask)?\b', line) for line in lines):
+                needAllData[rasterName] = True
 
-                    # replace no data values (see #479)
-                    if noDataValue is not None:
-                        for bandNo, arr in enumerate(array, 1):
-                            if reader.noDataValue(bandNo) is not None:
-                                arr[arr == reader.noDataValue(bandNo)] = noDataValue
-
-                    namespace[rasterName] = array
-                    namespace[rasterName + 'Mask'] = np.array(reader2.maskArray(array, None))
+            # check if the raster is a rasterized vector
+            isRasterizedVector[rasterName] = False
+            if needAllData[rasterName]:
+                isRasterizedVector[rasterName] = reader.bandName(reader.bandCount()) == 'None'
 
             #  find single band usages indicated by '@'
             atBands: Dict[Tuple, List[str]] = defaultdict(list)
             match_: Match
 
-            for line in code.splitlines():
-                if line.startswith('#'):
-                    continue
-                line += '    '  # add some space for avoiding index errors when checking
+            for line in lines:
                 matches = list()
                 matches.extend(finditer(rasterName + '@"[^"]+"', line))
                 matches.extend(finditer(rasterName + '@[0-9:|^]+', line))
@@ -518,9 +571,95 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
 
                     identifier = text.replace('Mask@', '@') + unit
                     atBands[bandNos].append(identifier)  # collect all identifiers for each band
+            atBandsByRaster[rasterName] = dict(atBands)
+
+        # inject writer objects
+        for rasterName in writerNames:
+            code = code.replace(rasterName + '.set', rasterName + '_.set', )
+
+        # strip empty lines
+        code = code.strip()
+
+        # remove all comments
+        code = '\n'.join([line for line in code.splitlines() if not line.strip().startswith('#')])
+
+        # substitute all @"<band name>" identifier with valid identifier
+        for atIdentifier in set(atIdentifiers):
+            code = code.replace(atIdentifier, Utils.makeIdentifier(atIdentifier.replace('@', 'At')))
+
+        # enable single line expressions
+        isSingleLineCode = '\n' not in code
+        if isSingleLineCode:
+            code = self.P_OUTPUT_RASTER + ' = ' + code  # make it a statement
+
+        # replace @
+        code = code.replace('@', 'At')
+
+        # compile code
+        code = code.replace(r'\n', '\n')  # convert raw new lines (only required when executed via qgis_process)
+        try:
+            codeObject = compile(code, '<string>', 'exec')
+        except Exception as error:
+            reportCodeError(feedback)
+            raise QgsProcessingException(str(error))
+
+        usesObjects = 'RS_' in code or any(name + '_.' in code for name in list(readers) + writerNames)
+
+        # evaluate pure element-wise single line expressions without full-size temporaries
+        expression = None
+        if isSingleLineCode:
+            expressionCode = code[len(self.P_OUTPUT_RASTER + ' = '):]
+            if FusedExpression.isElementwise(expressionCode):
+                expression = FusedExpression(expressionCode)
+
+        return RasterMathPlan(
+            needAllData, isRasterizedVector, atBandsByRaster, writerNames, code, isSingleLineCode, usesObjects,
+            codeObject, expression
+        )
+
+    def processBlock(
+            self, plan: RasterMathPlan, block: RasterBlockInfo, readers: Dict[str, RasterReader],
+            readers2: Dict[str, RasterReader], writers: Dict[str, Union[RasterWriter, Mock]],
+            floatInput: bool, noDataValue: Optional[float], overlap: int, feedback: ProcessingFeedback, dryRun=False
+    ) -> Dict[str, np.ndarray]:
+        namespace = self.readBlock(plan, block, readers, readers2, floatInput, noDataValue, overlap)
+        namespace.update(self.objectNamespace(namespace, readers, writers))
+        return executeRasterMathBlock(
+            plan.codeObject, plan.isSingleLineCode, list(readers), overlap, block, namespace, feedback, dryRun,
+            plan.expression
+        )
+
+    def readBlock(
+            self, plan: RasterMathPlan, block: RasterBlockInfo, readers: Dict[str, RasterReader],
+            readers2: Dict[str, RasterReader], floatInput: bool, noDataValue: Optional[float], overlap: int
+    ) -> Dict[str, Union[np.ndarray, List[np.ndarray]]]:
+        """Return the data arrays required by the plan."""
+
+        # add data arrays
+        namespace = dict()
+        for rasterName in readers:
+            reader = readers[rasterName]  # used for querying metadata etc.
+            reader2 = readers2[rasterName]  # used for reading the resampled data
+
+            if plan.needAllData[rasterName]:
+                if plan.isRasterizedVector[rasterName]:  # just assign the 0/1 mask, instead of all burned fields
+                    array = np.array(reader2.arrayFromBlock(block, [reader.bandCount()], overlap))
+                    namespace[rasterName] = array
+                    namespace[rasterName + 'Mask'] = array == 1
+                else:
+                    array = np.array(reader2.arrayFromBlock(block, None, overlap))
+
+                    # replace no data values (see #479)
+                    if noDataValue is not None:
+                        for bandNo, arr in enumerate(array, 1):
+                            if reader.noDataValue(bandNo) is not None:
+                                arr[arr == reader.noDataValue(bandNo)] = noDataValue
+
+                    namespace[rasterName] = array
+                    namespace[rasterName + 'Mask'] = np.array(reader2.maskArray(array, None))
 
             # add single band data
-            for bandNos, identifiers in atBands.items():
+            for bandNos, identifiers in plan.atBands[rasterName].items():
                 array = np.array(reader2.arrayFromBlock(block, list(bandNos), overlap))
 
                 # replace no data values (see #479)
@@ -535,50 +674,15 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
                     namespace[Utils.makeIdentifier(tmp[0] + 'At' + tmp[1])] = array
                     namespace[Utils.makeIdentifier(tmp[0] + 'MaskAt' + tmp[1])] = marray
 
-            namespace[rasterName + '_'] = reader
-
         namespace['RS'] = list()
-        namespace['RS_'] = list()
         namespace['RSMask'] = list()
         for rasterName in self.inputRasterListNames():
             if rasterName in namespace:
                 namespace['RS'].append(namespace[rasterName])
-                namespace['RS_'].append(namespace[rasterName + '_'])
                 namespace['RSMask'].append(namespace[rasterName + 'Mask'])
             else:
                 break
 
-        # add writers
-        for rasterName, writer in writers.items():
-            namespace[rasterName + '_'] = writer
-
-        # inject writer objects
-        for rasterName in writers:
-            code = code.replace(rasterName + '.set', rasterName + '_.set', )
-
-        # inject reader objects
-        for rasterName in readers:
-            for method in RasterReader.__dict__:
-                code = code.replace(rasterName + '.' + method, rasterName + '_.' + method)
-
-        # strip empty lines
-        code = code.strip()
-
-        # remove all comments
-        code = '\n'.join([line for line in code.splitlines() if not line.strip().startswith('#')])
-
-        # substitute all @"<band name>" identifier with valid identifier
-        for atIdentifier in set(atIdentifiers):
-            code = code.replace(atIdentifier, Utils.makeIdentifier(atIdentifier.replace('@', 'At')))
-
-        # enable single line expressions
-        isSingleLineCode = '\n' not in code
-        if isSingleLineCode:
-            code = self.P_OUTPUT_RASTER + ' = ' + code  # make it a statement
-
-        # replace @
-        code = code.replace('@', 'At')
-
         # cast inputs to float32
         if floatInput:
             for key, value in namespace.items():
@@ -588,55 +692,136 @@ class RasterMathAlgorithm(EnMAPProcessingAlgorithm):
                     continue
                 namespace[key] = value.astype(np.float32)
 
-        # execute code
-        try:
-            code = code.replace(r'\n', '\n')  # convert raw new lines (only required when executed via qgis_process)
-            exec(code, namespace)
-        except Exception as error:
-            traceback.print_exc()
-            text = traceback.format_exc()
-            text = text[text.index('File "<string>"'):]
-            feedback.reportError(text)
-            raise QgsProcessingException(str(error))
-
-        # prepare output data
-        results = dict()
-        for key, value in namespace.items():  # skip all input arrays
-            if key in readers:
-                if isSingleLineCode:
-                    if key != self.P_OUTPUT_RASTER:
-                        continue
-                else:
-                    continue
-            removeItem = False
-            for reader in readers:  # skip all input arrays with @ syntax
-                if key.startswith(reader + 'At'):
-                    removeItem = True
-            if removeItem:
-                continue
-
-            if key.endswith('Mask') and key[:-4] in readers:  # skip all input mask arrays
-                continue
-            if 'MaskAt' in key:  # skip all input mask arrays with @ syntax
-                continue
-            if not isinstance(value, np.ndarray):  # skip all non-arrays
-                continue
-            if value.ndim == 2:  # if single band array ...
-                feedback.pushInfo(f'Expand 2d-array ({key}) to 3d')
-                value = value[None]  # ... add third dimension
-            if value.ndim != 3:  # skip all non-3d-arrays
-                feedback.pushInfo(f'Skip non-3d-array ({key}{list(value.shape)})')
-                continue
-            if value.shape[1:] != (block.height + 2 * overlap, block.width + 2 * overlap):  # skip mismatching arrays
-                feedback.pushInfo(f'Skip mismatching array ({key})')
-                continue
-            results[key] = value
-
-        # Check if single line was already a statement. If so, remove the default output from the results.
-        if isSingleLineCode and len(results) > 1:
-            results.pop(self.P_OUTPUT_RASTER)
+        return namespace
 
-        return results
+    def objectNamespace(
+            self, namespace: Dict[str, Any], readers: Dict[str, RasterReader],
+            writers: Dict[str, Union[RasterWriter, Mock]]
+    ) -> Dict[str, Any]:
+        """Return the reader and writer objects, accessible via the underscore suffix, e.g. R1_."""
+        objects = dict()
+        for rasterName, reader in readers.items():
+            objects[rasterName + '_'] = reader
+        objects['RS_'] = list()
+        for rasterName in self.inputRasterListNames():
+            if rasterName in namespace:
+                objects['RS_'].append(readers[rasterName])
+            else:
+                break
+        for rasterName, writer in writers.items():
+            objects[rasterName + '_'] = writer
+        return objects
 
     def isTemporaryVariable(self, name) -> bool:
         return name.startswith('_') or name.endswith('_') or name.startswith('tmp') or name.startswith('temp')
+
+
+def reportCodeError(feedback: QgsProcessingFeedback):
+    traceback.print_exc()
+    text = traceback.format_exc()
+    if 'File "<string>"' in text:
+        text = text[text.index('File "<string>"'):]
+    feedback.reportError(text)
+
+
+def executeRasterMathBlock(
+        codeObject: CodeType, isSingleLineCode: bool, rasterNames: List[str], overlap: int, block: RasterBlockInfo,
+        namespace: Dict[str, Any], feedback: QgsProcessingFeedback, dryRun=False,
+        expression: FusedExpression = None
+) -> Dict[str, np.ndarray]:
+    """Execute the compiled raster math code on the given block data and return the output arrays."""
+
+    # add modules
+    namespace['np'] = np
+    namespace['numpy'] = numpy
+
+    # add special variables
+    if dryRun:
+        namespace['feedback'] = Mock()  # silently ignore all feedback
+    else:
+        namespace['feedback'] = feedback
+    namespace['block'] = block
+    namespace['dryRun'] = dryRun
+
+    # execute code
+    try:
+        if expression is not None and all(name in namespace for name in expression.variables):
+            namespace[RasterMathAlgorithm.P_OUTPUT_RASTER] = expression.evaluate(namespace)
+        else:
+            exec(codeObject, namespace)
+    except Exception as error:
+        reportCodeError(feedback)
+        raise QgsProcessingException(str(error))
+
+    # prepare output data
+    results = dict()
+    for key, value in namespace.items():  # skip all input arrays
+        if key in rasterNames:
+            if isSingleLineCode:
+                if key != RasterMathAlgorithm.P_OUTPUT_RASTER:
+                    continue
+            else:
+                continue
+        removeItem = False
+        for rasterName in rasterNames:  # skip all input arrays with @ syntax
+            if key.startswith(rasterName + 'At'):
+                removeItem = True
+        if removeItem:
+            continue
+
+        if key.endswith('Mask') and key[:-4] in rasterNames:  # skip all input mask arrays
+            continue
+        if 'MaskAt' in key:  # skip all input mask arrays with @ syntax
+            continue
+        if not isinstance(value, np.ndarray):  # skip all non-arrays
+            continue
+        if value.ndim == 2:  # if single band array ...
+            feedback.pushInfo(f'Expand 2d-array ({key}) to 3d')
+            value = value[None]  # ... add third dimension
+        if value.ndim != 3:  # skip all non-3d-arrays
+            feedback.pushInfo(f'Skip non-3d-array ({key}{list(value.shape)})')
+            continue
+        if value.shape[1:] != (block.height + 2 * overlap, block.width + 2 * overlap):  # skip mismatching arrays
+            feedback.pushInfo(f'Skip mismatching array ({key})')
+            continue
+        results[key] = value
+
+    # Check if single line was already a statement. If so, remove the default output from the results.
+    if isSingleLineCode and len(results) > 1:
+        results.pop(RasterMathAlgorithm.P_OUTPUT_RASTER)
+
+    return results
+
+
+def blockToTuple(block: RasterBlockInfo) -> Tuple:
+    extent = block.extent
+    return (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum(),
+            block.xOffset, block.yOffset, block.width, block.height)
+
+
+def blockFromTuple(values: Tuple) -> RasterBlockInfo:
+    xMinimum, yMinimum, xMaximum, yMaximum, xOffset, yOffset, width, height = values
+    return RasterBlockInfo(QgsRectangle(xMinimum, yMinimum, xMaximum, yMaximum), xOffset, yOffset, width, height)
+
+
+@lru_cache()
+def compileRasterMathCode(source: str) -> CodeType:
+    return compile(source, '<string>', 'exec')
+
+
+@lru_cache()
+def compileRasterMathExpression(expressionCode: Optional[str]) -> Optional[FusedExpression]:
+    if expressionCode is None:
+        return None
+    return FusedExpression(expressionCode)
+
+
+def executeRasterMathBlockInWorker(
+        source: str, isSingleLineCode: bool, rasterNames: List[str], overlap: int, expressionCode: Optional[str],
+        block: Tuple, namespace: Dict[str, Any]
+) -> Dict[str, np.ndarray]:
+    """Execute the raster math code inside a worker process."""
+    return executeRasterMathBlock(
+        compileRasterMathCode(source), isSingleLineCode, rasterNames, overlap, blockFromTuple(block), namespace,
+        QgsProcessingFeedback(), False, compileRasterMathExpression(expressionCode)
+    )
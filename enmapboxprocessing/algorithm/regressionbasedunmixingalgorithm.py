@@ -1,26 +1,24 @@
-from collections import defaultdict
-from os import makedirs
-from os.path import join, exists, dirname
+from functools import partial
+from io import StringIO
 from typing import Dict, Any, List, Tuple
 
-from osgeo import gdal
+import numpy as np
 
-from enmapboxprocessing.algorithm.aggregaterasterbandsalgorithm import AggregateRasterBandsAlgorithm
+from enmapboxprocessing.algorithm.aggregaterastersalgorithm import AggregateRastersAlgorithm
 from enmapboxprocessing.algorithm.classificationfromclassprobabilityalgorithm import \
     ClassificationFromClassProbabilityAlgorithm
-from enmapboxprocessing.algorithm.fitgenericregressoralgorithm import FitGenericRegressorAlgorithm
-from enmapboxprocessing.algorithm.predictregressionalgorithm import PredictRegressionAlgorithm
 from enmapboxprocessing.algorithm.prepareregressiondatasetfromsynthmixalgorithm import \
     PrepareRegressionDatasetFromSynthMixAlgorithm
-from enmapboxprocessing.algorithm.rastermathalgorithm.rastermathalgorithm import RasterMathAlgorithm
-from enmapboxprocessing.algorithm.stackrasterlayersalgorithm import StackRasterLayersAlgorithm
-from enmapboxprocessing.algorithm.translaterasteralgorithm import TranslateRasterAlgorithm
+from enmapboxprocessing.blockexecutor import BlockExecutor
+from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
-from enmapboxprocessing.rasterwriter import RasterWriter
+from enmapboxprocessing.memoryplanner import MemoryPlanner
+from enmapboxprocessing.predictionengine import PredictionEngine
+from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import ClassifierDump
 from enmapboxprocessing.utils import Utils
 from qgis.PyQt.QtGui import QColor
-from qgis.core import (QgsProcessingContext, QgsProcessingFeedback)
+from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, Qgis, QgsProcessingException)
 from enmapbox.typeguard import typechecked
 
 
@@ -38,6 +36,9 @@ class RegressionBasedUnmixingAlgorithm(EnMAPProcessingAlgorithm):
     P_ENSEMBLE_SIZE, _ENSEMBLE_SIZE = 'ensembleSize', 'Ensemble size'
     P_ROBUST_FUSION, _ROBUST_FUSION = 'robustFusion', 'Robust decision fusion'
     P_SUM_TO_ONE, _SUM_TO_ONE = 'sumToOne', 'Sum-to-one constraint'
+    P_SEED, _SEED = 'seed', 'Random seed'
+    P_WORKER_COUNT, _WORKER_COUNT = 'workerCount', 'Number of workers'
+    P_USE_PROCESSES, _USE_PROCESSES = 'useProcesses', 'Use processes instead of threads'
     P_OUTPUT_FRACTION, _OUTPUT_FRACTION = 'outputFraction', 'Output class fraction layer'
     P_OUTPUT_CLASSIFICATION, _OUTPUT_CLASSIFICATION = 'outputClassification', 'Output classification layer'
     P_OUTPUT_VARIATION, _OUTPUT_VARIATION = 'outputFractionVariation', 'Output class fraction variation layer'
@@ -71,6 +72,11 @@ class RegressionBasedUnmixingAlgorithm(EnMAPProcessingAlgorithm):
             (self._ROBUST_FUSION, 'Whether to use median and IQR (interquartile range) aggregation for ensemble '
                                   'decision fusion. The default is to use mean and standard deviation.'),
             (self._SUM_TO_ONE, 'Whether to ensure sum-to-one constraint for predicted fractions.'),
+            (self._SEED, 'The seed for the random generator can be provided.'),
+            (self._WORKER_COUNT, 'Number of workers used for fitting the ensemble members and for predicting blocks '
+                                 'in parallel. Use 1 for sequential processing and 0 for using all CPU cores.'),
+            (self._USE_PROCESSES, 'Whether to run the workers in separate processes instead of threads. '
+                                  'Processes are only recommended for regressors that do not release the GIL.'),
             (self._OUTPUT_FRACTION, self.RasterFileDestination),
             (self._OUTPUT_CLASSIFICATION, self.RasterFileDestination),
             (self._OUTPUT_VARIATION, self.RasterFileDestination)
@@ -92,6 +98,9 @@ class RegressionBasedUnmixingAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterInt(self.P_ENSEMBLE_SIZE, self._ENSEMBLE_SIZE, 1, False, 1)
         self.addParameterBoolean(self.P_ROBUST_FUSION, self._ROBUST_FUSION, False, True)
         self.addParameterBoolean(self.P_SUM_TO_ONE, self._SUM_TO_ONE, False, True)
+        self.addParameterInt(self.P_SEED, self._SEED, None, True, 1, None, True)
+        self.addParameterInt(self.P_WORKER_COUNT, self._WORKER_COUNT, 1, True, 0, None, True)
+        self.addParameterBoolean(self.P_USE_PROCESSES, self._USE_PROCESSES, False, True, True)
         self.addParameterRasterDestination(self.P_OUTPUT_FRACTION, self._OUTPUT_FRACTION)
         self.addParameterRasterDestination(self.P_OUTPUT_CLASSIFICATION, self._OUTPUT_CLASSIFICATION, None, True, False)
         self.addParameterRasterDestination(self.P_OUTPUT_VARIATION, self._OUTPUT_VARIATION, None, True, False)
@@ -105,171 +114,118 @@ class RegressionBasedUnmixingAlgorithm(EnMAPProcessingAlgorithm):
         n = self.parameterAsInt(parameters, self.P_N, context)
         background = self.parameterAsInt(parameters, self.P_BACKGROUND, context)
         includeEndmember = self.parameterAsBoolean(parameters, self.P_INCLUDE_ENDMEMBER, context)
-        mixingProbabilities = self.parameterAsString(parameters, self.P_MIXING_PROBABILITIES, context)
+        mixingProbabilities = self.parameterAsValues(parameters, self.P_MIXING_PROBABILITIES, context)
         allowWithinClassMixtures = self.parameterAsBoolean(parameters, self.P_ALLOW_WITHINCLASS_MIXTURES, context)
         classProbabilities = self.parameterAsValues(parameters, self.P_CLASS_PROBABILITIES, context)
         ensembleSize = self.parameterAsInt(parameters, self.P_ENSEMBLE_SIZE, context)
         robustFusion = self.parameterAsBoolean(parameters, self.P_ROBUST_FUSION, context)
         sumToOne = self.parameterAsBoolean(parameters, self.P_SUM_TO_ONE, context)
+        seed = self.parameterAsInt(parameters, self.P_SEED, context)
+        workerCount = self.parameterAsInt(parameters, self.P_WORKER_COUNT, context)
+        useProcesses = self.parameterAsBoolean(parameters, self.P_USE_PROCESSES, context)
         filenameFraction = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_FRACTION, context)
         filenameClassification = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_CLASSIFICATION, context)
         filenameVariation = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_VARIATION, context)
+        maximumMemoryUsage = Utils.maximumMemoryUsage()
 
         with open(filenameFraction + '.log', 'w') as logfile:
             feedback, feedback2 = self.createLoggingFeedback(feedback, logfile)
             self.tic(feedback, parameters, context)
 
-            categories = ClassifierDump.fromDict(Utils.pickleLoad(filenameClassificationDataset)).categories
-
-            # create ensemble runs
-            feedback.pushInfo('Create ensemble')
-            filenames = defaultdict(list)
-            folderEnsemble = Utils.tmpFilename(filenameFraction, 'ensemble')
-            folderRuns = join(folderEnsemble, 'runs')
-            for run in range(1, ensembleSize + 1):
-                feedback.setProgress((run - 1) / ensembleSize * 100)
-
-                folderRun = join(folderRuns, str(run))
-
-                # create mixtures
-                alg = PrepareRegressionDatasetFromSynthMixAlgorithm()
-                alg.initAlgorithm()
-                parameters = {
-                    alg.P_DATASET: filenameClassificationDataset,
-                    alg.P_N: n,
-                    alg.P_BACKGROUND: background,
-                    alg.P_INCLUDE_ENDMEMBER: includeEndmember,
-                    alg.P_MIXING_PROBABILITIES: mixingProbabilities,
-                    alg.P_ALLOW_WITHINCLASS_MIXTURES: allowWithinClassMixtures,
-                    alg.P_CLASS_PROBABILITIES: classProbabilities,
-                    alg.P_OUTPUT_FOLDER: folderRun
-                }
-                self.runAlg(alg, parameters, None, feedback2, context, True)
-
-                for category in categories:
-                    filenameRegressionDatasetRun = join(folderRun, category.name + '.pkl')
-                    filenameRegressorRun = filenameRegressionDatasetRun.replace('.pkl', '.regressor.pkl')
-                    filenameFractionRun = filenameRegressionDatasetRun.replace('.pkl', '.fraction.tif')
-
-                    # create regressor
-                    alg = FitGenericRegressorAlgorithm()
-                    alg.initAlgorithm()
-                    parameters = {
-                        alg.P_DATASET: filenameRegressionDatasetRun,
-                        alg.P_REGRESSOR: code,
-                        alg.P_OUTPUT_REGRESSOR: filenameRegressorRun
-                    }
-                    self.runAlg(alg, parameters, None, feedback2, context, True)
-
-                    # predict map
-                    alg = PredictRegressionAlgorithm()
-                    alg.initAlgorithm()
-                    parameters = {
-                        alg.P_RASTER: raster,
-                        alg.P_REGRESSOR: filenameRegressorRun,
-                        alg.P_OUTPUT_REGRESSION: filenameFractionRun
-                    }
-                    self.runAlg(alg, parameters, None, feedback2, context, True)
-
-                    filenames[category.name].append(filenameFractionRun)
-
-            # aggregate over runs
-            feedback.pushInfo('Aggregate runs')
-            for i, category in enumerate(categories):
-                feedback.setProgress(i / len(categories) * 100)
-
-                # stack runs
-                filenameStack = join(folderEnsemble, 'stack', category.name + '.vrt')
-                filenameAggregation = join(folderEnsemble, 'aggregation', category.name + '.tif')
-                if not exists(dirname(filenameStack)):
-                    makedirs(dirname(filenameStack))
-                if not exists(dirname(filenameAggregation)):
-                    makedirs(dirname(filenameAggregation))
-                gdal.BuildVRT(filenameStack, filenames[category.name], separate=True)
-
-                # aggregate runs
-                alg = AggregateRasterBandsAlgorithm()
-                parameters = {
-                    alg.P_RASTER: filenameStack,
-                    alg.P_OUTPUT_RASTER: filenameAggregation
-                }
-                if robustFusion:
-                    parameters[alg.P_FUNCTION] = [alg.MedianFunction]
-                    if filenameVariation is not None:
-                        parameters[alg.P_FUNCTION].append(alg.InterquartileRangeFunction)
-                else:
-                    parameters[alg.P_FUNCTION] = [alg.ArithmeticMeanFunction]
-                    if filenameVariation is not None:
-                        parameters[alg.P_FUNCTION].append(alg.StandardDeviationFunction)
-                self.runAlg(alg, parameters, None, feedback2, context, True)
-
-            # prepare fraction results
-            feedback.pushInfo('Prepare fraction layer')
-            filenames = [join(folderEnsemble, 'aggregation', category.name + '.tif') for category in categories]
-            filename = Utils.tmpFilename(filenameFraction, 'fraction.vrt')
-            alg = StackRasterLayersAlgorithm()
-            alg.initAlgorithm()
-            parameters = {
-                alg.P_RASTERS: filenames,
-                alg.P_BAND: 1,
-                alg.P_OUTPUT_RASTER: filename
-            }
-            self.runAlg(alg, parameters, None, feedback2, context, True)
-
-            # sum-to-one constraint
-            if sumToOne:
-                filename2 = Utils.tmpFilename(filenameFraction, 'fractionNormalized.tif')
-                alg = RasterMathAlgorithm()
-                alg.initAlgorithm()
-                parameters = {
-                    alg.P_R1: filename,
-                    alg.P_CODE: 'outputRaster = R1 / np.sum(R1, axis=0)\n'
-                                'outputRaster[~R1Mask] = -1\n'
-                                'for bandNo in R1.bandNumbers():\n'
-                                '    outputRaster.setNoDataValue(-1, bandNo)',
-                    alg.P_OUTPUT_RASTER: filename2
-                }
-                self.runAlg(alg, parameters, None, feedback2, context, True)
+            dump = ClassifierDump.fromDict(Utils.pickleLoad(filenameClassificationDataset))
+            categories = dump.categories
+            executor = BlockExecutor(workerCount, useProcesses)
+
+            # create mixtures and fit ensemble members in memory
+            feedback.pushInfo('Fit ensemble')
+            synthMix = PrepareRegressionDatasetFromSynthMixAlgorithm()
+            synthMix.X, synthMix.y, synthMix.categories = dump.X, dump.y, categories
+            synthMix.n = n
+            synthMix.background = background
+            synthMix.includeEndmember = includeEndmember
+            synthMix.mixingProbabilities = mixingProbabilities
+            synthMix.allowWithinClassMixtures = allowWithinClassMixtures
+            synthMix.classProbabilities = classProbabilities
+            rng = np.random.default_rng(seed)
+            members = [(run, category) for run in range(ensembleSize) for category in categories]
+            regressors: Dict[str, List] = {category.name: list() for category in categories}
+
+            def readMember(member):
+                run, category = member
+                X, y = synthMix.mixCategory(category, rng)  # mixtures are drawn sequentially, to be reproducible
+                namespace = dict()
+                exec(code, namespace)
+                return namespace['regressor'], X, y
+
+            def writeMember(member, regressor):
+                run, category = member
+                regressors[category.name].append(regressor)
+                feedback.setProgress(sum(map(len, regressors.values())) / len(members) * 50)
+
+            executor.run(members, readMember, fitEnsembleMember, writeMember)
+
+            # predict all ensemble members and fuse them in a single pass over the raster
+            feedback.pushInfo('Predict and fuse ensemble')
+            rasterReader = RasterReader(raster)
+            bandList = None
+            if rasterReader.bandCount() != dump.X.shape[1]:
+                goodBandList = [int(bandNo) for bandNo in np.flatnonzero(rasterReader.badBandMultipliers() == 1) + 1]
+                if len(goodBandList) != dump.X.shape[1]:
+                    message = f'number of endmember features ({dump.X.shape[1]}) not matching number of raster ' \
+                              f'bands ({rasterReader.bandCount()})'
+                    feedback.reportError(message, fatalError=True)
+                    raise QgsProcessingException(message)
+                bandList = goodBandList
+
+            if robustFusion:
+                functionIndices = [AggregateRastersAlgorithm.MedianFunction,
+                                   AggregateRastersAlgorithm.InterquartileRangeFunction]
             else:
-                filename2 = filename
-
-            alg = TranslateRasterAlgorithm()
-            parameters = {
-                alg.P_RASTER: filename2,
-                alg.P_OUTPUT_RASTER: filenameFraction
-            }
-            self.runAlg(alg, parameters, None, feedback2, context, True)
-            ds = gdal.Open(filenameFraction)
-
-            writer = RasterWriter(ds)
-            for bandNo, category in enumerate(categories, 1):
-                writer.setBandName(category.name, bandNo)
-                writer.setBandColor(QColor(category.color), bandNo)
-            writer.close()
-            # prepare variation results
+                functionIndices = [AggregateRastersAlgorithm.ArithmeticMeanFunction,
+                                   AggregateRastersAlgorithm.StandardDeviationFunction]
+
+            noDataValue = Utils.defaultNoDataValue(np.float32)
+            fractionNoDataValue = -1. if sumToOne else noDataValue
+            writers = [Driver(filenameFraction, feedback=feedback).createLike(
+                rasterReader, Qgis.DataType.Float32, len(categories)
+            )]
             if filenameVariation is not None:
-                feedback.pushInfo('Prepare variation layer')
-                filename = Utils.tmpFilename(filenameFraction, 'variation.vrt')
-                alg = StackRasterLayersAlgorithm()
-                parameters = {
-                    alg.P_RASTERS: filenames,
-                    alg.P_BAND: 2,
-                    alg.P_OUTPUT_RASTER: filename
-                }
-                self.runAlg(alg, parameters, None, feedback2, context, True)
-
-                alg = TranslateRasterAlgorithm()
-                parameters = {
-                    alg.P_RASTER: filename,
-                    alg.P_OUTPUT_RASTER: filenameVariation
-                }
-                self.runAlg(alg, parameters, None, feedback2, context, True)
-                ds = gdal.Open(filenameVariation)
-
-                writer = RasterWriter(ds)
+                writers.append(Driver(filenameVariation, feedback=feedback).createLike(
+                    rasterReader, Qgis.DataType.Float32, len(categories)
+                ))
+
+            planner = MemoryPlanner(executor.maximumBlockMemoryUsage(maximumMemoryUsage), feedback)
+            planner.addReader(rasterReader, bandList, 'features')
+            planner.addMask()
+            planner.add('ensemble predictions', ensembleSize + 2, np.float32)
+            planner.add('fractions and variations', 2 * len(categories), np.float32)  # computed even if not written
+            blockSizeX, blockSizeY = planner.blockSize(rasterReader, writers)
+
+            def read(block):
+                arrayX = rasterReader.arrayFromBlock(block, bandList)
+                valid = rasterReader.maskArrayAllBands(arrayX, bandList)
+                return arrayX, valid
+
+            def write(block, outarrays):
+                for writer, outarray in zip(writers, outarrays):
+                    for bandNo, array in enumerate(outarray, 1):
+                        writer.writeArray2d(array, bandNo, xOffset=block.xOffset, yOffset=block.yOffset)
+                feedback.setProgress(50 + (block.yOffset + block.height) / rasterReader.height() * 50)
+                if feedback.isCanceled():
+                    raise QgsProcessingException()
+
+            engines = [[PredictionEngine(regressor.predict) for regressor in regressors[category.name]]
+                       for category in categories]
+            process = partial(
+                predictEnsembleBlock, engines, functionIndices, sumToOne, noDataValue, fractionNoDataValue
+            )
+            executor.run(rasterReader.walkGrid(blockSizeX, blockSizeY), read, process, write)
+
+            for writer, writerNoDataValue in zip(writers, [fractionNoDataValue, noDataValue]):
                 for bandNo, category in enumerate(categories, 1):
                     writer.setBandName(category.name, bandNo)
                     writer.setBandColor(QColor(category.color), bandNo)
+                writer.setNoDataValue(writerNoDataValue)
                 writer.close()
 
             # prepare classification result
@@ -291,3 +247,36 @@ class RegressionBasedUnmixingAlgorithm(EnMAPProcessingAlgorithm):
             self.toc(feedback, result)
 
         return result
+
+
+def fitEnsembleMember(member, data):
+    regressor, X, y = data
+    try:
+        regressor.fit(X, y.ravel(), log_cout=StringIO(), log_cerr=StringIO())  # fixes issue #790
+    except Exception:
+        regressor.fit(X, y.ravel())
+    return regressor
+
+
+def predictEnsembleBlock(
+        engines: List[List[PredictionEngine]], functionIndices: List[int], sumToOne: bool, noDataValue: float,
+        fractionNoDataValue: float, block, data
+) -> List[np.ndarray]:
+    arrayX, valid = data
+    fraction = np.full((len(engines), *valid.shape), np.nan, np.float32)
+    variation = np.full((len(engines), *valid.shape), np.nan, np.float32)
+    for i, categoryEngines in enumerate(engines):
+        stack = np.full((len(categoryEngines), 1, *valid.shape), np.nan, np.float32)
+        for engine, arrayY in zip(categoryEngines, stack):
+            engine.predict(arrayX, valid, arrayY)
+        fraction[i], variation[i] = AggregateRastersAlgorithm.aggregateArray(stack[:, 0], functionIndices)
+
+    if sumToOne:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction /= np.sum(fraction, axis=0)
+    invalid = np.logical_not(valid)
+    fraction[:, invalid] = fractionNoDataValue
+    variation[:, invalid] = noDataValue
+    fraction[np.isnan(fraction)] = fractionNoDataValue
+    variation[np.isnan(variation)] = noDataValue
+    return [fraction, variation]
@@ -1,21 +1,20 @@
-from typing import Dict, Any, List, Tuple
+from math import ceil, floor
+from os.path import splitext
+from typing import Dict, Any, List, Tuple, Optional
 
 import numpy as np
+from osgeo import gdal, ogr
 
-import processing
 from enmapbox.typeguard import typechecked
-from enmapboxprocessing.algorithm.creategridalgorithm import CreateGridAlgorithm
-from enmapboxprocessing.algorithm.rasterizevectoralgorithm import RasterizeVectorAlgorithm
-from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group, AlgorithmCanceledException
 from enmapboxprocessing.processingfeedback import ProcessingFeedback
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.utils import Utils
 from qgis.PyQt.QtCore import QVariant
 from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, QgsVectorLayer, QgsRasterLayer,
-                       QgsFeature, QgsField, QgsProcessingFeatureSourceDefinition, QgsApplication,
-                       QgsVectorDataProvider, QgsRasterDataProvider, QgsPoint)
-from qgis.core.additions.edit import edit
+                       QgsFeature, QgsField, QgsFields, QgsGeometry, QgsVectorDataProvider, QgsPointXY,
+                       QgsRectangle, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject,
+                       QgsVectorFileWriter, QgsWkbTypes)
 
 
 @typechecked
@@ -96,46 +95,79 @@ class SampleRasterValuesAlgorithm(EnMAPProcessingAlgorithm):
             context: QgsProcessingContext
     ):
         assert Utils.isPointGeometry(vector.geometryType())
-        alg = 'qgis:rastersampling'
-        parameters = {
-            'COLUMN_PREFIX': 'SAMPLE_',
-            'INPUT': QgsProcessingFeatureSourceDefinition(vector.source(), selectedFeaturesOnly),
-            'OUTPUT': filename,
-            'RASTERCOPY': raster
-        }
-        processing.run(alg, parameters, None, feedback2, context, True)
-        sample = QgsVectorLayer(filename)
-
-        # add image X, Y coordinates and find no data pixel
-        rasterProvider = raster.dataProvider()
-        vectorProvider: QgsVectorDataProvider = sample.dataProvider()
-        fields = [QgsField('PIXEL_X', QVariant.LongLong), QgsField('PIXEL_Y', QVariant.LongLong)]
-        vectorProvider.addAttributes(fields)
-        sample.updateFields()
-        noDataPixels = list()
-        dataFields = [i for i, field in enumerate(sample.fields()) if field.name().startswith('SAMPLE_')]
-        with edit(sample):
-            feature: QgsFeature
-            for feature in sample.getFeatures():
-                if feature.geometry().isNull():
-                    continue
-                point = QgsPoint(feature.geometry().asPoint())
-                assert isinstance(point, QgsPoint)
-                imagePoint: QgsPoint = rasterProvider.transformCoordinates(
-                    point, QgsRasterDataProvider.TransformLayerToImage
-                )
-                feature.setAttribute('PIXEL_X', imagePoint.x())
-                feature.setAttribute('PIXEL_Y', imagePoint.y())
-                sample.updateFeature(feature)
 
-                if skipNoDataPixel:
-                    if np.all(np.equal(np.asarray(feature.attributes())[dataFields], None)):
-                        noDataPixels.append(feature.id())
+        reader = RasterReader(raster)
+        fields = QgsFields()
+        for field in vector.fields():
+            fields.append(QgsField(field))
+        for field in cls.sampleFields(reader):
+            fields.append(field)
+
+        if selectedFeaturesOnly:
+            pointFeatures = list(vector.getSelectedFeatures())
+        else:
+            pointFeatures = list(vector.getFeatures())
+
+        # transform all point locations into pixel indices at once
+        toRaster = QgsCoordinateTransform(vector.crs(), raster.crs(), QgsProject.instance())
+        coordinates = np.full((len(pointFeatures), 2), np.nan)
+        pointFeature: QgsFeature
+        for i, pointFeature in enumerate(pointFeatures):
+            if pointFeature.geometry().isNull():
+                continue
+            point = QgsPointXY(pointFeature.geometry().vertexAt(0))
+            if vector.crs() != raster.crs():
+                point = toRaster.transform(point)
+            coordinates[i] = point.x(), point.y()
+        extent = reader.extent()
+        with np.errstate(invalid='ignore'):
+            xIndices = np.floor((coordinates[:, 0] - extent.xMinimum()) / reader.rasterUnitsPerPixelX())
+            yIndices = np.floor((extent.yMaximum() - coordinates[:, 1]) / reader.rasterUnitsPerPixelY())
+            inside = (xIndices >= 0) & (xIndices < reader.width()) & (yIndices >= 0) & (yIndices < reader.height())
 
-        if skipNoDataPixel:
-            sample.dataProvider().deleteFeatures(noDataPixels)
+        if feedback.isCanceled():
+            raise AlgorithmCanceledException()
 
-        return sample
+        # read each raster block containing points once, for all bands
+        values = np.full((reader.bandCount(), len(pointFeatures)), None, object)
+        indices = np.flatnonzero(inside)
+        xIndicesInside = xIndices[indices].astype(np.int64)
+        yIndicesInside = yIndices[indices].astype(np.int64)
+        blockSizeX, blockSizeY = reader.gridBlockSize(reader.bandCount() * reader.dataTypeSize())
+        blockIds = (yIndicesInside // blockSizeY) * reader.width() + xIndicesInside // blockSizeX
+        order = np.argsort(blockIds, kind='stable')
+        blockIdsSorted = blockIds[order]
+        starts = np.flatnonzero(np.diff(blockIdsSorted, prepend=-1))
+        stops = np.append(starts[1:], len(order))
+        for i, (start, stop) in enumerate(zip(starts, stops)):
+            if feedback.isCanceled():
+                raise AlgorithmCanceledException()
+            feedback.setProgress(i / len(starts) * 100)
+            members = order[start:stop]
+            xMember = xIndicesInside[members]
+            yMember = yIndicesInside[members]
+            xOffset, yOffset = int(xMember.min()), int(yMember.min())
+            width, height = int(xMember.max()) - xOffset + 1, int(yMember.max()) - yOffset + 1
+            array = np.asarray(reader.arrayFromPixelOffsetAndSize(xOffset, yOffset, width, height))
+            maskArray = np.asarray(reader.maskArray(array))
+            array = array[:, yMember - yOffset, xMember - xOffset]
+            maskArray = maskArray[:, yMember - yOffset, xMember - xOffset]
+            values[:, indices[members]] = np.where(maskArray, array, None)
+
+        # write the attribute table in one batch
+        features = list()
+        for pointFeature, sample, pixelX, pixelY in zip(
+                pointFeatures, values.T.tolist(), xIndices.tolist(), yIndices.tolist()
+        ):
+            if skipNoDataPixel and all(value is None for value in sample):
+                continue
+            feature = QgsFeature(fields)
+            feature.setGeometry(pointFeature.geometry())
+            pixel = [int(pixelX), int(pixelY)] if pointFeature.hasGeometry() else [None, None]
+            feature.setAttributes(pointFeature.attributes() + sample + pixel)
+            features.append(feature)
+
+        return cls.writePoints(filename, vector.crs(), fields, features, vector.wkbType())
 
     @classmethod
     def samplePolygons(
@@ -145,114 +177,168 @@ class SampleRasterValuesAlgorithm(EnMAPProcessingAlgorithm):
     ):
         assert Utils.isPolygonGeometry(vector.geometryType())
 
-        # create oversampling grid
-        alg = CreateGridAlgorithm()
-        alg.initAlgorithm()
-        parameters = {
-            alg.P_CRS: raster.crs(),
-            alg.P_EXTENT: raster.extent(),
-            alg.P_UNIT: alg.PixelUnits,
-            alg.P_WIDTH: raster.width() * 10,
-            alg.P_HEIGHT: raster.height() * 10,
-            alg.P_OUTPUT_GRID: Utils.tmpFilename(filename, 'grid.x10.vrt')
-        }
-        result = processing.run(alg, parameters, None, feedback2, context, True)
-        x10Grid = QgsRasterLayer(result[alg.P_OUTPUT_GRID])
-
-        if feedback.isCanceled():
-            raise AlgorithmCanceledException()
-
-        feedback.pushInfo('Rasterize polygon IDs at x10 finer resolution')
-        alg = RasterizeVectorAlgorithm()
-        alg.initAlgorithm()
-        parameters = {
-            alg.P_VECTOR: vector,
-            alg.P_GRID: x10Grid,
-            alg.P_BURN_FID: True,
-            alg.P_OUTPUT_RASTER: Utils.tmpFilename(filename, 'fid.x10.tif'),
-        }
-        result = processing.run(alg, parameters, None, feedback2, context, True)
-        x10FidArray = RasterReader(result[alg.P_OUTPUT_RASTER]).array()[0]
-
-        sampleVectors = list()
+        reader = RasterReader(raster)
+        polygonFields = [field for field in vector.fields() if field.name() not in ['fid', 'temp_fid']]
+        polygonFieldIndices = [vector.fields().indexOf(field.name()) for field in polygonFields]
+        fields = QgsFields()
+        fields.append(QgsField('COVER', QVariant.Double))
+        for field in polygonFields:
+            fields.append(QgsField(field))
+        for field in cls.sampleFields(reader):
+            fields.append(field)
+
+        toRaster = QgsCoordinateTransform(vector.crs(), raster.crs(), QgsProject.instance())
+        toVector = QgsCoordinateTransform(raster.crs(), vector.crs(), QgsProject.instance())
+        if selectedFeaturesOnly:
+            polygonFeatures = vector.getSelectedFeatures()
+            n = vector.selectedFeatureCount()
+        else:
+            polygonFeatures = vector.getFeatures()
+            n = vector.featureCount()
+
+        features = list()
         polygonFeature: QgsFeature
-        refs = list()  # don't loose your C refs!
-        n = vector.featureCount()
-        for i, polygonFeature in enumerate(vector.getFeatures()):
-
-            if feedback.isCanceled():
-                raise AlgorithmCanceledException()
-
-            feedback.pushInfo(f'Sample polygon [{i + 1}/{n}]')
-
-            fid = polygonFeature.id()
-            # calculate coverage
-            x10MaskArray = x10FidArray == fid
-            percentArray = x10MaskArray.reshape((raster.height(), 10, raster.width(), 10)).sum(axis=3).sum(axis=1)
-            # mask coverage outside valid range
-            if coverageMin != 0:
-                percentArray[percentArray < coverageMin] = 0
-            if coverageMax != 100:
-                percentArray[percentArray > coverageMax] = 0
-
-            driver = Driver(Utils.tmpFilename(filename, f'cover{fid}.tif'), feedback=feedback2)
-            coverRaster = driver.createFromArray([percentArray], raster.extent(), raster.crs())
-            coverRaster.setNoDataValue(0)
-            coverRaster.close()
+        for i, polygonFeature in enumerate(polygonFeatures):
 
             if feedback.isCanceled():
                 raise AlgorithmCanceledException()
+            feedback.setProgress(i / max(n, 1) * 100)
+
+            if polygonFeature.geometry().isNull():
+                continue
+            geometry = QgsGeometry(polygonFeature.geometry())
+            if vector.crs() != raster.crs():
+                geometry.transform(toRaster)
+
+            # rasterize polygon at x10 finer resolution, but only inside the pixel window covering the polygon
+            window = cls.pixelWindow(reader, geometry.boundingBox())
+            if window is None:
+                continue
+            xOffset, yOffset, width, height = window
+            percentArray = cls.polygonCoverage(reader, geometry, xOffset, yOffset, width, height)
+
+            # select pixel inside the coverage range
+            valid = np.logical_and(percentArray > 0, percentArray >= coverageMin)
+            valid = np.logical_and(valid, percentArray <= coverageMax)
+            if not np.any(valid):
+                continue
+
+            # read all bands of the window at once
+            array = np.asarray(reader.arrayFromPixelOffsetAndSize(xOffset, yOffset, width, height))
+            maskArray = np.asarray(reader.maskArray(array))
+            if skipNoDataPixel:
+                valid = np.logical_and(valid, np.any(maskArray, axis=0))
+            yIndices, xIndices = np.where(valid)
+            values = np.where(maskArray[:, yIndices, xIndices], array[:, yIndices, xIndices], None)
+
+            polygonAttributes = [polygonFeature.attribute(index) for index in polygonFieldIndices]
+            features.extend(cls.pointFeatures(
+                reader, fields, xOffset + xIndices, yOffset + yIndices, values,
+                [[float(cover)] + polygonAttributes for cover in percentArray[yIndices, xIndices]], toVector
+            ))
 
-            # create sample locations with cover > 0%
-            alg = QgsApplication.processingRegistry().createAlgorithmById('native:pixelstopoints')
-            parameters = {
-                'FIELD_NAME': 'COVER',
-                'INPUT_RASTER': coverRaster.source(),
-                'OUTPUT': Utils.tmpFilename(filename, f'locations{fid}.gpkg'),
-                'RASTER_BAND': 1
-            }
-            result = processing.run(alg, parameters, None, feedback2, context, True)
-            locationVector = QgsVectorLayer(result['OUTPUT'])
-            refs.append(locationVector)
-            nFields = locationVector.fields().count()
+        if feedback.isCanceled():
+            raise AlgorithmCanceledException()
 
-            if feedback.isCanceled():
-                raise AlgorithmCanceledException()
+        return cls.writePoints(filename, vector.crs(), fields, features)
 
-            # add polygon attributes to each point (extremly redundant, but we want all data in one table)
-            provider: QgsVectorDataProvider = locationVector.dataProvider()
-            fields = [QgsField(field) for field in vector.fields()
-                      if field.name() not in ['fid', 'temp_fid']]
-            refs.append(fields)
-            provider.addAttributes(fields)
-            locationVector.updateFields()
-
-            polygonFeatureAttributes = [value for field, value in zip(vector.fields(), polygonFeature.attributes())
-                                        if field.name() not in ['fid', 'temp_fid']]
-            with edit(locationVector):
-                pointFeature: QgsFeature
-                for pointFeature in locationVector.getFeatures():
-                    values = [pointFeature.attribute(i) for i in range(nFields)] + polygonFeatureAttributes
-                    pointFeature.setAttributes(values)
-                    locationVector.updateFeature(pointFeature)
+    @classmethod
+    def sampleFields(cls, reader: RasterReader) -> List[QgsField]:
+        """Return the sample value fields, followed by the pixel location fields."""
+        fields = list()
+        for bandNo in range(1, reader.bandCount() + 1):
+            try:
+                isInteger = np.issubdtype(Utils.qgisDataTypeToNumpyDataType(reader.dataType(bandNo)), np.integer)
+            except Exception:
+                isInteger = False
+            fields.append(QgsField(f'SAMPLE_{bandNo}', QVariant.LongLong if isInteger else QVariant.Double))
+        fields.append(QgsField('PIXEL_X', QVariant.LongLong))
+        fields.append(QgsField('PIXEL_Y', QVariant.LongLong))
+        return fields
 
-            if feedback.isCanceled():
-                raise AlgorithmCanceledException()
+    @classmethod
+    def pixelWindow(cls, reader: RasterReader, boundingBox: QgsRectangle) -> Optional[Tuple[int, int, int, int]]:
+        """Return the pixel offset and size of the window covering the bounding box, clipped to the raster."""
+        extent = reader.extent()
+        xres = reader.rasterUnitsPerPixelX()
+        yres = reader.rasterUnitsPerPixelY()
+        x1 = max(int(floor((boundingBox.xMinimum() - extent.xMinimum()) / xres)), 0)
+        x2 = min(int(ceil((boundingBox.xMaximum() - extent.xMinimum()) / xres)), reader.width())
+        y1 = max(int(floor((extent.yMaximum() - boundingBox.yMaximum()) / yres)), 0)
+        y2 = min(int(ceil((extent.yMaximum() - boundingBox.yMinimum()) / yres)), reader.height())
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return x1, y1, x2 - x1, y2 - y1
 
-            sampleVector = cls.samplePoints(
-                Utils.tmpFilename(filename, f'sample{fid}.gpkg'), raster, locationVector, selectedFeaturesOnly,
-                skipNoDataPixel, feedback, feedback2, context
-            )
-            sampleVectors.append(sampleVector)
+    @classmethod
+    def polygonCoverage(
+            cls, reader: RasterReader, geometry: QgsGeometry, xOffset: int, yOffset: int, width: int, height: int
+    ) -> np.ndarray:
+        """Return pixel coverage (%) of the polygon inside the given pixel window."""
+        extent = reader.extent()
+        xres = reader.rasterUnitsPerPixelX()
+        yres = reader.rasterUnitsPerPixelY()
+
+        # rasterize at x10 finer resolution into an in-memory dataset
+        dataset: gdal.Dataset = gdal.GetDriverByName('MEM').Create('', width * 10, height * 10, 1, gdal.GDT_Byte)
+        dataset.SetGeoTransform(
+            (extent.xMinimum() + xOffset * xres, xres / 10, 0, extent.yMaximum() - yOffset * yres, 0, -yres / 10)
+        )
+        ogrDataSource = ogr.GetDriverByName('Memory').CreateDataSource('')
+        ogrLayer = ogrDataSource.CreateLayer('polygon', geom_type=ogr.wkbUnknown)
+        ogrFeature = ogr.Feature(ogrLayer.GetLayerDefn())
+        ogrFeature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geometry.asWkb())))
+        ogrLayer.CreateFeature(ogrFeature)
+        gdal.RasterizeLayer(dataset, [1], ogrLayer, burn_values=[1])
+        x10MaskArray = dataset.ReadAsArray()
+
+        percentArray = x10MaskArray.reshape((height, 10, width, 10)).sum(axis=3, dtype=np.int32).sum(axis=1)
+        return percentArray
 
-        if feedback.isCanceled():
-            raise AlgorithmCanceledException()
+    @classmethod
+    def pointFeatures(
+            cls, reader: RasterReader, fields: QgsFields, xIndices: np.ndarray, yIndices: np.ndarray,
+            values: np.ndarray, attributes: List[List[Any]], transform: QgsCoordinateTransform
+    ) -> List[QgsFeature]:
+        """Return point features located at the given pixel centers, with leading attributes, values and pixel."""
+        extent = reader.extent()
+        xCoordinates = extent.xMinimum() + (xIndices + 0.5) * reader.rasterUnitsPerPixelX()
+        yCoordinates = extent.yMaximum() - (yIndices + 0.5) * reader.rasterUnitsPerPixelY()
+        isIdentity = transform.sourceCrs() == transform.destinationCrs()
+        features = list()
+        for x, y, pixelX, pixelY, sample, leadingAttributes in zip(
+                xCoordinates.tolist(), yCoordinates.tolist(), xIndices.tolist(), yIndices.tolist(), values.T.tolist(),
+                attributes
+        ):
+            point = QgsPointXY(x, y)
+            if not isIdentity:
+                point = transform.transform(point)
+            feature = QgsFeature(fields)
+            feature.setGeometry(QgsGeometry.fromPointXY(point))
+            feature.setAttributes(leadingAttributes + sample + [pixelX, pixelY])
+            features.append(feature)
+        return features
 
-        # merge all samples
-        alg = QgsApplication.processingRegistry().createAlgorithmById('native:mergevectorlayers')
-        parameters = {
-            'LAYERS': sampleVectors,
-            'CRS': vector.crs(),
-            'OUTPUT': filename
-        }
-        processing.run(alg, parameters, None, feedback, context, True)
+    @classmethod
+    def writePoints(
+            cls, filename: str, crs: QgsCoordinateReferenceSystem, fields: QgsFields, features: List[QgsFeature],
+            wkbType: QgsWkbTypes.Type = QgsWkbTypes.Point
+    ) -> QgsVectorLayer:
+        """Write all point features at once."""
+        layer = QgsVectorLayer(QgsWkbTypes.displayString(wkbType), 'sample', 'memory')
+        layer.setCrs(crs)
+        provider: QgsVectorDataProvider = layer.dataProvider()
+        provider.addAttributes(fields.toList())
+        layer.updateFields()
+        provider.addFeatures(features)
+        layer.updateExtents()
+
+        saveVectorOptions = QgsVectorFileWriter.SaveVectorOptions()
+        saveVectorOptions.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
+        saveVectorOptions.driverName = QgsVectorFileWriter.driverForExtension(splitext(filename)[1])
+        transformContext = QgsProject.instance().transformContext()
+        error, message, newFilename, newLayer = QgsVectorFileWriter.writeAsVectorFormatV3(
+            layer, filename, transformContext, saveVectorOptions
+        )
+        assert error == QgsVectorFileWriter.NoError, f'Fail error {error}:{message}'
+        return QgsVectorLayer(filename)
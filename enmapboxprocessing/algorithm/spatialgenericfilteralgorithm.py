@@ -33,3 +33,6 @@ class SpatialGenericAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: generic_filter(array, function=filter_function, size=3)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 window
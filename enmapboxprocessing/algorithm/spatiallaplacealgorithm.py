@@ -28,3 +28,6 @@ class SpatialLaplaceAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: laplace(array)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 kernel
@@ -27,3 +27,6 @@ class SpatialMaximumAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: maximum_filter(array, size=3)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 window
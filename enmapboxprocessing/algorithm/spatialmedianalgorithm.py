@@ -27,3 +27,6 @@ class SpatialMedianAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: median_filter(array, size=3)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 window
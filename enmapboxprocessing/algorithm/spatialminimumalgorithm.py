@@ -27,3 +27,6 @@ class SpatialMinimumAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: minimum_filter(array, size=3)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 window
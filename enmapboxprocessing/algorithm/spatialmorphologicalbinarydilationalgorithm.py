@@ -35,3 +35,6 @@ class SpatialMorphologicalBinaryDilationAlgorithm(SpatialFilterFunctionAlgorithm
         structure = iterate_structure(structure=structure, iterations=1)
         function = lambda array: binary_dilation(array, structure=structure, iterations=1)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 structure
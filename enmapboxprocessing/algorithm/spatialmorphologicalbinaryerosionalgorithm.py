@@ -35,3 +35,6 @@ class SpatialMorphologicalBinaryErosionAlgorithm(SpatialFilterFunctionAlgorithmB
         structure = iterate_structure(structure=structure, iterations=1)
         function = lambda array: binary_erosion(array, structure=structure, iterations=1)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 structure
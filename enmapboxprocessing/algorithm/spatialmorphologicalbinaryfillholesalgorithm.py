@@ -1,3 +1,5 @@
+from typing import Optional
+
 from enmapboxprocessing.algorithm.spatialfilterfunctionalgorithmbase import SpatialFilterFunctionAlgorithmBase
 from enmapboxprocessing.enmapalgorithm import Group
 from enmapbox.typeguard import typechecked
@@ -34,3 +36,6 @@ class SpatialMorphologicalBinaryFillHolesAlgorithm(SpatialFilterFunctionAlgorith
         structure = iterate_structure(structure=structure, iterations=1)
         function = lambda array: binary_fill_holes(array, structure=structure)
         return function
+
+    def overlap(self) -> Optional[int]:
+        return None  # holes may be arbitrarily large, so whole bands are needed
@@ -35,3 +35,6 @@ class SpatialMorphologicalBinaryOpeningAlgorithm(SpatialFilterFunctionAlgorithmB
         structure = iterate_structure(structure=structure, iterations=1)
         function = lambda array: binary_opening(array, structure=structure, iterations=1)
         return function
+
+    def overlap(self) -> int:
+        return 2  # erosion followed by dilation with a 3x3 structure
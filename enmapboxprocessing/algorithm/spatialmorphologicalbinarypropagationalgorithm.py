@@ -1,3 +1,5 @@
+from typing import Optional
+
 from enmapboxprocessing.algorithm.spatialfilterfunctionalgorithmbase import SpatialFilterFunctionAlgorithmBase
 from enmapboxprocessing.enmapalgorithm import Group
 from enmapbox.typeguard import typechecked
@@ -35,3 +37,6 @@ class SpatialMorphologicalBinaryPropagationAlgorithm(SpatialFilterFunctionAlgori
         function = lambda array: binary_propagation(array, structure=structure)
 
         return function
+
+    def overlap(self) -> Optional[int]:
+        return None  # propagation may reach arbitrarily far, so whole bands are needed
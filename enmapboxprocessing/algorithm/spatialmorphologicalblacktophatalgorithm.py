@@ -35,3 +35,6 @@ class SpatialMorphologicalBlackTophatAlgorithm(SpatialFilterFunctionAlgorithmBas
         structure = iterate_structure(structure=structure, iterations=1)
         function = lambda array: black_tophat(array, structure=structure)
         return function
+
+    def overlap(self) -> int:
+        return 2  # closing with a 3x3 structure
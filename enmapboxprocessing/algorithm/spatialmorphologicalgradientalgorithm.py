@@ -36,3 +36,6 @@ class SpatialMorphologicalGradientAlgorithm(SpatialFilterFunctionAlgorithmBase):
         structure = iterate_structure(structure=structure, iterations=1)
         function = lambda array: morphological_gradient(array, structure=structure)
         return function
+
+    def overlap(self) -> int:
+        return 1  # dilation and erosion with a 3x3 structure
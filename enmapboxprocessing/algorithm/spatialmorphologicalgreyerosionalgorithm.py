@@ -35,3 +35,6 @@ class SpatialMorphologicalGreyErosionAlgorithm(SpatialFilterFunctionAlgorithmBas
         structure = iterate_structure(structure=structure, iterations=1)
         function = lambda array: grey_erosion(array, structure=structure)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 structure
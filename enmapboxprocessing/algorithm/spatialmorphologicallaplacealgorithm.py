@@ -29,3 +29,6 @@ class SpatialMorphologicalLaplaceAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: morphological_laplace(array, size=(3, 3))
         return function
+
+    def overlap(self) -> int:
+        return 1  # dilation and erosion with a 3x3 window
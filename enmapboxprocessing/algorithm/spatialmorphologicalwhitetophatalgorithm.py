@@ -28,3 +28,6 @@ class SpatialMorphologicalWhiteTophatAlgorithm(SpatialFilterFunctionAlgorithmBas
 
         function = lambda array: white_tophat(array, size=(3, 3))
         return function
+
+    def overlap(self) -> int:
+        return 2  # opening with a 3x3 window
@@ -27,3 +27,6 @@ class SpatialPercentileAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: percentile_filter(array, percentile=50, size=3)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 window
@@ -28,3 +28,6 @@ class SpatialPrewittAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: prewitt(array, axis=0)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 kernel
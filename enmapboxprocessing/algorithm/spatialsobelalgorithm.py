@@ -28,3 +28,6 @@ class SpatialSobelAlgorithm(SpatialFilterFunctionAlgorithmBase):
 
         function = lambda array: sobel(array, axis=0)
         return function
+
+    def overlap(self) -> int:
+        return 1  # 3x3 kernel
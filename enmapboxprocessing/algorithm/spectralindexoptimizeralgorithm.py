@@ -1,3 +1,4 @@
+from functools import partial
 from math import nan
 from typing import Dict, Any, List, Tuple
 
@@ -5,6 +6,7 @@ import numpy as np
 from qgis.core import QgsProcessingContext, QgsProcessingFeedback
 
 from enmapbox.typeguard import typechecked
+from enmapboxprocessing.blockexecutor import BlockExecutor
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
 from enmapboxprocessing.typing import RegressorDump
@@ -19,8 +21,12 @@ class SpectralIndexOptimizerAlgorithm(EnMAPProcessingAlgorithm):
     P_F1, _F1 = 'f1', 'Fixed feature F1'
     P_F2, _F2 = 'f2', 'Fixed feature F2'
     P_F3, _F3 = 'f3', 'Fixed feature F3'
+    P_WORKER_COUNT, _WORKER_COUNT = 'workerCount', 'Number of workers'
+    P_USE_PROCESSES, _USE_PROCESSES = 'useProcesses', 'Use processes instead of threads'
     P_OUTPUT_MATRIX, _OUTPUT_MATRIX = 'outScoreMatrix', 'Output score matrix'
 
+    ChunkSize = 2 ** 22  # number of formula values (samples x feature pairs) evaluated at once
+
     @classmethod
     def displayName(cls) -> str:
         return 'Spectral Index Optimizer'
@@ -38,6 +44,9 @@ class SpectralIndexOptimizerAlgorithm(EnMAPProcessingAlgorithm):
             (self._F1, 'Specify to use a fixed feature F1 in the formula.'),
             (self._F2, 'Specify to use a fixed feature F2 in the formula.'),
             (self._F3, 'Specify to use a fixed feature F3 in the formula.'),
+            (self._WORKER_COUNT, 'Number of workers used for scoring chunks of feature pairs in parallel. '
+                                 'Use 1 for sequential processing and 0 for using all CPU cores.'),
+            (self._USE_PROCESSES, 'Whether to run the workers in separate processes instead of threads.'),
             (self._OUTPUT_MATRIX, self.RasterFileDestination)
         ]
 
@@ -51,20 +60,21 @@ class SpectralIndexOptimizerAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameterInt(self.P_F1, self._F1, None, True, 1, None, True)
         self.addParameterInt(self.P_F2, self._F2, None, True, 1, None, True)
         self.addParameterInt(self.P_F3, self._F3, None, True, 1, None, True)
+        self.addParameterInt(self.P_WORKER_COUNT, self._WORKER_COUNT, 1, True, 0, None, True)
+        self.addParameterBoolean(self.P_USE_PROCESSES, self._USE_PROCESSES, False, True, True)
         self.addParameterRasterDestination(self.P_OUTPUT_MATRIX, self._OUTPUT_MATRIX)
 
     def processAlgorithm(
             self, parameters: Dict[str, Any], context: QgsProcessingContext, feedback: QgsProcessingFeedback
     ) -> Dict[str, Any]:
-        from sklearn.linear_model import LinearRegression
-        from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
-
         filenameDataset = self.parameterAsFile(parameters, self.P_DATASET, context)
         formula = self.parameterAsString(parameters, self.P_FORMULA, context)
         maxFeatures = self.parameterAsInt(parameters, self.P_MAX_FEATURES, context)
         f1No = self.parameterAsInt(parameters, self.P_F1, context)
         f2No = self.parameterAsInt(parameters, self.P_F2, context)
         f3No = self.parameterAsInt(parameters, self.P_F3, context)
+        workerCount = self.parameterAsInt(parameters, self.P_WORKER_COUNT, context)
+        useProcesses = self.parameterAsBoolean(parameters, self.P_USE_PROCESSES, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_MATRIX, context)
 
         with open(filename + '.log', 'w') as logfile:
@@ -96,34 +106,25 @@ class SpectralIndexOptimizerAlgorithm(EnMAPProcessingAlgorithm):
                 feedback.pushInfo(f'{featureNo}: {feature}')
             nfeatures = len(features)
             ntargets = len(targets)
-            olsr = LinearRegression()
             nbands = ntargets * 3
             scores = np.full((nbands, nfeatures, nfeatures), nan)
-            for ai in range(nfeatures):
-                feedback.setProgress(ai / nfeatures * 100)
-                A = X[:, ai]
-                for bi in range(ai + 1, nfeatures):
-                    B = X[:, bi]
-                    for yi in range(ntargets):
-                        S = eval(formula, {'A': A, 'B': B, 'F1': F1, 'F2': F2, 'F3': F3})
-                        assert isinstance(S, np.ndarray)
-                        Y = y[:, yi].flatten()
-
-                        # formula may eval to not finite values
-                        valid = np.isfinite(S)
-                        S = S[valid]
-                        Y = Y[valid]
-
-                        S = S.reshape((-1, 1))
-                        olsr.fit(S, Y)
-                        yP = olsr.predict(S)
-
-                        rmse = mean_squared_error(Y, yP) ** 0.5
-                        mae = mean_absolute_error(Y, yP)
-                        r2 = r2_score(Y, yP)
-                        scores[yi * 3 + 0, ai, bi] = scores[yi * 3 + 0, bi, ai] = rmse
-                        scores[yi * 3 + 1, ai, bi] = scores[yi * 3 + 1, bi, ai] = mae
-                        scores[yi * 3 + 2, ai, bi] = scores[yi * 3 + 2, bi, ai] = r2
+
+            # score chunks of feature pairs at once
+            pairs = np.array(np.triu_indices(nfeatures, 1))
+            chunkSize = max(1, self.ChunkSize // len(X))
+            if not isElementwiseFormula(formula, X, (F1, F2, F3)):
+                feedback.pushInfo('Formula is not element-wise, evaluate feature pairs individually')
+                chunkSize = 1
+            chunks = [pairs[:, i:i + chunkSize] for i in range(0, pairs.shape[1], chunkSize)]
+
+            def write(chunk, chunkScores):
+                ai, bi = chunk
+                scores[:, ai, bi] = scores[:, bi, ai] = chunkScores
+                feedback.setProgress(ai[-1] / nfeatures * 100)
+
+            executor = BlockExecutor(workerCount, useProcesses)
+            process = partial(scoreFeaturePairs, formula, X, y, (F1, F2, F3))
+            executor.run(chunks, lambda chunk: None, process, write)
 
             bandNames = list()
             scoreNames = ['RMSE', 'MAE', 'R^2']
@@ -153,3 +154,58 @@ class SpectralIndexOptimizerAlgorithm(EnMAPProcessingAlgorithm):
             self.toc(feedback, result)
 
         return result
+
+
+def evaluateFormula(formula: str, X: np.ndarray, fixed: Tuple, ai: np.ndarray, bi: np.ndarray) -> np.ndarray:
+    """Evaluate the formula for the given feature pairs. Returns an array of shape (samples, pairs)."""
+    F1, F2, F3 = [None if F is None else F[:, None] for F in fixed]
+    S = eval(formula, {'A': X[:, ai], 'B': X[:, bi], 'F1': F1, 'F2': F2, 'F3': F3})
+    assert isinstance(S, np.ndarray)
+    return np.broadcast_to(S, (len(X), len(ai)))
+
+
+def isElementwiseFormula(formula: str, X: np.ndarray, fixed: Tuple) -> bool:
+    """Return whether evaluating the formula for many feature pairs at once, equals evaluating pairs individually."""
+    ai, bi = np.array([0, 0, 1]), np.array([1, X.shape[1] - 1, X.shape[1] - 1])
+    with np.errstate(all='ignore'):
+        S = evaluateFormula(formula, X, fixed, ai, bi)
+        S1 = [evaluateFormula(formula, X, fixed, ai[i:i + 1], bi[i:i + 1])[:, 0] for i in range(len(ai))]
+    return np.allclose(S, np.transpose(S1), equal_nan=True)
+
+
+def scoreFeaturePairs(formula: str, X: np.ndarray, y: np.ndarray, fixed: Tuple, chunk, data) -> np.ndarray:
+    """
+    Score the formula for a chunk of feature pairs.
+
+    For each pair and target, an univariate ordinary least squares regression is fitted in closed form,
+    while ignoring samples with not finite formula values.
+    Returns RMSE, MAE and R^2 scores of shape (targets * 3, pairs).
+    """
+    ai, bi = chunk
+    with np.errstate(all='ignore'):
+        S = evaluateFormula(formula, X, fixed, ai, bi).astype(np.float64)
+    scores = np.full((y.shape[1] * 3, len(ai)), nan)
+    for yi in range(y.shape[1]):
+        Y = y[:, yi].astype(np.float64)[:, None]
+        valid = np.logical_and(np.isfinite(S), np.isfinite(Y))  # formula may eval to not finite values
+        n = np.sum(valid, axis=0)
+        with np.errstate(all='ignore'):
+            meanS = np.sum(np.where(valid, S, 0), axis=0) / n
+            meanY = np.sum(np.where(valid, Y, 0), axis=0) / n
+            dS = np.where(valid, S - meanS, 0)
+            dY = np.where(valid, Y - meanY, 0)
+            sxx = np.sum(dS * dS, axis=0)
+            sxy = np.sum(dS * dY, axis=0)
+            syy = np.sum(dY * dY, axis=0)
+            slope = np.where(sxx > 0, sxy / sxx, 0.)  # constant formula values result in a constant model
+            residuals = dY - slope * dS
+            sse = np.sum(residuals * residuals, axis=0)
+            rmse = np.sqrt(sse / n)
+            mae = np.sum(np.abs(residuals), axis=0) / n
+            r2 = np.where(syy > 0, 1 - sse / syy, np.where(sse > 0, 0., 1.))
+        isEmpty = n == 0
+        rmse[isEmpty] = mae[isEmpty] = r2[isEmpty] = nan
+        scores[yi * 3 + 0] = rmse
+        scores[yi * 3 + 1] = mae
+        scores[yi * 3 + 2] = r2
+    return scores
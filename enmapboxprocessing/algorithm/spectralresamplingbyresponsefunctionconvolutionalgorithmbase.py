@@ -1,19 +1,20 @@
 import inspect
 from collections import OrderedDict
-from math import ceil, sqrt, pi, exp
+from math import sqrt, pi, exp
 from os.path import splitext
 from typing import Dict, Any, List, Tuple, Union
 from warnings import warn
 
 import numpy as np
-from osgeo import gdal
 
 from enmapbox.typeguard import typechecked
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
 from enmapboxprocessing.geojsonlibrarywriter import GeoJsonLibraryWriter
+from enmapboxprocessing.memoryplanner import MemoryPlanner
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import Array3d, Number
+from enmapboxprocessing.utils import Utils
 from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, QgsProcessingException)
 
 RESPONSE_CUTOFF_VALUE = 0.001
@@ -80,7 +81,7 @@ class SpectralResamplingByResponseFunctionConvolutionAlgorithmBase(EnMAPProcessi
         responses = self.parameterAsResponses(parameters, self.P_CODE, context)
         filenameSrf = self.parameterAsFileOutput(parameters, self.P_OUTPUT_LIBRARY, context)
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_RASTER, context)
-        maximumMemoryUsage = gdal.GetCacheMax()
+        maximumMemoryUsage = Utils.maximumMemoryUsage()
 
         with open(filename + '.log', 'w') as logfile:
             feedback, feedback2 = self.createLoggingFeedback(feedback, logfile)
@@ -122,22 +123,26 @@ class SpectralResamplingByResponseFunctionConvolutionAlgorithmBase(EnMAPProcessi
                     raise QgsProcessingException(message)
 
             reader = RasterReader(raster)
-            wavelength = [reader.wavelength(i + 1) for i in range(reader.bandCount())]
+            wavelength = reader.wavelengths().tolist()
             outputBandCount = len(responses)
             outputNoDataValue = reader.noDataValue()
             if outputNoDataValue is None:
                 outputNoDataValue = 0
 
             writer = Driver(filename, feedback=feedback).createLike(reader, reader.dataType(), outputBandCount)
-            lineMemoryUsage = reader.lineMemoryUsage() * 2
-            blockSizeY = min(raster.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-            blockSizeX = raster.width()
+            planner = MemoryPlanner(maximumMemoryUsage, feedback)
+            planner.addReader(reader)
+            planner.addMask(reader.bandCount())
+            planner.add('resampling', 2 * reader.bandCount(), np.float32)
+            planner.addWriter(writer)
+            blockSizeX, blockSizeY = planner.blockSize(reader, [writer])
+            weightMatrix = self.responseMatrix(wavelength, responses)
             isFirstBlock = True
             for block in reader.walkGrid(blockSizeX, blockSizeY, feedback):
                 array = reader.arrayFromBlock(block)
                 marray = reader.maskArray(array)
                 outarray = self.resampleData(
-                    array, marray, wavelength, responses, outputNoDataValue, feedback, isFirstBlock
+                    array, marray, wavelength, responses, outputNoDataValue, feedback, isFirstBlock, weightMatrix
                 )
                 writer.writeArray(outarray, block.xOffset, block.yOffset)
                 isFirstBlock = False
@@ -181,40 +186,74 @@ class SpectralResamplingByResponseFunctionConvolutionAlgorithmBase(EnMAPProcessi
         return result
 
     @staticmethod
-    def resampleData(
-            array: Array3d, marray: Array3d, wavelength: List, responses: Dict[str, List[Tuple[int, float]]],
-            noDataValue: float, feedback: QgsProcessingFeedback, isFirstBlock=True
-    ) -> Array3d:
+    def responseMatrix(wavelength: List, responses: Dict[str, List[Tuple[int, float]]]):
+        """Return response function weights as sparse matrix with shape (target bands, source bands)."""
+        from scipy.sparse import csr_matrix
+
         wavelength = [int(round(v)) for v in wavelength]
-        outarray = list()
-        for name in responses:
+        rows = list()
+        columns = list()
+        weights = list()
+        for row, name in enumerate(responses):
             weightsByWavelength = dict(responses[name])
-            indices = list()
-            weights = list()
-            for index, wl in enumerate(wavelength):
+            for column, wl in enumerate(wavelength):
                 weight = weightsByWavelength.get(wl)
                 if weight is not None:
-                    indices.append(index)
+                    rows.append(row)
+                    columns.append(column)
                     weights.append(weight)
-            if len(indices) == 0:
-                if isFirstBlock:
-                    message = f'no source bands ({min(wavelength)} to {max(wavelength)} nanometers) ' \
-                              f'are covert by target band "{name}" ' \
-                              f'({min(weightsByWavelength.keys())} to {max(weightsByWavelength.keys())} nanometers), ' \
-                              f'which will result in output band filled with no data values'
-                    warn(message)
-                    feedback.pushWarning(message)
-                outarray.append(np.full_like(array[0], noDataValue, dtype=array[0].dtype))
-            else:
-                tmparray = np.asarray(array, np.float32)[indices]
-                tmpmarray = np.asarray(marray)[indices]
-                warray = np.array(weights).reshape((-1, 1, 1)) * np.ones_like(tmparray)
-                for tmparr, warr, marr in zip(tmparray, warray, tmpmarray):
-                    invalid = np.logical_not(marr)
-                    tmparr[invalid] = np.nan
-                    warr[invalid] = np.nan
-                outarr = np.nansum(tmparray * warray, 0) / np.nansum(warray, 0)
-                outarr[np.isnan(outarr)] = noDataValue
-                outarray.append(outarr)
-
-        return outarray
+        return csr_matrix((weights, (rows, columns)), (len(responses), len(wavelength)), np.float64)
+
+    @classmethod
+    def resampleData(
+            cls, array: Array3d, marray: Array3d, wavelength: List, responses: Dict[str, List[Tuple[int, float]]],
+            noDataValue: float, feedback: QgsProcessingFeedback, isFirstBlock=True, weightMatrix=None
+    ) -> Array3d:
+        """
+        Resample the data as a single masked matrix product.
+
+        Each target band is the weighted average of all valid source bands covered by its response function.
+        Weights are renormalized per pixel, if source bands are masked.
+        Pass the weightMatrix derived by responseMatrix() to avoid recompiling the response functions for each block.
+        """
+        if weightMatrix is None:
+            weightMatrix = cls.responseMatrix(wavelength, responses)
+
+        if isFirstBlock:
+            isCovered = np.diff(weightMatrix.indptr) > 0
+            for name, covered in zip(responses, isCovered):
+                if covered:
+                    continue
+                weightsByWavelength = dict(responses[name])
+                message = f'no source bands ({round(min(wavelength))} to {round(max(wavelength))} nanometers) ' \
+                          f'are covert by target band "{name}" ' \
+                          f'({min(weightsByWavelength.keys())} to {max(weightsByWavelength.keys())} nanometers), ' \
+                          f'which will result in output band filled with no data values'
+                warn(message)
+                feedback.pushWarning(message)
+
+        # only source bands covered by any response function are needed
+        sourceIndices = np.unique(weightMatrix.indices)
+        weightMatrix = weightMatrix[:, sourceIndices]
+        shape = array[0].shape
+        size = array[0].size
+        X = np.empty((len(sourceIndices), size), np.float32)
+        M = np.empty((len(sourceIndices), size), np.float32)
+        isMasked = False
+        for i, index in enumerate(sourceIndices):
+            invalid = np.logical_not(marray[index]).reshape(-1)
+            np.copyto(X[i], array[index].reshape(-1))
+            np.copyto(X[i], 0, where=invalid)
+            np.logical_not(invalid, out=M[i], casting='unsafe')
+            isMasked = isMasked or bool(invalid.any())
+
+        numerator = weightMatrix @ X
+        if isMasked:
+            denominator = weightMatrix @ M
+        else:  # all pixels are valid, so no need for per-pixel renormalisation
+            denominator = np.asarray(weightMatrix.sum(axis=1)).reshape((-1, 1))
+        outarray = np.empty(numerator.shape, np.float32)  # float32 output, as declared in the memory plan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(numerator, denominator, out=outarray)
+        outarray[np.broadcast_to(denominator == 0, outarray.shape)] = noDataValue
+        return outarray.reshape((-1, *shape))
@@ -87,7 +87,7 @@ class SpectralResamplingByWavelengthAlgorithm(EnMAPProcessingAlgorithm):
                 try:
                     # handle raster case
                     reader = RasterReader(wavelengthFile)
-                    targetWavelengths = [reader.wavelength(bandNo) for bandNo in reader.bandNumbers()]
+                    targetWavelengths = reader.wavelengths().tolist()
                 except RuntimeError as error:
                     # handle ENVI Speclib case
                     if "GDAL does not support 'ENVI Spectral Library' type files." in str(error):
@@ -99,7 +99,7 @@ class SpectralResamplingByWavelengthAlgorithm(EnMAPProcessingAlgorithm):
                         raise ValueError(f'{wavelengthFile} not supported')
 
             reader = RasterReader(raster)
-            sourceWavelengths = np.array([reader.wavelength(i + 1) for i in range(reader.bandCount())])
+            sourceWavelengths = reader.wavelengths()
             minSourceWavelengths = sourceWavelengths.min()
             maxSourceWavelengths = sourceWavelengths.max()
             outputBandCount = len(targetWavelengths)
@@ -95,9 +95,9 @@ class SpectralResamplingByWavelengthAndFwhmAlgorithm(EnMAPProcessingAlgorithm):
                 try:
                     # handle raster case
                     reader = RasterReader(responseFile)
-                    wavelengths = [reader.wavelength(bandNo) for bandNo in reader.bandNumbers()]
+                    wavelengths = reader.wavelengths().tolist()
                     if fwhmValue is None:
-                        fwhms = [reader.fwhm(bandNo) for bandNo in reader.bandNumbers()]
+                        fwhms = reader.fwhms().tolist()
                     else:
                         fwhms = [fwhmValue] * len(wavelengths)
                 except RuntimeError as error:
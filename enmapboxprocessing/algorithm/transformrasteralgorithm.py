@@ -1,12 +1,11 @@
-from math import ceil
 from typing import Dict, Any, List, Tuple
 
 import numpy as np
-from osgeo import gdal
 
 from enmapbox.typeguard import typechecked
 from enmapboxprocessing.driver import Driver
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.memoryplanner import MemoryPlanner
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxprocessing.typing import TransformerDump
 from enmapboxprocessing.utils import Utils
@@ -59,14 +58,14 @@ class TransformRasterAlgorithm(EnMAPProcessingAlgorithm):
         matchByName = self.parameterAsBoolean(parameters, self.P_MATCH_BY_NAME, context)
         format, options = self.GTiffFormat, self.DefaultGTiffCreationOptions
         filename = self.parameterAsOutputLayer(parameters, self.P_OUTPUT_RASTER, context)
-        maximumMemoryUsage = gdal.GetCacheMax()
+        maximumMemoryUsage = Utils.maximumMemoryUsage()
 
         with open(filename + '.log', 'w') as logfile:
             feedback, feedback2 = self.createLoggingFeedback(feedback, logfile)
             self.tic(feedback, parameters, context)
 
             reader = RasterReader(raster)
-            bandNames = [reader.bandName(i + 1) for i in range(reader.bandCount())]
+            bandNames = reader.bandNames()
 
             # match transformer features with raster band names
             # match regressor features with raster band names
@@ -79,8 +78,7 @@ class TransformRasterAlgorithm(EnMAPProcessingAlgorithm):
 
             # ... if not possible, try to remove bad bands
             if bandList is None and len(bandNames) != len(dump.features):
-                goodBandList = [bandNo for bandNo in reader.bandNumbers()
-                                if reader.badBandMultiplier(bandNo) == 1]
+                goodBandList = [int(bandNo) for bandNo in np.flatnonzero(reader.badBandMultipliers() == 1) + 1]
                 if len(goodBandList) == len(dump.features):
                     bandList = goodBandList
 
@@ -107,12 +105,16 @@ class TransformRasterAlgorithm(EnMAPProcessingAlgorithm):
             # init result raster
             noDataValue = Utils.defaultNoDataValue(np.float32)
             writer = Driver(filename, feedback=feedback).createLike(reader, Qgis.Float32, bandCount)
-            lineMemoryUsage = reader.lineMemoryUsage() + reader.lineMemoryUsage(bandCount, 4)
-            blockSizeY = min(raster.height(), ceil(maximumMemoryUsage / lineMemoryUsage))
-            blockSizeX = raster.width()
+            planner = MemoryPlanner(maximumMemoryUsage, feedback)
+            planner.addReader(reader, bandList, 'features')
+            planner.addMask()
+            planner.add('feature matrix', X0.shape[1], np.float64)  # estimators usually work on float64
+            planner.add('transformation', bandCount, np.float64)
+            planner.addWriter(writer, 'transformed features')
+            blockSizeX, blockSizeY = planner.blockSize(reader, [writer])
             for block in reader.walkGrid(blockSizeX, blockSizeY, feedback):
                 arrayX = reader.arrayFromBlock(block, bandList)
-                valid = np.all(reader.maskArray(arrayX, bandList), axis=0)
+                valid = reader.maskArrayAllBands(arrayX, bandList)
                 X = list()
                 for a in arrayX:
                     X.append(a[valid])
@@ -233,7 +233,7 @@ class TranslateRasterAlgorithm(EnMAPProcessingAlgorithm):
                 if spectralBandList is None:
                     spectralBandList = [i + 1 for i in range(spectralRaster.bandCount())]
 
-                wavelength = np.array([reader.wavelength(bandNo) for bandNo in bandList])
+                wavelength = reader.wavelengths()[np.array(bandList) - 1]
 
                 bandList = list()
                 for targetBandNo in spectralBandList:
@@ -3,6 +3,7 @@ from typing import Dict, Any, List, Tuple
 from osgeo import gdal
 
 from enmapboxprocessing.enmapalgorithm import EnMAPProcessingAlgorithm, Group
+from enmapboxprocessing.fusedexpression import FusedExpression
 from enmapboxprocessing.parameter.processingparametercodeeditwidget import ProcessingParameterCodeEditWidgetWrapper
 from enmapboxprocessing.rasterwriter import RasterWriter
 from qgis.core import (QgsProcessingContext, QgsProcessingFeedback, QgsProcessingParameterString)
@@ -25,6 +26,12 @@ class VrtBandMathAlgorithm(EnMAPProcessingAlgorithm):
         'https://gdal.org/drivers/raster/vrt.html#using-derived-bands-with-pixel-functions-in-python',
         'VRT Python Pixel Function')
 
+    # optional numexpr import for pixel function code, see assignExpressionCode
+    NumexprImportCode = 'try:\n' \
+                        '    import numexpr\n' \
+                        'except ImportError:  # fall back to NumPy\n' \
+                        '    numexpr = None\n'
+
     def displayName(self) -> str:
         return 'VRT band math'
 
@@ -61,6 +68,22 @@ class VrtBandMathAlgorithm(EnMAPProcessingAlgorithm):
         self.addParameter(param)
         self.flagParameterAsAdvanced(name, advanced)
 
+    @staticmethod
+    def assignExpressionCode(identifier: str, expression: str, indent='    ') -> str:
+        """
+        Return pixel function code, that assigns the result of the expression to the identifier.
+
+        Pure element-wise expressions are evaluated in a single pass by numexpr,
+        if numexpr is available (see NumexprImportCode); all other expressions are evaluated by NumPy.
+        """
+        if not FusedExpression.isElementwise(expression):
+            return f'{indent}{identifier} = {expression}\n'
+        numexprExpression = FusedExpression(expression).numexprExpression
+        return f'{indent}if numexpr is None:\n' \
+               f'{indent}    {identifier} = {expression}\n' \
+               f'{indent}else:\n' \
+               f'{indent}    {identifier} = numexpr.evaluate({numexprExpression!r})\n'
+
     def initAlgorithm(self, configuration: Dict[str, Any] = None):
         self.addParameterRasterLayer(self.P_RASTER, self._RASTER)
         self.addParameterBandList(self.P_BAND_LIST, self._BAND_LIST, parentLayerParameterName=self.P_RASTER)
@@ -0,0 +1,102 @@
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from os import cpu_count
+from typing import Any, Callable, Deque, Iterable, Optional, Tuple
+
+from enmapbox.typeguard import typechecked
+
+# process function of the current worker process (see BlockExecutor.useProcesses)
+_workerProcessFunction: Optional[Callable] = None
+
+
+def _initializeWorkerProcess(processFunction: Callable):
+    global _workerProcessFunction
+    _workerProcessFunction = processFunction
+
+
+def _callWorkerProcessFunction(block: Any, data: Any) -> Any:
+    return _workerProcessFunction(block, data)
+
+
+@typechecked
+class BlockExecutor(object):
+    """
+    Overlap block reading, processing and writing.
+
+    Blocks are read sequentially inside the calling thread,
+    because GDAL datasets and QGIS data providers must not be shared between threads.
+    The processing of each block is delegated to a pool of workers,
+    while the results are handed to a single writer in the original block order.
+    At most queueSize blocks are in flight at any time, which limits the memory footprint.
+
+    With a workerCount of 1, blocks are processed sequentially without any pool.
+    With useProcesses=True, the process function is sent once to each worker process and must be picklable.
+    Threads are sufficient, if the process function spends most of its time inside NumPy or other code,
+    that releases the GIL.
+    """
+
+    def __init__(self, workerCount: int = None, useProcesses=False, queueSize: int = None):
+        if workerCount is None:
+            workerCount = 1
+        if workerCount == 0:
+            workerCount = cpu_count()
+        if workerCount < 0:
+            raise ValueError(f'invalid worker count: {workerCount}')
+        if queueSize is None:
+            queueSize = 2 * workerCount
+        self.workerCount = workerCount
+        self.useProcesses = useProcesses
+        self.queueSize = max(1, queueSize)
+
+    def isParallel(self) -> bool:
+        return self.workerCount > 1
+
+    def maximumBlockMemoryUsage(self, maximumMemoryUsage: int) -> int:
+        """Return the memory (in bytes) available for a single block, given the overall memory budget."""
+        if not self.isParallel():
+            return maximumMemoryUsage
+        return max(1, maximumMemoryUsage // self.queueSize)
+
+    def run(
+            self, blocks: Iterable, read: Callable[[Any], Any], process: Callable[[Any, Any], Any],
+            write: Callable[[Any, Any], None]
+    ):
+        """
+        Call read(block), process(block, data) and write(block, result) for each block.
+
+        The read and write callbacks are always called inside the calling thread.
+        """
+        if not self.isParallel():
+            for block in blocks:
+                write(block, process(block, read(block)))
+            return
+
+        executor = self._createExecutor(process)
+        pending: Deque[Tuple[Any, Future]] = deque()
+        try:
+            for block in blocks:
+                data = read(block)
+                if self.useProcesses:
+                    future = executor.submit(_callWorkerProcessFunction, block, data)
+                else:
+                    future = executor.submit(process, block, data)
+                pending.append((block, future))
+                while len(pending) >= self.queueSize:
+                    self._writeNext(pending, write)
+            while len(pending) > 0:
+                self._writeNext(pending, write)
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+    def _createExecutor(self, process: Callable) -> Executor:
+        if self.useProcesses:
+            return ProcessPoolExecutor(self.workerCount, initializer=_initializeWorkerProcess, initargs=(process,))
+        else:
+            return ThreadPoolExecutor(self.workerCount)
+
+    @staticmethod
+    def _writeNext(pending: Deque[Tuple[Any, Future]], write: Callable[[Any, Any], None]):
+        block, future = pending.popleft()
+        write(block, future.result())
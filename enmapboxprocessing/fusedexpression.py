@@ -0,0 +1,177 @@
+import ast
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from enmapbox.typeguard import typechecked
+
+try:
+    import numexpr
+except ImportError:  # numexpr is optional, we fall back to chunked NumPy evaluation
+    numexpr = None
+
+
+@typechecked
+class FusedExpression(object):
+    """
+    Evaluate pure element-wise arithmetic expressions without full-size temporaries.
+
+    If numexpr is installed, the expression is evaluated in a single pass by numexpr.
+    Otherwise, the expression is evaluated by NumPy in chunks of rows,
+    so that all temporaries stay small, while the result is identical to plain NumPy evaluation.
+    Expressions that are not pure element-wise arithmetic are rejected with a ValueError,
+    use isElementwise() to check beforehand.
+    """
+
+    ChunkSize = 2 ** 16  # number of elements per chunk
+
+    # element-wise NumPy functions supported by numexpr (NumPy name -> numexpr name)
+    Functions = {
+        'abs': 'abs', 'absolute': 'abs', 'sqrt': 'sqrt', 'exp': 'exp', 'expm1': 'expm1', 'log': 'log',
+        'log10': 'log10', 'log1p': 'log1p', 'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'arcsin': 'arcsin',
+        'arccos': 'arccos', 'arctan': 'arctan', 'arctan2': 'arctan2', 'sinh': 'sinh', 'cosh': 'cosh',
+        'tanh': 'tanh', 'where': 'where'
+    }
+    # number of positional arguments, for which a function is element-wise (default is 1);
+    # e.g. np.where(condition) returns indices, only np.where(condition, x, y) is element-wise
+    FunctionArgumentCounts = {'arctan2': 2, 'where': 3}
+    Operators = (
+        ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.USub, ast.UAdd, ast.Invert, ast.BitAnd,
+        ast.BitOr, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE
+    )
+    Modules = ('np', 'numpy')
+
+    def __init__(self, expression: str):
+        tree = self._parse(expression)
+        if tree is None:
+            raise ValueError(f'not a pure element-wise expression: {expression}')
+        self.expression = expression
+        self.variables = self._variables(tree)
+        self.numexprExpression = _NumexprTranslator().visit(tree)
+        self.codeObject = compile(tree, '<string>', 'eval')
+
+    @classmethod
+    def isElementwise(cls, expression: str) -> bool:
+        """Return whether the expression is pure element-wise arithmetic."""
+        return cls._parse(expression) is not None
+
+    @classmethod
+    def _parse(cls, expression: str) -> Optional[ast.Expression]:
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError:
+            return None
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Expression, ast.Load, ast.Name, ast.BinOp, ast.UnaryOp) + cls.Operators):
+                continue
+            if isinstance(node, ast.Compare) and len(node.ops) == 1:
+                continue
+            if isinstance(node, ast.Constant) and type(node.value) in (int, float, bool):
+                continue
+            if isinstance(node, ast.Call) and cls._functionName(node) is not None:
+                argumentCount = cls.FunctionArgumentCounts.get(cls._functionName(node), 1)
+                if len(node.keywords) == 0 and len(node.args) == argumentCount:
+                    continue
+            if isinstance(node, ast.Attribute) and cls._isModuleFunction(node):
+                continue
+            return None
+        return tree
+
+    @classmethod
+    def _isModuleFunction(cls, node: ast.AST) -> bool:
+        return isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and \
+            node.value.id in cls.Modules and node.attr in cls.Functions
+
+    @classmethod
+    def _functionName(cls, node: ast.Call) -> Optional[str]:
+        if cls._isModuleFunction(node.func):
+            return node.func.attr
+        return None
+
+    def _variables(self, tree: ast.Expression) -> List[str]:
+        moduleNames = [node.value.id for node in ast.walk(tree) if self._isModuleFunction(node)]
+        variables = list()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id not in variables and node.id not in moduleNames:
+                variables.append(node.id)
+        return variables
+
+    def evaluate(self, namespace: Dict[str, Any], useNumexpr: bool = None) -> Any:
+        """Evaluate the expression with the variables taken from the namespace."""
+        if useNumexpr is None:
+            useNumexpr = numexpr is not None
+
+        values = {name: namespace[name] for name in self.variables}
+        arrays = [value for value in values.values() if isinstance(value, np.ndarray)]
+        isSupported = all(isinstance(value, (np.ndarray, int, float, bool, np.number)) for value in values.values())
+        if not isSupported or len(arrays) == 0 or any(array.size == 0 for array in arrays):
+            return eval(self.codeObject, {'np': np, 'numpy': np}, values)
+
+        shape = np.broadcast_shapes(*[array.shape for array in arrays])
+
+        # derive NumPy result data type from a single element (as 1d array, to keep array casting rules)
+        sample = {name: value.reshape(-1)[:1] if value.ndim == 0 else value[(0,) * (value.ndim - 1)][:1]
+                  if isinstance(value, np.ndarray) else value for name, value in values.items()}
+        dtype = np.asarray(eval(self.codeObject, {'np': np, 'numpy': np}, sample)).dtype
+
+        if useNumexpr and numexpr is not None:
+            try:
+                result = numexpr.evaluate(self.numexprExpression, local_dict=values, global_dict={})
+                return np.asarray(result).astype(dtype, copy=False).reshape(shape)
+            except Exception:
+                pass  # expression not supported by numexpr (e.g. bitwise operators on integers)
+
+        return self._evaluateChunked(values, shape, dtype)
+
+    def _evaluateChunked(self, values: Dict[str, Any], shape: tuple, dtype: np.dtype) -> np.ndarray:
+        out = np.empty(shape, dtype)
+        if len(shape) < 2:
+            out[...] = eval(self.codeObject, {'np': np, 'numpy': np}, values)
+            return out
+
+        height = shape[-2]
+        rowSize = int(np.prod(shape)) // max(1, height)
+        chunkHeight = max(1, self.ChunkSize // max(1, rowSize))
+        for start in range(0, height, chunkHeight):
+            stop = min(start + chunkHeight, height)
+            chunk = dict()
+            for name, value in values.items():
+                if isinstance(value, np.ndarray) and value.ndim >= 2 and value.shape[-2] == height:
+                    value = value[..., start:stop, :]
+                chunk[name] = value
+            out[..., start:stop, :] = eval(self.codeObject, {'np': np, 'numpy': np}, chunk)
+        return out
+
+
+class _NumexprTranslator(ast.NodeVisitor):
+    # Translate a validated expression into numexpr syntax.
+
+    BinaryOperators = {
+        ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Pow: '**', ast.Mod: '%', ast.BitAnd: '&',
+        ast.BitOr: '|'
+    }
+    UnaryOperators = {ast.USub: '-', ast.UAdd: '+', ast.Invert: '~'}
+    CompareOperators = {ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>='}
+
+    def visit_Expression(self, node: ast.Expression) -> str:
+        return self.visit(node.body)
+
+    def visit_BinOp(self, node: ast.BinOp) -> str:
+        return f'({self.visit(node.left)} {self.BinaryOperators[type(node.op)]} {self.visit(node.right)})'
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> str:
+        return f'({self.UnaryOperators[type(node.op)]}{self.visit(node.operand)})'
+
+    def visit_Compare(self, node: ast.Compare) -> str:
+        operator = self.CompareOperators[type(node.ops[0])]
+        return f'({self.visit(node.left)} {operator} {self.visit(node.comparators[0])})'
+
+    def visit_Call(self, node: ast.Call) -> str:
+        name = FusedExpression.Functions[node.func.attr]
+        return f'{name}({", ".join(self.visit(arg) for arg in node.args)})'
+
+    def visit_Name(self, node: ast.Name) -> str:
+        return node.id
+
+    def visit_Constant(self, node: ast.Constant) -> str:
+        return repr(node.value)
@@ -0,0 +1,100 @@
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from enmapbox.typeguard import typechecked
+from enmapboxprocessing.rasterreader import RasterReader
+from enmapboxprocessing.rasterwriter import RasterWriter
+from enmapboxprocessing.typing import NumpyDataType
+from enmapboxprocessing.utils import Utils
+from qgis.core import Qgis, QgsProcessingFeedback
+
+
+@typechecked
+class MemoryPlanner(object):
+    """
+    Derive block sizes from the per-pixel memory footprint of an algorithm.
+
+    Algorithms declare all arrays held in memory while processing a single block,
+    e.g. input data, masks, intermediate copies and outputs.
+    The block size is chosen, so that all arrays together fit into the memory budget,
+    which defaults to Utils.maximumMemoryUsage().
+    """
+
+    def __init__(self, maximumMemoryUsage: int = None, feedback: QgsProcessingFeedback = None):
+        if maximumMemoryUsage is None:
+            maximumMemoryUsage = Utils.maximumMemoryUsage()
+        self.maximumMemoryUsage = maximumMemoryUsage
+        self.feedback = feedback
+        self.items: List[Tuple[str, int, int]] = list()  # (name, number of bands, data type size)
+
+    def add(self, name: str, nBands: int, dataType: Union[Qgis.DataType, NumpyDataType]):
+        """Declare a block array with the given number of bands and data type."""
+        if isinstance(dataType, (type, np.dtype)):
+            dataTypeSize = np.dtype(dataType).itemsize
+        else:
+            dataTypeSize = np.dtype(Utils.qgisDataTypeToNumpyDataType(dataType)).itemsize
+        self.items.append((name, nBands, dataTypeSize))
+
+    def addReader(self, reader: RasterReader, bandList: List[int] = None, name='input'):
+        """Declare the data read from the given raster."""
+        if bandList is None:
+            bandList = list(reader.bandNumbers())
+        self.add(name, len(bandList), reader.dataType(bandList[0]))
+
+    def addMask(self, nBands: int = 1, name='mask'):
+        """Declare a boolean mask."""
+        self.add(name, nBands, bool)
+
+    def addWriter(self, writer: RasterWriter, name='output'):
+        """Declare the data written to the given raster."""
+        self.add(name, writer.bandCount(), writer.dataType())
+
+    def pixelMemoryUsage(self) -> int:
+        """Return the memory (in bytes) used for a single pixel of all declared arrays."""
+        return sum([nBands * dataTypeSize for name, nBands, dataTypeSize in self.items])
+
+    def blockSize(self, reader: RasterReader, writers: List[RasterWriter] = None, overlap: int = 0) -> Tuple[int, int]:
+        """
+        Return block size (width, height) for walking the grid of the given raster.
+
+        With an overlap, blocks are read with a halo of overlap pixels on each side (clipped at the raster border),
+        which is included in the memory budget.
+        """
+        if writers is None:
+            writers = []
+        pixelMemoryUsage = self.pixelMemoryUsage()
+        alignTo = [writer.blockSize() for writer in writers]
+        maximumMemoryUsage = self.maximumMemoryUsage
+        blockSizeX, blockSizeY = reader.gridBlockSize(pixelMemoryUsage, maximumMemoryUsage, alignTo)
+        while overlap > 0:
+            pixelCount = self.haloPixelCount(reader, blockSizeX, blockSizeY, overlap)
+            if pixelCount * pixelMemoryUsage <= self.maximumMemoryUsage:
+                break
+            # shrink the budget by the share of the halo, until the block fits or can't get any smaller
+            maximumMemoryUsage = maximumMemoryUsage * blockSizeX * blockSizeY // pixelCount
+            smallerBlockSize = reader.gridBlockSize(pixelMemoryUsage, maximumMemoryUsage, alignTo)
+            if smallerBlockSize == (blockSizeX, blockSizeY):
+                break
+            blockSizeX, blockSizeY = smallerBlockSize
+        if self.feedback is not None:
+            self.feedback.pushInfo(self.report(blockSizeX, blockSizeY, overlap, reader))
+        return blockSizeX, blockSizeY
+
+    @staticmethod
+    def haloPixelCount(reader: RasterReader, blockSizeX: int, blockSizeY: int, overlap: int) -> int:
+        """Return the number of pixels of a block read with a halo of overlap pixels."""
+        return min(blockSizeX + 2 * overlap, reader.width()) * min(blockSizeY + 2 * overlap, reader.height())
+
+    def report(self, blockSizeX: int, blockSizeY: int, overlap: int = 0, reader: RasterReader = None) -> str:
+        """Return a human-readable description of the memory plan."""
+        items = ', '.join([f'{name} ({nBands}x{dataTypeSize} bytes)' for name, nBands, dataTypeSize in self.items])
+        pixelCount = blockSizeX * blockSizeY
+        halo = ''
+        if overlap > 0:
+            pixelCount = self.haloPixelCount(reader, blockSizeX, blockSizeY, overlap)
+            halo = f' with {overlap} pixel halo'
+        megabytes = pixelCount * self.pixelMemoryUsage() / 2 ** 20
+        return f'Memory plan: {items} = {self.pixelMemoryUsage()} bytes per pixel; ' \
+               f'block size {blockSizeX}x{blockSizeY} pixel{halo} ({megabytes:.1f} of ' \
+               f'{self.maximumMemoryUsage / 2 ** 20:.1f} MB)'
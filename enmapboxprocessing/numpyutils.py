@@ -17,22 +17,30 @@ class NumpyUtils(object):
         if axis != 0:
             raise NotImplementedError()
 
-        def zvalue_from_index(arr, ind):
-            nB, nL, nS = arr.shape
-            idx = nS * nL * ind + nS * np.arange(nL)[:, None] + np.arange(nS)[None, :]
-            return np.take(arr, idx)
-
         a = np.array(a, dtype=np.float32)
 
         # valid (non NaN) observations along the first axis
         valid_obs = np.sum(np.isfinite(a), axis=0)
-        invalid_pixel = valid_obs == 0
 
         a[np.isnan(a)] = np.inf
 
         # sort - former NaNs will move to the end
         arr = np.sort(a, axis=0)
 
+        return NumpyUtils.percentilesFromSorted(arr, valid_obs, q)
+
+    @staticmethod
+    def percentilesFromSorted(arr: np.ndarray, valid_obs: np.ndarray, q: List[float]) -> List[np.ndarray]:
+        """
+        Return percentiles along the first axis of a sorted 3d array, where only the first valid_obs values of each
+        pixel are valid observations. Pixel without observations are set to NaN.
+        """
+
+        invalid_pixel = valid_obs == 0
+
+        def zvalue_from_index(arr, ind):
+            return np.take_along_axis(arr, np.clip(ind, 0, None)[None], axis=0)[0]
+
         result = []
         for qi in q:
             # desired position as well as floor and ceiling of it
@@ -0,0 +1,264 @@
+from math import pi
+from typing import List, Tuple
+
+import numpy as np
+
+from enmapbox.typeguard import typechecked
+
+
+@typechecked
+class OnlineAggregator(object):
+    """
+    Aggregate a series of equally shaped arrays, while ignoring NaN values.
+
+    Arrays are passed one at a time via update(), so that memory usage only depends on the array shape,
+    but not on the length of the series.
+    Mean and variance are accumulated with Welford's algorithm.
+    Quantiles are approximated by a per-pixel t-digest-like sketch of at most 2 x sketchSize centroids,
+    which is merged down to sketchSize centroids whenever it runs full.
+    As long as a pixel has not more than 2 x sketchSize observations, the sketch is exact.
+    If the seriesLength is known, the sketch is not larger than the series.
+    Centroid means and weights are stored as float32, weights are only allocated when the sketch is merged first.
+    Only the statistics enabled in the constructor are accumulated.
+    """
+
+    SketchSize = 100  # number of centroids after merging a sketch
+    SketchTemporaryCount = 8  # number of temporary sketch-shaped arrays held while merging or evaluating a sketch
+
+    def __init__(
+            self, shape: Tuple[int, ...], moments=False, extremes=False, sums=False, products=False, truths=False,
+            args=False, quantiles=False, sketchSize: int = None, seriesLength: int = None
+    ):
+        if sketchSize is None:
+            sketchSize = self.SketchSize
+        if sketchSize < 1:
+            raise ValueError(f'invalid sketch size: {sketchSize}')
+        self.shape = shape
+        self.sketchSize = sketchSize
+        self.seriesLength = seriesLength
+        self.index = 0  # number of arrays seen
+        self.count = np.zeros(shape, np.int64)
+        extremes = extremes or quantiles  # sketch interpolation is anchored at the exact minimum and maximum
+        if moments:
+            self.mean = np.zeros(shape, np.float64)
+            self.m2 = np.zeros(shape, np.float64)
+        if extremes or args:
+            self.minimum = np.full(shape, np.inf, np.float64)
+            self.maximum = np.full(shape, -np.inf, np.float64)
+        if args:
+            self.argMinimum = np.zeros(shape, np.int64)
+            self.argMaximum = np.zeros(shape, np.int64)
+        if sums:
+            self.sum = np.zeros(shape, np.float64)
+        if products:
+            self.product = np.ones(shape, np.float64)
+        if truths:
+            self.anyTrue = np.zeros(shape, bool)
+            self.allTrue = np.ones(shape, bool)
+        if quantiles:
+            nPixel = int(np.prod(shape))
+            self.centroidMeans = np.zeros((self.sketchSlotCount(sketchSize, seriesLength), nPixel), np.float32)
+            self.centroidWeights = None  # all weights are 1, until the sketch is merged
+            self.centroidCount = np.zeros(nPixel, np.int64)
+        self.moments = moments
+        self.extremes = extremes or args
+        self.sums = sums
+        self.products = products
+        self.truths = truths
+        self.args = args
+        self.quantiles = quantiles
+
+    @staticmethod
+    def sketchSlotCount(sketchSize: int = None, seriesLength: int = None) -> int:
+        """Return the number of centroids per pixel: 2 x sketchSize, but not more than the length of the series."""
+        if sketchSize is None:
+            sketchSize = OnlineAggregator.SketchSize
+        if seriesLength is None:
+            return 2 * sketchSize
+        return max(1, min(2 * sketchSize, seriesLength))
+
+    @staticmethod
+    def stateBandCount(
+            moments=False, extremes=False, sums=False, products=False, truths=False, args=False, quantiles=False
+    ) -> int:
+        """Return the number of 64-bit arrays of the given shape used to store the aggregation state."""
+        return 1 + 2 * moments + 2 * (extremes or args or quantiles) + 2 * args + sums + products + truths + quantiles
+
+    @staticmethod
+    def sketchBandCount(quantiles=False, sketchSize: int = None, seriesLength: int = None) -> int:
+        """
+        Return the number of 32-bit arrays of the given shape used to store the quantile sketch.
+
+        Centroid weights are only needed, if the series is longer than the sketch, which is then merged.
+        """
+        if not quantiles:
+            return 0
+        slotCount = OnlineAggregator.sketchSlotCount(sketchSize, seriesLength)
+        if seriesLength is not None and seriesLength <= slotCount:
+            return slotCount
+        return 2 * slotCount
+
+    @staticmethod
+    def temporaryBandCount(quantiles=False, sketchSize: int = None, seriesLength: int = None) -> int:
+        """
+        Return the number of 64-bit arrays of the given shape temporarily allocated on top of the aggregation state.
+
+        Merging a sketch and evaluating quantiles allocate several sorted copies of the centroids.
+        """
+        if not quantiles:
+            return 0
+        return OnlineAggregator.SketchTemporaryCount * (OnlineAggregator.sketchSlotCount(sketchSize, seriesLength) + 1)
+
+    def update(self, array: np.ndarray):
+        """Add an array to the aggregation. NaN values are ignored."""
+        assert array.shape == self.shape, f'array shape is {array.shape}'
+        assert self.seriesLength is None or self.index < self.seriesLength, 'series is longer than announced'
+        valid = np.logical_not(np.isnan(array))
+        values = np.where(valid, array, 0.).astype(np.float64)
+        self.count += valid
+
+        if self.moments:
+            delta = values - self.mean
+            self.mean += np.divide(delta, self.count, out=np.zeros_like(delta), where=valid)
+            self.m2 += np.where(valid, delta * (values - self.mean), 0.)
+        if self.extremes:
+            isMinimum = np.logical_and(valid, values < self.minimum)
+            isMaximum = np.logical_and(valid, values > self.maximum)
+            self.minimum[isMinimum] = values[isMinimum]
+            self.maximum[isMaximum] = values[isMaximum]
+            if self.args:
+                self.argMinimum[isMinimum] = self.index
+                self.argMaximum[isMaximum] = self.index
+        if self.sums:
+            self.sum += values
+        if self.products:
+            self.product *= np.where(valid, values, 1.)
+        if self.truths:
+            isTrue = np.logical_and(valid, values != 0)
+            self.anyTrue |= isTrue
+            self.allTrue &= isTrue
+        if self.quantiles:
+            self._updateSketch(values.reshape(-1), valid.reshape(-1))
+
+        self.index += 1
+
+    def _updateSketch(self, values: np.ndarray, valid: np.ndarray):
+        indices = np.flatnonzero(valid)
+        full = indices[self.centroidCount[indices] == len(self.centroidMeans)]
+        if len(full) > 0:  # merge full sketches only when another value arrives
+            self._mergeSketch(full)
+        slots = self.centroidCount[indices]
+        self.centroidMeans[slots, indices] = values[indices]
+        if self.centroidWeights is not None:
+            self.centroidWeights[slots, indices] = 1.
+        self.centroidCount[indices] += 1
+
+    def _mergeSketch(self, indices: np.ndarray):
+        # Merge neighbouring centroids of the given pixels into sketchSize bins.
+        # Bins are defined by the arcsine scale function of the t-digest, which keeps the tails fine-grained.
+        if self.centroidWeights is None:
+            self.centroidWeights = self._usedSlots().astype(np.float32)
+        means = self.centroidMeans[:, indices].astype(np.float64)
+        weights = self.centroidWeights[:, indices].astype(np.float64)
+        order = np.argsort(means, axis=0, kind='stable')
+        means = np.take_along_axis(means, order, axis=0)
+        weights = np.take_along_axis(weights, order, axis=0)
+        cumulated = np.cumsum(weights, axis=0)
+        q = (cumulated - weights / 2) / cumulated[-1]
+        k = self.sketchSize
+        bins = np.clip(np.floor(k * (np.arcsin(2 * q - 1) / pi + 0.5)), 0, k - 1).astype(np.int64)
+        bins += k * np.arange(len(indices))[None]  # unique bins per pixel
+        binWeights = np.bincount(bins.ravel(), weights.ravel(), k * len(indices)).reshape((-1, k)).T
+        binSums = np.bincount(bins.ravel(), (weights * means).ravel(), k * len(indices)).reshape((-1, k)).T
+        binMeans = np.divide(binSums, binWeights, out=np.zeros_like(binSums), where=binWeights > 0)
+
+        # move empty bins to the end
+        order = np.argsort(binWeights == 0, axis=0, kind='stable')
+        self.centroidMeans[:, indices] = 0.
+        self.centroidWeights[:, indices] = 0.
+        self.centroidMeans[:k, indices] = np.take_along_axis(binMeans, order, axis=0)
+        self.centroidWeights[:k, indices] = np.take_along_axis(binWeights, order, axis=0)
+        self.centroidCount[indices] = np.sum(binWeights > 0, axis=0)
+
+    def _usedSlots(self) -> np.ndarray:
+        return np.arange(len(self.centroidMeans))[:, None] < self.centroidCount[None]
+
+    def resultMean(self) -> np.ndarray:
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def resultVariance(self) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / self.count
+
+    def resultStandardDeviation(self) -> np.ndarray:
+        return np.sqrt(self.resultVariance())
+
+    def resultMinimum(self) -> np.ndarray:
+        return np.where(self.count > 0, self.minimum, np.nan)
+
+    def resultMaximum(self) -> np.ndarray:
+        return np.where(self.count > 0, self.maximum, np.nan)
+
+    def resultArgMinimum(self) -> np.ndarray:
+        return np.where(self.count > 0, self.argMinimum, np.nan)
+
+    def resultArgMaximum(self) -> np.ndarray:
+        return np.where(self.count > 0, self.argMaximum, np.nan)
+
+    def resultSum(self) -> np.ndarray:
+        return self.sum.copy()
+
+    def resultProduct(self) -> np.ndarray:
+        return self.product.copy()
+
+    def resultAnyTrue(self) -> np.ndarray:
+        return self.anyTrue.astype(np.float64)
+
+    def resultAllTrue(self) -> np.ndarray:
+        return self.allTrue.astype(np.float64)
+
+    def resultQuantiles(self, q: List[float]) -> List[np.ndarray]:
+        """
+        Return percentiles (0 to 100) with linear interpolation between observations.
+
+        Centroids are placed at the center of the observation ranks they represent,
+        and interpolation is anchored at the exact minimum (rank 0) and maximum (rank count - 1).
+        Percentiles 0 and 100 return the exact minimum and maximum.
+        """
+        count = self.count.reshape(-1)
+        used = self._usedSlots()
+        means = np.where(used, self.centroidMeans, np.inf)
+        order = np.argsort(means, axis=0, kind='stable')
+        means = np.take_along_axis(means, order, axis=0)
+        weights = used if self.centroidWeights is None else self.centroidWeights
+        weights = np.take_along_axis(weights, order, axis=0).astype(np.float64)
+        ranks = np.cumsum(weights, axis=0) - weights / 2 - 0.5
+
+        # anchor at minimum and maximum; unused slots are moved onto the maximum
+        maximum = self.maximum.reshape(-1)
+        ranks = np.concatenate([np.zeros((1, len(count))), np.where(used, ranks, count - 1.)])
+        values = np.concatenate([self.minimum.reshape((1, -1)), np.where(used, means, maximum)])
+
+        result = list()
+        for qi in q:
+            if qi <= 0:  # merged centroids may tie with the anchors
+                result.append(self.resultMinimum())
+                continue
+            if qi >= 100:
+                result.append(self.resultMaximum())
+                continue
+            rank = (count - 1) * (qi / 100.)
+            upper = np.minimum(np.sum(ranks <= rank, axis=0), len(ranks) - 1)[None]
+            lower = np.maximum(upper - 1, 0)
+            rankLower = np.take_along_axis(ranks, lower, axis=0)[0]
+            rankUpper = np.take_along_axis(ranks, upper, axis=0)[0]
+            valueLower = np.take_along_axis(values, lower, axis=0)[0]
+            valueUpper = np.take_along_axis(values, upper, axis=0)[0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.clip((rank - rankLower) / (rankUpper - rankLower), 0, 1)
+            fraction[rankUpper <= rankLower] = 0.
+            with np.errstate(invalid='ignore'):  # pixel without observations have infinite extremes
+                outarray = valueLower + (valueUpper - valueLower) * fraction
+            outarray[count == 0] = np.nan
+            result.append(outarray.reshape(self.shape))
+        return result
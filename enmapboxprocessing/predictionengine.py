@@ -0,0 +1,77 @@
+import threading
+from typing import Callable
+
+import numpy as np
+
+from enmapbox.typeguard import typechecked
+from enmapboxprocessing.typing import Array2d, Array3d
+
+
+@typechecked
+class PredictionEngine(object):
+    """
+    Predict raster blocks pixel-wise with a fitted estimator.
+
+    The valid pixels of a block are streamed into a C-contiguous feature matrix of at most batchSize rows,
+    which is passed to the estimator batch by batch.
+    The feature matrix buffer is allocated once per thread and reused for all batches and blocks.
+    Features are stored as float32, unless the raster data type requires float64 to be represented exactly,
+    so predictions are identical to passing the original data.
+
+    The engine is meant to be used as the process function of a BlockExecutor,
+    which dispatches blocks to a pool of workers for estimators without internal parallelism.
+    """
+
+    BatchSize = 2 ** 14  # number of pixels per batch
+
+    def __init__(self, function: Callable[[np.ndarray], np.ndarray], batchSize: int = None):
+        if batchSize is None:
+            batchSize = self.BatchSize
+        if batchSize < 1:
+            raise ValueError(f'invalid batch size: {batchSize}')
+        self.function = function
+        self.batchSize = batchSize
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']  # buffers are not shared between processes
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def featureBuffer(self, nFeatures: int, dataType: np.dtype) -> np.ndarray:
+        """Return the feature matrix buffer of the current thread."""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape[1] != nFeatures or buffer.dtype != dataType:
+            buffer = np.empty((self.batchSize, nFeatures), dataType, order='C')
+            self._local.buffer = buffer
+        return buffer
+
+    @staticmethod
+    def featureDataType(arrayX: Array3d) -> np.dtype:
+        """Return the smallest float data type, that represents all feature values exactly."""
+        return np.result_type(np.float32, *[array.dtype for array in arrayX])
+
+    def predict(self, arrayX: Array3d, valid: Array2d, arrayY: Array3d):
+        """
+        Predict all valid pixels and store the results in the prediction bands.
+
+        Invalid pixels of arrayY are left untouched, so arrayY is expected to be initialized with no data.
+        Estimators may return 1d (single output) or 2d (pixels x outputs) arrays.
+        """
+        indices = np.flatnonzero(valid)
+        if len(indices) == 0:
+            return
+        bands = [array.reshape(-1) for array in arrayX]
+        buffer = self.featureBuffer(len(bands), self.featureDataType(arrayX))
+        for start in range(0, len(indices), self.batchSize):
+            batchIndices = indices[start:start + self.batchSize]
+            X = buffer[:len(batchIndices)]
+            for i, band in enumerate(bands):
+                X[:, i] = band[batchIndices]
+            y = np.asarray(self.function(X)).reshape((len(batchIndices), -1))
+            for i, aY in enumerate(arrayY):
+                np.put(aY, batchIndices, y[:, i])
@@ -16,7 +16,7 @@ class RasterBlockInfo(NamedTuple):
         return self.extent.width() / self.width
 
     def yResolution(self):
-        return self.extent.width() / self.width
+        return self.extent.height() / self.height
 
     def xMap(self):
         xres = self.xResolution()
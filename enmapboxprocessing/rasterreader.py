@@ -1,7 +1,7 @@
 import json
-from math import isnan, ceil
+from math import ceil, sqrt, lcm
 from os.path import exists
-from typing import Iterable, List, Union, Optional, Tuple, Iterator, Dict
+from typing import Callable, Iterable, List, Union, Optional, Tuple, Iterator, Dict
 
 import numpy as np
 import processing
@@ -59,6 +59,11 @@ class RasterReader(object):
                 gdalDataset = None
 
         self.gdalDataset = gdalDataset
+        self._gdalReadDataTypes: Optional[List[Optional[Qgis.DataType]]] = None
+        self._maskSpecifications: Dict[Tuple, Tuple[np.ndarray, List[Tuple[int, float, float, bool, bool]]]] = dict()
+        self._datasetMetadataItemCache: Dict[Tuple[str, str], Optional[MetadataValue]] = dict()
+        self._datasetMetadataDomainKeysCache: Optional[List[str]] = None
+        self._bandMetadata: Dict[str, Union[np.ndarray, List]] = dict()
 
         self.setRasterPipeCrs(crs)
 
@@ -182,10 +187,12 @@ class RasterReader(object):
 
     def setUseSourceNoDataValue(self, bandNo: int, use: bool):
         """Read QGIS docs."""
+        self._maskSpecifications.clear()
         return self.provider.setUseSourceNoDataValue(bandNo, use)
 
     def setUserNoDataValue(self, bandNo: int, noData: Iterable[QgsRasterRange]):
         """Read QGIS docs."""
+        self._maskSpecifications.clear()
         return self.provider.setUserNoDataValue(bandNo, noData)
 
     def userNoDataValues(self, bandNo: int = None) -> List[QgsRasterRange]:
@@ -240,6 +247,57 @@ class RasterReader(object):
                 continue  # empty blocks may occure, but can just skip over
             yield RasterBlockInfo(blockExtent, xOffset, yOffset, width, height)
 
+    def nativeBlockSize(self, bandNo: int = None) -> Tuple[int, int]:
+        """Return the natural block size (width, height) of the underlying raster file."""
+        if self.gdalDataset is None:
+            return self.width(), 1
+        if bandNo is None:
+            bandNo = 1
+        blockSizeX, blockSizeY = self.gdalBand(bandNo).GetBlockSize()
+        return blockSizeX, blockSizeY
+
+    def gridBlockSize(
+            self, pixelMemoryUsage: int, maximumMemoryUsage: int = None, alignTo: List[Tuple[int, int]] = None
+    ) -> Tuple[int, int]:
+        """
+        Return block size (width, height) to be used with walkGrid.
+
+        Blocks are aligned to the native block size of the raster and, optionally, to other block sizes,
+        e.g. the block size of the output raster. Tiled rasters are walked in square-ish tiles,
+        while full-width strips are used for raster files that are organized in strips.
+        """
+        if maximumMemoryUsage is None:
+            maximumMemoryUsage = Utils.maximumMemoryUsage()
+        if alignTo is None:
+            alignTo = []
+        pixelCount = max(1, maximumMemoryUsage // max(1, pixelMemoryUsage))
+        return self.planBlockSize(self.width(), self.height(), pixelCount, [self.nativeBlockSize()] + alignTo)
+
+    @staticmethod
+    def planBlockSize(
+            width: int, height: int, pixelCount: int, alignTo: List[Tuple[int, int]]
+    ) -> Tuple[int, int]:
+        """Return block size (width, height) with at most pixelCount pixels, aligned to the given block sizes."""
+        if pixelCount >= width * height:
+            return width, height
+
+        alignX = alignY = 1
+        for blockSizeX, blockSizeY in alignTo:
+            alignX = min(lcm(alignX, max(1, blockSizeX)), width)
+            alignY = min(lcm(alignY, max(1, blockSizeY)), height)
+
+        if alignX >= width:  # strips
+            blockSizeX = width
+        else:  # tiles
+            blockSizeX = max(alignX, int(sqrt(pixelCount)) // alignX * alignX)
+            blockSizeX = min(blockSizeX, width)
+
+        blockSizeY = max(1, pixelCount // blockSizeX)
+        if blockSizeY >= alignY:
+            blockSizeY = blockSizeY // alignY * alignY
+        blockSizeY = min(blockSizeY, height)
+        return blockSizeX, blockSizeY
+
     def setRasterPipeCrs(self, crs: QgsCoordinateReferenceSystem = None):
         if crs is None:
             projector = self.provider
@@ -257,18 +315,23 @@ class RasterReader(object):
 
     def arrayFromBlock(
             self, block: RasterBlockInfo, bandList: List[int] = None, overlap: int = None,
-            feedback: QgsRasterBlockFeedback = None
+            feedback: QgsRasterBlockFeedback = None, out: np.ndarray = None
     ):
         """Return data for given block."""
         return self.arrayFromBoundingBoxAndSize(
-            block.extent, block.width, block.height, bandList, overlap, feedback
+            block.extent, block.width, block.height, bandList, overlap, feedback, out
         )
 
     def arrayFromBoundingBoxAndSize(
             self, boundingBox: QgsRectangle, width: int, height: int, bandList: List[int] = None,
-            overlap: int = None, feedback: QgsRasterBlockFeedback = None
+            overlap: int = None, feedback: QgsRasterBlockFeedback = None, out: np.ndarray = None
     ) -> Array3d:
-        """Return data for given bounding box and size."""
+        """
+        Return data for given bounding box and size.
+
+        Optionally, pass a preallocated 3d array of shape (len(bandList), height, width) via out,
+        which is filled and can be reused for reading subsequent blocks of the same size.
+        """
         if bandList is None:
             bandList = range(1, self.provider.bandCount() + 1)
         if overlap is not None:
@@ -282,14 +345,99 @@ class RasterReader(object):
             )
             width = width + 2 * overlap
             height = height + 2 * overlap
+        if out is not None:
+            assert out.shape == (len(bandList), height, width), f'out shape is {out.shape}'
+
+        # fast path: read all bands directly from the GDAL dataset
+        window = self._gdalReadWindow(boundingBox, width, height, bandList)
+        if window is not None:
+            xOffset, yOffset = window
+            if out is None:
+                dtype = Utils.qgisDataTypeToNumpyDataType(self.provider.dataType(bandList[0]))
+                out = np.empty((len(bandList), height, width), dtype)
+            if len(bandList) == 1:
+                self.gdalDataset.GetRasterBand(bandList[0]).ReadAsArray(
+                    xOffset, yOffset, width, height, buf_obj=out[0]
+                )
+            else:
+                self.gdalDataset.ReadAsArray(
+                    xOffset, yOffset, width, height, buf_obj=out, band_list=list(bandList)
+                )
+            return list(out)
+
+        # default path: read band-wise via the QGIS data provider (or raster pipe)
         arrays = list()
-        for bandNo in bandList:
+        for i, bandNo in enumerate(bandList):
             assert 0 < bandNo <= self.bandCount(), f'bandNo is {bandNo}'
             block: QgsRasterBlock = self.projector.block(bandNo, boundingBox, width, height, feedback)
             array = Utils.qgsRasterBlockToNumpyArray(block=block)
+            if out is not None:
+                out[i] = array
+                array = out[i]
             arrays.append(array)
         return arrays
 
+    def _gdalReadWindow(
+            self, boundingBox: QgsRectangle, width: int, height: int, bandList: Iterable[int]
+    ) -> Optional[Tuple[int, int]]:
+        """
+        Return pixel offset (x, y), if the requested data can be read directly from the GDAL dataset.
+
+        This is the case, if no raster pipe CRS is set, the bounding box is aligned to the pixel grid,
+        is fully inside the raster and matches the native resolution, and if all requested bands share the same
+        data type and have no scale and offset.
+        """
+        if self.pipe is not None or self.gdalDataset is None:
+            return None
+
+        if self._gdalReadDataTypes is None:
+            self._gdalReadDataTypes = self._prepareGdalReadDataTypes()
+        dataTypes = set()
+        for bandNo in bandList:
+            if not 0 < bandNo <= len(self._gdalReadDataTypes):
+                return None
+            dataTypes.add(self._gdalReadDataTypes[bandNo - 1])
+        if len(dataTypes) != 1 or None in dataTypes:
+            return None
+
+        x0, resX, rotX, y0, rotY, resY = self.gdalDataset.GetGeoTransform()
+        if rotX != 0 or rotY != 0 or resX <= 0 or resY >= 0:
+            return None
+        resY = -resY
+
+        xOffset = (boundingBox.xMinimum() - x0) / resX
+        yOffset = (y0 - boundingBox.yMaximum()) / resY
+        xSize = boundingBox.width() / resX
+        ySize = boundingBox.height() / resY
+        tolerance = 1e-4
+        for value in [xOffset, yOffset, xSize, ySize]:
+            if abs(value - round(value)) > tolerance:
+                return None
+        xOffset = int(round(xOffset))
+        yOffset = int(round(yOffset))
+        if int(round(xSize)) != width or int(round(ySize)) != height:
+            return None
+        if xOffset < 0 or yOffset < 0:
+            return None
+        if xOffset + width > self.gdalDataset.RasterXSize or yOffset + height > self.gdalDataset.RasterYSize:
+            return None
+
+        return xOffset, yOffset
+
+    def _prepareGdalReadDataTypes(self) -> List[Optional[Qgis.DataType]]:
+        dataTypes = list()
+        for bandNo in self.bandNumbers():
+            dataType = None
+            if bandNo <= self.gdalDataset.RasterCount:
+                if self.provider.bandScale(bandNo) == 1 and self.provider.bandOffset(bandNo) == 0:
+                    dataType = self.provider.dataType(bandNo)
+                    try:
+                        Utils.qgisDataTypeToNumpyDataType(dataType)
+                    except ValueError:
+                        dataType = None
+            dataTypes.append(dataType)
+        return dataTypes
+
     def arrayFromPixelOffsetAndSize(
             self, xOffset: int, yOffset: int, width: int, height: int, bandList: List[int] = None, overlap: int = None,
             feedback: QgsRasterBlockFeedback = None
@@ -335,53 +483,123 @@ class RasterReader(object):
 
     def maskArray(
             self, array: Array3d, bandList: List[int] = None, maskNotFinite=True, defaultNoDataValue: float = None,
-            maskNoDataValue=True
+            maskNoDataValue=True, out: np.ndarray = None
     ) -> Array3d:
-        """Return mask for given data. No data values evaluate to False, all other to True."""
+        """
+        Return mask for given data. No data values evaluate to False, all other to True.
+
+        The mask is evaluated for all bands at once. Optionally, pass a boolean array with the shape of the data
+        as out argument, to reuse a mask buffer across blocks.
+        """
+
+        if bandList is None:
+            bandList = range(1, self.provider.bandCount() + 1)
+        assert len(bandList) == len(array)
+        noDataValues, rasterRanges = self.maskSpecification(bandList, defaultNoDataValue, maskNoDataValue)
+
+        if isinstance(array, np.ndarray):
+            out = self._maskBands(array, noDataValues, rasterRanges, maskNotFinite, out)
+            return out
+
+        if out is None:
+            out = np.empty((len(array),) + np.shape(array[0]), dtype=bool)
+        for i, a in enumerate(array):
+            self._maskBands(np.asarray(a)[None], noDataValues[i:i + 1], [
+                (0, vmin, vmax, includeMin, includeMax)
+                for index, vmin, vmax, includeMin, includeMax in rasterRanges if index == i
+            ], maskNotFinite, out[i:i + 1])
+        return list(out)
+
+    def maskArrayAllBands(
+            self, array: Array3d, bandList: List[int] = None, maskNotFinite=True, defaultNoDataValue: float = None,
+            maskNoDataValue=True, out: np.ndarray = None
+    ) -> np.ndarray:
+        """
+        Return combined mask for given data. Pixels with no data in any band evaluate to False, all other to True.
 
+        Equivalent to np.all(maskArray(...), axis=0), but without allocating the full 3d mask.
+        """
         if bandList is None:
             bandList = range(1, self.provider.bandCount() + 1)
         assert len(bandList) == len(array)
-        maskArray = list()
+        noDataValues, rasterRanges = self.maskSpecification(bandList, defaultNoDataValue, maskNoDataValue)
+
+        shape = np.shape(array[0])
+        if out is None:
+            out = np.empty(shape, dtype=bool)
+        out[:] = True
+        bandMask = np.empty((1,) + shape, dtype=bool)
         for i, a in enumerate(array):
-            bandNo = i + 1
-            m = np.full_like(a, True, dtype=bool)
+            self._maskBands(np.asarray(a)[None], noDataValues[i:i + 1], [
+                (0, vmin, vmax, includeMin, includeMax)
+                for index, vmin, vmax, includeMin, includeMax in rasterRanges if index == i
+            ], maskNotFinite, bandMask)
+            np.logical_and(out, bandMask[0], out=out)
+        return out
+
+    def maskSpecification(
+            self, bandList: Iterable[int], defaultNoDataValue: float = None, maskNoDataValue=True
+    ) -> Tuple[np.ndarray, List[Tuple[int, float, float, bool, bool]]]:
+        """
+        Return no data values and user no data ranges for the given bands.
+
+        No data values are returned as float64 vector, with NaN for bands without a no data value.
+        Ranges are returned as (band index, min, max, include min, include max) tuples.
+        The specification is queried from the data provider only once per reader and band list,
+        changing no data settings via the reader setters resets it.
+        """
+        bandList = tuple(bandList)
+        key = bandList, defaultNoDataValue, maskNoDataValue
+        if key in self._maskSpecifications:
+            return self._maskSpecifications[key]
+
+        noDataValues = np.full((len(bandList),), np.nan, dtype=np.float64)
+        rasterRanges = list()
+        for i, bandNo in enumerate(bandList):
             if maskNoDataValue:
                 if self.provider.sourceHasNoDataValue(bandNo) and self.provider.useSourceNoDataValue(bandNo):
-                    noDataValue = self.provider.sourceNoDataValue(bandNo)
-                    if not isnan(noDataValue):
-                        m[a == noDataValue] = False
-                else:
-                    if defaultNoDataValue is not None:
-                        m[a == defaultNoDataValue] = False
+                    noDataValues[i] = self.provider.sourceNoDataValue(bandNo)
+                elif defaultNoDataValue is not None:
+                    noDataValues[i] = defaultNoDataValue
             rasterRange: QgsRasterRange
             for rasterRange in self.provider.userNoDataValues(bandNo):
-                if rasterRange.bounds() == QgsRasterRange.BoundsType.IncludeMinAndMax:
-                    contained = np.logical_and(
-                        np.greater_equal(a, rasterRange.min()), np.less_equal(a, rasterRange.max())
-                    )
-                elif rasterRange.bounds() == QgsRasterRange.BoundsType.IncludeMin:
-                    contained = np.logical_and(
-                        np.greater_equal(a, rasterRange.min()), np.less(a, rasterRange.max())
-                    )
-                elif rasterRange.bounds() == QgsRasterRange.BoundsType.IncludeMax:
-                    contained = np.logical_and(
-                        np.greater(a, rasterRange.min()), np.less_equal(a, rasterRange.max())
-                    )
-                elif rasterRange.bounds() == QgsRasterRange.BoundsType.Exclusive:
-                    contained = np.logical_and(
-                        np.greater(a, rasterRange.min()), np.less(a, rasterRange.max())
-                    )
+                bounds = rasterRange.bounds()
+                if bounds == QgsRasterRange.BoundsType.IncludeMinAndMax:
+                    includeMin, includeMax = True, True
+                elif bounds == QgsRasterRange.BoundsType.IncludeMin:
+                    includeMin, includeMax = True, False
+                elif bounds == QgsRasterRange.BoundsType.IncludeMax:
+                    includeMin, includeMax = False, True
+                elif bounds == QgsRasterRange.BoundsType.Exclusive:
+                    includeMin, includeMax = False, False
                 else:
                     raise ValueError()
+                rasterRanges.append((i, rasterRange.min(), rasterRange.max(), includeMin, includeMax))
 
-                m[contained] = False
+        self._maskSpecifications[key] = noDataValues, rasterRanges
+        return noDataValues, rasterRanges
 
-            if maskNotFinite:
-                m[np.logical_not(np.isfinite(a))] = False
-
-            maskArray.append(m)
-        return maskArray
+    @staticmethod
+    def _maskBands(
+            array: np.ndarray, noDataValues: np.ndarray, rasterRanges: List[Tuple[int, float, float, bool, bool]],
+            maskNotFinite: bool, out: Optional[np.ndarray]
+    ) -> np.ndarray:
+        # comparing against NaN evaluates to True, so bands without no data value need no special treatment
+        noDataValues = noDataValues.reshape((-1,) + (1,) * (array.ndim - 1))
+        if np.issubdtype(array.dtype, np.floating):
+            noDataValues = noDataValues.astype(array.dtype)  # compare in data precision, like scalar comparison
+        else:
+            maskNotFinite = False  # integer values are always finite
+        out = np.not_equal(array, noDataValues, out=out)
+        if maskNotFinite:
+            np.logical_and(out, np.isfinite(array), out=out)
+        for index, vmin, vmax, includeMin, includeMax in rasterRanges:
+            a = array[index]
+            greater = np.greater_equal if includeMin else np.greater
+            less = np.less_equal if includeMax else np.less
+            contained = np.logical_and(greater(a, vmin), less(a, vmax))
+            np.logical_and(out[index], np.logical_not(contained, out=contained), out=out[index])
+        return out
 
     def pixelByPoint(self, point: Union[QgsPointXY, SpatialPoint]) -> QPoint:
         if isinstance(point, QgsPointXY):
@@ -589,6 +807,18 @@ class RasterReader(object):
 
         return domains
 
+    def _datasetMetadataItem(self, key: str, domain: str = '') -> Optional[MetadataValue]:
+        # dataset-level items (e.g. the wavelength list) are parsed only once per reader
+        cacheKey = key, domain
+        if cacheKey not in self._datasetMetadataItemCache:
+            self._datasetMetadataItemCache[cacheKey] = self.metadataItem(key, domain)
+        return self._datasetMetadataItemCache[cacheKey]
+
+    def _datasetMetadataDomainKeys(self) -> List[str]:
+        if self._datasetMetadataDomainKeysCache is None:
+            self._datasetMetadataDomainKeysCache = self.metadataDomainKeys()
+        return self._datasetMetadataDomainKeysCache
+
     def isSpectralRasterLayer(self, quickCheck=True):
         """Return whether a raster has wavelength information."""
 
@@ -602,10 +832,10 @@ class RasterReader(object):
 
     def findBandName(self, bandName: str) -> Optional[int]:
         """Find band number by name."""
-        for bandNo in range(1, self.bandCount() + 1):
-            if self.bandName(bandNo) == bandName:
-                return bandNo
-        return None
+        bandNames = self.bandNames()
+        if bandName not in bandNames:
+            return None
+        return bandNames.index(bandName) + 1
 
     def wavelengthUnits(self, bandNo: int, guess=True) -> Optional[str]:
         """Return wavelength units."""
@@ -636,8 +866,8 @@ class RasterReader(object):
                     return Utils.wavelengthUnitsLongName(units)
 
             # check dataset-level domains
-            for domain in set(self.metadataDomainKeys() + ['']):
-                units = self.metadataItem(key, domain)
+            for domain in set(self._datasetMetadataDomainKeys() + ['']):
+                units = self._datasetMetadataItem(key, domain)
                 if units is not None:
                     return Utils.wavelengthUnitsLongName(units)
 
@@ -668,7 +898,7 @@ class RasterReader(object):
             return conversionFactor * wavelength
 
         # special handling: FORCE TSI raster
-        enviDescription = self.metadataItem('description', 'ENVI')
+        enviDescription = self._datasetMetadataItem('description', 'ENVI')
         if enviDescription is not None:
             if enviDescription[0].startswith('FORCE') and enviDescription[0].endswith('Time Series Analysis'):
                 return None
@@ -712,8 +942,8 @@ class RasterReader(object):
                     return conversionFactor * float(wavelength)
 
             # check dataset-level domains
-            for domain in set([''] + self.metadataDomainKeys()):
-                wavelengths = self.metadataItem(key, domain)
+            for domain in set([''] + self._datasetMetadataDomainKeys()):
+                wavelengths = self._datasetMetadataItem(key, domain)
                 if wavelengths is not None:
                     wavelength = wavelengths[bandNo - 1]
                     return conversionFactor * float(wavelength)
@@ -727,18 +957,11 @@ class RasterReader(object):
         if units is not None:
             wavelength = wavelength * Utils.wavelengthUnitsConversionFactor(units, 'nm')
 
-        bandNos = list()
-        distances = list()
-        for bandNo in range(1, self.bandCount() + 1):
-            wavelength_ = self.wavelength(bandNo)
-            if wavelength_ is None:
-                continue
-            bandNos.append(bandNo)
-            distances.append(abs(wavelength_ - wavelength))
-        if len(bandNos) == 0:
+        distances = np.abs(self.wavelengths() - wavelength)
+        if np.all(np.isnan(distances)):
             return None
 
-        return bandNos[np.argmin(distances)]
+        return int(np.nanargmin(distances)) + 1
 
     def fwhm(self, bandNo: int, units: str = None) -> Optional[float]:
         """Return band FWHM in nanometers. Optionally, specify destination units."""
@@ -774,8 +997,8 @@ class RasterReader(object):
                 return conversionFactor * float(fwhm)
 
         # check dataset-level domains
-        for domain in set(self.metadataDomainKeys() + ['']):
-            fwhm = self.metadataItem('fwhm', domain)
+        for domain in set(self._datasetMetadataDomainKeys() + ['']):
+            fwhm = self._datasetMetadataItem('fwhm', domain)
             if fwhm is not None:
                 fwhm = fwhm[bandNo - 1]
                 return conversionFactor * float(fwhm)
@@ -807,8 +1030,8 @@ class RasterReader(object):
                 return int(badBandMultiplier)
 
         # check dataset-level domains
-        for domain in set(self.metadataDomainKeys() + ['']):
-            bbl = self.metadataItem('bbl', domain)
+        for domain in set(self._datasetMetadataDomainKeys() + ['']):
+            bbl = self._datasetMetadataItem('bbl', domain)
             if bbl is not None:
                 badBandMultiplier = bbl[bandNo - 1]
                 return int(badBandMultiplier)
@@ -821,7 +1044,7 @@ class RasterReader(object):
         if bandNo is not None:
 
             # special handling: FORCE TSI raster
-            enviDescription = self.metadataItem('description', 'ENVI')
+            enviDescription = self._datasetMetadataItem('description', 'ENVI')
             if enviDescription is not None:
                 if enviDescription[0].startswith('FORCE') and enviDescription[0].endswith('Time Series Analysis'):
                     decimalYear = float(self.metadataItem('wavelength', '', bandNo))
@@ -967,18 +1190,63 @@ class RasterReader(object):
         if centerTime is None:
             return None
 
-        bandNos = list()
-        distances = list()
-        for bandNo in range(1, self.bandCount() + 1):
-            centerTime_ = self.centerTime(bandNo)
-            if centerTime_ is None:
-                continue
-            bandNos.append(bandNo)
-            distances.append(abs(centerTime_.msecsTo(centerTime)))
-        if len(bandNos) == 0:
+        msecs = self._bandMetadataField('centerTimeMSecs', self._centerTimeMSecs)
+        distances = np.abs(msecs - centerTime.toMSecsSinceEpoch())
+        if np.all(np.isnan(distances)):
             return None
 
-        return bandNos[np.argmin(distances)]
+        return int(np.nanargmin(distances)) + 1
+
+    def wavelengths(self, units: str = None) -> np.ndarray:
+        """Return center wavelengths of all bands in nanometers, NaN if undefined. Optionally, specify destination units."""
+        wavelengths = self._bandMetadataField('wavelength', lambda: self._floatArray(self.wavelength))
+        if units is None:
+            return wavelengths.copy()
+        return wavelengths * Utils.wavelengthUnitsConversionFactor('nm', units)
+
+    def fwhms(self, units: str = None) -> np.ndarray:
+        """Return FWHM of all bands in nanometers, NaN if undefined. Optionally, specify destination units."""
+        fwhms = self._bandMetadataField('fwhm', lambda: self._floatArray(self.fwhm))
+        if units is None:
+            return fwhms.copy()
+        return fwhms * Utils.wavelengthUnitsConversionFactor('nm', units)
+
+    def badBandMultipliers(self) -> np.ndarray:
+        """Return bad band multipliers of all bands, 0 for bad band and 1 for good band."""
+        badBandMultipliers = self._bandMetadataField(
+            'bbl', lambda: np.array([self.badBandMultiplier(bandNo) for bandNo in self.bandNumbers()], dtype=int)
+        )
+        return badBandMultipliers.copy()
+
+    def centerTimes(self) -> List[Optional[QDateTime]]:
+        """Return center times of all bands."""
+        centerTimes = self._bandMetadataField(
+            'centerTime', lambda: [self.centerTime(bandNo) for bandNo in self.bandNumbers()]
+        )
+        return list(centerTimes)
+
+    def bandNames(self) -> List[str]:
+        """Return names of all bands."""
+        bandNames = self._bandMetadataField(
+            'bandName', lambda: [self.bandName(bandNo) for bandNo in self.bandNumbers()]
+        )
+        return list(bandNames)
+
+    def _bandMetadataField(self, name: str, build: Callable) -> Union[np.ndarray, List]:
+        # spectral and temporal band metadata is collected only once per reader
+        if name not in self._bandMetadata:
+            self._bandMetadata[name] = build()
+        return self._bandMetadata[name]
+
+    def _floatArray(self, function: Callable) -> np.ndarray:
+        values = [function(bandNo) for bandNo in self.bandNumbers()]
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+    def _centerTimeMSecs(self) -> np.ndarray:
+        return np.array(
+            [np.nan if centerTime is None else centerTime.toMSecsSinceEpoch() for centerTime in self.centerTimes()],
+            dtype=np.float64
+        )
 
     def lineMemoryUsage(self, nBands: int = None, dataTypeSize: int = None) -> int:
         """Returns the memory (in bytes) used to store a single raster line."""
@@ -988,6 +1256,14 @@ class RasterReader(object):
             dataTypeSize = self.dataTypeSize()
         return self.width() * nBands * dataTypeSize
 
+    def pixelMemoryUsage(self, nBands: int = None, dataTypeSize: int = None) -> int:
+        """Returns the memory (in bytes) used to store a single pixel profile."""
+        if nBands is None:
+            nBands = self.bandCount()
+        if dataTypeSize is None:
+            dataTypeSize = self.dataTypeSize()
+        return nBands * dataTypeSize
+
     def _gdalObject(self, bandNo: int = None) -> Union[gdal.Band, gdal.Dataset]:
         if bandNo is None or bandNo > self.gdalDataset.RasterCount:  # handle case where GDAL band count != QGIS band count
             gdalObject = self.gdalDataset
@@ -1,4 +1,4 @@
-from typing import List, Union, Optional, Iterator
+from typing import List, Union, Optional, Iterator, Tuple
 
 from osgeo import gdal
 
@@ -174,6 +174,13 @@ class RasterWriter(object):
     def height(self) -> int:
         return self.gdalDataset.RasterYSize
 
+    def blockSize(self, bandNo: int = None) -> Tuple[int, int]:
+        """Return the natural block size (width, height) of the underlying raster file."""
+        if bandNo is None:
+            bandNo = 1
+        blockSizeX, blockSizeY = self.gdalBand(bandNo).GetBlockSize()
+        return blockSizeX, blockSizeY
+
     def _gdalObject(self, bandNo: int = None) -> Union[gdal.Dataset, gdal.Band]:
         if bandNo is None:
             return self.gdalDataset
@@ -36,7 +36,15 @@ class Utils(object):
 
     @staticmethod
     def maximumMemoryUsage() -> int:
-        """Return maximum memory usage in bytes."""
+        """
+        Return maximum memory usage in bytes.
+
+        Defaults to the GDAL cache size. Set the ENMAPBOX_MAXIMUM_MEMORY_USAGE config option (or environment variable)
+        to use a different budget (in megabytes).
+        """
+        value = gdal.GetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE')
+        if value is not None:
+            return int(float(value) * 2 ** 20)
         return gdal.GetCacheMax()
 
     @staticmethod
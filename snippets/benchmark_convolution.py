@@ -0,0 +1,56 @@
+"""
+Compare the convolution backends of ConvolutionFilterAlgorithmBase on a synthetic raster block.
+
+Prints runtime per backend and the maximum deviation from astropy's direct convolution.
+"""
+from time import perf_counter
+
+import numpy as np
+from astropy.convolution import (AiryDisk2DKernel, Box2DKernel, Gaussian1DKernel, Gaussian2DKernel,
+                                 Moffat2DKernel, Tophat2DKernel)
+
+from enmapboxprocessing.algorithm.convolutionfilteralgorithmbase import ConvolutionFilterAlgorithmBase
+
+
+def kernels():
+    yield 'Box2D(3)', Box2DKernel(3).array[None]
+    yield 'Box2D(15)', Box2DKernel(15).array[None]
+    yield 'Gaussian2D(1)', Gaussian2DKernel(1).array[None]
+    yield 'Gaussian2D(5)', Gaussian2DKernel(5).array[None]
+    yield 'Gaussian2D(4, 2, theta=0.5)', Gaussian2DKernel(4, 2, theta=0.5).array[None]
+    yield 'Tophat2D(3)', Tophat2DKernel(3).array[None]
+    yield 'Moffat2D(3, 2)', Moffat2DKernel(3, 2).array[None]
+    yield 'AiryDisk2D(10)', AiryDisk2DKernel(10).array[None]
+    yield 'Gaussian1D(3)', Gaussian1DKernel(3).array.reshape((-1, 1, 1))
+
+
+def benchmark(bandCount=10, size=500, noDataFraction=0.01, nan_treatment='interpolate', normalize_kernel=True):
+    alg = ConvolutionFilterAlgorithmBase
+    array = np.random.rand(bandCount, size, size) * 1000
+    invalid = np.random.rand(bandCount, size, size) < noDataFraction
+
+    print(f'block: {bandCount}x{size}x{size}, nan_treatment={nan_treatment}, normalize_kernel={normalize_kernel}')
+    print(f'{"kernel":30}{"shape":>16}{"automatic":>12}' + ''.join(f'{name:>12}' for name in alg.O_BACKEND[1:]))
+    for name, kernel in kernels():
+        automatic = alg.O_BACKEND[alg.selectBackend(kernel, nan_treatment, normalize_kernel)]
+        line = f'{name:30}{str(kernel.shape):>16}{automatic:>12}'
+        gold = None
+        for backend in [alg.DirectBackend, alg.SeparableBackend, alg.FftBackend]:
+            if backend == alg.SeparableBackend and alg.separableFactors(kernel) is None:
+                line += f'{"-":>12}'
+                continue
+            t0 = perf_counter()
+            outarray = alg.convolve(array, invalid, kernel, nan_treatment, normalize_kernel, backend)
+            seconds = perf_counter() - t0
+            if gold is None:
+                gold = outarray
+                line += f'{seconds:>11.2f}s'
+            else:
+                error = np.max(np.abs(outarray - gold)[np.isfinite(gold)], initial=0)
+                line += f'{seconds:>5.2f}s({error:.0e})'
+        print(line)
+
+
+if __name__ == '__main__':
+    benchmark()
+    benchmark(nan_treatment='fill')
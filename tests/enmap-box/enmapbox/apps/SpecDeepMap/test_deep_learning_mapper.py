@@ -43,6 +43,21 @@ BASE_TESTDATA = Path(DIR_UNITTESTS) / 'testdata/external/specdeepmap'
 @unittest.skipIf(import_error, f'Missing modules to run SpecDeepMap: {import_error}')
 class Test_Deep_Learning_Mapper(TestCase):
 
+    def test_crop_windows(self):
+        from enmapbox.apps.SpecDeepMap.core_deep_learning_mapper import calculate_stride_and_overlap, \
+            crop_windows, generate_positions
+
+        # cropped tiles must cover each pixel exactly once
+        for image_dim, tile_size, overlap in [(1000, 64, 10), (221, 64, 10), (500, 128, 25)]:
+            stride, _, overlap_pixel, _ = calculate_stride_and_overlap(tile_size, tile_size, overlap)
+            positions = generate_positions(image_dim, tile_size, stride)
+            coverage = [0] * image_dim
+            for pos, (start, end, output_start) in zip(positions, crop_windows(positions, image_dim, overlap_pixel)):
+                self.assertEqual(pos + start, output_start)
+                for i in range(output_start, pos + end):
+                    coverage[i] += 1
+            self.assertEqual([1] * image_dim, coverage)
+
     def test_iou_mapper(self):
 
         # init processing framework
@@ -4,6 +4,9 @@ import shutil
 import unittest
 from pathlib import Path
 
+import numpy as np
+from osgeo import gdal
+
 from enmapbox import DIR_UNITTESTS, exampledata
 from enmapbox.apps.SpecDeepMap import import_error
 from enmapbox.testing import start_app
@@ -12,6 +15,7 @@ from processing.core.Processing import Processing
 from qgis.core import QgsProcessingAlgorithm
 
 if not import_error:
+    from enmapbox.apps.SpecDeepMap.core_raster_splitter import split_raster
     from enmapbox.apps.SpecDeepMap.processing_algorithm_raster_splitter import RasterSplitter
 
     start_app()
@@ -81,3 +85,64 @@ class TestRasterSplitter(TestCase):
         if os.path.exists(str(folder_path_labels)):
             shutil.rmtree(str(folder_path_labels))  # Deletes folder and all its contents
             print(f"Deleted folder: {str(folder_path_labels)}")
+
+    def test_split_raster_synthetic(self):
+        # compare tile set, border padding and geotransforms with the former per-tile gdal.Translate behaviour
+        folder = self.createTestOutputDirectory() / 'synthetic'
+        os.makedirs(folder, exist_ok=True)
+        rng = np.random.default_rng(0)
+        nodata = [-1, -2, -3]  # no data value per band
+        image = rng.integers(0, 100, (3, 70, 90)).astype(np.int16)
+        for i in range(3):
+            image[i, :5] = nodata[i]
+        labels = (rng.random((70, 90)) < 0.3) * rng.integers(1, 5, (70, 90))
+        geo_transform = (1000, 30, 0, 2000, 0, -30)
+
+        driver = gdal.GetDriverByName('GTiff')
+        image_path = str(folder / 'image.tif')
+        ds = driver.Create(image_path, 90, 70, 3, gdal.GDT_Int16)
+        ds.SetGeoTransform(geo_transform)
+        for i in range(3):
+            band = ds.GetRasterBand(i + 1)
+            band.SetNoDataValue(nodata[i])
+            band.SetScale(0.5)
+            band.SetOffset(1.0)
+            band.WriteArray(image[i])
+        ds = None
+        label_path = str(folder / 'labels.tif')
+        ds = driver.Create(label_path, 90, 70, 1, gdal.GDT_Byte)
+        ds.SetGeoTransform(geo_transform)
+        ds.GetRasterBand(1).WriteArray(labels)
+        ds = None
+
+        output = folder / 'tiles'
+        tile_count = split_raster(image_path, label_path, str(output), 32, 24, 20, 16, remove_null_int=25,
+                                  n_workers=2, strip_memory=3000)
+
+        # reference: labels are set to 0 where the image has no data, both rasters are padded at the border
+        reference_labels = np.where(image[0] == nodata[0], 0, labels)
+        padded_labels = np.pad(reference_labels, ((0, 24), (0, 32)), constant_values=0)
+        padded_image = np.array([np.pad(image[i], ((0, 24), (0, 32)), constant_values=nodata[i]) for i in range(3)])
+        expected = list()
+        for x in range(0, 90, 20):
+            for y in range(0, 70, 16):
+                if np.count_nonzero(padded_labels[y:y + 24, x:x + 32]) / (32 * 24) >= 0.25:
+                    expected.append((x, y))
+        self.assertEqual(len(expected), tile_count)
+        self.assertEqual(sorted(f'image_tile_{x}_{y}.tif' for x, y in expected),
+                         sorted(os.listdir(output / 'images')))
+        self.assertEqual(sorted(os.listdir(output / 'images')), sorted(os.listdir(output / 'labels')))
+
+        for x, y in expected:
+            name = f'image_tile_{x}_{y}.tif'
+            ds = gdal.Open(str(output / 'images' / name))
+            self.assertEqual((1000 + x * 30, 30, 0, 2000 - y * 30, 0, -30), ds.GetGeoTransform())
+            self.assertArrayEqual(padded_image[:, y:y + 24, x:x + 32], ds.ReadAsArray())
+            self.assertEqual(nodata, [ds.GetRasterBand(i + 1).GetNoDataValue() for i in range(3)])
+            self.assertEqual(0.5, ds.GetRasterBand(1).GetScale())
+            self.assertEqual(1.0, ds.GetRasterBand(1).GetOffset())
+            ds = gdal.Open(str(output / 'labels' / name))
+            self.assertEqual((1000 + x * 30, 30, 0, 2000 - y * 30, 0, -30), ds.GetGeoTransform())
+            self.assertArrayEqual(padded_labels[y:y + 24, x:x + 32], ds.ReadAsArray())
+        # tiles at the right and lower border are padded
+        self.assertTrue(any(x + 32 > 90 or y + 24 > 70 for x, y in expected))
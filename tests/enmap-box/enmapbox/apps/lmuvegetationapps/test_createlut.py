@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import numpy as np
+
+from enmapboxprocessing.algorithm.testcase import TestCase
+from lmuvegetationapps.LUT.CreateLUT_algorithm import CreateLUTAlgorithm
+from lmuvegetationapps.LUT.LUT_container import LUTContainer
+
+DIR_TESTDATA = Path(__file__).parent / 'data'
+
+
+class LMUTests_CreateLUT(TestCase):
+
+    def test_createLUT(self):
+        alg = CreateLUTAlgorithm()
+        alg.initAlgorithm()
+        parameters = {
+            alg.P_PARAS: str(DIR_TESTDATA / 'TestLUT_2000_CpCBCcheck_00paras.txt'),
+            alg.P_NS: 50,
+            alg.P_SPLIT_SIZE: 20,
+            alg.P_WORKER_COUNT: 2,
+            alg.P_NAME: 'TestLUT',
+            alg.P_OUTPUT_FOLDER: self.createTestOutputFolder()
+        }
+        result = self.runalg(alg, parameters)
+        container = LUTContainer(str(Path(result[alg.P_OUTPUT_FOLDER]) / 'TestLUT.lutc'))
+        self.assertEqual((1, 21 + 2101, 50), container.data.shape)
+        self.assertEqual((1, 3), container.geometry.shape)
+        self.assertTrue(np.all(np.isfinite(container.data)))
+
+    def test_createLUT_cpCbcDependency(self):
+        alg = CreateLUTAlgorithm()
+        alg.initAlgorithm()
+        parameters = {
+            alg.P_PARAS: str(DIR_TESTDATA / 'TestLUT_2000_CpCBCcheck_00paras.txt'),
+            alg.P_NS: 50,
+            alg.P_CP_CBC: True,
+            alg.P_NAME: 'TestLUT',
+            alg.P_OUTPUT_FOLDER: self.createTestOutputFolder()
+        }
+        result = self.runalg(alg, parameters)
+        container = LUTContainer(str(Path(result[alg.P_OUTPUT_FOLDER]) / 'TestLUT.lutc'))
+        parameters = container.parameters(0)
+        cp, cbc = container.parameter_names.index('cp'), container.parameter_names.index('cbc')
+        self.assertTrue(np.all(parameters[cp] <= parameters[cbc]))
@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+
+from lmuvegetationapps.LUT.InvertLUT_core import RTMInversion
+
+
+class LMUTests_InvertLUT(unittest.TestCase):
+
+    def test_costfun_batch(self):
+        rng = np.random.default_rng(42)
+        image = rng.random((50, 7))
+        lut = rng.random((50, 100))
+        for ctype in [1, 2, 3]:
+            estimates = RTMInversion._costfun_batch(image_ref=image, model_ref=lut, ctype=ctype)
+            self.assertEqual((7, 100), estimates.shape)
+            for i in range(7):
+                gold = RTMInversion._costfun(image_ref=image[:, i:i + 1], model_ref=lut, ctype=ctype)
+                self.assertTrue(np.allclose(gold, estimates[i]))
+
+    def test_invert_chunk(self):
+        rng = np.random.default_rng(42)
+        lut_params = rng.random((3, 100))
+        lut = rng.random((50, 100))
+        spectra = rng.random((50, 7))
+        inv = RTMInversion()
+        inv.ctype = 1
+        inv.nbfits = 5
+        result = inv.invert_chunk(lut_params, lut, np.sum(lut ** 2, axis=0), None, None, spectra)
+        for i in range(7):
+            estimates = RTMInversion._costfun(image_ref=spectra[:, i:i + 1], model_ref=lut, ctype=1)
+            nbest_subset = np.argsort(estimates)[:5]
+            self.assertTrue(np.allclose(np.median(lut_params[:, nbest_subset], axis=1), result[:, i]))
+
+    def test_invert_chunk_index(self):
+        # kd- and ball-tree return the same best fits as the exhaustive search (RMSE and MAE)
+        rng = np.random.default_rng(42)
+        lut_params = rng.random((3, 100))
+        lut = rng.random((50, 100))
+        spectra = rng.random((50, 7))
+        for ctype in [1, 2]:
+            inv = RTMInversion()
+            inv.ctype = ctype
+            inv.nbfits = 5
+            gold = inv.invert_chunk(lut_params, [lut], np.sum(lut ** 2, axis=0), None, None, spectra)
+            for index_type in ['kd_tree', 'ball_tree']:
+                inv.index_type = index_type
+                index, projection = inv.build_index(lut)
+                self.assertIsNone(projection)
+                result = inv.invert_chunk(lut_params, [lut], None, index, projection, spectra)
+                self.assertTrue(np.allclose(gold, result))
+
+    def test_invert_chunk_index_pca(self):
+        # spectra within a 3-dimensional subspace are represented exactly by 3 principal components, so the
+        # re-ranked candidates equal the exhaustive search
+        rng = np.random.default_rng(42)
+        basis = rng.random((50, 3))
+        lut_params = rng.random((3, 100))
+        lut = basis @ rng.random((3, 100))
+        spectra = basis @ rng.random((3, 7))
+        inv = RTMInversion()
+        inv.ctype = 1
+        inv.nbfits = 5
+        gold = inv.invert_chunk(lut_params, [lut], np.sum(lut ** 2, axis=0), None, None, spectra)
+        for index_type in ['kd_tree', 'ball_tree']:
+            inv.index_type = index_type
+            inv.index_components = 3
+            index, projection = inv.build_index(lut)
+            mean, components = projection
+            self.assertEqual((3, 50), components.shape)
+            result = inv.invert_chunk(lut_params, [lut], None, index, projection, spectra)
+            self.assertTrue(np.allclose(gold, result))
+
+    def test_chunk_size(self):
+        # the cost matrices of all workers share chunk_memory
+        inv = RTMInversion()
+        inv.ntotal_lut = 1000
+        inv.chunk_memory = 8 * 1000 * 100
+        inv.workers = 1
+        self.assertEqual(100, inv.chunk_size())
+        inv.workers = 4
+        self.assertEqual(25, inv.chunk_size())
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=False)
@@ -0,0 +1,43 @@
+import tempfile
+import unittest
+from os.path import join
+
+import numpy as np
+
+from lmuvegetationapps.LUT.LUT_container import LUTContainer
+
+
+class LMUTests_LUTContainer(unittest.TestCase):
+
+    def test_container(self):
+        rng = np.random.default_rng(42)
+        data = rng.random((4, 3 + 10, 20))
+        geometry = [[tts, tto, 0.] for tto in [0., 10.] for tts in [30., 40.]]
+        with tempfile.TemporaryDirectory() as folder:
+            filename = join(folder, 'lut.lutc')
+            container = LUTContainer.create(filename, parameter_names=['a', 'b', 'c'], wavelengths=range(10),
+                                            geometry=geometry, n_members=20, meta={'name': 'lut'})
+            for geo in range(4):
+                container.parameters(geo)[:] = data[geo, :3]
+                container.spectra(geo)[:] = data[geo, 3:]
+            container.flush()
+            del container
+
+            container = LUTContainer(filename)
+            self.assertEqual('lut', container.meta['name'])
+            self.assertEqual(['a', 'b', 'c'], container.parameter_names)
+            self.assertTrue(np.array_equal(data, container.data))
+            self.assertTrue(np.array_equal(geometry, container.geometry))
+            self.assertTrue(np.shares_memory(container.record(1), container.data))
+            self.assertTrue(np.shares_memory(container.spectra(1, [2, 4, 6]), container.data))
+            self.assertTrue(np.array_equal(data[1, 3:][[2, 4, 6]], container.spectra(1, [2, 4, 6])))
+            self.assertTrue(np.array_equal(data[1, 3:][[0, 1, 5, 9]], container.spectra(1, [0, 1, 5, 9])))
+            runs = container.spectra_runs(1, [0, 1, 5, 9])
+            self.assertEqual(3, len(runs))
+            self.assertTrue(np.array_equal(data[1, 3:][[0, 1, 5, 9]], np.vstack(runs)))
+            self.assertEqual(3, container.geo_index(41., 9., 0.))
+            del runs, container
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=False)
@@ -45,3 +45,19 @@ class TestAggregateRasterBandsAlgorithm(TestCase):
         result = self.runalg(alg, parameters)
         reader = RasterReader(result[alg.P_OUTPUT_RASTER])
         array = reader.array()
+
+    def test_approximateQuantiles(self):
+        alg = AggregateRasterBandsAlgorithm()
+        functionIndices = [alg.MedianFunction, alg.InterquartileRangeFunction, alg.P0 + 10]
+        arrays = list()
+        for quantileMethod in [alg.ExactQuantileMethod, alg.ApproximateQuantileMethod]:
+            parameters = {
+                alg.P_RASTER: enmap,
+                alg.P_FUNCTION: functionIndices,
+                alg.P_QUANTILE_METHOD: quantileMethod,
+                alg.P_OUTPUT_RASTER: self.filename(f'aggregation_quantiles_{quantileMethod}.tif')
+            }
+            result = self.runalg(alg, parameters)
+            arrays.append(RasterReader(result[alg.P_OUTPUT_RASTER]).array())
+        # sketches are exact for short series
+        self.assertTrue(np.allclose(arrays[0], arrays[1], atol=1e-2))
@@ -1,5 +1,8 @@
+from math import nan
 from os.path import join, exists
 
+import numpy as np
+
 from enmapboxprocessing.algorithm.aggregaterasterbandsalgorithm import AggregateRasterBandsAlgorithm
 from enmapboxprocessing.algorithm.aggregaterastersalgorithm import AggregateRastersAlgorithm
 from enmapboxprocessing.algorithm.testcase import TestCase
@@ -68,6 +71,25 @@ class TestAggregateRastersAlgorithm(TestCase):
         reader = RasterReader(join(parameters[alg.P_OUTPUT_FOLDER], 'aggregation.arithmetic_mean.tif'))
         self.assertEqual(1, reader.array()[0], [0, 0])
 
+    def test_aggregateArray(self):
+        array = np.array([[1, 4], [nan, 2], [3, nan], [2, nan]], np.float32).reshape((4, 1, 2))
+        array[:, 0, 1] = nan
+        alg = AggregateRastersAlgorithm
+        functionIndices = [
+            alg.ArithmeticMeanFunction, alg.StandardDeviationFunction, alg.VarianceFunction, alg.MinimumFunction,
+            alg.MedianFunction, alg.MaximumFunction, alg.RangeFunction, alg.InterquartileRangeFunction,
+            alg.ArgMinimumFunction, alg.ArgMaximumFunction, alg.P0 + 25
+        ]
+        outarrays = alg.aggregateArray(array, functionIndices)
+        values = array[:, 0, 0]
+        gold = [
+            np.nanmean(values), np.nanstd(values), np.nanvar(values), 1, 2, 3, 2, 1, 0, 2,
+            np.nanpercentile(values, 25)
+        ]
+        for outarray, value in zip(outarrays, gold):
+            self.assertAlmostEqual(value, outarray[0, 0], 6)
+            self.assertTrue(np.isnan(outarray[0, 1]))
+
     def test_realData2(self):
         root = r'D:\data\EnFireMap\cube\X0005_Y0012'
         if not exists(root):
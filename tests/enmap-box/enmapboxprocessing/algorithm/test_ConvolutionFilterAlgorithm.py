@@ -1,8 +1,11 @@
 import unittest
 
+import numpy as np
+
 from enmapboxprocessing.algorithm.algorithms import algorithms
 from enmapboxprocessing.algorithm.convolutionfilteralgorithmbase import ConvolutionFilterAlgorithmBase
 from enmapboxprocessing.algorithm.testcase import TestCase
+from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxtestdata import hires
 
 try:
@@ -73,3 +76,47 @@ class TestConvolutionFilterAlgorithm(TestCase):
                 alg.P_OUTPUT_RASTER: self.filename('filtered.tif')
             }
             self.runalg(alg, parameters)
+
+    def test_backends(self):
+        alg = ConvolutionFilterAlgorithm()
+        alg.initAlgorithm()
+        arrays = list()
+        for backend in range(len(alg.O_BACKEND)):
+            parameters = {
+                alg.P_RASTER: hires,
+                alg.P_KERNEL: alg.defaultCodeAsString(),
+                alg.P_BACKEND: backend,
+                alg.P_OUTPUT_RASTER: self.filename(f'filtered{backend}.tif')
+            }
+            result = self.runalg(alg, parameters)
+            arrays.append(RasterReader(result[alg.P_OUTPUT_RASTER]).array())
+        for array in arrays[1:]:
+            self.assertTrue(np.allclose(arrays[0], array, rtol=1e-5))
+
+    def test_selectBackend(self):
+        from astropy.convolution import Box2DKernel, Gaussian2DKernel, AiryDisk2DKernel, RickerWavelet2DKernel
+
+        alg = ConvolutionFilterAlgorithmBase
+        self.assertEqual(alg.DirectBackend, alg.selectBackend(Box2DKernel(3).array[None], 'interpolate', False))
+        self.assertEqual(alg.SeparableBackend, alg.selectBackend(Box2DKernel(15).array[None], 'interpolate', False))
+        self.assertEqual(alg.SeparableBackend, alg.selectBackend(Gaussian2DKernel(5).array[None], 'fill', False))
+        self.assertEqual(alg.FftBackend, alg.selectBackend(AiryDisk2DKernel(10).array[None], 'interpolate', False))
+        self.assertEqual(alg.FftBackend, alg.selectBackend(RickerWavelet2DKernel(5).array[None], 'fill', False))
+        self.assertEqual(alg.DirectBackend, alg.selectBackend(RickerWavelet2DKernel(5).array[None], 'fill', True))
+
+    def test_convolve(self):
+        from astropy.convolution import Gaussian2DKernel, convolve
+
+        alg = ConvolutionFilterAlgorithmBase
+        kernel = Gaussian2DKernel(4, 2, theta=0.5).array[None]
+        array = np.random.rand(2, 100, 80)
+        invalid = np.random.rand(2, 100, 80) < 0.01
+        for nan_treatment in ['interpolate', 'fill']:
+            for normalize_kernel in [True, False]:
+                gold = convolve(
+                    array, kernel, fill_value=np.nan, nan_treatment=nan_treatment,
+                    normalize_kernel=normalize_kernel, mask=invalid
+                )
+                outarray = alg.convolve(array, invalid, kernel, nan_treatment, normalize_kernel, alg.FftBackend)
+                self.assertArrayEqual(np.isnan(gold), np.isnan(outarray))
+                self.assertTrue(np.allclose(gold, outarray, equal_nan=True))
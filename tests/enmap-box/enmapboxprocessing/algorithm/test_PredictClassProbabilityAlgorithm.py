@@ -49,3 +49,25 @@ class TestPredictClassProbabilityAlgorithm(TestCase):
         }
         result = self.runalg(alg, parameters)
         self.assertEqual(-13052, np.round(np.sum(RasterReader(result[alg.P_OUTPUT_PROBABILITY]).array())))
+
+    def test_workerCount(self):
+        algFit = FitTestClassifierAlgorithm()
+        algFit.initAlgorithm()
+        parametersFit = {
+            algFit.P_DATASET: classifierDumpPkl,
+            algFit.P_CLASSIFIER: algFit.defaultCodeAsString(),
+            algFit.P_OUTPUT_CLASSIFIER: self.filename('classifier.pkl'),
+        }
+        self.runalg(algFit, parametersFit)
+
+        alg = PredictClassPropabilityAlgorithm()
+        alg.initAlgorithm()
+        parameters = {
+            alg.P_RASTER: enmap,
+            alg.P_CLASSIFIER: parametersFit[algFit.P_OUTPUT_CLASSIFIER],
+            alg.P_WORKER_COUNT: 4,
+            alg.P_BATCH_SIZE: 1000,
+            alg.P_OUTPUT_PROBABILITY: self.filename('probability2.tif')
+        }
+        result = self.runalg(alg, parameters)
+        self.assertEqual(-13052, np.round(np.sum(RasterReader(result[alg.P_OUTPUT_PROBABILITY]).array())))
@@ -42,3 +42,18 @@ class TestPredictRegressionAlgorithm(TestCase):
             ['vegetation'],
             [reader.bandName(bandNo) for bandNo in reader.bandNumbers()]
         )
+
+    def test_workerCount(self):
+        alg = PredictRegressionAlgorithm()
+        parameters = {
+            alg.P_REGRESSOR: regressorDumpPkl,
+            alg.P_RASTER: enmap,
+            alg.P_OUTPUT_REGRESSION: self.filename('regression.tif')
+        }
+        self.runalg(alg, parameters)
+        array = RasterReader(parameters[alg.P_OUTPUT_REGRESSION]).array()
+
+        parameters[alg.P_WORKER_COUNT] = 4
+        parameters[alg.P_OUTPUT_REGRESSION] = self.filename('regression2.tif')
+        self.runalg(alg, parameters)
+        self.assertArrayEqual(array, RasterReader(parameters[alg.P_OUTPUT_REGRESSION]).array())
@@ -1,5 +1,7 @@
 from os.path import join
 
+import numpy as np
+
 from enmapboxprocessing.algorithm.prepareregressiondatasetfromsynthmixalgorithm import \
     PrepareRegressionDatasetFromSynthMixAlgorithm
 from enmapboxprocessing.algorithm.testcase import TestCase
@@ -27,3 +29,23 @@ class TestFitClassifierAlgorithm(TestCase):
             self.assertEqual(category.color, dump.targets[0].color)
             self.assertEqual((10, 177), dump.X.shape)
             self.assertEqual((10, 1), dump.y.shape)
+
+    def test_seed(self):
+        alg = PrepareRegressionDatasetFromSynthMixAlgorithm()
+        dumps = list()
+        for name in ['synthmix1', 'synthmix2']:
+            parameters = {
+                alg.P_DATASET: classifierDumpPkl,
+                alg.P_N: 1000,
+                alg.P_MIXING_PROBABILITIES: '0.4, 0.4, 0.2',
+                alg.P_SEED: 42,
+                alg.P_OUTPUT_FOLDER: self.filename(name)
+            }
+            self.runalg(alg, parameters)
+            category = ClassifierDump.fromDict(Utils.pickleLoad(classifierDumpPkl)).categories[0]
+            filename = join(parameters[alg.P_OUTPUT_FOLDER], category.name + '.pkl')
+            dumps.append(RegressorDump.fromDict(Utils.pickleLoad(filename)))
+        self.assertTrue(np.array_equal(dumps[0].X, dumps[1].X))
+        self.assertTrue(np.array_equal(dumps[0].y, dumps[1].y))
+        self.assertTrue(np.all(dumps[0].y >= 0))
+        self.assertTrue(np.all(dumps[0].y <= 1))
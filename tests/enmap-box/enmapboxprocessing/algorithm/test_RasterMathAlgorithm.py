@@ -7,9 +7,10 @@ from osgeo import gdal
 from enmapbox.testing import start_app
 from enmapboxprocessing.algorithm.rastermathalgorithm.rastermathalgorithm import RasterMathAlgorithm
 from enmapboxprocessing.algorithm.testcase import TestCase
+from enmapboxprocessing.processingfeedback import ProcessingFeedback
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxtestdata import enmap, landcover_polygon, hires
-from qgis.core import Qgis
+from qgis.core import Qgis, QgsProcessingFeedback
 
 start_app()
 
@@ -290,3 +291,77 @@ class TestRasterMathAlgorithm(TestCase):
         }
         result = self.runalg(alg, parameters)
         self.assertArrayEqual(-99, RasterReader(result[alg.P_OUTPUT_RASTER]).array(0, 0, 1, 1))
+
+    def test_makePlan(self):
+        alg = RasterMathAlgorithm()
+        reader = RasterReader(enmap)
+        code = '# comment\n' \
+               'ndvi = (R1@38 - R1@23) / (R1@38 + R1@23)\n' \
+               'ndvi.setNoDataValue(-1)'
+        plan = alg.makePlan(code, {'R1': reader}, ProcessingFeedback(QgsProcessingFeedback()))
+        atBands = {bandNos: set(identifiers) for bandNos, identifiers in plan.atBands['R1'].items()}
+        self.assertDictEqual({(38,): {'R1@38'}, (23,): {'R1@23'}}, atBands)  # identifiers are listed per usage
+        self.assertDictEqual({'R1': False}, plan.needAllData)
+        self.assertListEqual(['ndvi'], plan.writerNames)
+        self.assertFalse(plan.isSingleLineCode)
+        self.assertIn('R1At38', plan.source)
+        self.assertIn('ndvi_.setNoDataValue', plan.source)
+        self.assertNotIn('# comment', plan.source)
+
+    def test_makePlan_needAllData(self):
+        alg = RasterMathAlgorithm()
+        reader = RasterReader(enmap)
+        feedback = ProcessingFeedback(QgsProcessingFeedback())
+        readers = {'R1': reader, 'R2': reader, 'R11': reader}
+        plan = alg.makePlan('R1@1 + R1_.bandCount() + R2', readers, feedback)
+        self.assertDictEqual({'R1': False, 'R2': True, 'R11': False}, plan.needAllData)
+        plan = alg.makePlan('R1@1 + R1.bandCount()', readers, feedback)  # legacy reader method syntax
+        self.assertDictEqual({'R1': False, 'R2': False, 'R11': False}, plan.needAllData)
+        self.assertIn('R1_.bandCount()', plan.source)
+        plan = alg.makePlan('R1Mask + RS[0]', readers, feedback)
+        self.assertDictEqual({'R1': True, 'R2': False, 'R11': True}, plan.needAllData)
+
+    def test_workerCount(self):
+        alg = RasterMathAlgorithm()
+        code = '(R1@38 - R1@23) / (R1@38 + R1@23)'
+        parameters = {
+            alg.P_R1: enmap,
+            alg.P_CODE: code,
+            alg.P_OUTPUT_RASTER: self.filename('ndvi.tif')
+        }
+        gold = RasterReader(self.runalg(alg, parameters)[alg.P_OUTPUT_RASTER]).array()
+
+        for useProcesses in [False, True]:
+            gdal.SetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE', '1')  # force multiple blocks
+            try:
+                parameters = {
+                    alg.P_R1: enmap,
+                    alg.P_CODE: code,
+                    alg.P_WORKER_COUNT: 4,
+                    alg.P_USE_PROCESSES: useProcesses,
+                    alg.P_OUTPUT_RASTER: self.filename(f'ndvi_{useProcesses}.tif')
+                }
+                result = self.runalg(alg, parameters)
+            finally:
+                gdal.SetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE', None)
+            self.assertArrayEqual(gold, RasterReader(result[alg.P_OUTPUT_RASTER]).array())
+
+    def test_fusedExpression(self):
+        alg = RasterMathAlgorithm()
+        readers = {'R1': RasterReader(enmap)}
+        feedback = ProcessingFeedback(QgsProcessingFeedback())
+        plan = alg.makePlan('(R1@38 - R1@23) / (R1@38 + R1@23)', readers, feedback)
+        self.assertIsNotNone(plan.expression)
+        plan = alg.makePlan('np.mean(R1, axis=0)', readers, feedback)
+        self.assertIsNone(plan.expression)
+
+        parameters = {
+            alg.P_R1: enmap,
+            alg.P_CODE: '(R1@38 - R1@23) / (R1@38 + R1@23)',
+            alg.P_OUTPUT_RASTER: self.filename('ndvi.tif')
+        }
+        result = self.runalg(alg, parameters)
+        array = RasterReader(enmap).array(bandList=[23, 38])
+        red, nir = np.float32(array[0]), np.float32(array[1])
+        gold = (nir - red) / (nir + red)
+        self.assertTrue(np.allclose(gold, RasterReader(result[alg.P_OUTPUT_RASTER]).array()[0], equal_nan=True))
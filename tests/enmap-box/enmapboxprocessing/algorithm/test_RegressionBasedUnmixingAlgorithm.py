@@ -1,6 +1,7 @@
 import numpy as np
 
 from enmapbox.testing import start_app
+from enmapboxprocessing.algorithm.fitlinearregressionalgorithm import FitLinearRegressionAlgorithm
 from enmapboxprocessing.algorithm.fitrandomforestregressoralgorithm import FitRandomForestRegressorAlgorithm
 from enmapboxprocessing.algorithm.regressionbasedunmixingalgorithm import RegressionBasedUnmixingAlgorithm
 from enmapboxprocessing.algorithm.testcase import TestCase
@@ -48,6 +49,28 @@ class TestRegressionBasedUnmixingAlgorithm(TestCase):
         array = RasterReader(parameters[alg.P_OUTPUT_FRACTION]).array()
         self.assertListEqual([-5, 1], list(np.unique(np.round(np.sum(array, axis=0), 1))))
 
+    def test_workerCount(self):
+        alg = RegressionBasedUnmixingAlgorithm()
+        arrays = list()
+        for workerCount in [1, 2]:
+            parameters = {
+                alg.P_DATASET: classificationDatasetAsPklFile,
+                alg.P_RASTER: enmap,
+                alg.P_REGRESSOR: FitLinearRegressionAlgorithm().defaultCodeAsString(),
+                alg.P_N: 100,
+                alg.P_ENSEMBLE_SIZE: 3,
+                alg.P_ROBUST_FUSION: True,
+                alg.P_SEED: 42,
+                alg.P_WORKER_COUNT: workerCount,
+                alg.P_OUTPUT_FRACTION: self.filename(f'fraction{workerCount}.tif'),
+                alg.P_OUTPUT_VARIATION: self.filename(f'variation{workerCount}.tif')
+            }
+            self.runalg(alg, parameters)
+            arrays.append(RasterReader(parameters[alg.P_OUTPUT_FRACTION]).array())
+            arrays.append(RasterReader(parameters[alg.P_OUTPUT_VARIATION]).array())
+        self.assertTrue(np.allclose(arrays[0], arrays[2]))
+        self.assertTrue(np.allclose(arrays[1], arrays[3]))
+
     def test_debug(self):
         alg = RegressionBasedUnmixingAlgorithm()
         parameters = {
@@ -4,6 +4,7 @@ from osgeo import gdal
 
 from enmapboxprocessing.algorithm.samplerastervaluesalgorithm import SampleRasterValuesAlgorithm
 from enmapboxprocessing.algorithm.testcase import TestCase
+from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxtestdata import enmap, landcover_polygon, hires_potsdom
 from enmapboxtestdata import landcover_points_singlepart_epsg3035
 from qgis.core import (QgsRasterLayer, QgsVectorLayer)
@@ -22,6 +23,28 @@ class TestSampleRasterValuesAlgorithm(TestCase):
         }
         result = self.runalg(alg, parameters)
 
+    def test_pointSampleValues(self):
+        alg = SampleRasterValuesAlgorithm()
+        alg.initAlgorithm()
+        parameters = {
+            alg.P_RASTER: enmap,
+            alg.P_VECTOR: landcover_points_singlepart_epsg3035,
+            alg.P_OUTPUT_POINTS: self.filename('sample_vectorPointValues.gpkg')
+        }
+        result = self.runalg(alg, parameters)
+        points = QgsVectorLayer(result[alg.P_OUTPUT_POINTS])
+        self.assertEqual(QgsVectorLayer(landcover_points_singlepart_epsg3035).featureCount(), points.featureCount())
+        reader = RasterReader(enmap)
+        array = reader.array()
+        maskArray = reader.maskArray(array)
+        for feature in points.getFeatures():
+            x, y = feature.attribute('PIXEL_X'), feature.attribute('PIXEL_Y')
+            for bandNo in [1, 42, reader.bandCount()]:
+                if maskArray[bandNo - 1][y, x]:
+                    self.assertEqual(array[bandNo - 1][y, x], feature.attribute(f'SAMPLE_{bandNo}'))
+                else:
+                    self.assertIsNone(feature.attribute(f'SAMPLE_{bandNo}'))
+
     def test_sampleFromVectorPolygons(self):
         alg = SampleRasterValuesAlgorithm()
         alg.initAlgorithm()
@@ -51,6 +74,28 @@ class TestSampleRasterValuesAlgorithm(TestCase):
             points.fields().names()[:8]
         )
 
+    def test_polygonSampleAttributes(self):
+        alg = SampleRasterValuesAlgorithm()
+        alg.initAlgorithm()
+        parameters = {
+            alg.P_RASTER: enmap,
+            alg.P_VECTOR: landcover_polygon,
+            alg.P_COVERAGE_RANGE: [70, 100],
+            alg.P_OUTPUT_POINTS: self.filename('sample_70p_attributes.gpkg')
+        }
+        result = self.runalg(alg, parameters)
+        points = QgsVectorLayer(result[alg.P_OUTPUT_POINTS])
+        raster = QgsRasterLayer(enmap)
+        names = points.fields().names()
+        self.assertListEqual(
+            [f'SAMPLE_{i + 1}' for i in range(raster.bandCount())] + ['PIXEL_X', 'PIXEL_Y'],
+            names[names.index('SAMPLE_1'):]
+        )
+        for feature in points.getFeatures():
+            self.assertTrue(70 <= feature.attribute('COVER') <= 100)
+            self.assertTrue(0 <= feature.attribute('PIXEL_X') < raster.width())
+            self.assertTrue(0 <= feature.attribute('PIXEL_Y') < raster.height())
+
     def test_skipNoDataPixel(self):
         # create locations: one inside, one outside of the valid data region
         locations = self.filename('locations.geojson')
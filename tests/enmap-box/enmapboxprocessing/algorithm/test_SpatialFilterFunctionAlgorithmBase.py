@@ -1,3 +1,5 @@
+from osgeo import gdal
+
 from enmapboxtestdata import hires
 from enmapboxprocessing.algorithm.spatialgaussiangradientmagnitudealgorithm import \
     SpatialGaussianGradientMagnitudeAlgorithm
@@ -33,6 +35,7 @@ from enmapboxprocessing.algorithm.spatialpercentilealgorithm import SpatialPerce
 from enmapboxprocessing.algorithm.spatialprewittalgorithm import SpatialPrewittAlgorithm
 from enmapboxprocessing.algorithm.spatialsobelalgorithm import SpatialSobelAlgorithm
 from enmapboxprocessing.algorithm.testcase import TestCase
+from enmapboxprocessing.rasterreader import RasterReader
 
 
 class TestSpatialFilterFunctionAlgorithm(TestCase):
@@ -74,3 +77,60 @@ class TestSpatialFilterFunctionAlgorithm(TestCase):
             self.runalg(alg, parameters)
 
             break  # comment out to check all filter algos
+
+    def test_tiled(self):
+        for alg in [SpatialMedianAlgorithm(), SpatialMorphologicalGreyOpeningAlgorithm(),
+                    SpatialGaussianGradientMagnitudeAlgorithm(), SpatialMorphologicalBinaryFillHolesAlgorithm()]:
+            alg.initAlgorithm()
+            parameters = {
+                alg.P_RASTER: hires,
+                alg.P_FUNCTION: alg.defaultCodeAsString(),
+                alg.P_OUTPUT_RASTER: self.filename('gold.tif')
+            }
+            gold = RasterReader(self.runalg(alg, parameters)[alg.P_OUTPUT_RASTER]).array()
+
+            for useProcesses in [False, True]:
+                gdal.SetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE', '1')  # force multiple tiles
+                try:
+                    parameters = {
+                        alg.P_RASTER: hires,
+                        alg.P_FUNCTION: alg.defaultCodeAsString(),
+                        alg.P_WORKER_COUNT: 4,
+                        alg.P_USE_PROCESSES: useProcesses,
+                        alg.P_OUTPUT_RASTER: self.filename(f'result_{useProcesses}.tif')
+                    }
+                    result = self.runalg(alg, parameters)
+                finally:
+                    gdal.SetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE', None)
+                self.assertArrayEqual(gold, RasterReader(result[alg.P_OUTPUT_RASTER]).array())
+
+    def test_overlap(self):
+        alg = SpatialMedianAlgorithm()
+        alg.initAlgorithm()
+        code = alg.defaultCodeAsString()
+        self.assertTrue(alg.isDefaultCode(code + '\n\n'))
+        self.assertFalse(alg.isDefaultCode(code.replace('size=3', 'size=5')))
+        self.assertEqual(1, alg.overlap())
+        self.assertIsNone(SpatialMorphologicalBinaryPropagationAlgorithm().overlap())
+        self.assertIsNone(SpatialMorphologicalBinaryFillHolesAlgorithm().overlap())
+
+    def test_editedCode(self):
+        # edited code has an unknown footprint (here larger than the default), so whole bands are processed
+        alg = SpatialMedianAlgorithm()
+        alg.initAlgorithm()
+        gold = RasterReader(self.runalg(alg, {
+            alg.P_RASTER: hires,
+            alg.P_FUNCTION: alg.defaultCodeAsString().replace('size=3', 'size=5'),
+            alg.P_OUTPUT_RASTER: self.filename('gold.tif')
+        })[alg.P_OUTPUT_RASTER]).array()
+        gdal.SetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE', '1')  # the default footprint would be too small
+        try:
+            result = self.runalg(alg, {
+                alg.P_RASTER: hires,
+                alg.P_FUNCTION: alg.defaultCodeAsString().replace('size=3', 'size=5'),
+                alg.P_WORKER_COUNT: 2,
+                alg.P_OUTPUT_RASTER: self.filename('edited.tif')
+            })
+        finally:
+            gdal.SetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE', None)
+        self.assertArrayEqual(gold, RasterReader(result[alg.P_OUTPUT_RASTER]).array())
@@ -2,7 +2,8 @@ import numpy as np
 
 from enmapboxprocessing.algorithm.prepareregressiondatasetfromfilesalgorithm import \
     PrepareRegressionDatasetFromFilesAlgorithm
-from enmapboxprocessing.algorithm.spectralindexoptimizeralgorithm import SpectralIndexOptimizerAlgorithm
+from enmapboxprocessing.algorithm.spectralindexoptimizeralgorithm import SpectralIndexOptimizerAlgorithm, \
+    scoreFeaturePairs
 from enmapboxprocessing.algorithm.testcase import TestCase
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxtestdata import regressionDatasetAsPkl, classificationDatasetAsForceFile
@@ -34,6 +35,33 @@ class TestSpectralIndexOptimizerAlgorithm(TestCase):
         }
         self.runalg(alg, parameters)
 
+    def test_workerCount(self):
+        alg = SpectralIndexOptimizerAlgorithm()
+        arrays = list()
+        for workerCount in [1, 2]:
+            parameters = {
+                alg.P_DATASET: regressionDatasetAsPkl,
+                alg.P_MAX_FEATURES: 20,
+                alg.P_WORKER_COUNT: workerCount,
+                alg.P_OUTPUT_MATRIX: self.filename(f'scores{workerCount}.tif')
+            }
+            self.runalg(alg, parameters)
+            arrays.append(np.array(RasterReader(parameters[alg.P_OUTPUT_MATRIX]).array()))
+        self.assertTrue(np.array_equal(arrays[0], arrays[1], equal_nan=True))
+
+    def test_scoreFeaturePairs(self):
+        X = np.random.random((100, 3))
+        X[:5, 1] = -X[:5, 0]  # not finite formula values
+        y = np.random.random((100, 1))
+        scores = scoreFeaturePairs('(A-B) / (A+B)', X, y, (None, None, None), np.array([[0], [1]]), None)
+
+        S = (X[5:, 0] - X[5:, 1]) / (X[5:, 0] + X[5:, 1])
+        Y = y[5:, 0]
+        residuals = Y - np.polyval(np.polyfit(S, Y, 1), S)
+        self.assertAlmostEqual(np.sqrt(np.mean(residuals ** 2)), scores[0, 0])
+        self.assertAlmostEqual(np.mean(np.abs(residuals)), scores[1, 0])
+        self.assertAlmostEqual(1 - np.sum(residuals ** 2) / np.sum((Y - Y.mean()) ** 2), scores[2, 0])
+
     def test_formulaEvalsTo_notFinite_forSomeInputs(self):
         filenameFeatures, filenameLabels = classificationDatasetAsForceFile
         alg = PrepareRegressionDatasetFromFilesAlgorithm()
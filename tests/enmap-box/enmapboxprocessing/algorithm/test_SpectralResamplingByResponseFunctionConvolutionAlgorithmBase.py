@@ -5,6 +5,7 @@ from enmapboxprocessing.algorithm.spectralresamplingtolandsatalgorithm import Sp
 from enmapboxprocessing.algorithm.testcase import TestCase
 from enmapboxprocessing.rasterreader import RasterReader
 from enmapboxtestdata import enmap
+from qgis.core import QgsProcessingFeedback
 
 
 class TestSpectralResamplingByResponseFunctionConvolutionAlgorithmBase(TestCase):
@@ -26,3 +27,13 @@ class TestSpectralResamplingByResponseFunctionConvolutionAlgorithmBase(TestCase)
         }
         result = self.runalg(alg, parameters)
         self.assertEqual(-8712000, np.round(np.sum(RasterReader(result[alg.P_OUTPUT_RASTER]).array()[0])))
+
+    def test_resampleData_masked(self):
+        array = np.array([[[1, 1]], [[3, 3]], [[5, 5]]], np.int16)
+        marray = np.array([[[True, True]], [[True, False]], [[True, False]]])
+        responses = {'a': [(500, 1.), (501, 0.5)], 'b': [(502, 1.)], 'c': [(600, 1.)]}
+        outarray = SpectralResamplingToLandsatOliAlgorithm.resampleData(
+            array, marray, [500, 501, 502], responses, -1, QgsProcessingFeedback(), False
+        )
+        self.assertEqual(np.float32, outarray.dtype)
+        self.assertArrayEqual(np.array([[[5 / 3, 1]], [[5, -1]], [[-1, -1]]], np.float32), outarray)
@@ -32,3 +32,17 @@ class TestVrtBandMathAlgorithm(TestCase):
 
     def test_overlap(self):
         pass  # todo
+
+    def test_assignExpressionCode(self):
+        code = VrtBandMathAlgorithm.assignExpressionCode('ndvi', '(nir - red) / (nir + red)')
+        self.assertEqual(
+            '    if numexpr is None:\n'
+            '        ndvi = (nir - red) / (nir + red)\n'
+            '    else:\n'
+            "        ndvi = numexpr.evaluate('((nir - red) / (nir + red))')\n",
+            code
+        )
+        code = VrtBandMathAlgorithm.assignExpressionCode('mean', 'np.mean(in_ar, axis=0)')
+        self.assertEqual('    mean = np.mean(in_ar, axis=0)\n', code)
+        code = VrtBandMathAlgorithm.assignExpressionCode('indices', 'np.where(in_ar)')
+        self.assertEqual('    indices = np.where(in_ar)\n', code)
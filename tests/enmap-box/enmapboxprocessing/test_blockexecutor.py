@@ -0,0 +1,30 @@
+from enmapboxprocessing.blockexecutor import BlockExecutor
+from enmapboxprocessing.testcase import TestCase
+
+
+def double(block, data):
+    return 2 * data
+
+
+class TestBlockExecutor(TestCase):
+
+    def run_executor(self, executor: BlockExecutor):
+        results = list()
+        executor.run(range(10), lambda block: block + 1, double, lambda block, result: results.append((block, result)))
+        return results
+
+    def test_sequential(self):
+        results = self.run_executor(BlockExecutor())
+        self.assertListEqual([(i, 2 * (i + 1)) for i in range(10)], results)
+
+    def test_threads(self):
+        results = self.run_executor(BlockExecutor(4))
+        self.assertListEqual([(i, 2 * (i + 1)) for i in range(10)], results)
+
+    def test_processes(self):
+        results = self.run_executor(BlockExecutor(2, True))
+        self.assertListEqual([(i, 2 * (i + 1)) for i in range(10)], results)
+
+    def test_maximumBlockMemoryUsage(self):
+        self.assertEqual(100, BlockExecutor(1).maximumBlockMemoryUsage(100))
+        self.assertEqual(25, BlockExecutor(2).maximumBlockMemoryUsage(100))
@@ -0,0 +1,44 @@
+import numpy as np
+
+from enmapboxprocessing.fusedexpression import FusedExpression
+from enmapboxprocessing.testcase import TestCase
+
+
+class TestFusedExpression(TestCase):
+
+    def test_isElementwise(self):
+        self.assertTrue(FusedExpression.isElementwise('(a - b) / (a + b)'))
+        self.assertTrue(FusedExpression.isElementwise('np.where(a > 0, np.sqrt(a), -b)'))
+        self.assertFalse(FusedExpression.isElementwise('a[0]'))
+        self.assertFalse(FusedExpression.isElementwise('np.mean(a)'))
+        self.assertFalse(FusedExpression.isElementwise('a.mean()'))
+        self.assertFalse(FusedExpression.isElementwise('a = 1'))
+        self.assertFalse(FusedExpression.isElementwise('a // b'))
+        self.assertFalse(FusedExpression.isElementwise('np.where(a)'))  # returns indices
+        self.assertFalse(FusedExpression.isElementwise('np.where(a, b)'))
+        self.assertFalse(FusedExpression.isElementwise('np.sqrt(a, b)'))
+        self.assertTrue(FusedExpression.isElementwise('np.arctan2(a, b)'))
+
+    def test_numexprExpression(self):
+        expression = FusedExpression('np.sqrt(a) * 2.5 + numpy.abs(b)')
+        self.assertEqual('((sqrt(a) * 2.5) + abs(b))', expression.numexprExpression)
+        self.assertListEqual(['a', 'b'], sorted(expression.variables))
+
+    def test_evaluate(self):
+        a = np.random.rand(3, 100, 50).astype(np.float32)
+        b = np.random.rand(1, 100, 50).astype(np.float32)
+        c = np.arange(100 * 50, dtype=np.int16).reshape((100, 50))
+        namespace = {'a': a, 'b': b, 'c': c, 'np': np}
+        for code in ['(a - b) / (a + b)', 'np.sqrt(a) * 2.5 + c', 'np.where(a > 0.5, a, -b)', '~(a > b) | (c == 3)']:
+            gold = eval(code, namespace)
+            expression = FusedExpression(code)
+            expression.ChunkSize = 7 * 50  # force multiple chunks
+            for useNumexpr in [False, True]:
+                result = expression.evaluate(namespace, useNumexpr)
+                self.assertEqual(gold.dtype, result.dtype)
+                self.assertEqual(gold.shape, result.shape)
+                self.assertTrue(np.allclose(gold, result))
+            self.assertArrayEqual(gold, expression.evaluate(namespace, False))
+
+    def test_evaluate_scalars(self):
+        self.assertEqual(3, FusedExpression('a + 1').evaluate({'a': 2}))
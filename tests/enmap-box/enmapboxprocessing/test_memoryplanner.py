@@ -0,0 +1,50 @@
+import numpy as np
+
+from enmapboxprocessing.memoryplanner import MemoryPlanner
+from enmapboxprocessing.rasterreader import RasterReader
+from enmapboxprocessing.testcase import TestCase
+from enmapboxtestdata import enmap
+from qgis.core import Qgis
+
+
+class TestMemoryPlanner(TestCase):
+
+    def test_pixelMemoryUsage(self):
+        planner = MemoryPlanner(2 ** 20)
+        planner.add('data', 10, np.float32)
+        planner.add('output', 2, Qgis.DataType.Int16)
+        planner.addMask(10)
+        self.assertEqual(10 * 4 + 2 * 2 + 10 * 1, planner.pixelMemoryUsage())
+
+    def test_addReader(self):
+        reader = RasterReader(enmap)
+        planner = MemoryPlanner()
+        planner.addReader(reader)
+        planner.addReader(reader, [1, 2], 'subset')
+        self.assertEqual(177 * 2 + 2 * 2, planner.pixelMemoryUsage())
+
+    def test_blockSize(self):
+        reader = RasterReader(enmap)
+        planner = MemoryPlanner(220 * 10 * 177 * 2)
+        planner.addReader(reader)
+        blockSizeX, blockSizeY = planner.blockSize(reader)
+        self.assertEqual((220, 10), (blockSizeX, blockSizeY))
+        self.assertLessEqual(blockSizeX * blockSizeY * planner.pixelMemoryUsage(), planner.maximumMemoryUsage)
+
+    def test_blockSize_overlap(self):
+        reader = RasterReader(enmap)
+        planner = MemoryPlanner(220 * 10 * 177 * 2)
+        planner.addReader(reader)
+        blockSizeX, blockSizeY = planner.blockSize(reader, overlap=2)
+        self.assertLess(blockSizeX * blockSizeY, 220 * 10)
+        pixelCount = planner.haloPixelCount(reader, blockSizeX, blockSizeY, 2)
+        self.assertEqual(min(blockSizeX + 4, 220) * min(blockSizeY + 4, 400), pixelCount)
+        self.assertLessEqual(pixelCount * planner.pixelMemoryUsage(), planner.maximumMemoryUsage)
+
+    def test_report(self):
+        planner = MemoryPlanner(2 ** 20)
+        planner.add('data', 1, np.uint8)
+        self.assertEqual(
+            'Memory plan: data (1x1 bytes) = 1 bytes per pixel; block size 1024x1024 pixel (1.0 of 1.0 MB)',
+            planner.report(1024, 1024)
+        )
@@ -0,0 +1,93 @@
+import numpy as np
+
+from enmapboxprocessing.onlineaggregator import OnlineAggregator
+from enmapboxprocessing.testcase import TestCase
+
+
+class TestOnlineAggregator(TestCase):
+
+    def test_exact(self):
+        array = np.random.normal(size=(30, 4, 5))
+        array[np.random.random(array.shape) < 0.3] = np.nan
+        array[:, 0, 0] = np.nan
+        aggregator = OnlineAggregator((4, 5), True, True, True, True, True, True, True)
+        for values in array:
+            aggregator.update(values)
+
+        self.assertTrue(np.array_equal(np.sum(np.isfinite(array), axis=0), aggregator.count))
+        self.assertTrue(np.allclose(np.nanmean(array, axis=0), aggregator.resultMean(), equal_nan=True))
+        self.assertTrue(np.allclose(np.nanvar(array, axis=0), aggregator.resultVariance(), equal_nan=True))
+        self.assertTrue(np.allclose(np.nanmin(array, axis=0), aggregator.resultMinimum(), equal_nan=True))
+        self.assertTrue(np.allclose(np.nanmax(array, axis=0), aggregator.resultMaximum(), equal_nan=True))
+        self.assertTrue(np.allclose(np.nansum(array, axis=0), aggregator.resultSum()))
+        self.assertTrue(np.allclose(np.nanprod(array, axis=0), aggregator.resultProduct()))
+        q = [0, 10, 25, 50, 75, 90, 100]
+        gold = np.nanpercentile(array, q, axis=0)
+        self.assertTrue(np.allclose(gold, aggregator.resultQuantiles(q), equal_nan=True))
+        self.assertTrue(np.isnan(aggregator.resultArgMinimum()[0, 0]))
+        self.assertEqual(np.nanargmin(array[:, 1, 1]), aggregator.resultArgMinimum()[1, 1])
+        self.assertEqual(np.nanargmax(array[:, 1, 1]), aggregator.resultArgMaximum()[1, 1])
+
+    def test_approximateQuantiles(self):
+        array = np.random.exponential(size=(2000, 3, 3))
+        aggregator = OnlineAggregator((3, 3), quantiles=True, sketchSize=50)
+        for values in array:
+            aggregator.update(values)
+        self.assertLessEqual(aggregator.centroidCount.max(), 100)
+
+        q = [1, 10, 50, 90, 99]
+        sortedArray = np.sort(array, axis=0)
+        for qi, outarray in zip(q, aggregator.resultQuantiles(q)):
+            ranks = [np.searchsorted(sortedArray[:, i, j], outarray[i, j]) for i in range(3) for j in range(3)]
+            errors = np.abs(np.array(ranks) / len(array) * 100 - qi)
+            self.assertLess(errors.max(), 2.5)
+
+    def test_approximateQuantilesAreExactAtExtremes(self):
+        array = np.random.exponential(size=(1000, 3, 3))
+        aggregator = OnlineAggregator((3, 3), quantiles=True, sketchSize=20)
+        for values in array:
+            aggregator.update(values)
+        minimum, maximum = aggregator.resultQuantiles([0, 100])
+        self.assertTrue(np.array_equal(np.min(array, axis=0), minimum))
+        self.assertTrue(np.array_equal(np.max(array, axis=0), maximum))
+
+    def test_temporaryBandCount(self):
+        self.assertEqual(0, OnlineAggregator.temporaryBandCount())
+        self.assertEqual(8 * 41, OnlineAggregator.temporaryBandCount(quantiles=True, sketchSize=20))
+        self.assertEqual(8 * 11, OnlineAggregator.temporaryBandCount(quantiles=True, sketchSize=20, seriesLength=10))
+
+    def test_sketchBandCount(self):
+        self.assertEqual(0, OnlineAggregator.sketchBandCount())
+        self.assertEqual(2 * 40, OnlineAggregator.sketchBandCount(quantiles=True, sketchSize=20))
+        self.assertEqual(2 * 40, OnlineAggregator.sketchBandCount(quantiles=True, sketchSize=20, seriesLength=1000))
+        # short series never merge, so no weights are needed
+        self.assertEqual(10, OnlineAggregator.sketchBandCount(quantiles=True, sketchSize=20, seriesLength=10))
+
+    def test_shortSeriesSketch(self):
+        array = np.random.normal(size=(10, 3, 4))
+        aggregator = OnlineAggregator((3, 4), quantiles=True, sketchSize=20, seriesLength=len(array))
+        self.assertEqual((10, 12), aggregator.centroidMeans.shape)
+        self.assertEqual(np.float32, aggregator.centroidMeans.dtype)
+        for values in array:
+            aggregator.update(values)
+        self.assertIsNone(aggregator.centroidWeights)
+        q = [0, 10, 25, 50, 75, 90, 100]
+        gold = np.percentile(array.astype(np.float32), q, axis=0)
+        self.assertTrue(np.allclose(gold, aggregator.resultQuantiles(q)))
+
+    def test_weightsAreAllocatedOnFirstMerge(self):
+        aggregator = OnlineAggregator((2, 2), quantiles=True, sketchSize=5)
+        for i in range(10):
+            aggregator.update(np.full((2, 2), float(i)))
+        self.assertIsNone(aggregator.centroidWeights)
+        aggregator.update(np.full((2, 2), 10.))
+        self.assertEqual(np.float32, aggregator.centroidWeights.dtype)
+        self.assertTrue(np.all(aggregator.centroidWeights.sum(axis=0) == 11))
+
+    def test_memoryIsIndependentOfSeriesLength(self):
+        aggregator = OnlineAggregator((2, 2), quantiles=True, sketchSize=10)
+        for i in range(1000):
+            aggregator.update(np.full((2, 2), float(i)))
+        self.assertEqual((20, 4), aggregator.centroidMeans.shape)
+        self.assertTrue(np.allclose(0, aggregator.resultQuantiles([0])[0]))
+        self.assertTrue(np.allclose(999, aggregator.resultQuantiles([100])[0]))
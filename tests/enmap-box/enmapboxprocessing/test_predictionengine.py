@@ -0,0 +1,65 @@
+import pickle
+
+import numpy as np
+
+from enmapboxprocessing.predictionengine import PredictionEngine
+from enmapboxprocessing.testcase import TestCase
+
+
+class LinearEstimator(object):
+
+    def __init__(self):
+        self.batches = list()
+
+    def predict(self, X):
+        self.batches.append((X.shape, X.dtype, X.flags['C_CONTIGUOUS']))
+        return X.sum(axis=1)
+
+    def predict_proba(self, X):
+        return np.stack([X[:, 0], X[:, 1]], axis=1)
+
+
+class TestPredictionEngine(TestCase):
+
+    def test_predict(self):
+        arrayX = np.random.randint(0, 100, (3, 20, 10)).astype(np.int16)
+        valid = np.random.rand(20, 10) > 0.3
+        estimator = LinearEstimator()
+        arrayY = np.full((1, 20, 10), -1, np.float32)
+        PredictionEngine(estimator.predict, 7).predict(arrayX, valid, arrayY)
+
+        gold = np.full((20, 10), -1, np.float32)
+        gold[valid] = np.sum(arrayX, axis=0)[valid]
+        self.assertArrayEqual(gold, arrayY[0])
+        for shape, dtype, isContiguous in estimator.batches:
+            self.assertLessEqual(shape[0], 7)
+            self.assertEqual(3, shape[1])
+            self.assertEqual(np.float32, dtype)
+            self.assertTrue(isContiguous)
+        self.assertEqual(int(np.ceil(np.sum(valid) / 7)), len(estimator.batches))
+
+    def test_predict_multiOutput(self):
+        arrayX = [np.random.rand(20, 10) for i in range(3)]
+        valid = np.random.rand(20, 10) > 0.3
+        arrayY = np.full((2, 20, 10), -1, np.float64)
+        PredictionEngine(LinearEstimator().predict_proba, 7).predict(arrayX, valid, arrayY)
+        self.assertArrayEqual(np.where(valid, arrayX[0], -1), arrayY[0])
+        self.assertArrayEqual(np.where(valid, arrayX[1], -1), arrayY[1])
+
+    def test_predict_noValidPixel(self):
+        estimator = LinearEstimator()
+        arrayY = np.zeros((1, 20, 10), np.uint8)
+        PredictionEngine(estimator.predict).predict(np.ones((3, 20, 10)), np.zeros((20, 10), bool), arrayY)
+        self.assertEqual(0, len(estimator.batches))
+
+    def test_featureDataType(self):
+        self.assertEqual(np.float32, PredictionEngine.featureDataType([np.zeros((1, 1), np.uint16)]))
+        self.assertEqual(np.float32, PredictionEngine.featureDataType([np.zeros((1, 1), np.float32)]))
+        self.assertEqual(np.float64, PredictionEngine.featureDataType([np.zeros((1, 1), np.int32)]))
+        self.assertEqual(np.float64, PredictionEngine.featureDataType([np.zeros((1, 1), np.float64)]))
+
+    def test_pickle(self):
+        engine = pickle.loads(pickle.dumps(PredictionEngine(LinearEstimator().predict, 7)))
+        arrayY = np.zeros((1, 2, 2), np.float32)
+        engine.predict(np.ones((3, 2, 2)), np.ones((2, 2), bool), arrayY)
+        self.assertArrayEqual(np.full((1, 2, 2), 3), arrayY)
@@ -155,6 +155,46 @@ class TestRasterReader(TestCase):
         lead[0][10:-10, 10:-10] = reader.noDataValue(1)
         self.assertTrue(np.all(np.equal(reader.noDataValue(1), lead)))
 
+    def test_arrayFromBoundingBoxAndSize_gdalReadWindow(self):
+        reader = RasterReader(enmap)
+        gold = reader.gdalDataset.ReadAsArray()
+        extent = reader.extent()
+
+        # pixel-aligned block is read directly via GDAL
+        block = RasterBlockInfo(
+            QgsRectangle(extent.xMinimum() + 300, extent.yMaximum() - 600, extent.xMinimum() + 900, extent.yMaximum()),
+            10, 0, 20, 20
+        )
+        self.assertEqual((10, 0), reader._gdalReadWindow(block.extent, block.width, block.height, [1, 2, 3]))
+        lead = reader.arrayFromBlock(block, [1, 2, 3])
+        self.assertTrue(np.all(np.equal(gold[:3, 0:20, 10:30], lead)))
+
+        # resampled, shifted and overlapping blocks are read via the data provider
+        self.assertIsNone(reader._gdalReadWindow(extent, 110, 200, [1]))
+        shifted = QgsRectangle(block.extent)
+        shifted.setXMinimum(shifted.xMinimum() + 15)
+        shifted.setXMaximum(shifted.xMaximum() + 15)
+        self.assertIsNone(reader._gdalReadWindow(shifted, 20, 20, [1]))
+        self.assertIsNone(reader._gdalReadWindow(extent.buffered(30), 222, 402, [1]))
+
+        # raster pipe is never read directly
+        reader2 = RasterReader(enmap, crs=reader.crs())
+        self.assertIsNone(reader2._gdalReadWindow(block.extent, block.width, block.height, [1]))
+        self.assertTrue(np.all(np.equal(lead, reader2.arrayFromBlock(block, [1, 2, 3]))))
+
+    def test_arrayFromBoundingBoxAndSize_out(self):
+        reader = RasterReader(enmap)
+        gold = reader.gdalDataset.ReadAsArray()
+        out = np.zeros((2, 400, 220), np.int16)
+        lead = reader.arrayFromBoundingBoxAndSize(reader.extent(), 220, 400, [1, 2], out=out)
+        self.assertTrue(np.all(np.equal(gold[:2], out)))
+        self.assertTrue(np.shares_memory(lead[0], out))
+
+        # also supported by the data provider path
+        out = np.zeros((1, 200, 110), np.int16)
+        reader.arrayFromBoundingBoxAndSize(reader.extent(), 110, 200, [1], out=out)
+        self.assertTrue(np.all(np.equal(gold[0, 1::2, 1::2], out[0])))
+
     def test_arrayFromPixelOffsetAndSize(self):
         array = np.zeros((1, 5, 5))
         array[0, 0] = 1
@@ -230,6 +270,35 @@ class TestRasterReader(TestCase):
         self.assertTrue(np.all(np.equal(True, reader.maskArray(np.array([[[1, 3]]]), [1]))))
         self.assertTrue(np.all(np.equal(False, reader.maskArray(np.array([[[2]]]), [1]))))
 
+    def test_maskArray_bandList(self):
+        writer = self.rasterFromArray([[[1, 2]], [[1, 2]]])
+        writer.setNoDataValue(1, 1)
+        writer.setNoDataValue(2, 2)
+        writer.close()
+        reader = RasterReader(writer.source())
+        self.assertListEqual([[False, True]], reader.maskArray(np.array([[[1, 2]]]), [1])[0].tolist())
+        self.assertListEqual([[True, False]], reader.maskArray(np.array([[[1, 2]]]), [2])[0].tolist())
+
+    def test_maskArray_out(self):
+        reader = RasterReader(enmap)
+        array = reader.array()
+        out = np.empty((reader.bandCount(), reader.height(), reader.width()), bool)
+        marray = reader.maskArray(array, out=out)
+        self.assertTrue(np.all(np.equal(reader.gdalDataset.ReadAsArray() != reader.noDataValue(1), out)))
+        self.assertTrue(np.shares_memory(marray[0], out))
+        self.assertIs(out, reader.maskArray(np.array(array), out=out))
+
+    def test_maskArrayAllBands(self):
+        reader = RasterReader(enmap)
+        array = reader.array()
+        gold = np.all(reader.maskArray(array), axis=0)
+        self.assertTrue(np.all(np.equal(gold, reader.maskArrayAllBands(array))))
+        self.assertTrue(np.all(np.equal(gold, reader.maskArrayAllBands(np.array(array)))))
+
+        reader.setUserNoDataValue(2, [QgsRasterRange(1, 3, QgsRasterRange.BoundsType.IncludeMinAndMax)])
+        array = [np.array([[0, 1, 4]]), np.array([[0, 2, 4]])]
+        self.assertListEqual([[True, False, True]], reader.maskArrayAllBands(array, [1, 2]).tolist())
+
     def test_maskArray_withDefaultNoDataValue(self):
         writer = self.rasterFromArray([[[1]]])
         writer.close()
@@ -373,6 +442,30 @@ class TestRasterReader(TestCase):
         self.assertEqual(2, reader.findWavelength(190, reader.Nanometers))
         self.assertIsNone(reader.findWavelength(None))
 
+    def test_wavelengths(self):
+        reader = RasterReader(enmap)
+        wavelengths = reader.wavelengths()
+        self.assertEqual((177,), wavelengths.shape)
+        self.assertListEqual([reader.wavelength(bandNo) for bandNo in reader.bandNumbers()], wavelengths.tolist())
+        self.assertListEqual(
+            [reader.wavelength(bandNo, reader.Micrometers) for bandNo in reader.bandNumbers()],
+            reader.wavelengths(reader.Micrometers).tolist()
+        )
+        self.assertListEqual([reader.fwhm(bandNo) for bandNo in reader.bandNumbers()], reader.fwhms().tolist())
+        self.assertListEqual(
+            [reader.badBandMultiplier(bandNo) for bandNo in reader.bandNumbers()], reader.badBandMultipliers().tolist()
+        )
+        self.assertListEqual([reader.bandName(bandNo) for bandNo in reader.bandNumbers()], reader.bandNames())
+
+    def test_wavelengths_nonSpectralRaster(self):
+        writer = self.rasterFromArray(np.zeros((2, 1, 1)))
+        writer.setWavelength(100, 1)
+        writer.close()
+        reader = RasterReader(writer.source())
+        self.assertEqual(100, reader.wavelengths()[0])
+        self.assertTrue(np.isnan(reader.wavelengths()[1]))
+        self.assertTrue(np.all(np.isnan(reader.fwhms())))
+
     def test_findWavelength_nonSpectralRaster(self):
         writer = self.rasterFromArray(np.zeros((5, 1, 1)))
         writer.close()
@@ -561,6 +654,10 @@ class TestRasterReader(TestCase):
         writer.close()
         reader = RasterReader(writer.source())
         self.assertEqual(2, reader.findTime(QDateTime(2009, 1, 1, 0, 0)))
+        self.assertListEqual(
+            [QDateTime(2000, 1, 1, 0, 0), QDateTime(2010, 1, 1, 0, 0), QDateTime(2020, 1, 1, 0, 0), None],
+            reader.centerTimes()
+        )
 
         self.assertIsNone(reader.findTime(None))
 
@@ -582,6 +679,37 @@ class TestRasterReader(TestCase):
         self.assertEqual(gold * 2, reader.lineMemoryUsage(nBands=bandCount * 2))
         self.assertEqual(gold * 2, reader.lineMemoryUsage(dataTypeSize=8))
 
+    def test_pixelMemoryUsage(self):
+        writer = self.rasterFromArray(np.zeros((4, 1, 10), np.int32))
+        writer.close()
+        reader = RasterReader(writer.source())
+        self.assertEqual(4 * 4, reader.pixelMemoryUsage())
+        self.assertEqual(8 * 4, reader.pixelMemoryUsage(nBands=8))
+        self.assertEqual(4 * 8, reader.pixelMemoryUsage(dataTypeSize=8))
+
+    def test_nativeBlockSize(self):
+        self.assertEqual((220, 1), RasterReader(enmap).nativeBlockSize())
+
+    def test_planBlockSize(self):
+        # everything fits into memory
+        self.assertEqual((1000, 1200), RasterReader.planBlockSize(1000, 1200, 10 ** 9, [(1000, 1)]))
+        # strips
+        self.assertEqual((1000, 50), RasterReader.planBlockSize(1000, 1200, 50000, [(1000, 1)]))
+        self.assertEqual((30000, 32), RasterReader.planBlockSize(30000, 30000, 10 ** 6, [(30000, 4)]))
+        # tiles
+        self.assertEqual((768, 1280), RasterReader.planBlockSize(30000, 30000, 10 ** 6, [(256, 256)]))
+        # less memory than a single tile
+        self.assertEqual((256, 3), RasterReader.planBlockSize(30000, 30000, 1000, [(256, 256)]))
+
+    def test_gridBlockSize(self):
+        reader = RasterReader(enmap)
+        pixelMemoryUsage = reader.pixelMemoryUsage()
+        self.assertEqual((220, 400), reader.gridBlockSize(pixelMemoryUsage, 10 ** 9))
+        self.assertEqual((220, 10), reader.gridBlockSize(pixelMemoryUsage, pixelMemoryUsage * 220 * 10))
+        self.assertEqual(
+            (220, 256), reader.gridBlockSize(pixelMemoryUsage, pixelMemoryUsage * 220 * 300, [(256, 256)])
+        )
+
     @unittest.skip('STAC disabled')
     def test_stacMetadata(self):
         writer = self.rasterFromArray(np.zeros((1, 5, 5)), 'raster.tif')
@@ -45,6 +45,11 @@ class TestRasterWriter(TestCase):
         reader = RasterReader(writer.source())
         self.assertArrayEqual(1, reader.array())
 
+    def test_blockSize(self):
+        writer = self.rasterFromValue((1, 500, 500), 0)  # GTiff is created with TILED=YES
+        self.assertEqual((256, 256), writer.blockSize())
+        writer.close()
+
     def test_fill_singleBand(self):
         writer = self.rasterFromValue((3, 5, 5), 0)
         writer.fill(1, 2)
@@ -26,6 +26,13 @@ class TestUtils(TestCase):
     def test_maximumMemoryUsage(self):
         Utils.maximumMemoryUsage()
 
+    def test_maximumMemoryUsage_configOption(self):
+        gdal.SetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE', '100')
+        try:
+            self.assertEqual(100 * 2 ** 20, Utils.maximumMemoryUsage())
+        finally:
+            gdal.SetConfigOption('ENMAPBOX_MAXIMUM_MEMORY_USAGE', None)
+
     def test_qgisDataTypeToNumpyDataType_andBack(self):
         for qgisDataType, numpyDataType in [
             (Qgis.DataType.Byte, np.uint8), (Qgis.DataType.Float32, np.float32), (Qgis.DataType.Float64, np.float64),